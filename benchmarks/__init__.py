@@ -0,0 +1,3 @@
+"""
+Performance benchmarks for the proxy. Each module is runnable with ``python -m benchmarks.<name>``.
+"""
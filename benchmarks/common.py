@@ -0,0 +1,163 @@
+"""
+Helpers shared by the benchmark modules.
+"""
+import selectors
+import socket
+import threading
+import time
+
+from src.constants import AddressTypeCodes
+from src.models import DetailedAddress
+
+
+def tcp_socket_pair() -> tuple[socket.socket, socket.socket]:
+    """Returns two ends of a loopback TCP connection."""
+    with socket.socket() as listener:
+        listener.bind(("127.0.0.1", 0))
+        listener.listen(1)
+        client = socket.create_connection(listener.getsockname())
+        server, _ = listener.accept()
+    return client, server
+
+
+def loopback_address(port: int, name: str = "benchmark") -> DetailedAddress:
+    return DetailedAddress(
+        name=name, ip="127.0.0.1", port=port, address_type=AddressTypeCodes.IPv4
+    )
+
+
+class TCPSink:
+    """
+    Accepts one connection on a loopback port and drains it until EOF.
+    """
+
+    def __init__(self):
+        self.listener = socket.socket()
+        self.listener.bind(("127.0.0.1", 0))
+        self.listener.listen(1)
+        self.port: int = self.listener.getsockname()[1]
+        self.received = 0
+        self.finished = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        conn, _ = self.listener.accept()
+        with conn:
+            buffer = bytearray(1 << 20)
+            while received := conn.recv_into(buffer):
+                self.received += received
+        self.listener.close()
+        self.finished.set()
+
+
+def send_payload(sock: socket.socket, total_bytes: int, chunk_size: int = 1 << 16) -> None:
+    """Writes total_bytes to sock in chunk_size writes, then half-closes it."""
+    chunk = memoryview(b"\xab" * chunk_size)
+    remaining = total_bytes
+    while remaining > 0:
+        sock.sendall(chunk[: min(chunk_size, remaining)])
+        remaining -= chunk_size
+    sock.shutdown(socket.SHUT_WR)
+
+
+def format_rate(value: float, unit: str) -> str:
+    for prefix in ("", "K", "M", "G"):
+        if value < 1000:
+            return f"{value:8.2f} {prefix}{unit}"
+        value /= 1000
+    return f"{value:8.2f} T{unit}"
+
+
+class Timer:
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.elapsed = time.perf_counter() - self.start
+
+
+class SinkServer:
+    """
+    Drains every loopback connection until EOF on one selector thread, so idle
+    connections cost the benchmark process no thread of its own.
+    """
+
+    def __init__(self):
+        self.listener = socket.socket()
+        self.listener.bind(("127.0.0.1", 0))
+        self.listener.listen(1024)
+        self.listener.setblocking(False)
+        self.port: int = self.listener.getsockname()[1]
+        self.accepted = 0
+        self.received = 0
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(self.listener, selectors.EVENT_READ)
+        self._stop = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        buffer = bytearray(1 << 20)
+        while not self._stop:
+            for key, _ in self._selector.select(timeout=0.1):
+                if key.fileobj is self.listener:
+                    self._accept()
+                    continue
+                try:
+                    received = key.fileobj.recv_into(buffer)
+                except OSError:
+                    received = 0
+                if received:
+                    self.received += received
+                else:
+                    self._selector.unregister(key.fileobj)
+                    key.fileobj.close()
+        for key in list(self._selector.get_map().values()):
+            key.fileobj.close()
+        self._selector.close()
+
+    def _accept(self) -> None:
+        while True:
+            try:
+                conn, _ = self.listener.accept()
+            except BlockingIOError:
+                return
+            conn.setblocking(False)
+            self._selector.register(conn, selectors.EVENT_READ)
+            self.accepted += 1
+
+    def close(self) -> None:
+        self._stop = True
+        self._thread.join()
+
+
+class SourceServer:
+    """Writes total_bytes to every loopback connection, then closes it."""
+
+    def __init__(self, total_bytes: int):
+        self.total_bytes = total_bytes
+        self.listener = socket.socket()
+        self.listener.bind(("127.0.0.1", 0))
+        self.listener.listen(128)
+        self.port: int = self.listener.getsockname()[1]
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self) -> None:
+        while True:
+            try:
+                conn, _ = self.listener.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._send, args=(conn,), daemon=True).start()
+
+    def _send(self, conn: socket.socket) -> None:
+        with conn:
+            try:
+                send_payload(conn, self.total_bytes)
+            except OSError:
+                pass
+
+    def close(self) -> None:
+        self.listener.close()
@@ -0,0 +1,144 @@
+"""
+Time-to-first-byte benchmark for the upstream connection pool.
+
+Each sample opens a client connection to an in-process threaded proxy, negotiates
+SOCKS5, CONNECTs to a loopback echo server and times until the first echoed byte
+comes back. Runs once connecting upstream per request and once with the destination
+pooled. Loopback handshakes cost microseconds, so ``--rtt-ms`` delays every
+per-request upstream connect to stand in for a real network round trip.
+
+    python -m benchmarks.pool_ttfb [--requests N] [--rtt-ms MS]
+"""
+import argparse
+import socket
+import statistics
+import struct
+import threading
+import time
+from unittest.mock import patch
+
+from src import pool
+from src.server import ThreadingTCPServer, TCPProxyServer
+from src.relays import tcp_relay
+from src.utils import map_address_enum_to_socket_family
+
+from .common import Timer
+
+
+class EchoServer:
+    """Echoes every loopback connection until the peer closes it."""
+
+    def __init__(self):
+        self.listener = socket.socket()
+        self.listener.bind(("127.0.0.1", 0))
+        self.listener.listen(128)
+        self.port: int = self.listener.getsockname()[1]
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self) -> None:
+        while True:
+            try:
+                conn, _ = self.listener.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._echo, args=(conn,), daemon=True).start()
+
+    @staticmethod
+    def _echo(conn: socket.socket) -> None:
+        with conn:
+            while data := conn.recv(4096):
+                conn.sendall(data)
+
+    def close(self) -> None:
+        self.listener.close()
+
+
+class DelayedConnectSocket(socket.socket):
+    """A TCP socket whose connect() first sleeps for one emulated round trip."""
+
+    rtt: float = 0.0
+
+    def connect(self, address) -> None:
+        time.sleep(self.rtt)
+        super().connect(address)
+
+
+def generate_delayed_socket(address_type) -> socket.socket:
+    return DelayedConnectSocket(map_address_enum_to_socket_family(address_type), socket.SOCK_STREAM)
+
+
+def time_to_first_byte(proxy_port: int, echo_port: int) -> float:
+    with Timer() as timer:
+        with socket.create_connection(("127.0.0.1", proxy_port)) as client:
+            client.sendall(b"\x05\x01\x00")
+            client.recv(2)
+            client.sendall(
+                b"\x05\x01\x00\x01" + socket.inet_aton("127.0.0.1") + struct.pack("!H", echo_port)
+            )
+            reply = client.recv(10)
+            if reply[1] != 0x00:
+                raise RuntimeError(f"CONNECT failed with reply {reply[1]}")
+            client.sendall(b"x")
+            client.recv(1)
+    return timer.elapsed
+
+
+def run(requests: int, rtt: float, pooled: bool, echo_port: int) -> list[float]:
+    server = ThreadingTCPServer(("127.0.0.1", 0), TCPProxyServer)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    proxy_port = server.server_address[1]
+
+    if pooled:
+        upstream_pool = pool.start_upstream_pool([("127.0.0.1", echo_port)], size=4)
+        while upstream_pool.stats()["idle"] < 4:
+            time.sleep(0.01)
+
+    samples = []
+    try:
+        DelayedConnectSocket.rtt = rtt
+        with patch.object(tcp_relay, "generate_tcp_socket", generate_delayed_socket):
+            for _ in range(requests):
+                samples.append(time_to_first_byte(proxy_port, echo_port))
+                # Paces requests like a client that reconnects, giving the pool time to refill
+                time.sleep(rtt * 2)
+    finally:
+        pool.stop_upstream_pool()
+        server.shutdown()
+        server.server_close()
+    return samples
+
+
+def benchmark(requests: int, rtt_ms: float) -> dict:
+    echo = EchoServer()
+    try:
+        results = {}
+        for label, pooled in (("direct", False), ("pooled", True)):
+            samples = sorted(run(requests, rtt_ms / 1000, pooled, echo.port))
+            results[label] = {
+                "p50_ms": statistics.median(samples) * 1000,
+                "p99_ms": samples[int(len(samples) * 0.99) - 1] * 1000,
+                "mean_ms": statistics.fmean(samples) * 1000,
+            }
+        return results
+    finally:
+        echo.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--rtt-ms", type=float, default=1.0)
+    args = parser.parse_args()
+
+    results = benchmark(args.requests, args.rtt_ms)
+    print(f"CONNECT time to first byte, {args.requests} requests, {args.rtt_ms} ms emulated RTT")
+    for label, result in results.items():
+        print(
+            f"  {label:>6}: p50 {result['p50_ms']:7.3f} ms"
+            f" | p99 {result['p99_ms']:7.3f} ms"
+            f" | mean {result['mean_ms']:7.3f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""
+Fixed vs adaptive read buffers in the TCPRelay copy path.
+
+Runs every sizing policy through a bulk upload, where larger reads mean fewer
+syscalls per MB, and an interactive ping-pong of small messages, where a large
+fixed buffer only holds memory. Reports throughput or round-trip time, reads per
+MB and the most buffer memory one relay held at once.
+
+    python -m benchmarks.relay_buffers [--megabytes N] [--rounds N]
+"""
+import argparse
+import statistics
+import threading
+import time
+
+from src.constants import RELAY_BUFFER_MIN_SIZE, RELAY_BUFFER_MAX_SIZE
+from src.relays import TCPRelay
+
+from .common import TCPSink, Timer, format_rate, loopback_address, send_payload, tcp_socket_pair
+from .pool_ttfb import EchoServer
+
+MB = 1 << 20
+MESSAGE = b"\x42" * 64
+
+POLICIES = {
+    "fixed min": (RELAY_BUFFER_MIN_SIZE, RELAY_BUFFER_MIN_SIZE),
+    "fixed max": (RELAY_BUFFER_MAX_SIZE, RELAY_BUFFER_MAX_SIZE),
+    "adaptive": (RELAY_BUFFER_MIN_SIZE, RELAY_BUFFER_MAX_SIZE),
+}
+
+
+class MeasuredRelay(TCPRelay):
+    """Counts reads and tracks the largest total buffer size held across directions."""
+
+    def __init__(self, *args, **kwargs):
+        self.reads = 0
+        self.peak_buffer_bytes = 0
+        super().__init__(*args, **kwargs)
+
+    def _recv_data(self, sock, buffer) -> int:
+        self.reads += 1
+        held = sum(buffer.size for buffer in self._buffers.values())
+        self.peak_buffer_bytes = max(self.peak_buffer_bytes, held)
+        return super()._recv_data(sock, buffer)
+
+
+def start_relay(port: int, buffer_min: int, buffer_max: int):
+    client_app, client_conn = tcp_socket_pair()
+    relay = MeasuredRelay(
+        client_conn,
+        loopback_address(port),
+        relay_mode="copy",
+        buffer_min=buffer_min,
+        buffer_max=buffer_max,
+    )
+    return relay, client_app, client_conn
+
+
+def bulk(buffer_min: int, buffer_max: int, megabytes: int) -> dict:
+    """Uploads megabytes through the relay to a sink."""
+    total_bytes = megabytes * MB
+    sink = TCPSink()
+    relay, client_app, client_conn = start_relay(sink.port, buffer_min, buffer_max)
+    writer = threading.Thread(target=send_payload, args=(client_app, total_bytes), daemon=True)
+
+    with Timer() as timer:
+        writer.start()
+        relay.listen_and_relay()
+        sink.finished.wait()
+
+    writer.join()
+    client_app.close()
+    client_conn.close()
+    if sink.received != total_bytes:
+        raise RuntimeError(f"sink received {sink.received} of {total_bytes} bytes")
+    return {
+        "bytes_per_second": total_bytes / timer.elapsed,
+        "reads_per_mb": relay.reads / megabytes,
+        "peak_buffer_bytes": relay.peak_buffer_bytes,
+    }
+
+
+def interactive(buffer_min: int, buffer_max: int, rounds: int) -> dict:
+    """Bounces small messages off an echo server through the relay."""
+    echo = EchoServer()
+    relay, client_app, client_conn = start_relay(echo.port, buffer_min, buffer_max)
+    worker = threading.Thread(target=relay.listen_and_relay, daemon=True)
+    worker.start()
+
+    samples = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        client_app.sendall(MESSAGE)
+        received = 0
+        while received < len(MESSAGE):
+            received += len(client_app.recv(len(MESSAGE) - received))
+        samples.append(time.perf_counter() - started)
+
+    client_app.close()
+    worker.join()
+    client_conn.close()
+    echo.close()
+    return {
+        "median_rtt": statistics.median(samples),
+        "peak_buffer_bytes": relay.peak_buffer_bytes,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--megabytes", type=int, default=256)
+    parser.add_argument("--rounds", type=int, default=2000)
+    args = parser.parse_args()
+
+    print(f"Bulk upload, {args.megabytes} MB")
+    for label, (buffer_min, buffer_max) in POLICIES.items():
+        result = bulk(buffer_min, buffer_max, args.megabytes)
+        print(
+            f"  {label:>9}: {format_rate(result['bytes_per_second'], 'B/s')}"
+            f" | {result['reads_per_mb']:8.1f} reads/MB"
+            f" | {result['peak_buffer_bytes'] / 1024:6.0f} KiB buffers"
+        )
+
+    print(f"Interactive ping-pong, {args.rounds} x {len(MESSAGE)} byte messages")
+    for label, (buffer_min, buffer_max) in POLICIES.items():
+        result = interactive(buffer_min, buffer_max, args.rounds)
+        print(
+            f"  {label:>9}: {result['median_rtt'] * 1e6:8.1f} us median round trip"
+            f" | {result['peak_buffer_bytes'] / 1024:6.0f} KiB buffers"
+        )
+
+
+if __name__ == "__main__":
+    main()
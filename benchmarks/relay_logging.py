@@ -0,0 +1,106 @@
+"""
+Cost of relay logging in the TCPRelay copy path.
+
+Uploads through the relay with 4 KiB reads, so every chunk is a relay log
+candidate, once with DEBUG off and once per relay log setting with DEBUG on.
+Log output goes to /dev/null through the logging pipeline. Reports throughput,
+the records logged per MB and the records the full log queue dropped.
+
+    python -m benchmarks.relay_logging [--megabytes N]
+"""
+import argparse
+import os
+import threading
+from unittest.mock import patch
+
+from src import logger as logger_module
+from src.config import ProxyConfiguration
+from src.constants import RELAY_BUFFER_SIZE
+from src.logger import update_loggers
+from src.metrics import LOG_RECORDS_DROPPED
+from src.relays import TCPRelay
+
+from .common import TCPSink, Timer, format_rate, loopback_address, send_payload, tcp_socket_pair
+
+MB = 1 << 20
+
+# label: (logging level, --relay-log-sample, --relay-log-interval)
+SETTINGS = {
+    "info": ("info", 1, 0.0),
+    "debug, every chunk": ("debug", 1, 0.0),
+    "debug, 1 in 100": ("debug", 100, 0.0),
+    "debug, 1 s summaries": ("debug", 0, 1.0),
+}
+
+
+class CountingHandler:
+    """Counts the records that reach the relay's logger."""
+
+    level = 0
+
+    def __init__(self):
+        self.records = 0
+
+    def handle(self, record) -> None:
+        self.records += 1
+
+
+def upload(level: str, sample_rate: int, interval: float, megabytes: int) -> dict:
+    ProxyConfiguration.initialize(
+        "localhost", 0, level, relay_log_sample_rate=sample_rate, relay_log_interval=interval
+    )
+    update_loggers()
+    total_bytes = megabytes * MB
+    sink = TCPSink()
+    client_app, client_conn = tcp_socket_pair()
+    relay = TCPRelay(
+        client_conn,
+        loopback_address(sink.port),
+        relay_mode="copy",
+        buffer_min=RELAY_BUFFER_SIZE,
+        buffer_max=RELAY_BUFFER_SIZE,
+    )
+    counter = CountingHandler()
+    if relay.relay_log is not None:
+        relay.relay_log.logger.handlers.append(counter)
+    writer = threading.Thread(target=send_payload, args=(client_app, total_bytes), daemon=True)
+    dropped = LOG_RECORDS_DROPPED.get()
+
+    with Timer() as timer:
+        writer.start()
+        relay.listen_and_relay()
+        sink.finished.wait()
+
+    writer.join()
+    client_app.close()
+    client_conn.close()
+    if relay.relay_log is not None:
+        relay.relay_log.logger.handlers.remove(counter)
+    if sink.received != total_bytes:
+        raise RuntimeError(f"sink received {sink.received} of {total_bytes} bytes")
+    return {
+        "bytes_per_second": total_bytes / timer.elapsed,
+        "records_per_mb": counter.records / megabytes,
+        "dropped": LOG_RECORDS_DROPPED.get() - dropped,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--megabytes", type=int, default=64)
+    args = parser.parse_args()
+
+    print(f"Upload, {args.megabytes} MB in {RELAY_BUFFER_SIZE} byte reads")
+    with open(os.devnull, "w") as devnull, patch.object(logger_module._console_handler, "stream", devnull):
+        for label, (level, sample_rate, interval) in SETTINGS.items():
+            result = upload(level, sample_rate, interval, args.megabytes)
+            print(
+                f"  {label:>20}: {format_rate(result['bytes_per_second'], 'B/s')}"
+                f" | {result['records_per_mb']:8.1f} records/MB"
+                f" | {result['dropped']:8.0f} dropped"
+            )
+        logger_module.stop_logging()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""
+Cached SOCKS5 replies vs building each one from scratch.
+
+Failure replies are looked up from the table built at import time. Success replies
+cycle through ephemeral BND.PORTs on a few bind IPs, as a busy proxy sends them, so
+only the cached header and BND.ADDR can be reused. Reports replies per second.
+
+    python -m benchmarks.replies [--replies N] [--bind-ips N]
+"""
+import argparse
+import itertools
+import timeit
+
+from src.constants import SOCKS_VERSION, AddressTypeCodes, ReplyCodes
+from src.utils import replies
+from src.utils.addresses import map_address_to_bytes
+
+from .common import format_rate
+
+EPHEMERAL_PORTS = range(32768, 61000)
+
+
+def build_succeeded_reply(address_type: AddressTypeCodes, ip: str, port: int) -> bytes:
+    """Builds a success reply without the cache, as every reply was before."""
+    header = replies._reply_header.pack(SOCKS_VERSION, ReplyCodes.SUCCEEDED.value, 0, address_type.value)
+    return header + map_address_to_bytes(address_type, ip) + replies._port.pack(port)
+
+
+def rate(build, count: int) -> float:
+    """Returns the best of three runs of count calls to build, in calls per second."""
+    return count / min(timeit.repeat(build, number=count, repeat=3))
+
+
+def bind_addresses(bind_ips: int) -> list[tuple[AddressTypeCodes, str]]:
+    ipv4 = [(AddressTypeCodes.IPv4, f"10.0.0.{i + 1}") for i in range(bind_ips)]
+    ipv6 = [(AddressTypeCodes.IPv6, f"2001:db8::{i + 1:x}") for i in range(bind_ips)]
+    return ipv4 + ipv6
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--replies", type=int, default=200000)
+    parser.add_argument("--bind-ips", type=int, default=4)
+    args = parser.parse_args()
+
+    failure = (AddressTypeCodes.IPv4, ReplyCodes.HOST_UNREACHABLE)
+    print("Failure replies")
+    print(f"  {'cached':>8}: {format_rate(rate(lambda: replies.generate_failed_reply(*failure), args.replies), '/s')}")
+    print(f"  {'built':>8}: {format_rate(rate(lambda: replies._build_failed_reply(*failure), args.replies), '/s')}")
+
+    addresses = bind_addresses(args.bind_ips)
+    print(f"Success replies, {len(addresses)} bind IPs, {len(EPHEMERAL_PORTS)} ports")
+    for label, build in (("cached", replies.generate_succeeded_reply), ("built", build_succeeded_reply)):
+        binds = (
+            (address_type, ip, port)
+            for (address_type, ip), port in zip(itertools.cycle(addresses), itertools.cycle(EPHEMERAL_PORTS))
+        )
+        result = rate(lambda: build(*next(binds)), args.replies)
+        print(f"  {label:>8}: {format_rate(result, '/s')}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,387 @@
+"""
+End-to-end load benchmarks for the proxy, with JSON results and a regression check.
+
+Runs the proxy in-process on loopback, with either engine, against local echo, sink and
+source servers, and drives it through full SOCKS5 handshakes:
+
+  - connections per second, each a handshake, CONNECT, one echoed byte and close
+  - CONNECT time to first byte percentiles
+  - TCP throughput of one upload stream, one download stream and many upload streams
+  - UDP ASSOCIATE echoed datagrams per second
+  - resident memory per 1000 idle CONNECT tunnels
+
+Every metric is the median of ``--repeat`` runs. ``--output`` writes the results as
+JSON. ``--baseline`` compares them with a stored results file and exits with status 1
+when a metric is worse by more than ``--tolerance``. Results depend on the machine:
+record a baseline on the machine that checks against it.
+
+    python -m benchmarks.suite [--engine ENGINE] [--output FILE] [--baseline FILE] [--tolerance F]
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import select
+import socket
+import statistics
+import struct
+import sys
+import threading
+import time
+
+from src.async_server import AsyncTCPServer
+from src.server import ThreadingTCPServer, TCPProxyServer
+
+from .common import SinkServer, SourceServer, Timer, format_rate, send_payload
+from .pool_ttfb import EchoServer, time_to_first_byte
+from .udp_pps import UDPEchoServer
+
+MB = 1 << 20
+BASELINE = os.path.join(os.path.dirname(__file__), "baseline.json")
+
+# metric: (unit, True if higher is better)
+METRICS = {
+    "connections_per_second": ("connections/s", True),
+    "ttfb_p50_ms": ("ms", False),
+    "ttfb_p90_ms": ("ms", False),
+    "ttfb_p99_ms": ("ms", False),
+    "tcp_upload_single_bytes_per_second": ("B/s", True),
+    "tcp_download_single_bytes_per_second": ("B/s", True),
+    "tcp_upload_many_bytes_per_second": ("B/s", True),
+    "udp_datagrams_per_second": ("datagrams/s", True),
+    "rss_bytes_per_1k_idle_tunnels": ("B", False),
+}
+
+
+class InProcessProxy:
+    """The proxy serving on a loopback port from a background thread."""
+
+    def __init__(self, engine: str):
+        self.engine = engine
+
+    def __enter__(self):
+        if self.engine == "threading":
+            self._server = ThreadingTCPServer(("127.0.0.1", 0), TCPProxyServer)
+            threading.Thread(target=self._server.serve_forever, daemon=True).start()
+            self.port: int = self._server.server_address[1]
+            return self
+
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._thread.start()
+        self._server = AsyncTCPServer(("127.0.0.1", 0))
+        asyncio.run_coroutine_threadsafe(self._server.start(), self._loop).result()
+        self._serving = asyncio.run_coroutine_threadsafe(self._server.serve_forever(), self._loop)
+        self.port = self._server.server_address[1]
+        return self
+
+    def __exit__(self, *exc):
+        if self.engine == "threading":
+            self._server.shutdown()
+            self._server.server_close()
+            return
+        self._serving.cancel()
+        asyncio.run_coroutine_threadsafe(self._stop(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+    async def _stop(self) -> None:
+        await self._server.close()
+        # Clients have closed their tunnels; lets their handlers see EOF and return
+        deadline = self._loop.time() + 5
+        while self._server.active_connections and self._loop.time() < deadline:
+            await asyncio.sleep(0.01)
+
+
+def open_tunnel(proxy_port: int, dst_port: int) -> socket.socket:
+    """Returns a client socket CONNECTed through the proxy to a loopback port."""
+    client = socket.create_connection(("127.0.0.1", proxy_port))
+    try:
+        client.sendall(b"\x05\x01\x00")
+        if client.recv(2) != b"\x05\x00":
+            raise RuntimeError("method negotiation failed")
+        client.sendall(
+            b"\x05\x01\x00\x01" + socket.inet_aton("127.0.0.1") + struct.pack("!H", dst_port)
+        )
+        reply = client.recv(10)
+        if len(reply) < 2 or reply[1] != 0x00:
+            raise RuntimeError(f"CONNECT failed with reply {reply[1:2].hex() or 'EOF'}")
+    except BaseException:
+        client.close()
+        raise
+    return client
+
+
+def run_in_threads(count: int, target, *args) -> None:
+    threads = [threading.Thread(target=target, args=args, daemon=True) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def wait_until(predicate, timeout: float = 30.0) -> bool:
+    """Returns whether predicate became true within timeout seconds."""
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def connections_per_second(proxy_port: int, echo_port: int, connections: int, concurrency: int) -> float:
+    remaining = iter(range(connections))
+    lock = threading.Lock()
+
+    def client() -> None:
+        while True:
+            with lock:
+                if next(remaining, None) is None:
+                    return
+            with open_tunnel(proxy_port, echo_port) as tunnel:
+                tunnel.sendall(b"x")
+                tunnel.recv(1)
+
+    with Timer() as timer:
+        run_in_threads(concurrency, client)
+    return connections / timer.elapsed
+
+
+def ttfb_percentiles(proxy_port: int, echo_port: int, requests: int) -> dict:
+    samples = sorted(time_to_first_byte(proxy_port, echo_port) for _ in range(requests))
+    return {
+        "ttfb_p50_ms": statistics.median(samples) * 1000,
+        "ttfb_p90_ms": samples[max(int(len(samples) * 0.9) - 1, 0)] * 1000,
+        "ttfb_p99_ms": samples[max(int(len(samples) * 0.99) - 1, 0)] * 1000,
+    }
+
+
+def upload_throughput(proxy_port: int, sink: SinkServer, streams: int, total_bytes: int) -> float:
+    """Bytes per second of streams tunnels, together uploading total_bytes to the sink."""
+    tunnels = [open_tunnel(proxy_port, sink.port) for _ in range(streams)]
+    expected = sink.received + total_bytes
+    try:
+        with Timer() as timer:
+            threads = [
+                threading.Thread(target=send_payload, args=(tunnel, total_bytes // streams), daemon=True)
+                for tunnel in tunnels
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            delivered = wait_until(lambda: sink.received >= expected)
+    finally:
+        for tunnel in tunnels:
+            tunnel.close()
+    if not delivered:
+        missing = expected - sink.received
+        raise RuntimeError(f"sink is missing {missing} of {total_bytes} bytes, a relay dropped data")
+    return total_bytes / timer.elapsed
+
+
+def download_throughput(proxy_port: int, total_bytes: int) -> float:
+    source = SourceServer(total_bytes)
+    buffer = bytearray(1 << 20)
+    received = 0
+    try:
+        with Timer() as timer:
+            with open_tunnel(proxy_port, source.port) as tunnel:
+                while chunk := tunnel.recv_into(buffer):
+                    received += chunk
+    finally:
+        source.close()
+    if received != total_bytes:
+        raise RuntimeError(f"received {received} of {total_bytes} bytes")
+    return total_bytes / timer.elapsed
+
+
+def udp_datagrams_per_second(proxy_port: int, echo_port: int, datagrams: int, window: int) -> float:
+    """Echoed datagrams per second through one UDP ASSOCIATE, window in flight."""
+    control = socket.create_connection(("127.0.0.1", proxy_port))
+    client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    client.bind(("127.0.0.1", 0))
+    try:
+        control.sendall(b"\x05\x01\x00")
+        control.recv(2)
+        control.sendall(b"\x05\x03\x00\x01" + socket.inet_aton("127.0.0.1") + struct.pack("!H", 0))
+        reply = control.recv(10)
+        if reply[1] != 0x00:
+            raise RuntimeError(f"UDP ASSOCIATE failed with reply {reply[1]}")
+        relay_address = ("127.0.0.1", struct.unpack("!H", reply[8:10])[0])
+
+        datagram = b"\x00\x00\x00\x01" + socket.inet_aton("127.0.0.1") + struct.pack("!H", echo_port)
+        datagram += b"\xab" * 64
+        received = 0
+        with Timer() as timer:
+            for _ in range(datagrams // window):
+                for _ in range(window):
+                    client.sendto(datagram, relay_address)
+                pending = window
+                # Datagrams lost on a full socket buffer are not retried
+                while pending and select.select([client], [], [], 0.5)[0]:
+                    client.recv(65535)
+                    pending -= 1
+                    received += 1
+    finally:
+        client.close()
+        control.close()
+    return received / timer.elapsed
+
+
+def rss_bytes() -> int:
+    """Resident set size of this process, from /proc (Linux)."""
+    with open("/proc/self/statm") as statm:
+        return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def rss_per_1k_idle_tunnels(proxy_port: int, tunnels: int) -> float:
+    """
+    Resident memory added per 1000 CONNECT tunnels that are open but carry no data.
+    The clients live in this process too, but a client socket costs only kernel memory.
+    """
+    sink = SinkServer()
+    opened: list[socket.socket] = []
+
+    def open_all() -> None:
+        accepted = sink.accepted
+        for _ in range(tunnels):
+            opened.append(open_tunnel(proxy_port, sink.port))
+        if not wait_until(lambda: sink.accepted >= accepted + tunnels):
+            raise RuntimeError(f"only {sink.accepted - accepted} of {tunnels} tunnels reached the sink")
+        time.sleep(0.2)
+
+    def close_all() -> None:
+        for tunnel in opened:
+            tunnel.close()
+        opened.clear()
+
+    try:
+        # A first round grows the allocator arenas and thread stacks, which are kept
+        # for reuse, so the measured round counts only what live tunnels hold
+        open_all()
+        close_all()
+        time.sleep(0.5)
+        before = rss_bytes()
+        open_all()
+        return (rss_bytes() - before) / tunnels * 1000
+    finally:
+        close_all()
+        sink.close()
+
+
+def run(args: argparse.Namespace) -> dict:
+    results = {}
+    echo, udp_echo, sink = EchoServer(), UDPEchoServer(), SinkServer()
+    try:
+        with InProcessProxy(args.engine) as proxy:
+            results["connections_per_second"] = connections_per_second(
+                proxy.port, echo.port, args.connections, args.concurrency
+            )
+            results.update(ttfb_percentiles(proxy.port, echo.port, args.requests))
+            results["tcp_upload_single_bytes_per_second"] = upload_throughput(
+                proxy.port, sink, 1, args.megabytes * MB
+            )
+            results["tcp_download_single_bytes_per_second"] = download_throughput(
+                proxy.port, args.megabytes * MB
+            )
+            results["tcp_upload_many_bytes_per_second"] = upload_throughput(
+                proxy.port, sink, args.streams, args.megabytes * MB
+            )
+            results["udp_datagrams_per_second"] = udp_datagrams_per_second(
+                proxy.port, udp_echo.port, args.datagrams, args.window
+            )
+            if sys.platform.startswith("linux"):
+                results["rss_bytes_per_1k_idle_tunnels"] = rss_per_1k_idle_tunnels(
+                    proxy.port, args.idle_tunnels
+                )
+    finally:
+        echo.close()
+        udp_echo.close()
+        sink.close()
+    return results
+
+
+def find_regressions(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """
+    Returns a line for every metric in both result sets that is worse than its
+    baseline value by more than tolerance, a fraction of the baseline.
+    """
+    regressions = []
+    for metric, (unit, higher_is_better) in METRICS.items():
+        if metric not in results or not baseline.get(metric):
+            continue
+        change = (results[metric] - baseline[metric]) / baseline[metric]
+        if (-change if higher_is_better else change) > tolerance:
+            regressions.append(
+                f"{metric}: {results[metric]:.2f} {unit} vs baseline "
+                f"{baseline[metric]:.2f} {unit} ({change:+.1%})"
+            )
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--engine", choices=["threading", "asyncio"], default="threading")
+    parser.add_argument("--connections", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--megabytes", type=int, default=128)
+    parser.add_argument("--streams", type=int, default=16)
+    parser.add_argument("--datagrams", type=int, default=50_000)
+    parser.add_argument("--window", type=int, default=32)
+    # The threading engine refuses connections past its limit of 200
+    parser.add_argument("--idle-tunnels", type=int, default=150)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", help="Write the results to this JSON file.")
+    parser.add_argument(
+        "--baseline",
+        nargs="?",
+        const=BASELINE,
+        help=f"Compare with the results in this JSON file (default {os.path.relpath(BASELINE)}).",
+    )
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args()
+
+    runs = [run(args) for _ in range(args.repeat)]
+    # Medians across runs, so one noisy run does not trip the regression check
+    results = {metric: statistics.median(result[metric] for result in runs) for metric in runs[0]}
+    print(f"Proxy end to end, {args.engine} engine, median of {args.repeat} runs")
+    for metric, value in results.items():
+        unit = METRICS[metric][0]
+        shown = format_rate(value, unit) if unit.endswith(("/s", "B")) else f"{value:8.3f} {unit}"
+        print(f"  {metric:>38}: {shown}")
+
+    if args.output:
+        report = {
+            "engine": args.engine,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "repeat": args.repeat,
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "results": results,
+        }
+        with open(args.output, "w") as output:
+            json.dump(report, output, indent=2)
+            output.write("\n")
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        if baseline.get("engine") != args.engine:
+            print(f"Baseline was recorded with the {baseline.get('engine')} engine")
+        regressions = find_regressions(results, baseline["results"], args.tolerance)
+        if regressions:
+            print(f"Regressions beyond {args.tolerance:.0%} of {args.baseline}:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print(f"No regressions beyond {args.tolerance:.0%} of {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Throughput benchmark for UDP fragment reassembly.
+
+A client sends payloads through a UDPRelay to a loopback UDP echo server, either
+whole or split into SOCKS5 fragments (RFC 1928 section 7) that the relay reassembles
+before forwarding, and waits for each echoed payload. Reports payloads and payload
+bytes per second for each fragment count.
+
+    python -m benchmarks.udp_fragments [--payloads N] [--size BYTES]
+"""
+import argparse
+import socket
+import struct
+import threading
+
+from src.constants import AddressTypeCodes
+from src.models import DetailedAddress
+from src.relays import UDPRelay
+
+from .common import Timer, format_rate, tcp_socket_pair
+from .udp_pps import UDPEchoServer
+
+FRAGMENT_COUNTS = (1, 2, 4, 8)
+END_OF_SEQUENCE = 0x80
+
+
+def fragment_payload(payload: bytes, count: int, echo_port: int) -> list[bytes]:
+    """Splits payload into count SOCKS5 UDP datagrams, or one FRAG 0 datagram if count is 1."""
+    address = socket.inet_aton("127.0.0.1") + struct.pack("!H", echo_port)
+    if count == 1:
+        return [b"\x00\x00\x00\x01" + address + payload]
+    step = -(-len(payload) // count)
+    datagrams = []
+    for position in range(1, count + 1):
+        frag = position | (END_OF_SEQUENCE if position == count else 0)
+        chunk = payload[(position - 1) * step : position * step]
+        datagrams.append(struct.pack("!HBB", 0, frag, 1) + address + chunk)
+    return datagrams
+
+
+def run(count: int, payloads: int, size: int, echo_port: int) -> tuple[int, float]:
+    """Returns (payloads echoed, elapsed seconds)."""
+    control_client, control_server = tcp_socket_pair()
+    dst = DetailedAddress(name="0.0.0.0", ip="0.0.0.0", port=0, address_type=AddressTypeCodes.IPv4)
+    relay = UDPRelay(control_server, dst)
+    relay_thread = threading.Thread(target=relay.listen_and_relay, daemon=True)
+    relay_thread.start()
+
+    relay_address = ("127.0.0.1", relay.get_proxy_address().port)
+    datagrams = fragment_payload(b"\xab" * size, count, echo_port)
+    client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    client.settimeout(0.5)
+    received = 0
+    with Timer() as timer:
+        for _ in range(payloads):
+            for datagram in datagrams:
+                client.sendto(datagram, relay_address)
+            try:
+                client.recv(65535)
+            except socket.timeout:
+                continue
+            received += 1
+
+    client.close()
+    control_client.close()
+    relay_thread.join()
+    control_server.close()
+    return received, timer.elapsed
+
+
+def benchmark(payloads: int, size: int) -> dict:
+    echo = UDPEchoServer()
+    try:
+        results = {}
+        for count in FRAGMENT_COUNTS:
+            received, elapsed = run(count, payloads, size, echo.port)
+            results[count] = {
+                "payloads_per_second": received / elapsed,
+                "bytes_per_second": received * size / elapsed,
+                "loss": 1 - received / payloads,
+            }
+        return results
+    finally:
+        echo.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--payloads", type=int, default=20_000)
+    parser.add_argument("--size", type=int, default=4000)
+    args = parser.parse_args()
+
+    results = benchmark(args.payloads, args.size)
+    print(f"UDP relay, {args.payloads} payloads of {args.size} bytes, one in flight")
+    for count, result in results.items():
+        label = "whole" if count == 1 else f"{count} fragments"
+        print(
+            f"  {label:>11}: {format_rate(result['payloads_per_second'], 'payloads/s')}"
+            f" | {format_rate(result['bytes_per_second'], 'B/s')}"
+            f" | {result['loss']:6.2%} lost"
+        )
+
+
+if __name__ == "__main__":
+    main()
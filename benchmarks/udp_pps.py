@@ -0,0 +1,134 @@
+"""
+Packets-per-second benchmark for the UDP relay.
+
+A client pushes windows of small SOCKS5-encapsulated datagrams through a UDPRelay to a
+loopback UDP echo server and waits for the replies. Compares one recvfrom/sendto per
+datagram with the batched data path, both draining with plain socket calls and with
+recvmmsg/sendmmsg where the platform has them.
+
+    python -m benchmarks.udp_pps [--datagrams N] [--window W] [--size BYTES]
+"""
+import argparse
+import select
+import socket
+import struct
+import threading
+
+from src.constants import AddressTypeCodes, RELAY_BUFFER_SIZE, UDP_BATCH_SIZE, UDP_BUFFER_SIZE
+from src.models import DetailedAddress
+from src.relays import UDPRelay
+from src.utils import mmsg
+from src.utils.mmsg import DatagramReceiver, DatagramSender
+
+from .common import Timer, format_rate, tcp_socket_pair
+
+MODES = {
+    # label: (batch size, use recvmmsg/sendmmsg)
+    "per-datagram": (1, False),
+    "drain": (UDP_BATCH_SIZE, False),
+    "mmsg": (UDP_BATCH_SIZE, True),
+}
+
+
+class UDPEchoServer:
+    """Echoes every datagram back to its sender, in batches."""
+
+    def __init__(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(("127.0.0.1", 0))
+        self.sock.setblocking(False)
+        self.port: int = self.sock.getsockname()[1]
+        self._stop = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        receiver = DatagramReceiver(UDP_BATCH_SIZE, RELAY_BUFFER_SIZE)
+        sender = DatagramSender(UDP_BATCH_SIZE, RELAY_BUFFER_SIZE)
+        while not self._stop:
+            select.select([self.sock], [], [], 0.1)
+            sender.send(self.sock, receiver.recv(self.sock))
+
+    def close(self) -> None:
+        self._stop = True
+        self._thread.join()
+        self.sock.close()
+
+
+def run(mode: str, datagrams: int, window: int, size: int, echo_port: int) -> tuple[int, float]:
+    """Returns (replies received, elapsed seconds)."""
+    batch_size, use_mmsg = MODES[mode]
+    control_client, control_server = tcp_socket_pair()
+    dst = DetailedAddress(name="0.0.0.0", ip="0.0.0.0", port=0, address_type=AddressTypeCodes.IPv4)
+
+    relay = UDPRelay(control_server, dst)
+    relay._receiver = DatagramReceiver(batch_size, UDP_BUFFER_SIZE, use_mmsg=use_mmsg)
+    relay._sender = DatagramSender(batch_size, UDP_BUFFER_SIZE + 22, use_mmsg=use_mmsg)
+    relay_thread = threading.Thread(target=relay.listen_and_relay, daemon=True)
+    relay_thread.start()
+
+    relay_address = ("127.0.0.1", relay.get_proxy_address().port)
+    header = b"\x00\x00\x00\x01" + socket.inet_aton("127.0.0.1") + struct.pack("!H", echo_port)
+    packet = (header + b"\xab" * size, relay_address)
+
+    client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    client.setblocking(False)
+    client_sender = DatagramSender(window, RELAY_BUFFER_SIZE)
+    client_receiver = DatagramReceiver(UDP_BATCH_SIZE, RELAY_BUFFER_SIZE)
+    received = 0
+    with Timer() as timer:
+        for _ in range(datagrams // window):
+            client_sender.send(client, [packet] * window)
+            pending = window
+            # Datagrams lost on a full socket buffer are not retried
+            while pending and select.select([client], [], [], 0.5)[0]:
+                replies = len(client_receiver.recv(client))
+                pending -= replies
+                received += replies
+
+    client.close()
+    control_client.close()
+    relay_thread.join()
+    control_server.close()
+    return received, timer.elapsed
+
+
+def benchmark(datagrams: int, window: int, size: int) -> dict:
+    echo = UDPEchoServer()
+    try:
+        results = {}
+        for mode in MODES:
+            if MODES[mode][1] and not mmsg.MMSG_AVAILABLE:
+                continue
+            received, elapsed = run(mode, datagrams, window, size, echo.port)
+            results[mode] = {
+                # Every reply is two relayed datagrams: the request and its response
+                "datagrams_per_second": 2 * received / elapsed,
+                "loss": 1 - received / (datagrams // window * window),
+            }
+        return results
+    finally:
+        echo.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--datagrams", type=int, default=200_000)
+    parser.add_argument("--window", type=int, default=64)
+    parser.add_argument("--size", type=int, default=64)
+    args = parser.parse_args()
+
+    results = benchmark(args.datagrams, args.window, args.size)
+    print(
+        f"UDP relay, {args.datagrams} datagrams of {args.size} bytes, "
+        f"{args.window} in flight, batches of {UDP_BATCH_SIZE}"
+    )
+    for label, result in results.items():
+        print(
+            f"  {label:>12}: {format_rate(result['datagrams_per_second'], 'datagrams/s')}"
+            f" | {result['loss']:6.2%} lost"
+        )
+
+
+if __name__ == "__main__":
+    main()
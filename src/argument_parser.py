@@ -1,8 +1,34 @@
 import argparse
+import os
+
+from .tuning import PROFILES
 
 __version__ = "2.0.0"
 
 
+def host_port(value: str) -> tuple[str, int]:
+    """
+    Parses HOST:PORT, with IPv6 hosts written as [HOST]:PORT.
+    """
+    host, _, port = value.rpartition(":")
+    host = host.strip("[]")
+    if not host or not port.isdigit() or not 0 < int(port) < 65536:
+        raise argparse.ArgumentTypeError(f"expected HOST:PORT, got {value!r}")
+    return host, int(port)
+
+
+def port_profile(value: str) -> tuple[int, str]:
+    """
+    Parses PORT=PROFILE, with PROFILE one of the socket profiles.
+    """
+    port, _, profile = value.partition("=")
+    if not port.isdigit() or not 0 < int(port) < 65536 or profile not in PROFILES:
+        raise argparse.ArgumentTypeError(
+            f"expected PORT=PROFILE with PROFILE one of {', '.join(PROFILES)}, got {value!r}"
+        )
+    return int(port), profile
+
+
 def parse_arguments() -> argparse.Namespace:
     """
     Parses command line arguments for the SOCKS5 Proxy Server.
@@ -26,6 +52,198 @@ def parse_arguments() -> argparse.Namespace:
     server_group.add_argument(
         "-P", "--port", type=int, default=1080, help="Port number for the SOCKS server."
     )
+    server_group.add_argument(
+        "-E",
+        "--engine",
+        type=str,
+        choices=["threading", "asyncio"],
+        default="threading",
+        help="Serving engine: a pool of worker threads, one per connection being served, "
+        "or a single asyncio event loop.",
+    )
+    server_group.add_argument(
+        "-W",
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of worker processes. With more than one, each worker binds the "
+        "address with SO_REUSEPORT and a supervisor restarts crashed workers.",
+    )
+    server_group.add_argument(
+        "--max-connections",
+        type=int,
+        default=None,
+        metavar="N",
+        help="Connections served at once per worker process: worker threads with the "
+        "threading engine (default 200), open connections with asyncio (default 20000).",
+    )
+    server_group.add_argument(
+        "--accept-queue",
+        type=int,
+        default=256,
+        metavar="N",
+        help="Threading engine: accepted connections that may wait for a busy worker thread "
+        "before new ones are refused. 0 refuses as soon as every worker is busy.",
+    )
+    server_group.add_argument(
+        "--accept-queue-timeout",
+        type=float,
+        default=5.0,
+        metavar="SECONDS",
+        help="Threading engine: close queued connections that waited longer than this "
+        "for a worker thread. 0 waits indefinitely.",
+    )
+    server_group.add_argument(
+        "--socket-profile",
+        type=str,
+        choices=list(PROFILES),
+        default="default",
+        help="Socket options for accepted client sockets and, unless --port-profile "
+        "says otherwise, upstream sockets: kernel defaults, interactive (TCP_NODELAY, "
+        "quick ACKs, fast keepalive) or bulk (large buffers, patient timeouts).",
+    )
+
+    # DNS Configuration
+    dns_group = parser.add_argument_group("DNS Configuration")
+    dns_group.add_argument(
+        "--reverse-dns",
+        type=str,
+        choices=["async", "off"],
+        default="async",
+        help="Reverse (PTR) lookups of requested IPs for log lines: resolved in the background, or disabled.",
+    )
+
+    # Relay Configuration
+    relay_group = parser.add_argument_group("Relay Configuration")
+    relay_group.add_argument(
+        "-R",
+        "--relay-mode",
+        type=str,
+        choices=["copy", "splice", "auto"],
+        default="copy",
+        help="TCP relay data path: copy through Python buffers, zero-copy splice() (Linux), "
+        "or splice when available.",
+    )
+    relay_group.add_argument(
+        "--pool-destination",
+        type=host_port,
+        action="append",
+        default=[],
+        metavar="HOST:PORT",
+        help="Keep pre-connected sockets to this upstream for CONNECT requests. Repeatable.",
+    )
+    relay_group.add_argument(
+        "--pool-size",
+        type=int,
+        default=4,
+        help="Connected sockets kept per --pool-destination.",
+    )
+    relay_group.add_argument(
+        "--relay-buffer-min",
+        type=int,
+        default=4096,
+        metavar="BYTES",
+        help="Smallest TCP relay read size. Each direction starts here and returns here when idle.",
+    )
+    relay_group.add_argument(
+        "--relay-buffer-max",
+        type=int,
+        default=262144,
+        metavar="BYTES",
+        help="Largest TCP relay read size, reached while reads keep filling the buffer. "
+        "Equal to --relay-buffer-min for a fixed size.",
+    )
+    relay_group.add_argument(
+        "--port-profile",
+        type=port_profile,
+        action="append",
+        default=[],
+        metavar="PORT=PROFILE",
+        help="Socket profile for both sides of tunnels to this destination port, "
+        "e.g. 22=interactive. Repeatable.",
+    )
+    relay_group.add_argument(
+        "--idle-timeout",
+        type=float,
+        default=0.0,
+        metavar="SECONDS",
+        help="Close TCP tunnels that relayed no bytes in either direction for this long. 0 disables.",
+    )
+    relay_group.add_argument(
+        "--max-lifetime",
+        type=float,
+        default=0.0,
+        metavar="SECONDS",
+        help="Close TCP tunnels this long after relaying starts, busy or not. 0 disables.",
+    )
+    relay_group.add_argument(
+        "--half-close-linger",
+        type=float,
+        default=0.0,
+        metavar="SECONDS",
+        help="When one side of a TCP tunnel finishes sending, pass the half-close on and keep "
+        "relaying the other direction for up to this long. 0 closes the tunnel at once.",
+    )
+
+    # Authentication
+    auth_group = parser.add_argument_group("Authentication")
+    auth_group.add_argument(
+        "--credentials-file",
+        type=str,
+        default=None,
+        metavar="PATH",
+        help="File of username:hash lines to authenticate users against, reloaded when it "
+        "changes. Lines are made by python -m src.credentials USERNAME. Defaults to the "
+        "SOCKS5_USERNAME and SOCKS5_PASSWORD pair.",
+    )
+    auth_group.add_argument(
+        "--auth-cache-ttl",
+        type=float,
+        default=300.0,
+        metavar="SECONDS",
+        help="Accept credentials verified in the last SECONDS without hashing them again. 0 disables.",
+    )
+
+    # Per-User Limits
+    limits_group = parser.add_argument_group("Per-User Limits")
+    limits_group.add_argument(
+        "--user-bandwidth",
+        type=int,
+        default=0,
+        metavar="BYTES",
+        help="Bytes per second each authenticated user may relay in each direction, "
+        "shared by all of the user's sessions. 0 disables.",
+    )
+    limits_group.add_argument(
+        "--user-max-sessions",
+        type=int,
+        default=0,
+        metavar="N",
+        help="Concurrent sessions per authenticated user. 0 disables.",
+    )
+    limits_group.add_argument(
+        "--user-connection-rate",
+        type=float,
+        default=0.0,
+        metavar="PER_SECOND",
+        help="New sessions per second per authenticated user. 0 disables.",
+    )
+
+    # Metrics Configuration
+    metrics_group = parser.add_argument_group("Metrics Configuration")
+    metrics_group.add_argument(
+        "--metrics-port",
+        type=int,
+        default=None,
+        help="Serve Prometheus metrics at http://METRICS_HOST:METRICS_PORT/metrics. "
+        "Disabled when unset. With --workers, worker N listens on METRICS_PORT + N.",
+    )
+    metrics_group.add_argument(
+        "--metrics-host",
+        type=str,
+        default="localhost",
+        help="Host address for the metrics listener.",
+    )
 
     # Logging Configuration
     logging_group = parser.add_argument_group("Logging Configuration")
@@ -34,8 +252,31 @@ def parse_arguments() -> argparse.Namespace:
         "--logging-level",
         type=str,
         choices=["disabled", "debug", "info", "warning", "error", "critical"],
-        default="debug",
-        help="Set the logging level.",
+        default="info",
+        help="Set the logging level. debug logs every relayed chunk, see --relay-log-sample.",
+    )
+    logging_group.add_argument(
+        "--slow-session-threshold",
+        type=float,
+        default=1.0,
+        metavar="SECONDS",
+        help="Log sessions whose setup, from accept to the first relayed byte, takes at "
+        "least this long, with the time spent in each phase. 0 disables.",
+    )
+    logging_group.add_argument(
+        "--relay-log-sample",
+        type=int,
+        default=1,
+        metavar="N",
+        help="At debug level, log one in every N chunks relayed by each connection. 0 disables.",
+    )
+    logging_group.add_argument(
+        "--relay-log-interval",
+        type=float,
+        default=0.0,
+        metavar="SECONDS",
+        help="At debug level, log the chunks and bytes each connection relayed in each "
+        "direction every SECONDS, and when it closes. 0 disables.",
     )
 
     # Version Information
@@ -44,4 +285,25 @@ def parse_arguments() -> argparse.Namespace:
     )
 
     args = parser.parse_args()
+    if not 0 < args.relay_buffer_min <= args.relay_buffer_max:
+        parser.error("--relay-buffer-min must be positive and at most --relay-buffer-max")
+    if args.max_connections is not None and args.max_connections < 1:
+        parser.error("--max-connections must be at least 1")
+    if args.credentials_file is not None and not os.path.isfile(args.credentials_file):
+        parser.error(f"--credentials-file {args.credentials_file} is not a file")
+    for flag in (
+        "idle_timeout",
+        "max_lifetime",
+        "half_close_linger",
+        "accept_queue",
+        "accept_queue_timeout",
+        "relay_log_sample",
+        "relay_log_interval",
+        "user_bandwidth",
+        "user_max_sessions",
+        "user_connection_rate",
+        "auth_cache_ttl",
+    ):
+        if getattr(args, flag) < 0:
+            parser.error(f"--{flag.replace('_', '-')} must not be negative")
     return args
@@ -0,0 +1,426 @@
+"""
+asyncio serving engine.
+
+Serves the same SOCKS5 flow as ThreadingTCPServer/TCPProxyServer, but every client,
+upstream connection and UDP association lives on one event loop instead of an OS thread.
+"""
+import asyncio
+import socket
+from concurrent.futures import Future
+
+from .constants import (
+    SOCKS_VERSION,
+    AUTH_TIMEOUT,
+    DNS_LOOKUP_TIMEOUT,
+    HANDSHAKE_READ_SIZE,
+    AddressTypeCodes,
+    CommandCodes,
+    MethodCodes,
+)
+from .credentials import get_authenticator
+from .exceptions import InvalidRequestError, InvalidVersionError, UserLimitExceededError
+from .handlers import TCPHandler
+from .handlers.base import BaseHandler
+from .limits import UserSession, get_user_limiter
+from .relays import AsyncTCPRelay, AsyncUDPRelay
+from .resolver import get_resolver
+from .utils import (
+    map_address_int_to_enum,
+    generate_general_socks_server_failure_reply,
+    generate_command_not_supported_reply,
+    generate_connection_refused_reply,
+    generate_host_unreachable_reply,
+    generate_succeeded_reply,
+    generate_connection_not_allowed_by_ruleset_reply,
+    connection_established_template,
+)
+from .logger import get_logger
+from .metrics import (
+    ACTIVE_CONNECTIONS,
+    CONNECTIONS_ACCEPTED,
+    CONNECTIONS_REJECTED,
+    HANDSHAKE_FAILURES,
+)
+from .models import Request, DetailedAddress
+from .protocol import Credentials, Event, Greeting, RequestReceived, ServerProtocol
+from .timing import SessionTimer
+from .tuning import apply_socket_profile, listener_profile
+
+logger = get_logger(__name__)
+
+
+MAX_CONNECTIONS = 20000
+
+
+class AsyncTCPServer:
+    """
+    An asyncio TCP server with a connection limit.
+
+    https://docs.python.org/3/library/asyncio-stream.html#asyncio.start_server
+    """
+
+    def __init__(
+        self,
+        server_address: tuple[str, int],
+        max_connections: int = None,
+        reuse_port: bool = False,
+    ):
+        self.server_address = server_address
+        self.max_connections = max_connections or MAX_CONNECTIONS
+        self.reuse_port = reuse_port
+        self.active_connections = 0
+        self._server: asyncio.AbstractServer = None
+
+    async def start(self) -> None:
+        """
+        Binds the listening socket. server_address is updated with the bound address.
+        """
+        self._server = await asyncio.start_server(
+            self._accept, *self.server_address, reuse_port=self.reuse_port or None
+        )
+        self.server_address = self._server.sockets[0].getsockname()[:2]
+
+    async def serve_forever(self) -> None:
+        if self._server is None:
+            await self.start()
+        await self._server.serve_forever()
+
+    async def close(self) -> None:
+        if self._server is None:
+            return
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def _accept(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        if self.active_connections >= self.max_connections:
+            logger.warning("Connection limit reached, rejecting connection")
+            CONNECTIONS_REJECTED.labels("limit").inc()
+            writer.close()
+            return
+
+        self.active_connections += 1
+        CONNECTIONS_ACCEPTED.inc()
+        ACTIVE_CONNECTIONS.inc()
+        apply_socket_profile(writer.get_extra_info("socket"), listener_profile())
+        try:
+            await AsyncTCPProxyHandler(reader, writer).handle()
+        finally:
+            ACTIVE_CONNECTIONS.dec()
+            self.active_connections -= 1
+
+
+class AsyncTCPProxyHandler:
+    """
+    Coroutine counterpart of TCPProxyServer and TCPHandler. One instance per client.
+    """
+
+    client_address: DetailedAddress
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """
+        Initializes a new instance of the AsyncTCPProxyHandler class.
+
+        Args:
+            reader (asyncio.StreamReader): The client stream reader.
+            writer (asyncio.StreamWriter): The client stream writer.
+        """
+        self.reader = reader
+        self.writer = writer
+        self.protocol = ServerProtocol()
+        # Set once USERNAME/PASSWORD authentication succeeds
+        self.username: str = None
+        self.user_session: UserSession = None
+        # The loop runs the accept callback directly, so accept ends here
+        self.timer = SessionTimer()
+        self.timer.mark("accept")
+
+    async def handle(self) -> None:
+        """
+        Services a single client from method negotiation to the end of the relay.
+        """
+        try:
+            if not await self.handle_request():
+                logger.error("Handshake failed")
+                return
+
+            try:
+                dst_request: Request = await self.parse_request()
+            except Exception:
+                logger.error("Failed to parse SOCKS5 request")
+                HANDSHAKE_FAILURES.labels("request").inc()
+                await self._send_error_reply(generate_general_socks_server_failure_reply())
+                return
+            self.timer.mark("request")
+
+            peer = self.writer.get_extra_info("peername")
+            self.timer.peer = peer
+            self.timer.destination = dst_request.address
+            self.client_address = DetailedAddress(
+                ip=peer[0],
+                port=peer[1],
+                name="Client",
+                address_type=dst_request.address.address_type,
+            )
+            self._log_connection(dst_request.address)
+
+            atyp = dst_request.address.address_type
+            try:
+                self.user_session = get_user_limiter().acquire(self.username)
+            except UserLimitExceededError as e:
+                logger.warning(str(e))
+                HANDSHAKE_FAILURES.labels(e.reason).inc()
+                await self._send_error_reply(generate_connection_not_allowed_by_ruleset_reply(atyp))
+                return
+
+            try:
+                if dst_request.command == CommandCodes.CONNECT.value:
+                    await self.handle_connect(dst_request.address, self.protocol.trailing_data())
+
+                elif dst_request.command == CommandCodes.BIND.value:
+                    logger.error("BIND command not supported")
+                    HANDSHAKE_FAILURES.labels("command_not_supported").inc()
+                    await self._send_error_reply(generate_command_not_supported_reply(atyp))
+
+                elif dst_request.command == CommandCodes.UDP_ASSOCIATE.value:
+                    await self.handle_udp_associate(dst_request.address)
+
+                else:
+                    HANDSHAKE_FAILURES.labels("command_not_supported").inc()
+                    await self._send_error_reply(generate_command_not_supported_reply(atyp))
+
+            except ConnectionRefusedError:
+                logger.error(f"Connection refused: {dst_request.address}")
+                HANDSHAKE_FAILURES.labels("connection_refused").inc()
+                await self._send_error_reply(generate_connection_refused_reply(atyp))
+            except (socket.gaierror, TimeoutError, asyncio.TimeoutError):
+                logger.error(f"Host unreachable: {dst_request.address}")
+                HANDSHAKE_FAILURES.labels("host_unreachable").inc()
+                await self._send_error_reply(generate_host_unreachable_reply(atyp))
+            except Exception as e:
+                logger.error(f"Exception: {e}")
+                HANDSHAKE_FAILURES.labels("server_failure").inc()
+                await self._send_error_reply(generate_general_socks_server_failure_reply(atyp))
+        finally:
+            self.timer.finish()
+            if self.user_session is not None:
+                self.user_session.release()
+            await self.finish()
+
+    async def handle_request(self) -> bool:
+        """
+        Method negotiation per RFC 1928, see TCPHandler.handle_request.
+
+        Returns:
+            bool: True if the handshake was successful, False otherwise.
+        """
+        try:
+            greeting: Greeting = await self._next_event()
+            negotiated_authentication: MethodCodes = (
+                TCPHandler._negotiate_authentication_method(greeting.methods)
+            )
+            await self._send(self.protocol.select_method(negotiated_authentication))
+            self.timer.mark("negotiation")
+
+            if negotiated_authentication == MethodCodes.NO_AUTHENTICATION_REQUIRED:
+                return True
+            elif negotiated_authentication == MethodCodes.USERNAME_PASSWORD:
+                authenticated = await self._handle_username_password_auth()
+                self.timer.mark("auth")
+                return authenticated
+            else:
+                logger.warning("No acceptable authentication methods")
+                HANDSHAKE_FAILURES.labels("no_acceptable_methods").inc()
+                return False
+
+        except InvalidVersionError as e:
+            logger.warning(f"Handshake error: {e}")
+            HANDSHAKE_FAILURES.labels("version").inc()
+            return False
+        except InvalidRequestError as e:
+            logger.warning(f"Malformed greeting: {e}")
+            HANDSHAKE_FAILURES.labels("negotiation").inc()
+            return False
+        except OSError as e:
+            logger.error(f"Socket error during handshake: {e}")
+            HANDSHAKE_FAILURES.labels("negotiation").inc()
+            return False
+
+    async def _handle_username_password_auth(self) -> bool:
+        """
+        USERNAME/PASSWORD subnegotiation per RFC 1929, see TCPHandler._handle_username_password_auth.
+        """
+        try:
+            if await asyncio.wait_for(self._username_password_auth(), AUTH_TIMEOUT):
+                return True
+        except asyncio.TimeoutError:
+            logger.error("Socket timed out waiting for data")
+        except OSError as e:
+            logger.error(f"Socket error during username/password authentication: {e}")
+        HANDSHAKE_FAILURES.labels("auth").inc()
+        return False
+
+    async def _username_password_auth(self) -> bool:
+        try:
+            credentials: Credentials = await self._next_event()
+        except (InvalidVersionError, InvalidRequestError) as e:
+            logger.error(f"Malformed username/password request: {e}")
+            await self._send(self.protocol.auth_reply(False))
+            return False
+        username, password = credentials.username, credentials.password
+
+        # Hashing a password takes long enough to stall the event loop, so it runs in a thread
+        authenticator = get_authenticator()
+        authenticated = authenticator.cached(username, password)
+        if not authenticated:
+            loop = asyncio.get_running_loop()
+            authenticated = await loop.run_in_executor(None, authenticator.verify, username, password)
+        await self._send(self.protocol.auth_reply(authenticated))
+        if authenticated:
+            logger.info(f"Authenticated user: {username}")
+            self.username = username
+            return True
+
+        logger.warning(f"Invalid authentication request: {username}")
+        return False
+
+    async def parse_request(self) -> Request:
+        """
+        Parses the client request, see BaseHandler.parse_request.
+        """
+        request: RequestReceived = await self._next_event()
+        address: DetailedAddress = await self._resolve_address(request)
+        return Request(version=SOCKS_VERSION, command=request.command, address=address)
+
+    async def _resolve_address(self, request: RequestReceived) -> DetailedAddress:
+        """
+        Resolves the destination of request, see BaseHandler._resolve_address.
+        """
+        candidates: list[str] = []
+        address_type = request.address_type
+        if address_type == AddressTypeCodes.DOMAIN_NAME.value:
+            self.timer.mark("request")
+            address, address_type, candidates = await self._resolve_hostname(request.host)
+            self.timer.mark("dns")
+        else:
+            address = request.host
+
+        detailed_address = DetailedAddress(
+            name=request.host,
+            ip=address,
+            port=request.port,
+            address_type=map_address_int_to_enum(address_type),
+            candidates=candidates,
+        )
+        if request.address_type != AddressTypeCodes.DOMAIN_NAME.value:
+            BaseHandler._enrich_address(detailed_address)
+        return detailed_address
+
+    async def _wait_for_lookup(self, lookup: Future, label: str):
+        """Wait up to DNS_LOOKUP_TIMEOUT for a resolver lookup. Returns result or None."""
+        waiter = asyncio.wrap_future(lookup)
+        # Retrieve late failures so an abandoned lookup does not log "exception never retrieved"
+        waiter.add_done_callback(lambda done: done.cancelled() or done.exception())
+        try:
+            # shield() keeps a timeout here from cancelling a lookup other clients share
+            return await asyncio.wait_for(asyncio.shield(waiter), DNS_LOOKUP_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.debug(f"DNS lookup timed out for {label}")
+        except OSError:
+            pass
+        except Exception as e:
+            logger.error(f"DNS lookup error for {label}", exc_info=e)
+        return None
+
+    async def _resolve_hostname(self, name: str) -> tuple[str, int, list[str]]:
+        result = await self._wait_for_lookup(get_resolver().resolve(name), name)
+        return BaseHandler._select_address(name, result)
+
+    async def handle_connect(self, dst_address: DetailedAddress, early_data: bytes = b"") -> None:
+        """
+        Handles CONNECT command, see TCPProxyServer.handle_connect.
+        """
+        tcp_relay = AsyncTCPRelay(self.reader, self.writer, dst_address, self.user_session)
+        await tcp_relay.generate_proxy_connection()
+        self.timer.mark("connect")
+
+        try:
+            await self._send(
+                generate_succeeded_reply(dst_address.address_type, *tcp_relay.get_proxy_address())
+            )
+        except Exception:
+            await tcp_relay._cleanup()
+            raise
+        self.timer.mark("reply")
+
+        tcp_relay.on_first_byte = self.timer.first_byte
+        tcp_relay.forward_early_data(early_data)
+        await tcp_relay.listen_and_relay()
+
+    async def handle_udp_associate(self, dst_address: DetailedAddress) -> None:
+        """
+        Handles UDP ASSOCIATE command.
+        """
+        udp_relay = AsyncUDPRelay(self.writer, dst_address, self.user_session)
+        self.timer.mark("connect")
+
+        try:
+            await self._send(
+                generate_succeeded_reply(dst_address.address_type, *udp_relay.get_proxy_address())
+            )
+        except Exception:
+            udp_relay._cleanup()
+            raise
+        self.timer.mark("reply")
+        self.timer.finish()
+
+        await udp_relay.listen_and_relay(self.reader)
+
+    async def _next_event(self) -> Event:
+        """
+        Returns the next message from the client, see BaseHandler._next_event.
+        """
+        event = self.protocol.next_event()
+        while event is None:
+            data = await self.reader.read(HANDSHAKE_READ_SIZE)
+            if not data:
+                raise ConnectionError("Connection closed during recv")
+            self.protocol.receive_data(data)
+            event = self.protocol.next_event()
+        return event
+
+    async def _send(self, data: bytes) -> None:
+        self.writer.write(data)
+        await self.writer.drain()
+
+    async def _send_error_reply(self, reply: bytes) -> None:
+        """
+        Sends an error reply to the client, swallowing OSError on send failure.
+        """
+        try:
+            await self._send(reply)
+        except OSError as e:
+            logger.error(f"Error sending reply: {e}")
+
+    async def finish(self) -> None:
+        """
+        Ensures proper closure of the client stream.
+        """
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except OSError:
+            pass
+
+    def _log_connection(self, dst_address: DetailedAddress) -> None:
+        logger.info(
+            connection_established_template.substitute(
+                src_domain_name=self.client_address.name,
+                src_ip=self.client_address.ip,
+                src_port=self.client_address.port,
+                dst_domain_name=dst_address.name,
+                dst_ip=dst_address.ip,
+                dst_port=dst_address.port,
+            )
+        )
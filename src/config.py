@@ -3,6 +3,23 @@ This file contains the configuration for the proxy server set at runtime.
 """
 import logging
 
+from .constants import (
+    UPSTREAM_POOL_SIZE,
+    SLOW_SESSION_THRESHOLD,
+    RELAY_BUFFER_MIN_SIZE,
+    RELAY_BUFFER_MAX_SIZE,
+    RELAY_IDLE_TIMEOUT,
+    RELAY_MAX_LIFETIME,
+    RELAY_HALF_CLOSE_LINGER,
+    ACCEPT_QUEUE_SIZE,
+    ACCEPT_QUEUE_TIMEOUT,
+    RELAY_LOG_SAMPLE_RATE,
+    RELAY_LOG_INTERVAL,
+    USER_BANDWIDTH,
+    USER_MAX_SESSIONS,
+    USER_CONNECTION_RATE,
+    AUTH_CACHE_TTL,
+)
 from .models import BaseAddress
 
 
@@ -10,6 +27,32 @@ class ProxyConfiguration:
     _host: str
     _port: int
     _logging_level: str
+    _engine: str = "threading"
+    _relay_mode: str = "copy"
+    _workers: int = 1
+    _reverse_dns: str = "async"
+    _pool_destinations: list[tuple[str, int]] = []
+    _pool_size: int = UPSTREAM_POOL_SIZE
+    _metrics_host: str = "localhost"
+    _metrics_port: int = None
+    _slow_session_threshold: float = SLOW_SESSION_THRESHOLD
+    _relay_buffer_min: int = RELAY_BUFFER_MIN_SIZE
+    _relay_buffer_max: int = RELAY_BUFFER_MAX_SIZE
+    _socket_profile: str = "default"
+    _port_profiles: dict[int, str] = {}
+    _idle_timeout: float = RELAY_IDLE_TIMEOUT
+    _max_lifetime: float = RELAY_MAX_LIFETIME
+    _half_close_linger: float = RELAY_HALF_CLOSE_LINGER
+    _max_connections: int = None
+    _accept_queue_size: int = ACCEPT_QUEUE_SIZE
+    _accept_queue_timeout: float = ACCEPT_QUEUE_TIMEOUT
+    _relay_log_sample_rate: int = RELAY_LOG_SAMPLE_RATE
+    _relay_log_interval: float = RELAY_LOG_INTERVAL
+    _user_bandwidth: int = USER_BANDWIDTH
+    _user_max_sessions: int = USER_MAX_SESSIONS
+    _user_connection_rate: float = USER_CONNECTION_RATE
+    _credentials_file: str = None
+    _auth_cache_ttl: float = AUTH_CACHE_TTL
 
     _logging_level_str_to_level = {
         "disabled": logging.NOTSET,
@@ -22,12 +65,68 @@ class ProxyConfiguration:
 
     @classmethod
     def initialize(
-        cls, host: str, port: int, logging_level: int, use_tor: bool = False
+        cls,
+        host: str,
+        port: int,
+        logging_level: int,
+        use_tor: bool = False,
+        engine: str = "threading",
+        relay_mode: str = "copy",
+        workers: int = 1,
+        reverse_dns: str = "async",
+        pool_destinations: list[tuple[str, int]] = None,
+        pool_size: int = UPSTREAM_POOL_SIZE,
+        metrics_host: str = "localhost",
+        metrics_port: int = None,
+        slow_session_threshold: float = SLOW_SESSION_THRESHOLD,
+        relay_buffer_min: int = RELAY_BUFFER_MIN_SIZE,
+        relay_buffer_max: int = RELAY_BUFFER_MAX_SIZE,
+        socket_profile: str = "default",
+        port_profiles: dict[int, str] = None,
+        idle_timeout: float = RELAY_IDLE_TIMEOUT,
+        max_lifetime: float = RELAY_MAX_LIFETIME,
+        half_close_linger: float = RELAY_HALF_CLOSE_LINGER,
+        max_connections: int = None,
+        accept_queue_size: int = ACCEPT_QUEUE_SIZE,
+        accept_queue_timeout: float = ACCEPT_QUEUE_TIMEOUT,
+        relay_log_sample_rate: int = RELAY_LOG_SAMPLE_RATE,
+        relay_log_interval: float = RELAY_LOG_INTERVAL,
+        user_bandwidth: int = USER_BANDWIDTH,
+        user_max_sessions: int = USER_MAX_SESSIONS,
+        user_connection_rate: float = USER_CONNECTION_RATE,
+        credentials_file: str = None,
+        auth_cache_ttl: float = AUTH_CACHE_TTL,
     ) -> None:
         cls._host = host
         cls._port = port
         cls._logging_level = logging_level
         cls._use_tor = use_tor
+        cls._engine = engine
+        cls._relay_mode = relay_mode
+        cls._workers = workers
+        cls._reverse_dns = reverse_dns
+        cls._pool_destinations = pool_destinations or []
+        cls._pool_size = pool_size
+        cls._metrics_host = metrics_host
+        cls._metrics_port = metrics_port
+        cls._slow_session_threshold = slow_session_threshold
+        cls._relay_buffer_min = relay_buffer_min
+        cls._relay_buffer_max = relay_buffer_max
+        cls._socket_profile = socket_profile
+        cls._port_profiles = port_profiles or {}
+        cls._idle_timeout = idle_timeout
+        cls._max_lifetime = max_lifetime
+        cls._half_close_linger = half_close_linger
+        cls._max_connections = max_connections
+        cls._accept_queue_size = accept_queue_size
+        cls._accept_queue_timeout = accept_queue_timeout
+        cls._relay_log_sample_rate = relay_log_sample_rate
+        cls._relay_log_interval = relay_log_interval
+        cls._user_bandwidth = user_bandwidth
+        cls._user_max_sessions = user_max_sessions
+        cls._user_connection_rate = user_connection_rate
+        cls._credentials_file = credentials_file
+        cls._auth_cache_ttl = auth_cache_ttl
 
     @classmethod
     def is_initialized(cls) -> bool:
@@ -49,6 +148,111 @@ class ProxyConfiguration:
     def get_port(cls) -> int:
         return cls._port
 
+    @classmethod
+    def get_engine(cls) -> str:
+        return cls._engine
+
+    @classmethod
+    def get_relay_mode(cls) -> str:
+        return cls._relay_mode
+
+    @classmethod
+    def get_workers(cls) -> int:
+        return cls._workers
+
+    @classmethod
+    def get_reverse_dns(cls) -> str:
+        return cls._reverse_dns
+
+    @classmethod
+    def get_pool_destinations(cls) -> list[tuple[str, int]]:
+        return cls._pool_destinations
+
+    @classmethod
+    def get_pool_size(cls) -> int:
+        return cls._pool_size
+
+    @classmethod
+    def get_metrics_host(cls) -> str:
+        return cls._metrics_host
+
+    @classmethod
+    def get_metrics_port(cls) -> int:
+        return cls._metrics_port
+
+    @classmethod
+    def get_slow_session_threshold(cls) -> float:
+        return cls._slow_session_threshold
+
+    @classmethod
+    def get_relay_buffer_min(cls) -> int:
+        return cls._relay_buffer_min
+
+    @classmethod
+    def get_relay_buffer_max(cls) -> int:
+        return cls._relay_buffer_max
+
+    @classmethod
+    def get_socket_profile(cls) -> str:
+        return cls._socket_profile
+
+    @classmethod
+    def get_port_profiles(cls) -> dict[int, str]:
+        return cls._port_profiles
+
+    @classmethod
+    def get_idle_timeout(cls) -> float:
+        return cls._idle_timeout
+
+    @classmethod
+    def get_max_lifetime(cls) -> float:
+        return cls._max_lifetime
+
+    @classmethod
+    def get_half_close_linger(cls) -> float:
+        return cls._half_close_linger
+
+    @classmethod
+    def get_max_connections(cls) -> int:
+        """None leaves the limit to the serving engine."""
+        return cls._max_connections
+
+    @classmethod
+    def get_accept_queue_size(cls) -> int:
+        return cls._accept_queue_size
+
+    @classmethod
+    def get_accept_queue_timeout(cls) -> float:
+        return cls._accept_queue_timeout
+
+    @classmethod
+    def get_relay_log_sample_rate(cls) -> int:
+        return cls._relay_log_sample_rate
+
+    @classmethod
+    def get_relay_log_interval(cls) -> float:
+        return cls._relay_log_interval
+
+    @classmethod
+    def get_user_bandwidth(cls) -> int:
+        return cls._user_bandwidth
+
+    @classmethod
+    def get_user_max_sessions(cls) -> int:
+        return cls._user_max_sessions
+
+    @classmethod
+    def get_user_connection_rate(cls) -> float:
+        return cls._user_connection_rate
+
+    @classmethod
+    def get_credentials_file(cls) -> str:
+        return cls._credentials_file
+
+    @classmethod
+    def get_auth_cache_ttl(cls) -> float:
+        return cls._auth_cache_ttl
+
     @classmethod
     def get_address(cls) -> BaseAddress:
         return BaseAddress(cls._host, cls._port)
@@ -13,12 +13,58 @@ def auth_required() -> bool:
 
 # Buffer and timeout constants
 RELAY_BUFFER_SIZE: int = 4096
+RELAY_BUFFER_MIN_SIZE: int = 4096  # adaptive TCP read size, initial and smallest
+RELAY_BUFFER_MAX_SIZE: int = 262144  # adaptive TCP read size, largest
+UDP_BUFFER_SIZE: int = 65536  # per datagram, above the largest UDP payload
+SUCCEEDED_REPLY_CACHE_SIZE: int = 1024  # success reply prefixes kept, keyed by bind IP
+SPLICE_CHUNK_SIZE: int = 65536  # default Linux pipe capacity
 TCP_SELECTOR_TIMEOUT: int = 3  # seconds
+TCP_RELAY_MAX_PENDING: int = 65536  # bytes buffered per direction before reading pauses
+RELAY_IDLE_TIMEOUT: float = 0.0  # seconds without bytes in either direction, 0 disables
+RELAY_MAX_LIFETIME: float = 0.0  # seconds, 0 disables
+RELAY_HALF_CLOSE_LINGER: float = 0.0  # seconds the open direction may run after a half-close
 AUTH_TIMEOUT: float = 45.0  # seconds
+HANDSHAKE_READ_SIZE: int = 4096  # bytes per read while parsing the greeting, credentials and request
+AUTH_CACHE_TTL: float = 300.0  # seconds a successful verification is reused, 0 disables
+AUTH_CACHE_MAX_ENTRIES: int = 1024
+CREDENTIALS_CHECK_INTERVAL: float = 1.0  # seconds between checks of the credential file for changes
+SCRYPT_N: int = 16384  # scrypt cost for new password hashes
+SCRYPT_R: int = 8
+SCRYPT_P: int = 1
+PBKDF2_ITERATIONS: int = 600000  # PBKDF2-SHA256 rounds for new password hashes
+USER_BANDWIDTH: int = 0  # bytes per second per user in each direction, 0 disables
+USER_MAX_SESSIONS: int = 0  # concurrent sessions per user, 0 disables
+USER_CONNECTION_RATE: float = 0.0  # new sessions per second per user, 0 disables
+ACCEPT_QUEUE_SIZE: int = 256  # connections waiting for a worker thread before new ones are refused
+ACCEPT_QUEUE_TIMEOUT: float = 5.0  # seconds a connection may wait for a worker thread
 LOG_FILE_MAX_BYTES: int = 1048576  # 1 MB
+LOG_QUEUE_SIZE: int = 10000  # records waiting for the log writer thread before new ones are dropped
+RELAY_LOG_SAMPLE_RATE: int = 1  # log one in this many relayed chunks at DEBUG, 0 disables
+RELAY_LOG_INTERVAL: float = 0.0  # seconds between per-connection relay summaries at DEBUG, 0 disables
+SLOW_SESSION_THRESHOLD: float = 1.0  # seconds of setup before a session is logged as slow
 DNS_LOOKUP_TIMEOUT: float = 2.0  # seconds
+DNS_RESOLVER_WORKERS: int = 8
+DNS_CACHE_MAX_ENTRIES: int = 4096
+DNS_CACHE_TTL: float = 60.0  # seconds
+DNS_NEGATIVE_CACHE_TTL: float = 10.0  # seconds
+PTR_LOOKUP_WORKERS: int = 2
+PTR_CACHE_MAX_ENTRIES: int = 4096
+PTR_CACHE_TTL: float = 300.0  # seconds
+PTR_LOOKUP_MAX_PENDING: int = 256  # distinct IPs queued for a PTR lookup before new ones go unnamed
+PTR_LOOKUP_TIMEOUT: float = 2.0  # seconds a PTR lookup may wait for a worker before it is skipped
+UPSTREAM_CONNECT_TIMEOUT: float = 10.0  # seconds
+HAPPY_EYEBALLS_DELAY: float = 0.25  # seconds, RFC 8305 Connection Attempt Delay
+FAMILY_PREFERENCE_TTL: float = 600.0  # seconds
+FAMILY_PREFERENCE_MAX_ENTRIES: int = 4096
+UPSTREAM_POOL_SIZE: int = 4  # connected sockets per pooled destination
+UPSTREAM_POOL_MAX_IDLE: float = 30.0  # seconds
+UPSTREAM_POOL_CHECK_INTERVAL: float = 5.0  # seconds
+UPSTREAM_POOL_RETRY_DELAY: float = 5.0  # seconds
 UDP_RECV_TIMEOUT: int = 120  # seconds
-UDP_FORWARD_TIMEOUT: int = 10  # seconds
+UDP_BATCH_SIZE: int = 32  # datagrams moved per recvmmsg/sendmmsg call
+UDP_MAX_DESTINATIONS: int = 4096  # per association, least recently used are forgotten
+UDP_REASSEMBLY_TIMEOUT: float = 5.0  # seconds, the RFC 1928 section 7 minimum
+UDP_REASSEMBLY_MAX_BYTES: int = 65507  # per association, the largest IPv4 UDP payload
 
 # See https://www.ietf.org/rfc/rfc1928.txt for more information about the below codes
 
@@ -0,0 +1,320 @@
+"""
+Credential backends for USERNAME/PASSWORD authentication (RFC 1929).
+
+StaticCredentials checks the single pair from SOCKS5_USERNAME/SOCKS5_PASSWORD.
+CredentialFile checks a file of salted password hashes, one "username:hash" line per
+user, and reloads it when it changes. Hashes are scrypt or PBKDF2-SHA256 as written
+by hash_password(); generate a line with
+
+    python -m src.credentials USERNAME
+
+Verifying a hash deliberately takes tens of milliseconds, so the Authenticator keeps
+a bounded cache of recent successful verifications. Entries hold an HMAC of the
+password under a per-process key, never the password, and are dropped when they
+expire or the credential file changes. All comparisons are constant-time.
+"""
+import base64
+import hashlib
+import hmac
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+from .config import ProxyConfiguration
+from .constants import (
+    USERNAME,
+    PASSWORD,
+    AUTH_CACHE_MAX_ENTRIES,
+    CREDENTIALS_CHECK_INTERVAL,
+    SCRYPT_N,
+    SCRYPT_R,
+    SCRYPT_P,
+    PBKDF2_ITERATIONS,
+)
+from .logger import get_logger
+from .metrics import AUTH_SECONDS
+
+logger = get_logger(__name__)
+
+_auth_cached = AUTH_SECONDS.labels("cached")
+_auth_verified = AUTH_SECONDS.labels("verified")
+_auth_rejected = AUTH_SECONDS.labels("rejected")
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.b64encode(data).decode()
+
+
+def hash_password(password: str, scheme: str = "scrypt") -> str:
+    """
+    Returns a salted hash of password in the credential file format:
+    scrypt$N$r$p$salt$hash or pbkdf2_sha256$iterations$salt$hash, base64 encoded.
+    """
+    salt = secrets.token_bytes(16)
+    if scheme == "scrypt":
+        digest = hashlib.scrypt(password.encode(), salt=salt, n=SCRYPT_N, r=SCRYPT_R, p=SCRYPT_P)
+        return f"scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}${_b64encode(salt)}${_b64encode(digest)}"
+    if scheme == "pbkdf2_sha256":
+        digest = hashlib.pbkdf2_hmac("sha256", password.encode(), salt, PBKDF2_ITERATIONS)
+        return f"pbkdf2_sha256${PBKDF2_ITERATIONS}${_b64encode(salt)}${_b64encode(digest)}"
+    raise ValueError(f"Unknown password hash scheme: {scheme}")
+
+
+def verify_password(password: str, encoded: str) -> bool:
+    """
+    Checks password against a hash from hash_password().
+
+    Raises:
+        ValueError: If encoded is not a hash in a known scheme.
+    """
+    scheme, _, params = encoded.partition("$")
+    try:
+        if scheme == "scrypt":
+            n, r, p, salt, expected = params.split("$")
+            expected = base64.b64decode(expected)
+            digest = hashlib.scrypt(
+                password.encode(),
+                salt=base64.b64decode(salt),
+                n=int(n),
+                r=int(r),
+                p=int(p),
+                maxmem=256 * int(n) * int(r),
+                dklen=len(expected),
+            )
+        elif scheme == "pbkdf2_sha256":
+            iterations, salt, expected = params.split("$")
+            expected = base64.b64decode(expected)
+            digest = hashlib.pbkdf2_hmac(
+                "sha256", password.encode(), base64.b64decode(salt), int(iterations), len(expected)
+            )
+        else:
+            raise ValueError(f"Unknown password hash scheme: {scheme}")
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"Malformed password hash: {e}") from None
+    return hmac.compare_digest(digest, expected)
+
+
+class CredentialBackend:
+    """
+    Checks a username and password. Subclasses implement verify().
+    """
+
+    # Bumped whenever the credentials change, to invalidate cached verifications
+    generation: int = 0
+
+    def refresh(self) -> None:
+        """
+        Picks up changed credentials, bumping generation. Must be cheap.
+        """
+
+    def verify(self, username: str, password: str) -> bool:
+        raise NotImplementedError
+
+
+class StaticCredentials(CredentialBackend):
+    """
+    The single username and password pair from the environment.
+    """
+
+    def __init__(self, username: str = USERNAME, password: str = PASSWORD):
+        self._username = username.encode()
+        self._password = password.encode()
+
+    def verify(self, username: str, password: str) -> bool:
+        # Both comparisons always run, so timing does not tell which one failed
+        username_matches = hmac.compare_digest(username.encode(), self._username)
+        password_matches = hmac.compare_digest(password.encode(), self._password)
+        return username_matches & password_matches
+
+
+class CredentialFile(CredentialBackend):
+    """
+    Users and password hashes from a file of "username:hash" lines. Blank lines and
+    lines starting with # are ignored; malformed lines are logged and skipped.
+
+    The file's modification time and size are checked at most every check_interval
+    seconds, when a verification needs them, and the file is reloaded when either
+    changed. A file that cannot be read keeps the users loaded before.
+    """
+
+    def __init__(self, path: str, check_interval: float = CREDENTIALS_CHECK_INTERVAL):
+        self.path = path
+        self.check_interval = check_interval
+        self._users: dict[str, str] = {}
+        self._signature: tuple = None
+        self._checked = float("-inf")
+        self._lock = threading.Lock()
+        # Unknown users are checked against this hash, so they take as long as known ones
+        self._dummy_hash = hash_password(secrets.token_hex(16))
+        self.refresh()
+
+    def verify(self, username: str, password: str) -> bool:
+        self.refresh()
+        encoded = self._users.get(username)
+        if encoded is None:
+            verify_password(password, self._dummy_hash)
+            return False
+        try:
+            return verify_password(password, encoded)
+        except ValueError as e:
+            logger.error(f"Credential file {self.path}: user {username}: {e}")
+            return False
+
+    def refresh(self) -> None:
+        now = time.monotonic()
+        if now - self._checked < self.check_interval:
+            return
+        with self._lock:
+            if now - self._checked < self.check_interval:
+                return
+            self._checked = now
+            try:
+                stat = os.stat(self.path)
+            except OSError as e:
+                logger.error(f"Cannot read credential file {self.path}: {e}")
+                return
+            signature = (stat.st_mtime_ns, stat.st_size)
+            if signature == self._signature:
+                return
+            try:
+                self._users = self._load()
+            except (OSError, UnicodeDecodeError) as e:
+                logger.error(f"Cannot read credential file {self.path}: {e}")
+                return
+            self._signature = signature
+            self.generation += 1
+            logger.info(f"Loaded {len(self._users)} users from {self.path}")
+
+    def _load(self) -> dict[str, str]:
+        users: dict[str, str] = {}
+        with open(self.path, encoding="utf-8") as file:
+            for number, line in enumerate(file, start=1):
+                line = line.strip()
+                if not line or line.startswith("#"):
+                    continue
+                username, separator, encoded = line.rpartition(":")
+                if not separator or not username or "$" not in encoded:
+                    logger.error(f"Credential file {self.path}: line {number} is not username:hash")
+                    continue
+                users[username] = encoded
+        return users
+
+
+class VerificationCache:
+    """
+    Recent successful verifications, least recently used first. Each entry holds an
+    HMAC of the password under a key that never leaves the process.
+    """
+
+    def __init__(self, max_entries: int = AUTH_CACHE_MAX_ENTRIES, ttl: float = 0.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._key = secrets.token_bytes(32)
+        self._entries: OrderedDict[str, tuple[bytes, float, int]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _digest(self, username: str, password: str) -> bytes:
+        return hmac.new(self._key, f"{username}\0{password}".encode(), hashlib.sha256).digest()
+
+    def get(self, username: str, password: str, generation: int) -> bool:
+        """
+        True if username was verified with password within the TTL, against the
+        credentials of generation.
+        """
+        if not self.ttl:
+            return False
+        digest = self._digest(username, password)
+        with self._lock:
+            entry = self._entries.get(username)
+            if entry is None:
+                return False
+            cached_digest, expires, cached_generation = entry
+            if cached_generation != generation or time.monotonic() >= expires:
+                del self._entries[username]
+                return False
+            self._entries.move_to_end(username)
+        return hmac.compare_digest(digest, cached_digest)
+
+    def put(self, username: str, password: str, generation: int) -> None:
+        if not self.ttl:
+            return
+        digest = self._digest(username, password)
+        with self._lock:
+            self._entries[username] = (digest, time.monotonic() + self.ttl, generation)
+            self._entries.move_to_end(username)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class Authenticator:
+    """
+    Verifies credentials against a backend through the verification cache, and
+    records how long each verification took in socks5_auth_seconds.
+    """
+
+    def __init__(self, backend: CredentialBackend, cache: VerificationCache):
+        self.backend = backend
+        self.cache = cache
+
+    def cached(self, username: str, password: str) -> bool:
+        """
+        True if the credentials were verified recently. Never runs the backend, so the
+        event loop can call it before handing a verification off to a thread.
+        """
+        started = time.perf_counter()
+        self.backend.refresh()
+        if self.cache.get(username, password, self.backend.generation):
+            _auth_cached.observe(time.perf_counter() - started)
+            return True
+        return False
+
+    def verify(self, username: str, password: str) -> bool:
+        if self.cached(username, password):
+            return True
+        started = time.perf_counter()
+        generation = self.backend.generation
+        if self.backend.verify(username, password):
+            self.cache.put(username, password, generation)
+            _auth_verified.observe(time.perf_counter() - started)
+            return True
+        _auth_rejected.observe(time.perf_counter() - started)
+        return False
+
+
+_authenticator: Authenticator = None
+_authenticator_lock = threading.Lock()
+
+
+def get_authenticator() -> Authenticator:
+    """
+    Returns the process-wide authenticator, created from the configuration on first use.
+    """
+    global _authenticator
+    with _authenticator_lock:
+        if _authenticator is None:
+            path = ProxyConfiguration.get_credentials_file()
+            backend = CredentialFile(path) if path else StaticCredentials()
+            _authenticator = Authenticator(
+                backend, VerificationCache(ttl=ProxyConfiguration.get_auth_cache_ttl())
+            )
+        return _authenticator
+
+
+def main() -> None:
+    import argparse
+    import getpass
+
+    parser = argparse.ArgumentParser(description="Prints a credential file line for a user.")
+    parser.add_argument("username")
+    parser.add_argument("--scheme", choices=["scrypt", "pbkdf2_sha256"], default="scrypt")
+    args = parser.parse_args()
+    if ":" in args.username:
+        parser.error("usernames in the credential file cannot contain ':'")
+    password = getpass.getpass(f"Password for {args.username}: ")
+    print(f"{args.username}:{hash_password(password, args.scheme)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -17,3 +17,15 @@ class InvalidRequestError(Exception):
 
     def __init__(self, request: Union[bytes, int]) -> None:
         super().__init__(f"Invalid request: {request}")
+
+
+class UserLimitExceededError(Exception):
+    """Exception raised when a user's session is refused by the per-user limits.
+
+    Attributes:
+        reason (str): session_limit or connection_rate.
+    """
+
+    def __init__(self, username: str, reason: str) -> None:
+        super().__init__(f"User {username} refused: {reason}")
+        self.reason = reason
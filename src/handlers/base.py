@@ -1,11 +1,13 @@
-import struct
 import socket
-import threading
+from concurrent.futures import Future, TimeoutError as LookupTimeoutError
 
-from ..constants import SOCKS_VERSION, AddressTypeCodes, DNS_LOOKUP_TIMEOUT
-from ..exceptions import InvalidRequestError, InvalidVersionError
+from ..config import ProxyConfiguration
+from ..constants import SOCKS_VERSION, AddressTypeCodes, DNS_LOOKUP_TIMEOUT, HANDSHAKE_READ_SIZE
 from ..logger import get_logger
 from ..models import DetailedAddress, Request
+from ..protocol import Event, RequestReceived, ServerProtocol
+from ..resolver import get_resolver, get_reverse_lookup_enricher
+from ..timing import SessionTimer
 from ..utils import map_address_int_to_enum
 
 logger = get_logger(__name__)
@@ -13,27 +15,34 @@ logger = get_logger(__name__)
 
 class BaseHandler:
     connection: socket.socket
+    timer: SessionTimer
+    protocol: ServerProtocol
 
-    def __init__(self, connection: socket.socket):
+    def __init__(self, connection: socket.socket, timer: SessionTimer = None):
         """
         Initializes a new instance of the BaseRequestHandler class.
 
         Args:
             connection (socket.socket): The client socket.
+            timer (SessionTimer): Marked as the handshake phases end. Defaults to a new timer.
         """
         self.connection = connection
+        self.timer = timer if timer is not None else SessionTimer()
+        self.protocol = ServerProtocol()
 
-    def _recv_exact(self, n: int) -> bytes:
-        """Receive exactly n bytes from the connection, handling partial reads."""
-        buf = bytearray(n)
-        pos = 0
-        while pos < n:
-            chunk = self.connection.recv(n - pos)
-            if not chunk:
+    def _next_event(self) -> Event:
+        """
+        Returns the next message from the client, reading from the connection only while
+        the bytes received so far do not hold one.
+        """
+        event = self.protocol.next_event()
+        while event is None:
+            data = self.connection.recv(HANDSHAKE_READ_SIZE)
+            if not data:
                 raise ConnectionError("Connection closed during recv")
-            buf[pos:pos + len(chunk)] = chunk
-            pos += len(chunk)
-        return bytes(buf)
+            self.protocol.receive_data(data)
+            event = self.protocol.next_event()
+        return event
 
     def handle_request(self) -> bool:
         """
@@ -65,92 +74,80 @@ class BaseHandler:
         o  DST.PORT - desired destination port in network octet order
         """
         try:
-            header = self._recv_exact(4)
-
-            version, cmd, rsv, address_type = struct.unpack("!BBBB", header)
-            if version != SOCKS_VERSION:
-                raise InvalidVersionError(version)
-            if rsv != 0x00:
-                raise InvalidRequestError(rsv)
-
-            address: DetailedAddress = self._parse_address(address_type)
-
-            return Request(version=version, command=cmd, address=address)
+            request: RequestReceived = self._next_event()
+            address: DetailedAddress = self._resolve_address(request)
+            return Request(version=SOCKS_VERSION, command=request.command, address=address)
 
         except socket.error as e:
             logger.exception(f"Socket error during request parsing: {e}")
             raise
 
-    def _parse_address(self, address_type: int) -> DetailedAddress:
-        try:
-            if address_type == AddressTypeCodes.IPv4.value:
-                address: str = socket.inet_ntoa(self._recv_exact(4))
-                domain_name: str = self._gethostbyaddr(address)
-            elif address_type == AddressTypeCodes.DOMAIN_NAME.value:
-                domain_length = self._recv_exact(1)[0]
-                domain_name = self._recv_exact(domain_length).decode()
-                address, address_type = self._resolve_hostname(domain_name)
-            elif address_type == AddressTypeCodes.IPv6.value:
-                address: str = socket.inet_ntop(
-                    socket.AF_INET6, self._recv_exact(16)
-                )
-                domain_name: str = self._gethostbyaddr(address)
-            else:
-                raise InvalidRequestError(address_type)
-
-            port: int = struct.unpack("!H", self._recv_exact(2))[0]
-            return DetailedAddress(
-                name=str(domain_name),
-                ip=address,
-                port=port,
-                address_type=map_address_int_to_enum(address_type),
-            )
-
-        except socket.error as e:
-            logger.exception(f"Socket error during address and port parsing: {e}")
-            raise
-
-    def _dns_lookup_with_timeout(self, fn, label: str):
-        """Run a DNS function on a daemon thread with timeout. Returns result or None."""
-        result = [None]
-        error = [None]
+    def _resolve_address(self, request: RequestReceived) -> DetailedAddress:
+        """
+        Resolves the destination of request. Domain names are looked up; IP addresses
+        are named from their PTR record in the background.
+        """
+        candidates: list[str] = []
+        address_type = request.address_type
+        if address_type == AddressTypeCodes.DOMAIN_NAME.value:
+            self.timer.mark("request")
+            address, address_type, candidates = self._resolve_hostname(request.host)
+            self.timer.mark("dns")
+        else:
+            address = request.host
+
+        detailed_address = DetailedAddress(
+            name=request.host,
+            ip=address,
+            port=request.port,
+            address_type=map_address_int_to_enum(address_type),
+            candidates=candidates,
+        )
+        if request.address_type != AddressTypeCodes.DOMAIN_NAME.value:
+            self._enrich_address(detailed_address)
+        return detailed_address
 
-        def lookup():
-            try:
-                result[0] = fn()
-            except Exception as e:
-                error[0] = e
+    def _wait_for_lookup(self, lookup: Future, label: str):
+        """Wait up to DNS_LOOKUP_TIMEOUT for a resolver lookup. Returns result or None."""
+        try:
+            return lookup.result(timeout=DNS_LOOKUP_TIMEOUT)
+        except LookupTimeoutError:
+            logger.debug(f"DNS lookup timed out for {label}")
+        except OSError:
+            pass
+        except Exception as e:
+            logger.error(f"DNS lookup error for {label}", exc_info=e)
+        return None
+
+    @staticmethod
+    def _enrich_address(address: DetailedAddress) -> None:
+        """
+        Names an IP address request from its PTR record in the background, unless
+        reverse DNS is disabled. The request proceeds with the IP as its name.
+        """
+        if ProxyConfiguration.get_reverse_dns() == "off":
+            return
+        get_reverse_lookup_enricher().enrich(address)
 
-        t = threading.Thread(target=lookup, daemon=True)
-        t.start()
-        t.join(timeout=DNS_LOOKUP_TIMEOUT)
+    def _resolve_hostname(self, name: str) -> tuple[str, int, list[str]]:
+        """
+        Resolve a hostname using getaddrinfo for dual-stack support.
 
-        if t.is_alive():
-            logger.debug(f"DNS lookup timed out for {label}")
-            return None
-        if error[0] is not None:
-            if not isinstance(error[0], OSError):
-                logger.error(f"DNS lookup error for {label}", exc_info=error[0])
-            return None
-        return result[0]
-
-    def _gethostbyaddr(self, ip: str) -> str:
-        result = self._dns_lookup_with_timeout(
-            lambda: socket.gethostbyaddr(ip)[0], ip
-        )
-        return result if result is not None else ip
+        Returns:
+            tuple: (ip, address_type_value, candidates), where ip is the first address
+            getaddrinfo returned and candidates is every distinct address in its order.
+            Unresolved names are returned as-is with no candidates.
+        """
+        result = self._wait_for_lookup(get_resolver().resolve(name), name)
+        return self._select_address(name, result)
 
-    def _resolve_hostname(self, name: str) -> tuple[str, int]:
-        """Resolve a hostname to (ip, address_type_value) using getaddrinfo for dual-stack support."""
-        result = self._dns_lookup_with_timeout(
-            lambda: socket.getaddrinfo(name, None, socket.AF_UNSPEC, socket.SOCK_STREAM),
-            name,
-        )
+    @staticmethod
+    def _select_address(name: str, result: list) -> tuple[str, int, list[str]]:
         if not result:
-            return name, AddressTypeCodes.IPv4.value
+            return name, AddressTypeCodes.IPv4.value, []
 
+        candidates = list(dict.fromkeys(sockaddr[0] for _, _, _, _, sockaddr in result))
         family, _, _, _, sockaddr = result[0]
-        ip = sockaddr[0]
         if family == socket.AF_INET6:
-            return ip, AddressTypeCodes.IPv6.value
-        return ip, AddressTypeCodes.IPv4.value
+            return sockaddr[0], AddressTypeCodes.IPv6.value, candidates
+        return sockaddr[0], AddressTypeCodes.IPv4.value, candidates
@@ -1,11 +1,13 @@
-import struct
 import socket
 
 from .base import BaseHandler
-from ..constants import SOCKS_VERSION, MethodCodes, USERNAME, PASSWORD, AUTH_TIMEOUT, auth_required
-from ..exceptions import InvalidVersionError
+from ..constants import MethodCodes, AUTH_TIMEOUT, auth_required
+from ..credentials import get_authenticator
+from ..exceptions import InvalidRequestError, InvalidVersionError
 from ..logger import get_logger
-from ..utils import generate_connection_method_response
+from ..metrics import HANDSHAKE_FAILURES
+from ..protocol import Credentials, Greeting
+from ..timing import SessionTimer
 
 logger = get_logger(__name__)
 
@@ -13,14 +15,17 @@ logger = get_logger(__name__)
 class TCPHandler(BaseHandler):
     connection: socket.socket
 
-    def __init__(self, connection: socket.socket):
+    def __init__(self, connection: socket.socket, timer: SessionTimer = None):
         """
         Initializes a new instance of the TCPRequestHandler class.
 
         Args:
             connection (socket.socket): The client socket.
+            timer (SessionTimer): Marked as the handshake phases end. Defaults to a new timer.
         """
-        self.connection = connection
+        super().__init__(connection, timer)
+        # Set once USERNAME/PASSWORD authentication succeeds
+        self.username: str = None
 
     def handle_request(self) -> bool:
         """
@@ -54,42 +59,50 @@ class TCPHandler(BaseHandler):
         """
         try:
             # Parses client VER, NMETHODS, METHODS
-            header = self._recv_exact(2)
-
-            version, nmethods = struct.unpack("!BB", header)
-
-            if version != SOCKS_VERSION:
-                raise InvalidVersionError(version)
-
-            methods = self._recv_exact(nmethods)
+            greeting: Greeting = self._next_event()
 
             # Handles negotiation for authentication method
             negotiated_authentication: MethodCodes = (
-                self._negotiate_authentication_method(methods)
+                self._negotiate_authentication_method(greeting.methods)
             )
 
             # Handles server response
-            self.connection.sendall(
-                generate_connection_method_response(negotiated_authentication)
-            )
+            self.connection.sendall(self.protocol.select_method(negotiated_authentication))
+            self.timer.mark("negotiation")
 
             # Handles authentication
             if negotiated_authentication == MethodCodes.NO_AUTHENTICATION_REQUIRED:
                 return True
             elif negotiated_authentication == MethodCodes.USERNAME_PASSWORD:
-                return self._handle_username_password_auth()
+                authenticated = self._handle_username_password_auth()
+                self.timer.mark("auth")
+                if authenticated:
+                    return True
+                HANDSHAKE_FAILURES.labels("auth").inc()
+                return False
             elif negotiated_authentication == MethodCodes.GSSAPI:
                 # Not implemented yet
                 return self._handle_gssapi_auth()
             else:
                 logger.warning("No acceptable authentication methods")
+                HANDSHAKE_FAILURES.labels("no_acceptable_methods").inc()
                 return False
 
+        except InvalidVersionError as e:
+            logger.warning(f"Handshake error: {e}")
+            HANDSHAKE_FAILURES.labels("version").inc()
+            return False
+        except InvalidRequestError as e:
+            logger.warning(f"Malformed greeting: {e}")
+            HANDSHAKE_FAILURES.labels("negotiation").inc()
+            return False
         except socket.error as e:
             logger.exception(f"Socket error during handshake: {e}")
+            HANDSHAKE_FAILURES.labels("negotiation").inc()
             return False
 
-    def _negotiate_authentication_method(self, methods: bytes) -> MethodCodes:
+    @staticmethod
+    def _negotiate_authentication_method(methods: bytes) -> MethodCodes:
         """
         Finds the a mutually supported authentication method.
         USERNAME/PASSWORD is the preferred method.
@@ -146,36 +159,23 @@ class TCPHandler(BaseHandler):
         original_timeout = self.connection.gettimeout()
         self.connection.settimeout(AUTH_TIMEOUT)
         try:
-            # Receive and verify the version
-            version = self._recv_exact(1)
-            if version != b"\x01":
-                logger.error(f"Incorrect subnegotiation version: {version}")
-                self.connection.sendall(b"\x01\x01")
+            # Receive VER, ULEN, UNAME, PLEN, PASSWD
+            try:
+                credentials: Credentials = self._next_event()
+            except (InvalidVersionError, InvalidRequestError) as e:
+                logger.error(f"Malformed username/password request: {e}")
+                self.connection.sendall(self.protocol.auth_reply(False))
                 return False
 
-            # Receive username length and username
-            username_len = self._recv_exact(1)[0]
-            username = (
-                self._recv_exact(username_len).decode() if username_len else ""
-            )
-
-            # Receive password length and password
-            password_len = self._recv_exact(1)[0]
-            password = (
-                self._recv_exact(password_len).decode() if password_len else ""
-            )
-
             # Validate credentials
-            if username == USERNAME and password == PASSWORD:
-                # Success
-                logger.info(f"Authenticated user: {username}")
-                self.connection.sendall(b"\x01\x00")  # version 1, status 0 (success)
+            authenticated = get_authenticator().verify(credentials.username, credentials.password)
+            self.connection.sendall(self.protocol.auth_reply(authenticated))
+            if authenticated:
+                logger.info(f"Authenticated user: {credentials.username}")
+                self.username = credentials.username
                 return True
-            else:
-                # Failure
-                logger.warning(f"Invalid authentication request: {username}")
-                self.connection.sendall(b"\x01\x01")  # version 1, status 1 (failure)
-                return False
+            logger.warning(f"Invalid authentication request: {credentials.username}")
+            return False
         except socket.timeout:
             logger.exception("Socket timed out waiting for data")
             return False
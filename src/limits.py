@@ -0,0 +1,185 @@
+"""
+Per-user limits on authenticated sessions.
+
+Every user has a token bucket of bytes per second for each relay direction, shared
+by all of that user's TCP and UDP relays, a cap on concurrent sessions and a token
+bucket of new sessions per second. Buckets refill lazily from the time elapsed since
+they were last used, so no timer runs per user or per connection.
+
+TCP relays go into debt on their direction's bucket and stop reading from that side
+until it is repaid, which slows the sender down through TCP flow control. UDP relays
+drop datagrams the bucket cannot pay for.
+
+Limits are per process: with several workers, each one keeps its own buckets.
+"""
+import threading
+import time
+from typing import Callable
+
+from .config import ProxyConfiguration
+from .constants import UDP_BUFFER_SIZE
+from .exceptions import UserLimitExceededError
+
+
+class TokenBucket:
+    """
+    Holds up to burst tokens, refilled at rate tokens per second.
+    """
+
+    def __init__(self, rate: float, burst: float, clock: Callable[[], float] = time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self._clock = clock
+        self._tokens = burst
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = self._clock()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def consume(self, amount: float) -> float:
+        """
+        Takes amount tokens, going into debt if there are not enough.
+
+        Returns:
+            float: Seconds until the debt is repaid, 0 if there is none.
+        """
+        with self._lock:
+            self._refill()
+            self._tokens -= amount
+            return -self._tokens / self.rate if self._tokens < 0 else 0.0
+
+    def try_consume(self, amount: float = 1) -> bool:
+        """
+        Takes amount tokens if there are enough.
+        """
+        with self._lock:
+            self._refill()
+            if self._tokens < amount:
+                return False
+            self._tokens -= amount
+            return True
+
+
+class UserLimits:
+    """
+    The buckets and session count shared by every session of one user.
+    A bucket is None while its limit is disabled.
+    """
+
+    def __init__(self, bandwidth: int, connection_rate: float, clock: Callable[[], float]):
+        # One second of traffic, and never less than the largest UDP datagram
+        burst = max(bandwidth, UDP_BUFFER_SIZE)
+        self.upstream: TokenBucket = TokenBucket(bandwidth, burst, clock) if bandwidth else None
+        self.downstream: TokenBucket = TokenBucket(bandwidth, burst, clock) if bandwidth else None
+        self.connections: TokenBucket = (
+            TokenBucket(connection_rate, max(connection_rate, 1), clock) if connection_rate else None
+        )
+        self.sessions = 0
+
+
+class UserSession:
+    """
+    A session admitted for a user. Relays charge the buckets of their direction;
+    release() must be called once the session ends.
+    """
+
+    def __init__(self, limiter: "UserLimiter", username: str, limits: UserLimits):
+        self.username = username
+        self.upstream: TokenBucket = limits.upstream
+        self.downstream: TokenBucket = limits.downstream
+        self._limiter = limiter
+        self._limits = limits
+        self._released = False
+
+    def release(self) -> None:
+        if not self._released:
+            self._released = True
+            self._limiter._release(self._limits)
+
+
+def paced_read_size(session: UserSession, smallest: int, largest: int) -> int:
+    """
+    Returns the largest relay read size for session: at most an eighth of a second of
+    the user's bandwidth, so throttled flows move in small steps instead of long bursts
+    and pauses. Reads are charged after the fact, so this also bounds a bucket's debt.
+    """
+    if session is None or session.upstream is None:
+        return largest
+    return max(smallest, min(largest, int(session.upstream.rate) // 8))
+
+
+class UserLimiter:
+    """
+    Admits sessions of authenticated users within the per-user limits.
+    A limit of 0 disables it.
+    """
+
+    def __init__(
+        self,
+        bandwidth: int = 0,
+        max_sessions: int = 0,
+        connection_rate: float = 0.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.bandwidth = bandwidth
+        self.max_sessions = max_sessions
+        self.connection_rate = connection_rate
+        self._clock = clock
+        self._users: dict[str, UserLimits] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.bandwidth or self.max_sessions or self.connection_rate)
+
+    def acquire(self, username: str) -> UserSession:
+        """
+        Admits a new session for username.
+
+        Returns:
+            UserSession: The admitted session, or None for anonymous sessions and
+            when no limit is configured.
+
+        Raises:
+            UserLimitExceededError: If the user is at the session cap or the connection rate.
+        """
+        if username is None or not self.enabled:
+            return None
+        with self._lock:
+            limits = self._users.get(username)
+            if limits is None:
+                limits = self._users[username] = UserLimits(
+                    self.bandwidth, self.connection_rate, self._clock
+                )
+            if self.max_sessions and limits.sessions >= self.max_sessions:
+                raise UserLimitExceededError(username, "session_limit")
+            if limits.connections is not None and not limits.connections.try_consume():
+                raise UserLimitExceededError(username, "connection_rate")
+            limits.sessions += 1
+        return UserSession(self, username, limits)
+
+    def _release(self, limits: UserLimits) -> None:
+        with self._lock:
+            limits.sessions -= 1
+
+
+_limiter: UserLimiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_user_limiter() -> UserLimiter:
+    """
+    Returns the process-wide limiter, created from the configuration on first use.
+    """
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None:
+            _limiter = UserLimiter(
+                ProxyConfiguration.get_user_bandwidth(),
+                ProxyConfiguration.get_user_max_sessions(),
+                ProxyConfiguration.get_user_connection_rate(),
+            )
+        return _limiter
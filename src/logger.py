@@ -1,9 +1,29 @@
+"""
+Logging for every module goes through one queue-based pipeline per process.
+
+configure_logger() gives each named logger the same QueueHandler, which puts records
+on a queue, so logging from a relay or the event loop never waits on the console or
+disk. The handler merges each record's arguments and traceback into its message
+before queueing it, so queued records hold no references to caller objects or frames
+and show mutable arguments as they were when logged. A single writer thread takes
+records off the queue and hands them to the console handler and the errors.log
+RotatingFileHandler, so line formatting, writing and rotation happen in one place.
+Records that find LOG_QUEUE_SIZE records already waiting are dropped, before any
+formatting, and counted in socks5_log_records_dropped_total rather than stalling the
+caller.
+
+The writer thread is restarted in forked workers, and stop_logging() writes out what
+is still queued before the process exits.
+"""
+import atexit
 import logging
+import os
+import queue
 import threading
-from logging.handlers import RotatingFileHandler
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 
 from .config import ProxyConfiguration
-from .constants import LOG_FILE_MAX_BYTES
+from .constants import LOG_FILE_MAX_BYTES, LOG_QUEUE_SIZE
 
 
 class LogColors:
@@ -31,9 +51,57 @@ class ColorFormatter(logging.Formatter):
         return message
 
 
+class DroppingQueueHandler(QueueHandler):
+    """
+    Puts records on the writer thread's queue with their message merged, see
+    QueueHandler.prepare(), leaving line formatting to the writer. A record that finds
+    capacity records already waiting is dropped and counted without being merged.
+    """
+
+    def __init__(self, record_queue: queue.SimpleQueue, capacity: int = LOG_QUEUE_SIZE):
+        super().__init__(record_queue)
+        self.capacity = capacity
+        self.dropped = 0
+
+    def handle(self, record: logging.LogRecord) -> bool:
+        # The queue is thread-safe, so callers skip the handler lock
+        rv = self.filter(record)
+        if rv:
+            self.emit(record)
+        return rv
+
+    def emit(self, record: logging.LogRecord) -> None:
+        if self.queue.qsize() >= self.capacity:
+            self._drop()
+            return
+        super().emit(record)
+
+    def _drop(self) -> None:
+        from .metrics import LOG_RECORDS_DROPPED  # metrics logs through this module
+
+        self.dropped += 1
+        LOG_RECORDS_DROPPED.inc()
+
+
 _loggers = {}
 _logger_lock = threading.Lock()
 
+_console_handler = logging.StreamHandler()
+_console_handler.setFormatter(ColorFormatter("[%(asctime)s] - [%(levelname)s] - %(message)s"))
+
+# File handler for logging errors only; errors.log is created by the first error
+_file_handler = RotatingFileHandler(
+    "errors.log", maxBytes=LOG_FILE_MAX_BYTES, backupCount=5, delay=True
+)
+_file_handler.setLevel(logging.ERROR)
+_file_handler.setFormatter(
+    logging.Formatter("[%(asctime)s] - [%(name)s] - [%(levelname)s] - [%(message)s]")
+)
+
+_queue_handler = DroppingQueueHandler(queue.SimpleQueue())
+_listener: QueueListener = None
+_listener_lock = threading.Lock()
+
 
 def get_logger(name: str) -> logging.Logger:
     with _logger_lock:
@@ -58,25 +126,53 @@ def configure_logger(logger: logging.Logger) -> None:
 
     logger.handlers.clear()
     logger.setLevel(logging_level)
-
-    # Console Handler for logging
-    c_handler = logging.StreamHandler()
-    c_handler.setLevel(logging_level)
-    c_format = ColorFormatter("[%(asctime)s] - [%(levelname)s] - %(message)s")
-    c_handler.setFormatter(c_format)
-
-    # File Handler for logging errors only
-    f_handler = RotatingFileHandler("errors.log", maxBytes=LOG_FILE_MAX_BYTES, backupCount=5)
-    f_handler.setLevel(logging.ERROR)
-    f_format = logging.Formatter(
-        "[%(asctime)s] - [%(name)s] - [%(levelname)s] - [%(message)s]"
-    )
-    f_handler.setFormatter(f_format)
-
-    logger.addHandler(c_handler)
-    logger.addHandler(f_handler)
+    _console_handler.setLevel(logging_level)
+    logger.addHandler(_queue_handler)
+    start_logging()
 
 
 def update_loggers() -> None:
     for logger in _loggers.values():
         configure_logger(logger)
+
+
+def start_logging() -> None:
+    """
+    Starts the writer thread if it is not running.
+    """
+    global _listener
+    with _listener_lock:
+        if _listener is None:
+            _listener = QueueListener(
+                _queue_handler.queue, _console_handler, _file_handler, respect_handler_level=True
+            )
+            _listener.start()
+
+
+def stop_logging() -> None:
+    """
+    Writes out the records still queued and stops the writer thread. Records logged
+    afterwards wait on the queue until start_logging().
+    """
+    global _listener
+    with _listener_lock:
+        listener, _listener = _listener, None
+    if listener is not None:
+        listener.stop()
+    _file_handler.close()
+
+
+def _after_fork_in_child() -> None:
+    # The parent's writer thread does not survive the fork, and the records queued
+    # in the parent are the parent's to write
+    global _listener, _listener_lock
+    _listener_lock = threading.Lock()
+    running, _listener = _listener is not None, None
+    _queue_handler.queue = queue.SimpleQueue()
+    if running:
+        start_logging()
+
+
+atexit.register(stop_logging)
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
@@ -1,11 +1,17 @@
+import asyncio
 from argparse import Namespace
+from functools import partial
 
 from .server import (
     ThreadingTCPServer,
     TCPProxyServer,
 )
+from .async_server import AsyncTCPServer
+from .workers import WorkerSupervisor, worker_index
 from .logger import get_logger, update_loggers
 from .config import ProxyConfiguration
+from .pool import start_upstream_pool, stop_upstream_pool
+from .metrics import serve_metrics, stop_metrics
 
 logger = get_logger(__name__)
 
@@ -16,24 +22,138 @@ def main(args: Namespace):
     Sets program configuration, starts the server, and handles server shutdown.
     """
 
-    ProxyConfiguration.initialize(args.host, args.port, args.logging_level)
+    ProxyConfiguration.initialize(
+        args.host,
+        args.port,
+        args.logging_level,
+        engine=args.engine,
+        relay_mode=args.relay_mode,
+        workers=args.workers,
+        reverse_dns=args.reverse_dns,
+        pool_destinations=args.pool_destination,
+        pool_size=args.pool_size,
+        metrics_host=args.metrics_host,
+        metrics_port=args.metrics_port,
+        slow_session_threshold=args.slow_session_threshold,
+        relay_buffer_min=args.relay_buffer_min,
+        relay_buffer_max=args.relay_buffer_max,
+        socket_profile=args.socket_profile,
+        port_profiles=dict(args.port_profile),
+        idle_timeout=args.idle_timeout,
+        max_lifetime=args.max_lifetime,
+        half_close_linger=args.half_close_linger,
+        max_connections=args.max_connections,
+        accept_queue_size=args.accept_queue,
+        accept_queue_timeout=args.accept_queue_timeout,
+        relay_log_sample_rate=args.relay_log_sample,
+        relay_log_interval=args.relay_log_interval,
+        user_bandwidth=args.user_bandwidth,
+        user_max_sessions=args.user_max_sessions,
+        user_connection_rate=args.user_connection_rate,
+        credentials_file=args.credentials_file,
+        auth_cache_ttl=args.auth_cache_ttl,
+    )
 
     update_loggers()
 
+    serve = serve_asyncio if ProxyConfiguration.get_engine() == "asyncio" else serve_threading
+
+    if ProxyConfiguration.get_workers() > 1:
+        supervisor = WorkerSupervisor(ProxyConfiguration.get_workers(), partial(serve, reuse_port=True))
+        supervisor.run()
+        if supervisor.exit_code:
+            logger.error("Workers failed to start, supervisor terminated.")
+            exit(supervisor.exit_code)
+        logger.info("Supervisor terminated.")
+        return
+
     try:
-        with ThreadingTCPServer(
-            (ProxyConfiguration.get_host(), ProxyConfiguration.get_port()), TCPProxyServer
-        ) as tcp_server:
-            logger.info(f"Server started on {ProxyConfiguration.get_address()}")
-
-            try:
-                tcp_server.serve_forever()
-            except KeyboardInterrupt:
-                logger.info("Server shutting down...")
-            finally:
-                tcp_server.shutdown()
-                tcp_server.server_close()
-                logger.info("Server terminated.")
+        serve()
     except OSError as e:
         logger.error(f"Error starting server: {e}")
         exit(1)
+
+
+def start_pool() -> None:
+    """
+    Starts the upstream pool in the serving process if any destinations are configured.
+    """
+    if ProxyConfiguration.get_pool_destinations():
+        start_upstream_pool(
+            ProxyConfiguration.get_pool_destinations(), ProxyConfiguration.get_pool_size()
+        )
+
+
+def start_metrics() -> None:
+    """
+    Starts the metrics listener in the serving process if a metrics port is configured.
+    Workers listen on consecutive ports from the configured one.
+    """
+    if ProxyConfiguration.get_metrics_port() is None:
+        return
+    port = ProxyConfiguration.get_metrics_port() + worker_index()
+    try:
+        serve_metrics(ProxyConfiguration.get_metrics_host(), port)
+    except OSError as e:
+        logger.error(f"Error starting metrics listener on port {port}: {e}")
+
+
+def serve_threading(reuse_port: bool = False) -> None:
+    """
+    Serves clients on a pool of worker threads, one per connection being served.
+    """
+    with ThreadingTCPServer(
+        (ProxyConfiguration.get_host(), ProxyConfiguration.get_port()),
+        TCPProxyServer,
+        bind_and_activate=False,
+        max_connections=ProxyConfiguration.get_max_connections(),
+        queue_size=ProxyConfiguration.get_accept_queue_size(),
+        queue_timeout=ProxyConfiguration.get_accept_queue_timeout(),
+    ) as tcp_server:
+        tcp_server.allow_reuse_port = reuse_port
+        tcp_server.server_bind()
+        tcp_server.server_activate()
+        logger.info(f"Server started on {ProxyConfiguration.get_address()}")
+        start_pool()
+        start_metrics()
+
+        try:
+            tcp_server.serve_forever()
+        except KeyboardInterrupt:
+            logger.info("Server shutting down...")
+        finally:
+            tcp_server.shutdown()
+            tcp_server.server_close()
+            stop_upstream_pool()
+            stop_metrics()
+            logger.info("Server terminated.")
+
+
+def serve_asyncio(reuse_port: bool = False) -> None:
+    """
+    Serves clients on a single asyncio event loop.
+    """
+    tcp_server = AsyncTCPServer(
+        (ProxyConfiguration.get_host(), ProxyConfiguration.get_port()),
+        max_connections=ProxyConfiguration.get_max_connections(),
+        reuse_port=reuse_port,
+    )
+
+    async def run() -> None:
+        await tcp_server.start()
+        logger.info(f"Server started on {ProxyConfiguration.get_address()} (asyncio)")
+        start_pool()
+        start_metrics()
+        try:
+            await tcp_server.serve_forever()
+        finally:
+            await tcp_server.close()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        logger.info("Server shutting down...")
+    finally:
+        stop_upstream_pool()
+        stop_metrics()
+        logger.info("Server terminated.")
@@ -0,0 +1,320 @@
+"""
+Process-wide metrics in the Prometheus text exposition format.
+
+Counters, gauges and histograms are module-level singletons updated by the servers,
+handlers and relays. Each labelled child guards its value with its own lock, so an
+update is a single uncontended lock acquisition; hot loops bind their children once
+with labels() instead of looking them up per update.
+
+serve_metrics() answers GET /metrics from an HTTP listener in a daemon thread. Metrics
+are per process: with several workers, each one serves its own listener.
+"""
+import threading
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from .logger import get_logger
+
+logger = get_logger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: tuple[str, ...], values: tuple[str, ...]) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+class _Value:
+    """A counter or gauge sample."""
+
+    __slots__ = ("_value", "_lock")
+
+    def __init__(self):
+        self._value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1) -> None:
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount: float = 1) -> None:
+        with self._lock:
+            self._value -= amount
+
+    def set(self, value: float) -> None:
+        self._value = value
+
+    def get(self) -> float:
+        return self._value
+
+
+class _HistogramValue:
+    """Bucket counts, sum and count of one histogram child."""
+
+    __slots__ = ("_upper_bounds", "_counts", "_sum", "_lock")
+
+    def __init__(self, upper_bounds: tuple[float, ...]):
+        self._upper_bounds = upper_bounds
+        self._counts = [0] * (len(upper_bounds) + 1)  # the last bucket is +Inf
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        index = bisect_left(self._upper_bounds, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+
+    def snapshot(self) -> tuple[list[int], float]:
+        with self._lock:
+            return list(self._counts), self._sum
+
+
+class Metric:
+    """
+    Base class of the metric types. Metrics with label names are updated through
+    labels(); metrics without are updated directly.
+    """
+
+    type_name: str
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = (), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: dict[tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            self._default = self._children[()] = self._new_child()
+        (REGISTRY if registry is None else registry).register(self)
+
+    def _new_child(self):
+        return _Value()
+
+    def labels(self, *values: str):
+        """Returns the child for values, one per label name, creating it on first use."""
+        if len(values) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {values}")
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def collect(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        for values, child in sorted(self._children.items()):
+            lines.extend(self._samples(_format_labels(self.labelnames, values), values, child))
+        return lines
+
+    def _samples(self, labels: str, values: tuple[str, ...], child) -> list[str]:
+        return [f"{self.name}{labels} {_format_value(child.get())}"]
+
+
+class Counter(Metric):
+    """A value that only goes up."""
+
+    type_name = "counter"
+
+    def inc(self, amount: float = 1) -> None:
+        self._default.inc(amount)
+
+    def get(self) -> float:
+        return self._default.get()
+
+
+class Gauge(Metric):
+    """A value that goes up and down."""
+
+    type_name = "gauge"
+
+    def inc(self, amount: float = 1) -> None:
+        self._default.inc(amount)
+
+    def dec(self, amount: float = 1) -> None:
+        self._default.dec(amount)
+
+    def set(self, value: float) -> None:
+        self._default.set(value)
+
+    def get(self) -> float:
+        return self._default.get()
+
+
+class Histogram(Metric):
+    """Counts observations into cumulative buckets by upper bound."""
+
+    type_name = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+        registry=None,
+    ):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value: float) -> None:
+        self._default.observe(value)
+
+    def _samples(self, labels: str, values: tuple[str, ...], child) -> list[str]:
+        counts, total = child.snapshot()
+        samples = []
+        cumulative = 0
+        for upper_bound, count in zip((*self.buckets, float("inf")), counts):
+            cumulative += count
+            bucket_labels = _format_labels((*self.labelnames, "le"), (*values, _format_value(upper_bound)))
+            samples.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+        samples.append(f"{self.name}_sum{labels} {_format_value(total)}")
+        samples.append(f"{self.name}_count{labels} {cumulative}")
+        return samples
+
+
+class Registry:
+    """The metrics rendered by one /metrics endpoint."""
+
+    def __init__(self):
+        self._metrics: list[Metric] = []
+
+    def register(self, metric: Metric) -> None:
+        self._metrics.append(metric)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.collect())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+ACTIVE_CONNECTIONS = Gauge(
+    "socks5_active_connections", "Client connections currently being served."
+)
+CONNECTIONS_ACCEPTED = Counter(
+    "socks5_connections_accepted_total", "Client connections accepted."
+)
+CONNECTIONS_REJECTED = Counter(
+    "socks5_connections_rejected_total",
+    "Client connections refused or dropped by admission control, by reason.",
+    ("reason",),
+)
+ACCEPT_QUEUE_DEPTH = Gauge(
+    "socks5_accept_queue_depth", "Accepted connections waiting for a worker thread."
+)
+ACCEPT_QUEUE_WAIT_SECONDS = Histogram(
+    "socks5_accept_queue_wait_seconds",
+    "Time accepted connections waited for a worker thread.",
+    buckets=(0.0001, 0.00025, 0.0005, *DEFAULT_BUCKETS),
+)
+HANDSHAKE_FAILURES = Counter(
+    "socks5_handshake_failures_total",
+    "SOCKS5 sessions that failed before relaying, by reason.",
+    ("reason",),
+)
+RELAYED_BYTES = Counter(
+    "socks5_relayed_bytes_total",
+    "Payload bytes relayed, by protocol and direction (upstream is client to destination).",
+    ("protocol", "direction"),
+)
+RELAY_CLOSES = Counter(
+    "socks5_relay_closes_total", "TCP relays closed, by reason.", ("reason",)
+)
+DNS_LOOKUP_SECONDS = Histogram(
+    "socks5_dns_lookup_seconds", "Duration of DNS lookups that missed the resolver cache."
+)
+UPSTREAM_CONNECT_SECONDS = Histogram(
+    "socks5_upstream_connect_seconds", "Duration of connecting to CONNECT destinations."
+)
+UDP_DATAGRAMS = Counter(
+    "socks5_udp_datagrams_total", "UDP datagrams relayed, by direction.", ("direction",)
+)
+UDP_DROPPED = Counter(
+    "socks5_udp_dropped_total", "UDP datagrams dropped, by reason.", ("reason",)
+)
+AUTH_SECONDS = Histogram(
+    "socks5_auth_seconds",
+    "Duration of username and password checks, by result (cached, verified or rejected).",
+    ("result",),
+    buckets=(0.00001, 0.0001, *DEFAULT_BUCKETS),
+)
+LOG_RECORDS_DROPPED = Counter(
+    "socks5_log_records_dropped_total", "Log records dropped because the log queue was full."
+)
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    """Serves REGISTRY at /metrics."""
+
+    registry: Registry = REGISTRY
+
+    def do_GET(self) -> None:
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = self.registry.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args) -> None:
+        logger.debug(f"Metrics request from {self.client_address[0]}: {format % args}")
+
+
+_server: ThreadingHTTPServer = None
+_server_lock = threading.Lock()
+
+
+def serve_metrics(host: str, port: int) -> ThreadingHTTPServer:
+    """
+    Starts the process-wide metrics listener, replacing any previous one.
+    """
+    global _server
+    server = ThreadingHTTPServer((host, port), MetricsRequestHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    with _server_lock:
+        previous, _server = _server, server
+    if previous is not None:
+        _shutdown(previous)
+    logger.info(f"Metrics available on http://{host}:{server.server_address[1]}/metrics")
+    return server
+
+
+def stop_metrics() -> None:
+    """
+    Stops the process-wide metrics listener, if one is running.
+    """
+    global _server
+    with _server_lock:
+        server, _server = _server, None
+    if server is not None:
+        _shutdown(server)
+
+
+def _shutdown(server: ThreadingHTTPServer) -> None:
+    server.shutdown()
+    server.server_close()
@@ -1,4 +1,4 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from collections import namedtuple
 
 from .constants import AddressTypeCodes
@@ -17,6 +17,7 @@ class BaseAddress:
 class DetailedAddress(BaseAddress):
     name: str  # Domain name
     address_type: AddressTypeCodes  # IPv4, IPv6, or domain name, see AddressTypeCodes
+    candidates: list[str] = field(default_factory=list)  # Every IP the domain name resolved to
 
     def __str__(self):
         return f"{self.name}, {self.ip}:{self.port}"
@@ -0,0 +1,242 @@
+"""
+Pre-warmed upstream connection pool.
+
+For each configured (host, port) destination the pool keeps up to K connected sockets
+that a CONNECT to that destination takes instead of paying for a TCP handshake. A
+background thread refills the pool after every hand-out and periodically evicts
+sockets the peer has closed or that have been idle longer than the idle limit.
+Destinations are refilled concurrently, one refill thread each, so a backend that is
+slow to accept does not hold up the others.
+"""
+import socket
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+from .constants import (
+    UPSTREAM_CONNECT_TIMEOUT,
+    UPSTREAM_POOL_SIZE,
+    UPSTREAM_POOL_MAX_IDLE,
+    UPSTREAM_POOL_CHECK_INTERVAL,
+    UPSTREAM_POOL_RETRY_DELAY,
+)
+from .logger import get_logger
+from .models import DetailedAddress
+
+logger = get_logger(__name__)
+
+
+class UpstreamPool:
+    """
+    Keeps connected sockets to a fixed set of destinations.
+
+    acquire() never blocks: it returns a healthy pooled socket or None, in which case
+    the caller connects as usual.
+    """
+
+    def __init__(
+        self,
+        destinations: list[tuple[str, int]],
+        size: int = UPSTREAM_POOL_SIZE,
+        max_idle: float = UPSTREAM_POOL_MAX_IDLE,
+        check_interval: float = UPSTREAM_POOL_CHECK_INTERVAL,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        """
+        Initializes a new instance of the UpstreamPool class.
+
+        Args:
+            destinations (list[tuple[str, int]]): (host, port) pairs to keep connections to.
+            size (int): Connected sockets to keep per destination.
+            max_idle (float): Seconds a socket may sit in the pool before it is evicted.
+            check_interval (float): Seconds between background health checks.
+        """
+        self.size = size
+        self.max_idle = max_idle
+        self.check_interval = check_interval
+        self._clock = clock
+        self._idle: dict[tuple[str, int], deque[tuple[float, socket.socket]]] = {
+            (host, port): deque() for host, port in destinations
+        }
+        self._retry_at: dict[tuple[str, int], float] = dict.fromkeys(self._idle, 0.0)
+        self._refilling: set[tuple[str, int]] = set()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = False
+        self._thread: threading.Thread = None
+        self._refillers = ThreadPoolExecutor(
+            max_workers=max(len(self._idle), 1), thread_name_prefix="upstream-pool-refill"
+        )
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def start(self) -> None:
+        """
+        Starts the background thread that fills and health-checks the pool.
+        """
+        self._thread = threading.Thread(target=self._run, name="upstream-pool", daemon=True)
+        self._thread.start()
+
+    def close(self) -> None:
+        """
+        Stops the background thread and closes every pooled socket.
+        """
+        self._stopping = True
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+        self._refillers.shutdown()
+        with self._lock:
+            for idle in self._idle.values():
+                while idle:
+                    idle.pop()[1].close()
+
+    def acquire(self, address: DetailedAddress) -> socket.socket:
+        """
+        Takes a pooled socket connected to address, if the pool serves it.
+
+        Returns:
+            socket.socket: A connected socket in blocking mode, or None.
+        """
+        key = self._key_for(address)
+        if key is None:
+            return None
+
+        sock = None
+        with self._lock:
+            idle = self._idle[key]
+            while idle:
+                # Newest first, so the oldest sockets are the ones left to age out
+                idle_since, candidate = idle.pop()
+                if self._is_healthy(candidate, idle_since):
+                    sock = candidate
+                    break
+                candidate.close()
+                self.evictions += 1
+
+            if sock is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+
+        self._wakeup.set()
+        return sock
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "idle": sum(len(idle) for idle in self._idle.values()),
+            }
+
+    def _key_for(self, address: DetailedAddress) -> tuple[str, int]:
+        for host in (address.name, address.ip):
+            if (host, address.port) in self._idle:
+                return host, address.port
+        return None
+
+    def _is_healthy(self, sock: socket.socket, idle_since: float) -> bool:
+        """
+        A pooled socket is healthy while it is younger than max_idle and the peer has
+        not closed it. Data waiting on the socket (a server greeting) is left in place
+        for the client.
+        """
+        if self._clock() - idle_since >= self.max_idle:
+            return False
+        try:
+            return sock.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT) != b""
+        except BlockingIOError:
+            return True
+        except OSError:
+            return False
+
+    def _run(self) -> None:
+        while not self._stopping:
+            # Cleared before the work it asks for, so a hand-out during the work is not lost
+            self._wakeup.clear()
+            self._evict_unhealthy()
+            self._refill()
+            self._wakeup.wait(self.check_interval)
+
+    def _evict_unhealthy(self) -> None:
+        with self._lock:
+            for idle in self._idle.values():
+                for entry in list(idle):
+                    if not self._is_healthy(entry[1], entry[0]):
+                        idle.remove(entry)
+                        entry[1].close()
+                        self.evictions += 1
+
+    def _refill(self) -> None:
+        """
+        Starts a refill for every destination that is short of sockets, unless one is
+        already running for it or it is waiting out a failed connect.
+        """
+        with self._lock:
+            for key, idle in self._idle.items():
+                if key in self._refilling or len(idle) >= self.size or self._clock() < self._retry_at[key]:
+                    continue
+                self._refilling.add(key)
+                self._refillers.submit(self._refill_destination, key)
+
+    def _refill_destination(self, key: tuple[str, int]) -> None:
+        idle = self._idle[key]
+        try:
+            while not self._stopping:
+                with self._lock:
+                    if len(idle) >= self.size:
+                        break
+                try:
+                    sock = socket.create_connection(key, timeout=UPSTREAM_CONNECT_TIMEOUT)
+                except OSError as e:
+                    logger.warning(f"Upstream pool failed to connect to {key[0]}:{key[1]}: {e}")
+                    self._retry_at[key] = self._clock() + UPSTREAM_POOL_RETRY_DELAY
+                    break
+                sock.settimeout(None)
+                with self._lock:
+                    idle.append((self._clock(), sock))
+        finally:
+            with self._lock:
+                self._refilling.discard(key)
+                # A hand-out after the last size check found this refill still running
+                short = len(idle) < self.size and self._clock() >= self._retry_at[key]
+            if short:
+                self._wakeup.set()
+
+
+_pool: UpstreamPool = None
+
+
+def start_upstream_pool(destinations: list[tuple[str, int]], size: int) -> UpstreamPool:
+    """
+    Starts the process-wide upstream pool. Call it in the process that serves clients,
+    since the background thread does not survive fork().
+    """
+    global _pool
+    _pool = UpstreamPool(destinations, size)
+    _pool.start()
+    logger.info(f"Upstream pool keeping {size} connections to {len(destinations)} destinations")
+    return _pool
+
+
+def stop_upstream_pool() -> None:
+    global _pool
+    if _pool is not None:
+        _pool.close()
+        _pool = None
+
+
+def acquire_pooled_connection(address: DetailedAddress) -> socket.socket:
+    """
+    Returns a pooled socket connected to address, or None when no pool is running,
+    the pool does not serve address, or it has no healthy socket left.
+    """
+    if _pool is None:
+        return None
+    return _pool.acquire(address)
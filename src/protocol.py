@@ -0,0 +1,285 @@
+"""
+The SOCKS5 server protocol (RFC 1928) and USERNAME/PASSWORD subnegotiation (RFC 1929),
+without any I/O.
+
+ServerProtocol is fed the bytes a client sends, in chunks of any size, and parses them
+into events: the method greeting, the credentials and the request. The engine answers
+each event through the protocol, which returns the reply bytes to send and moves on to
+the next message. Reading, writing, authentication and DNS stay with the engines, so the
+threaded and asyncio servers share one parser, and a client that sends its greeting,
+credentials and request at once is parsed from a single read.
+
+parse_udp_header() parses the header of datagrams sent to a UDP association.
+"""
+import socket
+import struct
+from dataclasses import dataclass
+from enum import Enum
+
+from .constants import SOCKS_VERSION, AddressTypeCodes, MethodCodes
+from .exceptions import InvalidRequestError, InvalidVersionError
+from .models import UDPDatagram
+from .utils import generate_connection_method_response, map_address_int_to_enum
+
+AUTH_VERSION = 0x01  # RFC 1929 subnegotiation version
+AUTH_SUCCESS = b"\x01\x00"
+AUTH_FAILURE = b"\x01\x01"
+
+
+class ProtocolState(Enum):
+    AWAITING_GREETING = "awaiting_greeting"
+    SELECTING_METHOD = "selecting_method"  # the engine answers with select_method()
+    AWAITING_CREDENTIALS = "awaiting_credentials"
+    VERIFYING_CREDENTIALS = "verifying_credentials"  # the engine answers with auth_reply()
+    AWAITING_REQUEST = "awaiting_request"
+    ESTABLISHED = "established"  # later bytes belong to the relayed stream
+    CLOSED = "closed"
+
+
+@dataclass
+class Greeting:
+    methods: bytes  # Authentication methods offered by the client, see MethodCodes
+
+
+@dataclass
+class Credentials:
+    username: str
+    password: str
+
+
+@dataclass
+class RequestReceived:
+    command: int  # See CommandCodes
+    address_type: int  # See AddressTypeCodes
+    host: str  # IP address, or the domain name for AddressTypeCodes.DOMAIN_NAME
+    port: int
+
+
+Event = Greeting | Credentials | RequestReceived
+
+
+def _parse_address(data, offset: int) -> tuple[int, str, int, int]:
+    """
+    Parses the ATYP, DST.ADDR and DST.PORT fields starting at offset.
+
+    Returns:
+        tuple: (address_type, host, port, end), where end is the offset after the port,
+        or None if data ends before the port does.
+
+    Raises:
+        InvalidRequestError: If the address type is unknown or the domain name is not UTF-8.
+    """
+    if len(data) <= offset:
+        return None
+    address_type = data[offset]
+    start = offset + 1
+    if address_type == AddressTypeCodes.IPv4.value:
+        end = start + 4
+    elif address_type == AddressTypeCodes.DOMAIN_NAME.value:
+        if len(data) <= start:
+            return None
+        start += 1
+        end = start + data[start - 1]
+    elif address_type == AddressTypeCodes.IPv6.value:
+        end = start + 16
+    else:
+        raise InvalidRequestError(address_type)
+    if len(data) < end + 2:
+        return None
+
+    raw = bytes(data[start:end])
+    if address_type == AddressTypeCodes.IPv4.value:
+        host = socket.inet_ntoa(raw)
+    elif address_type == AddressTypeCodes.IPv6.value:
+        host = socket.inet_ntop(socket.AF_INET6, raw)
+    else:
+        try:
+            host = raw.decode()
+        except UnicodeDecodeError:
+            raise InvalidRequestError(raw) from None
+    port: int = struct.unpack_from("!H", data, end)[0]
+    return address_type, host, port, end + 2
+
+
+def _parse_greeting(data: bytearray) -> tuple[Greeting, int]:
+    """
+    +----+----------+----------+
+    |VER | NMETHODS | METHODS  |
+    +----+----------+----------+
+    | 1  |    1     | 1 to 255 |
+    +----+----------+----------+
+    """
+    if not data:
+        return None
+    if data[0] != SOCKS_VERSION:
+        raise InvalidVersionError(data[0])
+    if len(data) < 2:
+        return None
+    end = 2 + data[1]
+    if len(data) < end:
+        return None
+    return Greeting(bytes(data[2:end])), end
+
+
+def _parse_credentials(data: bytearray) -> tuple[Credentials, int]:
+    """
+    +----+------+----------+------+----------+
+    |VER | ULEN |  UNAME   | PLEN |  PASSWD  |
+    +----+------+----------+------+----------+
+    | 1  |  1   | 1 to 255 |  1   | 1 to 255 |
+    +----+------+----------+------+----------+
+    """
+    if not data:
+        return None
+    if data[0] != AUTH_VERSION:
+        raise InvalidVersionError(data[0])
+    if len(data) < 2:
+        return None
+    password_start = 2 + data[1] + 1
+    if len(data) < password_start:
+        return None
+    end = password_start + data[password_start - 1]
+    if len(data) < end:
+        return None
+    try:
+        username = bytes(data[2:password_start - 1]).decode()
+        password = bytes(data[password_start:end]).decode()
+    except UnicodeDecodeError:
+        raise InvalidRequestError(bytes(data[2:password_start - 1])) from None
+    return Credentials(username, password), end
+
+
+def _parse_request(data: bytearray) -> tuple[RequestReceived, int]:
+    """
+    +----+-----+-------+------+----------+----------+
+    |VER | CMD |  RSV  | ATYP | DST.ADDR | DST.PORT |
+    +----+-----+-------+------+----------+----------+
+    | 1  |  1  | X'00' |  1   | Variable |    2     |
+    +----+-----+-------+------+----------+----------+
+    """
+    if not data:
+        return None
+    if data[0] != SOCKS_VERSION:
+        raise InvalidVersionError(data[0])
+    if len(data) < 3:
+        return None
+    if data[2] != 0x00:
+        raise InvalidRequestError(data[2])
+    address = _parse_address(data, 3)
+    if address is None:
+        return None
+    address_type, host, port, end = address
+    return RequestReceived(data[1], address_type, host, port), end
+
+
+class ServerProtocol:
+    """
+    The server side of one SOCKS5 handshake, from the greeting to the request.
+
+    receive_data() adds bytes from the client; next_event() returns the next complete
+    message as an event, or None until enough bytes arrived. After a Greeting the engine
+    must call select_method(), and after Credentials auth_reply(), before asking for the
+    next event. Replies to the request itself are built by the engine, see utils.replies.
+
+    A message that breaks the protocol raises InvalidVersionError or InvalidRequestError
+    and closes the protocol.
+    """
+
+    _parsers = {
+        ProtocolState.AWAITING_GREETING: (_parse_greeting, ProtocolState.SELECTING_METHOD),
+        ProtocolState.AWAITING_CREDENTIALS: (_parse_credentials, ProtocolState.VERIFYING_CREDENTIALS),
+        ProtocolState.AWAITING_REQUEST: (_parse_request, ProtocolState.ESTABLISHED),
+    }
+
+    def __init__(self):
+        self.state = ProtocolState.AWAITING_GREETING
+        self._buffer = bytearray()
+
+    def receive_data(self, data: bytes) -> None:
+        self._buffer += data
+
+    def next_event(self) -> Event:
+        """
+        Parses the next message from the bytes received so far.
+
+        Returns:
+            Event: The message, or None if more bytes are needed.
+
+        Raises:
+            InvalidVersionError: If the message has the wrong protocol version.
+            InvalidRequestError: If the message is malformed, including names and
+                credentials that are not UTF-8.
+            RuntimeError: If no message is expected in the current state.
+        """
+        if self.state not in self._parsers:
+            raise RuntimeError(f"No message expected while {self.state.value}")
+        parse, next_state = self._parsers[self.state]
+        try:
+            parsed = parse(self._buffer)
+        except (InvalidVersionError, InvalidRequestError):
+            self.state = ProtocolState.CLOSED
+            raise
+        if parsed is None:
+            return None
+        event, consumed = parsed
+        del self._buffer[:consumed]
+        self.state = next_state
+        return event
+
+    def select_method(self, method: MethodCodes) -> bytes:
+        """
+        Answers the greeting with method. Returns the reply to send.
+        """
+        if method == MethodCodes.USERNAME_PASSWORD:
+            self.state = ProtocolState.AWAITING_CREDENTIALS
+        elif method == MethodCodes.NO_AUTHENTICATION_REQUIRED:
+            self.state = ProtocolState.AWAITING_REQUEST
+        else:
+            self.state = ProtocolState.CLOSED
+        return generate_connection_method_response(method)
+
+    def auth_reply(self, success: bool) -> bytes:
+        """
+        Answers the credentials. Returns the reply to send; after a failure the
+        connection must be closed.
+        """
+        if success:
+            self.state = ProtocolState.AWAITING_REQUEST
+            return AUTH_SUCCESS
+        self.state = ProtocolState.CLOSED
+        return AUTH_FAILURE
+
+    def trailing_data(self) -> bytes:
+        """
+        Returns and forgets the bytes received after the request, which a client that
+        does not wait for the reply sends ahead for the destination.
+        """
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        return data
+
+
+def parse_udp_header(data: bytes) -> UDPDatagram:
+    """
+    Parses a datagram sent to a UDP association (RFC 1928 section 7).
+
+    +----+------+------+----------+----------+----------+
+    |RSV | FRAG | ATYP | DST.ADDR | DST.PORT |   DATA   |
+    +----+------+------+----------+----------+----------+
+    | 2  |  1   |  1   | Variable |    2     | Variable |
+    +----+------+------+----------+----------+----------+
+
+    Raises:
+        InvalidRequestError: If the address type is unknown or the header is truncated.
+    """
+    address = _parse_address(data, 3)
+    if address is None:
+        raise InvalidRequestError(bytes(data[:4]))
+    address_type, host, port, end = address
+    return UDPDatagram(
+        frag=data[2],
+        address_type=map_address_int_to_enum(address_type),
+        dst_addr=host,
+        dst_port=port,
+        data=data[end:],
+    )
@@ -1,4 +1,5 @@
 from .tcp_relay import TCPRelay
 from .udp_relay import UDPRelay
+from .async_relay import AsyncTCPRelay, AsyncUDPRelay
 
-__all__ = ["TCPRelay", "UDPRelay"]
+__all__ = ["TCPRelay", "UDPRelay", "AsyncTCPRelay", "AsyncUDPRelay"]
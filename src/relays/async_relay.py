@@ -0,0 +1,369 @@
+import asyncio
+import socket
+import time
+
+from .base import BaseRelay, RelayDeadlines, RelayLogSampler
+from .udp_relay import UDPRelay, ReassemblyQueue, CLIENT
+from ..config import ProxyConfiguration
+from ..constants import (
+    RELAY_BUFFER_SIZE,
+    UDP_RECV_TIMEOUT,
+    UPSTREAM_CONNECT_TIMEOUT,
+    HAPPY_EYEBALLS_DELAY,
+)
+from ..limits import TokenBucket, UserSession, paced_read_size
+from ..models import DetailedAddress
+from ..pool import acquire_pooled_connection
+from ..logger import get_logger
+from ..metrics import RELAYED_BYTES, RELAY_CLOSES, UPSTREAM_CONNECT_SECONDS
+from ..tuning import tune_relay_sockets
+from ..utils import (
+    map_address_enum_to_socket_family,
+    map_address_family_to_enum,
+    address_family_of,
+    order_connect_candidates,
+    remember_connect_family,
+    connection_closed_template,
+)
+from ..utils.buffers import AdaptiveBuffer
+
+logger = get_logger(__name__)
+
+_upstream_bytes = RELAYED_BYTES.labels("tcp", "upstream")
+_downstream_bytes = RELAYED_BYTES.labels("tcp", "downstream")
+
+
+class AsyncTCPRelay(BaseRelay):
+    """
+    Relays data between a client stream and a remote stream on the running event loop.
+    """
+
+    def __init__(
+        self,
+        client_reader: asyncio.StreamReader,
+        client_writer: asyncio.StreamWriter,
+        dst_address: DetailedAddress,
+        user_session: UserSession = None,
+    ):
+        """
+        Initializes a new instance of the AsyncTCPRelay class.
+
+        Args:
+            client_reader (asyncio.StreamReader): The client stream reader.
+            client_writer (asyncio.StreamWriter): The client stream writer.
+            dst_address (DetailedAddress): The address to connect to.
+            user_session (UserSession): The per-user limits to charge relayed bytes to.
+        """
+        super().__init__(client_writer.get_extra_info("socket"), dst_address, user_session)
+        self.relay_log = RelayLogSampler.create(logger, "TCP")
+        self.client_reader = client_reader
+        self.client_writer = client_writer
+        self.proxy_reader: asyncio.StreamReader = None
+        self.proxy_writer: asyncio.StreamWriter = None
+        self.deadlines: RelayDeadlines = None
+
+    async def generate_proxy_connection(self) -> None:
+        """
+        Opens the connection to the destination, see TCPRelay.generate_proxy_connection.
+        """
+        sock = acquire_pooled_connection(self.dst_address)
+        started = time.monotonic()
+        if sock is None and len(self.dst_address.candidates) > 1:
+            sock = await asyncio.wait_for(
+                self._happy_eyeballs_connect(), UPSTREAM_CONNECT_TIMEOUT
+            )
+            UPSTREAM_CONNECT_SECONDS.observe(time.monotonic() - started)
+        if sock is not None:
+            self.dst_address.ip = sock.getpeername()[0]
+            self.dst_address.address_type = map_address_family_to_enum(sock.family)
+            self.proxy_reader, self.proxy_writer = await asyncio.open_connection(sock=sock)
+        else:
+            self.proxy_reader, self.proxy_writer = await asyncio.wait_for(
+                asyncio.open_connection(
+                    self.dst_address.ip,
+                    self.dst_address.port,
+                    family=map_address_enum_to_socket_family(self.dst_address.address_type),
+                ),
+                UPSTREAM_CONNECT_TIMEOUT,
+            )
+            UPSTREAM_CONNECT_SECONDS.observe(time.monotonic() - started)
+        self.proxy_connection = self.proxy_writer.get_extra_info("socket")
+        self.set_proxy_address()
+        tune_relay_sockets(self.client_connection, self.proxy_connection, self.dst_address.port)
+
+    def forward_early_data(self, data: bytes) -> None:
+        """
+        Queues data the client sent ahead of the reply for the destination, see
+        TCPRelay.forward_early_data.
+        """
+        if data:
+            self.proxy_writer.write(data)
+            _upstream_bytes.inc(len(data))
+            if self.user_session is not None and self.user_session.upstream is not None:
+                self.user_session.upstream.consume(len(data))
+
+    async def _happy_eyeballs_connect(self) -> socket.socket:
+        """
+        Coroutine counterpart of happy_eyeballs_connect: starts an attempt every
+        HAPPY_EYEBALLS_DELAY seconds, or as soon as one fails, and returns the first
+        socket to connect. Losing attempts are cancelled and their sockets closed.
+        """
+        loop = asyncio.get_running_loop()
+        host, port = self.dst_address.name, self.dst_address.port
+
+        async def attempt(ip: str) -> socket.socket:
+            sock = socket.socket(address_family_of(ip), socket.SOCK_STREAM)
+            sock.setblocking(False)
+            try:
+                await loop.sock_connect(sock, (ip, port))
+            except BaseException:
+                sock.close()
+                raise
+            return sock
+
+        def discard(task: asyncio.Task) -> None:
+            if not task.cancelled() and task.exception() is None:
+                task.result().close()
+
+        pending: set[asyncio.Task] = set()
+        last_error: OSError = None
+        try:
+            candidates = order_connect_candidates(host, self.dst_address.candidates)
+            while candidates or pending:
+                if candidates:
+                    pending.add(asyncio.ensure_future(attempt(candidates.pop(0))))
+                done, pending = await asyncio.wait(
+                    pending,
+                    timeout=HAPPY_EYEBALLS_DELAY if candidates else None,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                for task in done:
+                    if task.exception() is None:
+                        sock = task.result()
+                        remember_connect_family(host, sock.family)
+                        for other in done - {task}:
+                            discard(other)
+                        return sock
+                    last_error = task.exception()
+            raise last_error
+        finally:
+            for task in pending:
+                task.cancel()
+                task.add_done_callback(discard)
+
+    async def listen_and_relay(self) -> None:
+        """
+        Relays data in both directions until either side closes, or a deadline of
+        TCPRelay.listen_and_relay passes.
+        """
+        loop = asyncio.get_running_loop()
+        self.deadlines = RelayDeadlines(loop.time())
+        upstream = asyncio.ensure_future(
+            self._pipe(
+                self.client_reader,
+                self.proxy_writer,
+                self.get_client_address(),
+                self.get_dst_address(),
+                _upstream_bytes,
+                self.user_session.upstream if self.user_session is not None else None,
+            )
+        )
+        downstream = asyncio.ensure_future(
+            self._pipe(
+                self.proxy_reader,
+                self.client_writer,
+                self.get_dst_address(),
+                self.get_client_address(),
+                _downstream_bytes,
+                self.user_session.downstream if self.user_session is not None else None,
+            )
+        )
+        try:
+            pending = {upstream, downstream}
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending,
+                    timeout=self.deadlines.timeout(loop.time()),
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                for task in done:
+                    if task.exception() is not None or not task.result():
+                        self.close_reason = "error"
+                        return
+                    if self.close_reason is None:
+                        self.close_reason = (
+                            "client_closed" if task is upstream else "upstream_closed"
+                        )
+                    if not self.deadlines.linger:
+                        return
+                    # Pass the half-close on and keep the other direction running
+                    self._half_close(self.proxy_writer if task is upstream else self.client_writer)
+                    self.deadlines.half_closed(loop.time())
+                reason = self.deadlines.expired(loop.time())
+                if reason is not None:
+                    logger.debug(f"Closing TCP relay: {reason}")
+                    self.close_reason = reason
+                    return
+        finally:
+            for task in (upstream, downstream):
+                task.cancel()
+            await asyncio.gather(upstream, downstream, return_exceptions=True)
+            await self._cleanup()
+
+    async def _pipe(
+        self,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+        src_addr: DetailedAddress,
+        dst_addr: DetailedAddress,
+        relayed_bytes,
+        bucket: TokenBucket = None,
+    ) -> bool:
+        """
+        Copies reader to writer until EOF. Returns False if the relay failed instead.
+        Reads are charged to bucket, and reading pauses while it is in debt.
+        """
+        # Only the size policy is used; the stream hands back its own bytes
+        buffer_min = ProxyConfiguration.get_relay_buffer_min()
+        sizer = AdaptiveBuffer(
+            buffer_min,
+            paced_read_size(self.user_session, buffer_min, ProxyConfiguration.get_relay_buffer_max()),
+        )
+        clock = asyncio.get_running_loop().time
+        try:
+            while True:
+                data = await reader.read(sizer.size)
+                if not data:
+                    return True
+                self.deadlines.last_activity = clock()
+                sizer.record(len(data))
+                writer.write(data)
+                await writer.drain()
+                relayed_bytes.inc(len(data))
+                if self.on_first_byte is not None:
+                    callback, self.on_first_byte = self.on_first_byte, None
+                    callback()
+                if self.relay_log is not None:
+                    self.relay_log.record(src_addr, dst_addr, len(data))
+                if bucket is not None:
+                    delay = bucket.consume(len(data))
+                    if delay:
+                        # Waiting out a user's bandwidth limit does not count as idle
+                        self.deadlines.last_activity = clock() + delay
+                        await asyncio.sleep(delay)
+        except BrokenPipeError:
+            logger.exception("Broken Pipe")
+        except ConnectionResetError:
+            logger.exception("Connection Reset")
+        except OSError:
+            logger.exception("Socket error during relay")
+        return False
+
+    @staticmethod
+    def _half_close(writer: asyncio.StreamWriter) -> None:
+        try:
+            if writer.can_write_eof():
+                writer.write_eof()
+        except OSError:
+            pass
+
+    def _log_connection_closed(self) -> None:
+        client_address: DetailedAddress = self.get_client_address()
+        dst_address: DetailedAddress = self.get_dst_address()
+
+        logger.info(
+            connection_closed_template.substitute(
+                src_domain_name=client_address.name,
+                src_ip=client_address.ip,
+                src_port=client_address.port,
+                dst_domain_name=dst_address.name,
+                dst_ip=dst_address.ip,
+                dst_port=dst_address.port,
+            )
+        )
+
+    async def _cleanup(self) -> None:
+        RELAY_CLOSES.labels(self.close_reason or "error").inc()
+        if self.relay_log is not None:
+            self.relay_log.summarize()
+        self._log_connection_closed()
+        # Only close the proxy stream — the client stream is owned by the server
+        if self.proxy_writer is None:
+            return
+        self.proxy_writer.close()
+        try:
+            await self.proxy_writer.wait_closed()
+        except OSError:
+            pass
+
+
+class AsyncUDPRelay(UDPRelay):
+    """
+    Relays SOCKS5-encapsulated datagrams for one UDP association on the running event loop.
+
+    Shares UDPRelay's NAT table and batched datagram handling; the client-facing socket
+    and the outbound sockets are watched with loop readers instead of a selector, so an
+    association costs file descriptors but no thread.
+    """
+
+    def __init__(
+        self,
+        client_writer: asyncio.StreamWriter,
+        dst_address: DetailedAddress,
+        user_session: UserSession = None,
+    ):
+        self._loop = asyncio.get_running_loop()
+        self._last_activity = self._loop.time()
+        super().__init__(client_writer.get_extra_info("socket"), dst_address, user_session)
+        self._reassembly = ReassemblyQueue(clock=self._loop.time)
+
+    def _watch(self, sock: socket.socket, role: str) -> None:
+        if role == CLIENT:
+            self._loop.add_reader(sock.fileno(), self._on_client_readable)
+        else:
+            self._loop.add_reader(sock.fileno(), self._on_remote_readable, sock)
+
+    async def listen_and_relay(self, control_reader: asyncio.StreamReader) -> None:
+        """
+        Keeps the association alive until the TCP control connection closes
+        or no datagram has been seen for UDP_RECV_TIMEOUT seconds, waking up to
+        expire the reassembly queue.
+        """
+        try:
+            while True:
+                now = self._loop.time()
+                remaining = self._last_activity + UDP_RECV_TIMEOUT - now
+                if remaining <= 0:
+                    logger.debug("UDP relay timed out waiting for data")
+                    return
+                self._reassembly.expire()
+                if self._reassembly.deadline is not None:
+                    remaining = min(remaining, self._reassembly.deadline - now)
+                try:
+                    data = await asyncio.wait_for(
+                        control_reader.read(RELAY_BUFFER_SIZE), remaining
+                    )
+                except asyncio.TimeoutError:
+                    continue
+                if not data:
+                    return
+        except OSError as e:
+            logger.error(f"UDP relay socket error: {e}")
+        finally:
+            self._cleanup()
+
+    def _on_client_readable(self) -> None:
+        if self._relay_client_datagrams():
+            self._last_activity = self._loop.time()
+
+    def _on_remote_readable(self, sock: socket.socket) -> None:
+        if self._relay_remote_datagrams(sock):
+            self._last_activity = self._loop.time()
+
+    def _cleanup(self) -> None:
+        for sock in [self.proxy_connection, *self._outbound.values()]:
+            try:
+                self._loop.remove_reader(sock.fileno())
+            except (OSError, ValueError):
+                pass
+        super()._cleanup()
@@ -1,7 +1,155 @@
+import logging
+import time
 from socket import socket
+from typing import Callable
 
-from ..models import DetailedAddress, BindAddress
+from ..config import ProxyConfiguration
+from ..limits import UserSession
+from ..models import BaseAddress, DetailedAddress, BindAddress
 from ..utils.addresses import map_address_family_to_enum
+from ..utils.logs import base_relay_template, detailed_relay_template, relay_summary_template
+
+
+class RelayDeadlines:
+    """
+    Idle, lifetime and half-close linger deadlines of one TCP relay, from the configured
+    timeouts. A timeout of 0 disables it. Times are on the clock of whoever passes them.
+    """
+
+    def __init__(self, now: float):
+        self.idle_timeout: float = ProxyConfiguration.get_idle_timeout()
+        self.linger: float = ProxyConfiguration.get_half_close_linger()
+        max_lifetime = ProxyConfiguration.get_max_lifetime()
+        self.last_activity = now
+        self.end_of_life: float = now + max_lifetime if max_lifetime else None
+        self.linger_until: float = None
+
+    def half_closed(self, now: float) -> None:
+        """
+        Starts the linger period when the first side finishes sending.
+        """
+        if self.linger_until is None:
+            self.linger_until = now + self.linger
+
+    def expired(self, now: float) -> str:
+        """
+        Returns the close reason of a deadline that has passed, or None.
+        """
+        if self.idle_timeout and now - self.last_activity >= self.idle_timeout:
+            return "idle_timeout"
+        if self.end_of_life is not None and now >= self.end_of_life:
+            return "max_lifetime"
+        if self.linger_until is not None and now >= self.linger_until:
+            return "linger_expired"
+        return None
+
+    def timeout(self, now: float, longest: float = None) -> float:
+        """
+        Returns the seconds until the next deadline, capped at longest.
+        None means there is no deadline and no cap.
+        """
+        deadline = self.end_of_life
+        if self.idle_timeout:
+            idle_deadline = self.last_activity + self.idle_timeout
+            deadline = idle_deadline if deadline is None else min(deadline, idle_deadline)
+        if self.linger_until is not None:
+            deadline = self.linger_until if deadline is None else min(deadline, self.linger_until)
+        if deadline is None:
+            return longest
+        remaining = max(deadline - now, 0.0)
+        return remaining if longest is None else min(remaining, longest)
+
+
+class RelayLogSampler:
+    """
+    The DEBUG relay log of one relay. One in every sample_rate relayed chunks is logged,
+    and with a summary interval the chunks and bytes relayed per direction are logged
+    every interval seconds and once more when the relay closes. Relays hold None instead
+    while DEBUG is off, so relaying a chunk then costs a single None check.
+    """
+
+    def __init__(self, logger: logging.Logger, protocol: str):
+        self.logger = logger
+        self.protocol = protocol
+        self.sample_rate: int = ProxyConfiguration.get_relay_log_sample_rate()
+        self.interval: float = ProxyConfiguration.get_relay_log_interval()
+        self._chunks = 0
+        # (source, destination) -> [chunks, bytes] since the last summary
+        self._totals: dict[tuple[tuple, tuple], list[int]] = {}
+        self._summarized = time.monotonic()
+
+    @classmethod
+    def create(cls, logger: logging.Logger, protocol: str):
+        """
+        Returns a sampler for a new relay, or None if there is nothing to log.
+        """
+        if not logger.isEnabledFor(logging.DEBUG):
+            return None
+        if not ProxyConfiguration.get_relay_log_sample_rate() and not ProxyConfiguration.get_relay_log_interval():
+            return None
+        return cls(logger, protocol)
+
+    def record(self, src_addr: BaseAddress, dst_addr: BaseAddress, data_len: int) -> None:
+        """
+        Counts data_len bytes relayed from src_addr to dst_addr, logging them if sampled.
+        """
+        if self.sample_rate:
+            self._chunks += 1
+            if self._chunks >= self.sample_rate:
+                self._chunks = 0
+                self.logger.debug(self._chunk_message(src_addr, dst_addr, data_len))
+        if self.interval:
+            key = ((src_addr.ip, src_addr.port), (dst_addr.ip, dst_addr.port))
+            totals = self._totals.get(key)
+            if totals is None:
+                totals = self._totals[key] = [0, 0]
+            totals[0] += 1
+            totals[1] += data_len
+            if time.monotonic() - self._summarized >= self.interval:
+                self.summarize()
+
+    def summarize(self) -> None:
+        """
+        Logs and resets the totals per direction since the last summary.
+        """
+        now = time.monotonic()
+        seconds = round(now - self._summarized, 3)
+        for ((src_ip, src_port), (dst_ip, dst_port)), (chunks, data_size) in self._totals.items():
+            self.logger.debug(
+                relay_summary_template.substitute(
+                    protocol=self.protocol,
+                    src_ip=src_ip,
+                    src_port=src_port,
+                    dst_ip=dst_ip,
+                    dst_port=dst_port,
+                    chunks=chunks,
+                    data_size=data_size,
+                    seconds=seconds,
+                )
+            )
+        self._totals.clear()
+        self._summarized = now
+
+    def _chunk_message(self, src_addr: BaseAddress, dst_addr: BaseAddress, data_len: int) -> str:
+        if isinstance(src_addr, DetailedAddress) and isinstance(dst_addr, DetailedAddress):
+            return detailed_relay_template.substitute(
+                protocol=self.protocol,
+                src_domain_name=src_addr.name,
+                src_ip=src_addr.ip,
+                src_port=src_addr.port,
+                dst_domain_name=dst_addr.name,
+                dst_ip=dst_addr.ip,
+                dst_port=dst_addr.port,
+                data_size=data_len,
+            )
+        return base_relay_template.substitute(
+            protocol=self.protocol,
+            src_ip=src_addr.ip,
+            src_port=src_addr.port,
+            dst_ip=dst_addr.ip,
+            dst_port=dst_addr.port,
+            data_size=data_len,
+        )
 
 
 class BaseRelay:
@@ -12,10 +160,24 @@ class BaseRelay:
     dst_address: DetailedAddress
     proxy_address: BindAddress
 
-    def __init__(self, connection: socket, dst_address: DetailedAddress):
+    # Called once, when the first payload byte has been relayed in either direction
+    on_first_byte: Callable[[], None]
+    # Why a TCP relay ended: client_closed, upstream_closed, idle_timeout, max_lifetime,
+    # linger_expired or error
+    close_reason: str
+    # Set by subclasses from RelayLogSampler.create(); None while DEBUG is off
+    relay_log: RelayLogSampler
+    # The per-user limits the relayed bytes are charged to; None for unlimited sessions
+    user_session: UserSession
+
+    def __init__(self, connection: socket, dst_address: DetailedAddress, user_session: UserSession = None):
         self.client_connection = connection
         self.dst_address = dst_address
+        self.user_session = user_session
         self.proxy_address = None
+        self.on_first_byte = None
+        self.close_reason = None
+        self.relay_log = None
         self.set_client_address()
 
     def listen_and_relay(self):
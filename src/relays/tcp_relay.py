@@ -1,33 +1,85 @@
+import os
 import socket
 import selectors
+import time
 
-from .base import BaseRelay
-from ..constants import RELAY_BUFFER_SIZE, TCP_SELECTOR_TIMEOUT
+from .base import BaseRelay, RelayDeadlines, RelayLogSampler
+from ..config import ProxyConfiguration
+from ..constants import (
+    SPLICE_CHUNK_SIZE,
+    TCP_SELECTOR_TIMEOUT,
+    TCP_RELAY_MAX_PENDING,
+    UPSTREAM_CONNECT_TIMEOUT,
+)
+from ..limits import UserSession, paced_read_size
 from ..models import DetailedAddress
+from ..pool import acquire_pooled_connection
 from ..logger import get_logger
+from ..metrics import RELAYED_BYTES, RELAY_CLOSES, UPSTREAM_CONNECT_SECONDS
+from ..tuning import tune_relay_sockets
 from ..utils import (
     generate_tcp_socket,
-    detailed_relay_template,
+    happy_eyeballs_connect,
+    map_address_family_to_enum,
     connection_closed_template,
 )
+from ..utils.buffers import AdaptiveBuffer
 
 logger = get_logger(__name__)
 
+SPLICE_AVAILABLE: bool = hasattr(os, "splice")
+
+_upstream_bytes = RELAYED_BYTES.labels("tcp", "upstream")
+_downstream_bytes = RELAYED_BYTES.labels("tcp", "downstream")
+
 
 class TCPRelay(BaseRelay):
     """
     Class responsible for relaying data between a client socket and a remote socket via TCP.
     """
 
-    def __init__(self, client_connection: socket.socket, dst_address: DetailedAddress):
+    def __init__(
+        self,
+        client_connection: socket.socket,
+        dst_address: DetailedAddress,
+        relay_mode: str = None,
+        buffer_min: int = None,
+        buffer_max: int = None,
+        user_session: UserSession = None,
+    ):
         """
         Initializes a new instance of the TCPRelay class.
 
         Args:
             connection (socket.socket): The client socket.
             dst_address (DetailedAddress): The address to connect to.
+            relay_mode (str): "copy", "splice" or "auto". Defaults to the configured relay mode.
+            buffer_min (int): Smallest read size in copy mode. Defaults to the configured minimum.
+            buffer_max (int): Largest read size in copy mode. Defaults to the configured maximum.
+            user_session (UserSession): The per-user limits to charge relayed bytes to.
         """
-        super().__init__(client_connection, dst_address)
+        super().__init__(client_connection, dst_address, user_session)
+        self.relay_log = RelayLogSampler.create(logger, "TCP")
+        self.relay_mode = self._select_relay_mode(
+            relay_mode or ProxyConfiguration.get_relay_mode()
+        )
+        self._pipes: dict[socket.socket, tuple[int, int]] = {}
+        self._buffer_min = buffer_min or ProxyConfiguration.get_relay_buffer_min()
+        self._buffer_max = paced_read_size(
+            user_session, self._buffer_min, buffer_max or ProxyConfiguration.get_relay_buffer_max()
+        )
+        self._buffers: dict[socket.socket, AdaptiveBuffer] = {}
+        # Keyed by the receiving socket while it is backed up: copied bytes,
+        # or bytes left in the sender's pipe
+        self._pending: dict[socket.socket, bytearray] = {}
+        self._spliced: dict[socket.socket, int] = {}
+        self._interest: dict[socket.socket, int] = {}
+        self._eof: set[socket.socket] = set()
+        # Sockets whose write side was shut down after their peer finished sending
+        self._shut_down: set[socket.socket] = set()
+        # Sockets not read from until the given time, while their user's bucket is in debt
+        self._throttled: dict[socket.socket, float] = {}
+        self.deadlines: RelayDeadlines = None
         self.selector = selectors.DefaultSelector()
         try:
             self.generate_proxy_connection()
@@ -35,35 +87,134 @@ class TCPRelay(BaseRelay):
             self.selector.close()
             raise
 
+    @staticmethod
+    def _select_relay_mode(relay_mode: str) -> str:
+        """
+        Resolves the requested relay mode to the data path that will be used.
+        splice() falls back to copying where the platform does not provide it.
+        """
+        if relay_mode == "copy":
+            return "copy"
+        if SPLICE_AVAILABLE:
+            return "splice"
+        if relay_mode == "splice":
+            logger.warning("splice() is not available on this platform, falling back to copy")
+        return "copy"
+
     def generate_proxy_connection(self) -> None:
         """
         Generates a new proxy connection.
+
+        A pre-warmed socket from the upstream pool is used when one is available.
+        Otherwise domain names that resolved to several addresses are raced with Happy
+        Eyeballs (RFC 8305). dst_address is updated to the address actually connected.
+        Both sockets are then tuned with the socket profile for the destination port.
         """
         # Generate proxy connection
-        self.proxy_connection = generate_tcp_socket(self.dst_address.address_type)
-        self.proxy_connection.connect((self.dst_address.ip, self.dst_address.port))
+        self.proxy_connection = acquire_pooled_connection(self.dst_address)
+        if self.proxy_connection is not None:
+            self._use_connected_address()
+        else:
+            started = time.monotonic()
+            self._connect_upstream()
+            UPSTREAM_CONNECT_SECONDS.observe(time.monotonic() - started)
         self.set_proxy_address()
+        tune_relay_sockets(self.client_connection, self.proxy_connection, self.dst_address.port)
         # Set sockets to non-blocking
         self.client_connection.setblocking(False)
         self.proxy_connection.setblocking(False)
         # Register sockets with selector
-        self.selector.register(self.client_connection, selectors.EVENT_READ)
-        self.selector.register(self.proxy_connection, selectors.EVENT_READ)
+        for sock in (self.client_connection, self.proxy_connection):
+            self.selector.register(sock, selectors.EVENT_READ)
+            self._interest[sock] = selectors.EVENT_READ
+
+    def forward_early_data(self, data: bytes) -> None:
+        """
+        Queues data the client sent ahead of the reply, and that was read along with its
+        request, for the destination ahead of the relayed stream.
+
+        It is sent once listen_and_relay() starts, through the same non-blocking path as
+        relayed data, so a destination that never reads it holds the relay only until
+        its deadlines expire.
+        """
+        if not data:
+            return
+        self._count_relayed(self.client_connection, len(data))
+        if self.relay_mode == "splice":
+            # A handshake read's worth fits in the new, empty pipe without blocking
+            _, pipe_w = self._get_pipe(self.client_connection)
+            os.write(pipe_w, data)
+            self._spliced[self.proxy_connection] = len(data)
+        else:
+            self._pending[self.proxy_connection] = bytearray(data)
+        self._update_interest(self.client_connection)
+        self._update_interest(self.proxy_connection)
+
+    def _connect_upstream(self) -> None:
+        if len(self.dst_address.candidates) > 1:
+            self.proxy_connection = happy_eyeballs_connect(
+                self.dst_address.name, self.dst_address.candidates, self.dst_address.port
+            )
+            self._use_connected_address()
+            return
+
+        self.proxy_connection = generate_tcp_socket(self.dst_address.address_type)
+        try:
+            self.proxy_connection.settimeout(UPSTREAM_CONNECT_TIMEOUT)
+            self.proxy_connection.connect((self.dst_address.ip, self.dst_address.port))
+        except Exception:
+            self.proxy_connection.close()
+            raise
+
+    def _use_connected_address(self) -> None:
+        self.dst_address.ip = self.proxy_connection.getpeername()[0]
+        self.dst_address.address_type = map_address_family_to_enum(self.proxy_connection.family)
 
     def listen_and_relay(self) -> None:
         """
         Relays data between the client socket and the remote socket.
-        """
 
+        Data a receiver cannot take yet is kept for it, and its socket is watched for
+        write readiness instead. Reading from the sender pauses while that backlog is
+        at TCP_RELAY_MAX_PENDING bytes, so a slow receiver slows the sender down.
+
+        The relay also ends at the configured idle timeout or maximum lifetime. With a
+        half-close linger, a side that finishes sending is passed on as a half-close and
+        the other direction keeps running until it finishes too or the linger runs out.
+
+        With a user session, bytes read are charged to the user's bucket for their
+        direction, and a side whose bucket is in debt is not read from until it is repaid.
+        """
+        now = time.monotonic()
+        self.deadlines = RelayDeadlines(now)
         try:
             while True:
-                events = self.selector.select(timeout=TCP_SELECTOR_TIMEOUT)
+                timeout = self.deadlines.timeout(now, TCP_SELECTOR_TIMEOUT)
+                if self._throttled:
+                    timeout = min(timeout, max(min(self._throttled.values()) - now, 0.0))
+                events = self.selector.select(timeout=timeout)
+                now = time.monotonic()
+                # Waiting out a user's bandwidth limit does not count as idle
+                if events or self._throttled:
+                    self.deadlines.last_activity = now
+                reason = self.deadlines.expired(now)
+                if reason is not None:
+                    logger.debug(f"Closing TCP relay: {reason}")
+                    self.close_reason = reason
+                    return
+                resumed = self._throttled and self._resume_reads(now)
                 if not events:
+                    if resumed:
+                        continue
                     if self.client_connection.fileno() == -1 or self.proxy_connection.fileno() == -1:
+                        self.close_reason = "error"
                         break
+                    # Quiet flows give back the memory a burst grew their buffers to
+                    for buffer in self._buffers.values():
+                        buffer.idle()
                     continue
 
-                for key, _ in events:
+                for key, mask in events:
                     sock = key.fileobj
                     other_sock = (
                         self.proxy_connection
@@ -71,61 +222,296 @@ class TCPRelay(BaseRelay):
                         else self.client_connection
                     )
 
-                    # Metadata for logging
-                    other_info: DetailedAddress = (
-                        self.get_dst_address()
-                        if sock is self.client_connection
-                        else self.get_client_address()
-                    )
-                    sock_info: DetailedAddress = (
-                        self.get_client_address()
-                        if sock is self.client_connection
-                        else self.get_dst_address()
-                    )
+                    if mask & selectors.EVENT_WRITE:
+                        self._flush(sock)
 
-                    # Handle incoming data
-                    data: bytes = self._recv_data(sock)
-                    if not data:
-                        return
+                    if mask & selectors.EVENT_READ:
+                        # Metadata for logging
+                        other_info: DetailedAddress = (
+                            self.get_dst_address()
+                            if sock is self.client_connection
+                            else self.get_client_address()
+                        )
+                        sock_info: DetailedAddress = (
+                            self.get_client_address()
+                            if sock is self.client_connection
+                            else self.get_dst_address()
+                        )
 
-                    while data:
-                        # Send data loop to other socket
-                        sent: int = self._send_data(other_sock, data)
-                        self._log_relay(sock_info, other_info, sent)
-                        data = data[sent:]
+                        if self.relay_mode == "splice":
+                            relaying = self._relay_splice(sock, other_sock, sock_info, other_info)
+                        else:
+                            relaying = self._relay_copy(sock, other_sock, sock_info, other_info)
+                        if not relaying:
+                            if not self._eof:
+                                self.close_reason = (
+                                    "client_closed"
+                                    if sock is self.client_connection
+                                    else "upstream_closed"
+                                )
+                            self._eof.add(sock)
+
+                    # Interest only changes while a direction is backed up, throttled or at EOF
+                    if (
+                        mask & selectors.EVENT_WRITE
+                        or self._pending
+                        or self._spliced
+                        or self._throttled
+                        or self._eof
+                    ):
+                        if self._finished():
+                            return
+                        self._update_interest(sock)
+                        self._update_interest(other_sock)
 
         except BrokenPipeError:
+            self.close_reason = "error"
             logger.exception("Broken Pipe")
         except ConnectionResetError:
+            self.close_reason = "error"
             logger.exception("Connection Reset")
         except OSError:
+            self.close_reason = "error"
             logger.exception("Socket error during relay")
         finally:
             self._cleanup()
 
-    def _log_relay(
-        self, src_addr: DetailedAddress, dst_addr: DetailedAddress, data_len: int
+    def _peer(self, sock: socket.socket) -> socket.socket:
+        return self.proxy_connection if sock is self.client_connection else self.client_connection
+
+    def _address_of(self, sock: socket.socket) -> DetailedAddress:
+        return self.get_client_address() if sock is self.client_connection else self.get_dst_address()
+
+    def _finished(self) -> bool:
+        """
+        True once a side has reached EOF and everything it sent has been delivered.
+        With a half-close linger, that side's peer is shut down for writing instead,
+        and the relay finishes once both sides are done.
+        """
+        drained = [sock for sock in self._eof if not self._pending_bytes(self._peer(sock))]
+        if not drained:
+            return False
+        if not self.deadlines.linger or len(drained) == 2:
+            return True
+        for sock in drained:
+            self._half_close(self._peer(sock))
+        return False
+
+    def _half_close(self, sock: socket.socket) -> None:
+        """
+        Passes EOF on to sock, leaving the direction it sends in open.
+        """
+        if sock in self._shut_down:
+            return
+        self._shut_down.add(sock)
+        self.deadlines.half_closed(time.monotonic())
+        try:
+            sock.shutdown(socket.SHUT_WR)
+        except OSError:
+            pass
+
+    def _pending_bytes(self, sock: socket.socket) -> int:
+        """
+        Returns how many bytes are waiting to be sent to sock.
+        """
+        if self.relay_mode == "splice":
+            return self._spliced.get(sock, 0)
+        pending = self._pending.get(sock)
+        return len(pending) if pending is not None else 0
+
+    def _wants_read(self, sock: socket.socket) -> bool:
+        if sock in self._eof or sock in self._throttled:
+            return False
+        if self.relay_mode == "splice":
+            # The kernel pipe holds one chunk; read the next once it has drained
+            return not self._pending_bytes(self._peer(sock))
+        return self._pending_bytes(self._peer(sock)) < TCP_RELAY_MAX_PENDING
+
+    def _update_interest(self, sock: socket.socket) -> None:
+        """
+        Watches sock for reads while its peer is keeping up, and for writes while
+        data is pending for it.
+        """
+        events = 0
+        if self._wants_read(sock):
+            events |= selectors.EVENT_READ
+        if self._pending_bytes(sock):
+            events |= selectors.EVENT_WRITE
+
+        current = self._interest.get(sock, 0)
+        if events == current:
+            return
+        if not current:
+            self.selector.register(sock, events)
+        elif not events:
+            self.selector.unregister(sock)
+        else:
+            self.selector.modify(sock, events)
+        self._interest[sock] = events
+
+    def _flush(self, sock: socket.socket) -> None:
+        """
+        Sends as much of the data pending for sock as it takes without blocking.
+        """
+        src_info = self._address_of(self._peer(sock))
+        dst_info = self._address_of(sock)
+        if self.relay_mode == "splice":
+            self._flush_pipe(sock, src_info, dst_info)
+            return
+
+        pending = self._pending.get(sock)
+        while pending:
+            sent: int = self._send_data(sock, pending)
+            if not sent:
+                return
+            if self.relay_log is not None:
+                self.relay_log.record(src_info, dst_info, sent)
+            del pending[:sent]
+        self._pending.pop(sock, None)
+
+    def _relay_copy(
+        self,
+        sock: socket.socket,
+        other_sock: socket.socket,
+        sock_info: DetailedAddress,
+        other_info: DetailedAddress,
+    ) -> bool:
+        """
+        Copies one chunk from sock to other_sock through the adaptive buffer for
+        that direction, which grows while reads fill it. Partial sends advance a memoryview slice instead of
+        copying the remaining payload; whatever other_sock cannot take without
+        blocking is kept as pending data for it.
+
+        Returns:
+            bool: False once sock has reached EOF.
+        """
+        adaptive: AdaptiveBuffer = self._get_buffer(sock)
+        buffer: memoryview = adaptive.view
+        try:
+            received: int = self._recv_data(sock, buffer)
+        except BlockingIOError:
+            return True
+        if not received:
+            return False
+        self._count_relayed(sock, received)
+        adaptive.record(received)
+
+        pending = self._pending.get(other_sock)
+        if pending:
+            # Keeps order behind data already waiting
+            pending += buffer[:received]
+            return True
+
+        offset = 0
+        while offset < received:
+            # Send data loop to other socket
+            sent: int = self._send_data(other_sock, buffer[offset:received])
+            if not sent:
+                self._pending.setdefault(other_sock, bytearray()).extend(buffer[offset:received])
+                break
+            if self.relay_log is not None:
+                self.relay_log.record(sock_info, other_info, sent)
+            offset += sent
+        return True
+
+    def _count_relayed(self, sock: socket.socket, data_len: int) -> None:
+        """
+        Adds data_len bytes read from sock to the relayed bytes metric for its direction,
+        and reports the first relayed bytes to on_first_byte. With a user session, the
+        bytes are charged to the user's bucket for the direction, and sock is throttled
+        while the bucket is in debt.
+        """
+        if self.on_first_byte is not None:
+            callback, self.on_first_byte = self.on_first_byte, None
+            callback()
+        if sock is self.client_connection:
+            _upstream_bytes.inc(data_len)
+            bucket = self.user_session.upstream if self.user_session is not None else None
+        else:
+            _downstream_bytes.inc(data_len)
+            bucket = self.user_session.downstream if self.user_session is not None else None
+        if bucket is not None:
+            delay = bucket.consume(data_len)
+            if delay:
+                self._throttled[sock] = time.monotonic() + delay
+
+    def _resume_reads(self, now: float) -> bool:
+        """
+        Reads again from throttled sockets whose debt has been repaid by now.
+        Returns True if any was resumed.
+        """
+        resumed = [sock for sock, until in self._throttled.items() if until <= now]
+        for sock in resumed:
+            del self._throttled[sock]
+            self._update_interest(sock)
+        return bool(resumed)
+
+    def _get_buffer(self, sock: socket.socket) -> AdaptiveBuffer:
+        """
+        Returns the receive buffer for data read from sock, creating it on first use.
+        """
+        buffer = self._buffers.get(sock)
+        if buffer is None:
+            buffer = AdaptiveBuffer(self._buffer_min, self._buffer_max)
+            self._buffers[sock] = buffer
+        return buffer
+
+    def _relay_splice(
+        self,
+        sock: socket.socket,
+        other_sock: socket.socket,
+        sock_info: DetailedAddress,
+        other_info: DetailedAddress,
+    ) -> bool:
+        """
+        Moves one chunk from sock to other_sock through a kernel pipe with splice(),
+        so the payload never enters user space. What other_sock cannot take without
+        blocking stays in the pipe as pending data for it.
+
+        Returns:
+            bool: False once sock has reached EOF.
+        """
+        pipe_r, pipe_w = self._get_pipe(sock)
+        flags = os.SPLICE_F_MOVE | os.SPLICE_F_NONBLOCK
+        try:
+            moved: int = os.splice(sock.fileno(), pipe_w, SPLICE_CHUNK_SIZE, flags=flags)
+        except BlockingIOError:
+            return True
+        if not moved:
+            return False
+
+        self._count_relayed(sock, moved)
+        self._spliced[other_sock] = self._spliced.get(other_sock, 0) + moved
+        self._flush_pipe(other_sock, sock_info, other_info)
+        return True
+
+    def _flush_pipe(
+        self, sock: socket.socket, src_info: DetailedAddress, dst_info: DetailedAddress
     ) -> None:
         """
-        Logs the relay of data between the client and the destination.
+        Splices the bytes pending for sock out of its peer's pipe until sock would block.
+        """
+        pipe_r, _ = self._get_pipe(self._peer(sock))
+        flags = os.SPLICE_F_MOVE | os.SPLICE_F_NONBLOCK
+        while self._spliced.get(sock):
+            try:
+                sent: int = os.splice(pipe_r, sock.fileno(), self._spliced[sock], flags=flags)
+            except BlockingIOError:
+                return
+            if self.relay_log is not None:
+                self.relay_log.record(src_info, dst_info, sent)
+            self._spliced[sock] -= sent
+        self._spliced.pop(sock, None)
 
-        Args:
-            src_addr (DetailedAddress): The source socket information.
-            dst_addr (DetailedAddress): The destination socket information.
-            data_len (int): The length of the data sent.
-        """
-        logger.debug(
-            detailed_relay_template.substitute(
-                protocol="TCP",
-                src_domain_name=src_addr.name,
-                src_ip=src_addr.ip,
-                src_port=src_addr.port,
-                dst_domain_name=dst_addr.name,
-                dst_ip=dst_addr.ip,
-                dst_port=dst_addr.port,
-                data_size=data_len,
-            )
-        )
+    def _get_pipe(self, sock: socket.socket) -> tuple[int, int]:
+        """
+        Returns the kernel pipe carrying data read from sock, creating it on first use.
+        """
+        pipe = self._pipes.get(sock)
+        if pipe is None:
+            pipe = os.pipe()
+            self._pipes[sock] = pipe
+        return pipe
 
     def _log_connection_closed(self) -> None:
         """
@@ -145,27 +531,35 @@ class TCPRelay(BaseRelay):
             )
         )
 
-    def _send_data(self, sock: socket.socket, data: bytes) -> int:
+    def _send_data(self, sock: socket.socket, data: memoryview) -> int:
+        """
+        Returns the number of bytes sent, 0 if sock cannot take any without blocking.
+        """
         try:
             return sock.send(data)
+        except BlockingIOError:
+            return 0
         except socket.error as e:
             logger.error(f"Error sending data: {e}")
             raise
 
-    def _recv_data(self, sock: socket.socket) -> bytes:
+    def _recv_data(self, sock: socket.socket, buffer: memoryview) -> int:
         try:
-            return sock.recv(RELAY_BUFFER_SIZE)
+            return sock.recv_into(buffer)
         except socket.error as e:
             logger.error(f"Error receiving data: {e}")
             raise
 
     def _cleanup(self) -> None:
+        RELAY_CLOSES.labels(self.close_reason or "error").inc()
+        if self.relay_log is not None:
+            self.relay_log.summarize()
         self._log_connection_closed()
-        # Unregister both sockets from the selector
+        # Unregister both sockets from the selector, unless interest already dropped to none
         for sock in [self.client_connection, self.proxy_connection]:
             try:
                 self.selector.unregister(sock)
-            except (OSError, ValueError):
+            except (KeyError, OSError, ValueError):
                 pass
         # Only close proxy_connection — client_connection is owned by the server
         try:
@@ -180,3 +574,12 @@ class TCPRelay(BaseRelay):
             self.selector.close()
         except OSError:
             pass
+        for pipe in self._pipes.values():
+            for fd in pipe:
+                try:
+                    os.close(fd)
+                except OSError:
+                    pass
+        self._pipes.clear()
+        self._buffers.clear()
+        self._pending.clear()
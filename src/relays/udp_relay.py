@@ -1,118 +1,366 @@
 import socket
+import selectors
+import time
+from collections import OrderedDict
+from dataclasses import replace
 
-from .base import BaseRelay
-from ..constants import RELAY_BUFFER_SIZE, UDP_RECV_TIMEOUT, UDP_FORWARD_TIMEOUT
-from ..models import DetailedAddress, BaseAddress
+from .base import BaseRelay, RelayLogSampler
+from ..constants import (
+    RELAY_BUFFER_SIZE,
+    UDP_RECV_TIMEOUT,
+    UDP_MAX_DESTINATIONS,
+    UDP_BATCH_SIZE,
+    UDP_BUFFER_SIZE,
+    UDP_REASSEMBLY_TIMEOUT,
+    UDP_REASSEMBLY_MAX_BYTES,
+)
+from ..exceptions import InvalidRequestError
+from ..limits import TokenBucket, UserSession
+from ..models import DetailedAddress, BaseAddress, UDPDatagram
 from ..logger import get_logger
+from ..metrics import RELAYED_BYTES, UDP_DATAGRAMS, UDP_DROPPED
 from ..handlers import UDPHandler
 from ..utils import (
     generate_udp_socket,
     map_address_enum_to_socket_family,
-    base_relay_template,
 )
+from ..utils.mmsg import DatagramReceiver, DatagramSender
 
 logger = get_logger(__name__)
 
+CLIENT, CONTROL, REMOTE = "client", "control", "remote"
+
+_upstream_datagrams = UDP_DATAGRAMS.labels("upstream")
+_downstream_datagrams = UDP_DATAGRAMS.labels("downstream")
+_upstream_bytes = RELAYED_BYTES.labels("udp", "upstream")
+_downstream_bytes = RELAYED_BYTES.labels("udp", "downstream")
+
+
+def permit_destination(destinations: OrderedDict, destination: tuple[str, int]) -> None:
+    """
+    Records destination as one an association accepts replies from, forgetting the
+    least recently used destination beyond UDP_MAX_DESTINATIONS.
+    """
+    destinations[destination] = None
+    destinations.move_to_end(destination)
+    if len(destinations) > UDP_MAX_DESTINATIONS:
+        destinations.popitem(last=False)
+
+
+class ReassemblyQueue:
+    """
+    Reassembles fragmented SOCKS5 UDP datagrams for one association (RFC 1928 section 7).
+
+    FRAG 1 to 127 is a fragment's position in its sequence and the high-order bit marks
+    the last fragment. Fragments must arrive in order; the queue is abandoned when a
+    datagram arrives with a FRAG lower than or out of sequence with the highest one
+    queued, when the destination changes, when the reassembly timer expires, or when
+    the queued data would exceed max_bytes. One sequence is held at a time, so an
+    association never buffers more than max_bytes.
+    """
+
+    END_OF_SEQUENCE = 0x80
+
+    def __init__(
+        self,
+        timeout: float = UDP_REASSEMBLY_TIMEOUT,
+        max_bytes: int = UDP_REASSEMBLY_MAX_BYTES,
+        clock=time.monotonic,
+    ):
+        self.timeout = timeout
+        self.max_bytes = max_bytes
+        self._clock = clock
+        self._fragments: list[UDPDatagram] = []
+        self._size = 0
+        self.deadline: float = None  # when the reassembly timer expires, if running
+
+    def add(self, datagram: UDPDatagram) -> UDPDatagram:
+        """
+        Queues datagram. Returns the datagram to forward: datagram itself if it is not a
+        fragment, the reassembled datagram once the last fragment arrives, otherwise None.
+        """
+        self.expire()
+        if datagram.frag == 0:
+            if self._fragments:
+                self._abandon("standalone datagram arrived")
+            return datagram
+
+        position = datagram.frag & ~self.END_OF_SEQUENCE
+        destination = (datagram.dst_addr, datagram.dst_port)
+        if self._fragments:
+            first = self._fragments[0]
+            if position != len(self._fragments) + 1:
+                self._abandon(f"fragment {position} after {len(self._fragments)}")
+            elif destination != (first.dst_addr, first.dst_port):
+                self._abandon("destination changed")
+        if not self._fragments and position != 1:
+            logger.debug(f"(UDP) Dropped fragment {position} without its sequence")
+            UDP_DROPPED.labels("reassembly").inc()
+            return None
+        if self._size + len(datagram.data) > self.max_bytes:
+            self._abandon(f"more than {self.max_bytes} bytes")
+            UDP_DROPPED.labels("reassembly").inc()
+            return None
+
+        if not self._fragments:
+            self.deadline = self._clock() + self.timeout
+        self._fragments.append(datagram)
+        self._size += len(datagram.data)
+        if not datagram.frag & self.END_OF_SEQUENCE:
+            return None
+
+        data = b"".join(fragment.data for fragment in self._fragments)
+        self._reset()
+        return replace(datagram, frag=0, data=data)
+
+    def expire(self) -> None:
+        """
+        Abandons the queued fragments if the reassembly timer has expired.
+        """
+        if self.deadline is not None and self._clock() >= self.deadline:
+            self._abandon("reassembly timer expired")
+
+    def _abandon(self, reason: str) -> None:
+        logger.debug(f"(UDP) Abandoned {len(self._fragments)} queued fragments: {reason}")
+        UDP_DROPPED.labels("reassembly").inc(len(self._fragments))
+        self._reset()
+
+    def _reset(self) -> None:
+        self._fragments = []
+        self._size = 0
+        self.deadline = None
+
 
 class UDPRelay(BaseRelay):
     """
     Class responsible for relaying data between a client socket and a remote socket via UDP.
+
+    Each association keeps a small NAT table: one outbound socket per address family,
+    shared by every destination the client sends to, and the set of destinations that
+    replies are accepted from. The client-facing socket, the outbound sockets and the
+    TCP control connection are multiplexed in one selector, so any number of datagrams
+    and replies can be in flight at once. Readable sockets are drained and written in
+    batches of up to UDP_BATCH_SIZE datagrams (recvmmsg/sendmmsg where available).
+    Fragmented datagrams are reassembled in a ReassemblyQueue before they are forwarded.
     """
 
-    def __init__(self, client_connection: socket.socket, dst_address: DetailedAddress):
-        super().__init__(client_connection, dst_address)
+    selector: selectors.BaseSelector = None
+
+    def __init__(
+        self,
+        client_connection: socket.socket,
+        dst_address: DetailedAddress,
+        user_session: UserSession = None,
+    ):
+        super().__init__(client_connection, dst_address, user_session)
+        self.relay_log = RelayLogSampler.create(logger, "UDP")
+        # Datagrams the user's bucket for their direction cannot pay for are dropped
+        self._upstream_bucket: TokenBucket = user_session.upstream if user_session is not None else None
+        self._downstream_bucket: TokenBucket = user_session.downstream if user_session is not None else None
         self.expected_client_ip = client_connection.getpeername()[0]
-        self.generate_proxy_connection()
+        self._outbound: dict[int, socket.socket] = {}
+        self._destinations: OrderedDict[tuple[str, int], None] = OrderedDict()
+        self._client_addr: tuple = None
+        self._reassembly = ReassemblyQueue()
+        # Slots fit any UDP payload, so large datagrams are not truncated
+        self._receiver = DatagramReceiver(UDP_BATCH_SIZE, UDP_BUFFER_SIZE)
+        # Replies grow by a SOCKS5 UDP header of at most 22 bytes (IPv6)
+        self._sender = DatagramSender(UDP_BATCH_SIZE, UDP_BUFFER_SIZE + 22)
+        try:
+            self.generate_proxy_connection()
+        except Exception:
+            if self.selector is not None:
+                self.selector.close()
+            raise
 
     def generate_proxy_connection(self) -> None:
         sock = generate_udp_socket(self.dst_address.address_type)
         try:
             sock.bind(("", 0))  # Bind to any available port
-            sock.settimeout(UDP_RECV_TIMEOUT)
+            sock.setblocking(False)
         except Exception:
             sock.close()
             raise
         self.proxy_connection = sock
         self.set_proxy_address()
+        self._watch(sock, CLIENT)
 
-    def listen_and_relay(self):
+    def _watch(self, sock: socket.socket, role: str) -> None:
+        """
+        Starts watching sock for datagrams. role is CLIENT, CONTROL or REMOTE.
+        """
+        if self.selector is None:
+            self.selector = selectors.DefaultSelector()
+        self.selector.register(sock, selectors.EVENT_READ, role)
+
+    def listen_and_relay(self) -> None:
+        """
+        Relays datagrams until the TCP control connection closes (RFC 1928 section 6)
+        or no datagram has been seen for UDP_RECV_TIMEOUT seconds.
+        """
+        last_activity = time.monotonic()
         try:
+            self._watch(self.client_connection, CONTROL)
             while True:
-                data, addr = self.proxy_connection.recvfrom(RELAY_BUFFER_SIZE)
-
-                if addr[0] != self.expected_client_ip:
-                    logger.debug(
-                        f"(UDP) Dropped datagram from unauthorized source: {addr[0]}"
-                    )
-                    continue
-
-                datagram = UDPHandler.parse_udp_datagram(data)
+                now = time.monotonic()
+                remaining = last_activity + UDP_RECV_TIMEOUT - now
+                if remaining <= 0:
+                    logger.debug("UDP relay timed out waiting for data")
+                    return
+                self._reassembly.expire()
+                if self._reassembly.deadline is not None:
+                    remaining = min(remaining, self._reassembly.deadline - now)
 
-                if datagram.frag != 0:
-                    logger.debug(
-                        f"(UDP) Dropped fragmented datagram: {addr} -> "
-                        f"{datagram.dst_addr}:{datagram.dst_port}, "
-                        f"Size: {len(datagram.data)} bytes"
-                    )
-                    continue
-
-                try:
-                    self._forward_packet(datagram, addr)
-                except (ValueError, KeyError) as e:
-                    logger.debug(f"(UDP) Dropped unsupported datagram from {addr}: {e}")
-                    continue
+                for key, _ in self.selector.select(timeout=remaining):
+                    if key.data == CONTROL:
+                        if not self.client_connection.recv(RELAY_BUFFER_SIZE):
+                            return
+                    elif key.data == CLIENT:
+                        if self._relay_client_datagrams():
+                            last_activity = time.monotonic()
+                    elif self._relay_remote_datagrams(key.fileobj):
+                        last_activity = time.monotonic()
 
-        except socket.timeout:
-            logger.debug("UDP relay timed out waiting for data")
         except OSError as e:
             logger.error(f"UDP relay socket error: {e}")
         finally:
+            self._cleanup()
+
+    def _relay_client_datagrams(self) -> int:
+        """
+        Forwards the batch of datagrams waiting on the client-facing socket, grouped
+        into one send per outbound socket. Returns the number of datagrams forwarded.
+        """
+        try:
+            batch = self._receiver.recv(self.proxy_connection)
+        except OSError as e:
+            logger.error(f"UDP relay socket error: {e}")
+            return 0
+
+        outgoing: dict[int, list[tuple[bytes, tuple[str, int]]]] = {}
+        for data, addr in batch:
+            if addr[0] != self.expected_client_ip:
+                logger.debug(f"(UDP) Dropped datagram from unauthorized source: {addr[0]}")
+                UDP_DROPPED.labels("unauthorized_source").inc()
+                continue
+
             try:
-                self.proxy_connection.close()
-            except OSError:
-                pass
+                datagram = self._reassembly.add(UDPHandler.parse_udp_datagram(data))
+                if datagram is None:
+                    continue
+                family = map_address_enum_to_socket_family(datagram.address_type)
+            except (InvalidRequestError, ValueError, KeyError, OSError) as e:
+                logger.debug(f"(UDP) Dropped unsupported datagram from {addr}: {e}")
+                UDP_DROPPED.labels("unsupported").inc()
+                continue
 
-    def _forward_packet(self, datagram, client_addr: tuple) -> None:
-        with socket.socket(
-            map_address_enum_to_socket_family(datagram.address_type),
-            socket.SOCK_DGRAM,
-        ) as forward_socket:
-            forward_socket.settimeout(UDP_FORWARD_TIMEOUT)
-            forward_socket.sendto(
-                datagram.data, (datagram.dst_addr, datagram.dst_port)
-            )
-            self._log_relay(
-                BaseAddress(client_addr[0], client_addr[1]),
-                BaseAddress(datagram.dst_addr, datagram.dst_port),
-                len(datagram.data),
+            self._client_addr = addr
+            if not self._within_limit(self._upstream_bucket, len(datagram.data)):
+                continue
+            outgoing.setdefault(family, []).append(
+                (datagram.data, (datagram.dst_addr, datagram.dst_port))
             )
 
+        forwarded = 0
+        for family, datagrams in outgoing.items():
             try:
-                response, remote_addr = forward_socket.recvfrom(RELAY_BUFFER_SIZE)
-                header = UDPHandler.build_udp_response_header(
-                    remote_addr[0], remote_addr[1]
-                )
-                encapsulated = header + response
-                self.proxy_connection.sendto(encapsulated, client_addr)
-                self._log_relay(
-                    BaseAddress(datagram.dst_addr, datagram.dst_port),
-                    BaseAddress(client_addr[0], client_addr[1]),
-                    len(encapsulated),
-                )
-            except socket.timeout:
-                logger.debug(
-                    f"UDP forward timeout waiting for response from "
-                    f"{datagram.dst_addr}:{datagram.dst_port}"
+                sent = self._sender.send(self._get_outbound_socket(family), datagrams)
+            except OSError as e:
+                logger.debug(f"(UDP) Failed to forward datagrams: {e}")
+                sent = 0
+            self._count_sent(_upstream_datagrams, _upstream_bytes, datagrams, sent)
+            forwarded += sent
+            if not sent:
+                continue
+            for data, destination in datagrams:
+                permit_destination(self._destinations, destination)
+                if self.relay_log is not None:
+                    self.relay_log.record(
+                        BaseAddress(self._client_addr[0], self._client_addr[1]),
+                        BaseAddress(*destination),
+                        len(data),
+                    )
+        return forwarded
+
+    def _relay_remote_datagrams(self, sock: socket.socket) -> int:
+        """
+        Returns the batch of replies waiting on an outbound socket to the client in one
+        send. Returns the number of replies relayed.
+        """
+        try:
+            batch = self._receiver.recv(sock)
+        except OSError as e:
+            logger.debug(f"(UDP) Error receiving from remote: {e}")
+            return 0
+
+        replies: list[tuple[bytes, tuple]] = []
+        for response, remote_addr in batch:
+            if (remote_addr[0], remote_addr[1]) not in self._destinations:
+                logger.debug(f"(UDP) Dropped datagram from unknown remote: {remote_addr[0]}")
+                UDP_DROPPED.labels("unknown_remote").inc()
+                continue
+            if not self._within_limit(self._downstream_bucket, len(response)):
+                continue
+            header = UDPHandler.build_udp_response_header(remote_addr[0], remote_addr[1])
+            replies.append((header + response, self._client_addr))
+            if self.relay_log is not None:
+                self.relay_log.record(
+                    BaseAddress(remote_addr[0], remote_addr[1]),
+                    BaseAddress(self._client_addr[0], self._client_addr[1]),
+                    len(header) + len(response),
                 )
 
-    def _log_relay(self, src_addr: BaseAddress, dst_addr: BaseAddress, data_len: int):
-        logger.debug(
-            base_relay_template.substitute(
-                protocol="UDP",
-                src_ip=src_addr.ip,
-                src_port=src_addr.port,
-                dst_ip=dst_addr.ip,
-                dst_port=dst_addr.port,
-                data_size=data_len,
-            )
-        )
+        try:
+            sent = self._sender.send(self.proxy_connection, replies)
+        except OSError as e:
+            logger.debug(f"(UDP) Failed to return datagrams to client: {e}")
+            sent = 0
+        self._count_sent(_downstream_datagrams, _downstream_bytes, replies, sent)
+        return sent
+
+    @staticmethod
+    def _within_limit(bucket: TokenBucket, data_len: int) -> bool:
+        """
+        Charges a datagram of data_len bytes to bucket. Returns False, counting the
+        datagram as dropped, if the bucket cannot pay for it.
+        """
+        if bucket is None or bucket.try_consume(data_len):
+            return True
+        UDP_DROPPED.labels("rate_limited").inc()
+        return False
+
+    @staticmethod
+    def _count_sent(datagrams_metric, bytes_metric, datagrams: list[tuple[bytes, tuple]], sent: int) -> None:
+        """
+        Counts a batch send of which sent datagrams went out. When some were dropped, the
+        relayed bytes are approximated by the first sent datagrams of the batch.
+        """
+        if sent:
+            datagrams_metric.inc(sent)
+            bytes_metric.inc(sum(len(data) for data, _ in datagrams[:sent]))
+        if sent < len(datagrams):
+            UDP_DROPPED.labels("send_failed").inc(len(datagrams) - sent)
+
+    def _get_outbound_socket(self, family: int) -> socket.socket:
+        sock = self._outbound.get(family)
+        if sock is None:
+            sock = socket.socket(family, socket.SOCK_DGRAM)
+            sock.setblocking(False)
+            self._watch(sock, REMOTE)
+            self._outbound[family] = sock
+        return sock
+
+    def _cleanup(self) -> None:
+        """
+        Closes the association's UDP sockets. The control connection is owned by the server.
+        """
+        if self.relay_log is not None:
+            self.relay_log.summarize()
+        if self.selector is not None:
+            self.selector.close()
+        for sock in [self.proxy_connection, *self._outbound.values()]:
+            try:
+                sock.close()
+            except OSError:
+                pass
+        self._outbound.clear()
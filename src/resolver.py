@@ -0,0 +1,312 @@
+"""
+Process-wide DNS resolver and reverse lookup enricher.
+
+Lookups run on a bounded thread pool and are cached with TTL expiry and an LRU bound.
+Failures are cached as negative entries. Concurrent lookups of the same name share one
+in-flight query instead of each starting their own.
+
+PTR lookups only feed log lines, so they never block a request: the enricher fills in
+DetailedAddress.name in the background from its own pool and cache. Its backlog is
+bounded, and addresses it has no room for keep their IP as the name.
+"""
+import socket
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Hashable
+
+from .constants import (
+    DNS_RESOLVER_WORKERS,
+    DNS_CACHE_MAX_ENTRIES,
+    DNS_CACHE_TTL,
+    DNS_NEGATIVE_CACHE_TTL,
+    PTR_LOOKUP_WORKERS,
+    PTR_CACHE_MAX_ENTRIES,
+    PTR_CACHE_TTL,
+    PTR_LOOKUP_MAX_PENDING,
+    PTR_LOOKUP_TIMEOUT,
+)
+from .metrics import DNS_LOOKUP_SECONDS
+from .models import DetailedAddress
+
+
+class TTLCache:
+    """
+    LRU-bounded mapping whose entries expire after a per-entry TTL. Not thread-safe.
+    """
+
+    def __init__(self, max_entries: int, clock: Callable[[], float] = time.monotonic):
+        self.max_entries = max_entries
+        self._clock = clock
+        self._entries: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._entries.get(key)
+        if entry is None:
+            return default
+        expires_at, value = entry
+        if expires_at <= self._clock():
+            del self._entries[key]
+            return default
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: float) -> None:
+        self._entries[key] = (self._clock() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class _NegativeEntry:
+    __slots__ = ("error",)
+
+    def __init__(self, error: OSError):
+        self.error = error
+
+
+class Resolver:
+    """
+    Caching resolver shared by every handler in the process.
+
+    resolve() returns a concurrent.futures.Future. Cache hits return an already
+    completed future; failed lookups raise the cached OSError.
+    """
+
+    def __init__(
+        self,
+        max_workers: int = DNS_RESOLVER_WORKERS,
+        max_entries: int = DNS_CACHE_MAX_ENTRIES,
+        ttl: float = DNS_CACHE_TTL,
+        negative_ttl: float = DNS_NEGATIVE_CACHE_TTL,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._cache = TTLCache(max_entries, clock)
+        self._inflight: dict[Hashable, Future] = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="dns-resolver"
+        )
+
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def resolve(self, name: str) -> Future:
+        """
+        Resolves name with getaddrinfo for TCP on any address family.
+        """
+        return self.lookup(("getaddrinfo", name), lambda: self._getaddrinfo(name))
+
+    @staticmethod
+    def _getaddrinfo(name: str) -> list:
+        started = time.monotonic()
+        try:
+            return socket.getaddrinfo(name, None, socket.AF_UNSPEC, socket.SOCK_STREAM)
+        finally:
+            DNS_LOOKUP_SECONDS.observe(time.monotonic() - started)
+
+    def lookup(self, key: Hashable, fn: Callable[[], Any]) -> Future:
+        """
+        Returns a future for fn(), served from the cache or from an in-flight lookup
+        for the same key whenever possible.
+        """
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                if isinstance(cached, _NegativeEntry):
+                    self.negative_hits += 1
+                    return self._completed(error=cached.error.with_traceback(None))
+                self.hits += 1
+                return self._completed(result=cached)
+
+            self.misses += 1
+            future = self._inflight.get(key)
+            if future is not None:
+                self.coalesced += 1
+                return future
+
+            future = self._executor.submit(fn)
+            self._inflight[key] = future
+
+        future.add_done_callback(lambda done: self._store(key, done))
+        return future
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "negative_hits": self.negative_hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "inflight": len(self._inflight),
+                "entries": len(self._cache),
+            }
+
+    def clear(self) -> None:
+        """
+        Drops every cached entry. Lookups still in flight will not populate the cache.
+        """
+        with self._lock:
+            self._cache.clear()
+            self._inflight.clear()
+
+    def _store(self, key: Hashable, future: Future) -> None:
+        with self._lock:
+            if self._inflight.get(key) is not future:
+                return
+            del self._inflight[key]
+            if future.cancelled():
+                return
+            error = future.exception()
+            if error is None:
+                self._cache.set(key, future.result(), self.ttl)
+            elif isinstance(error, OSError):
+                self._cache.set(key, _NegativeEntry(error), self.negative_ttl)
+
+    @staticmethod
+    def _completed(result: Any = None, error: BaseException = None) -> Future:
+        future = Future()
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+        return future
+
+
+class ReverseLookupEnricher:
+    """
+    Fills in DetailedAddress.name with the PTR name of its IP in the background.
+
+    Addresses keep their IP as the name until the lookup completes. Results, including
+    failures (cached as the IP itself), are kept in a cache separate from the resolver's.
+
+    At most max_pending IPs are queued or being looked up at once; addresses of further
+    IPs are left unnamed rather than queued. gethostbyaddr() cannot be timed out, so a
+    lookup that waited longer than timeout for a worker is skipped instead of run late.
+    """
+
+    def __init__(
+        self,
+        max_workers: int = PTR_LOOKUP_WORKERS,
+        max_entries: int = PTR_CACHE_MAX_ENTRIES,
+        ttl: float = PTR_CACHE_TTL,
+        negative_ttl: float = DNS_NEGATIVE_CACHE_TTL,
+        max_pending: int = PTR_LOOKUP_MAX_PENDING,
+        timeout: float = PTR_LOOKUP_TIMEOUT,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self._clock = clock
+        self._cache = TTLCache(max_entries, clock)
+        self._pending: dict[str, list[DetailedAddress]] = {}
+        self._inflight: dict[str, Future] = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="ptr-enricher"
+        )
+
+        self.dropped = 0
+        self.skipped = 0
+
+    def enrich(self, address: DetailedAddress) -> Future:
+        """
+        Names address from the cache, or queues a PTR lookup that names it later.
+
+        Returns:
+            Future: The pending lookup, resolving to the name once every waiting address
+            has been updated, or None when the name came from the cache or the backlog
+            is full.
+        """
+        ip = address.ip
+        with self._lock:
+            name = self._cache.get(ip)
+            if name is not None:
+                address.name = name
+                return None
+
+            future = self._inflight.get(ip)
+            if future is None:
+                if len(self._inflight) >= self.max_pending:
+                    self.dropped += 1
+                    return None
+                deadline = self._clock() + self.timeout
+                future = self._executor.submit(self._lookup, ip, self._generation, deadline)
+                self._inflight[ip] = future
+            self._pending.setdefault(ip, []).append(address)
+            return future
+
+    def clear(self) -> None:
+        """
+        Drops every cached name. Lookups still in flight will not populate the cache.
+        """
+        with self._lock:
+            self._generation += 1
+            self._cache.clear()
+            self._pending.clear()
+            self._inflight.clear()
+
+    def _lookup(self, ip: str, generation: int, deadline: float) -> str:
+        if self._clock() >= deadline:
+            # Too late to be of use; not cached, so a later address tries again
+            name, ttl = ip, None
+        else:
+            try:
+                name, ttl = socket.gethostbyaddr(ip)[0], self.ttl
+            except Exception:
+                name, ttl = ip, self.negative_ttl
+
+        with self._lock:
+            if generation != self._generation:
+                return name
+            self._inflight.pop(ip, None)
+            if ttl is None:
+                self.skipped += 1
+            else:
+                self._cache.set(ip, name, ttl)
+            addresses = self._pending.pop(ip, [])
+
+        for address in addresses:
+            address.name = name
+        return name
+
+
+_resolver: Resolver = None
+_resolver_lock = threading.Lock()
+_enricher: ReverseLookupEnricher = None
+
+
+def get_resolver() -> Resolver:
+    """
+    Returns the process-wide resolver, creating it on first use.
+    """
+    global _resolver
+    with _resolver_lock:
+        if _resolver is None:
+            _resolver = Resolver()
+        return _resolver
+
+
+def get_reverse_lookup_enricher() -> ReverseLookupEnricher:
+    """
+    Returns the process-wide reverse lookup enricher, creating it on first use.
+    """
+    global _enricher
+    with _resolver_lock:
+        if _enricher is None:
+            _enricher = ReverseLookupEnricher()
+        return _enricher
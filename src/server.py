@@ -1,9 +1,13 @@
 import socket
 import threading
-from socketserver import StreamRequestHandler, ThreadingMixIn, TCPServer
+import time
+from collections import deque
+from socketserver import StreamRequestHandler, TCPServer
 
-from .constants import CommandCodes
+from .constants import CommandCodes, ACCEPT_QUEUE_SIZE, ACCEPT_QUEUE_TIMEOUT
+from .exceptions import UserLimitExceededError
 from .handlers import TCPHandler
+from .limits import UserSession, get_user_limiter
 from .relays import TCPRelay, UDPRelay
 from .utils import (
     generate_general_socks_server_failure_reply,
@@ -11,10 +15,21 @@ from .utils import (
     generate_connection_refused_reply,
     generate_host_unreachable_reply,
     generate_succeeded_reply,
+    generate_connection_not_allowed_by_ruleset_reply,
     connection_established_template,
 )
 from .logger import get_logger
+from .metrics import (
+    ACCEPT_QUEUE_DEPTH,
+    ACCEPT_QUEUE_WAIT_SECONDS,
+    ACTIVE_CONNECTIONS,
+    CONNECTIONS_ACCEPTED,
+    CONNECTIONS_REJECTED,
+    HANDSHAKE_FAILURES,
+)
 from .models import Request, DetailedAddress
+from .timing import SessionTimer
+from .tuning import apply_socket_profile, listener_profile
 
 logger = get_logger(__name__)
 
@@ -22,32 +37,139 @@ logger = get_logger(__name__)
 MAX_CONNECTIONS = 200
 
 
-class ThreadingTCPServer(ThreadingMixIn, TCPServer):
+class ThreadingTCPServer(TCPServer):
     """
-    A threading version of a TCP server with a connection limit.
+    A TCP server that serves each connection on one of a bounded pool of worker threads.
+
+    Workers start on demand, up to max_connections, and are reused. Connections accepted
+    while every worker is busy wait in a queue of up to queue_size, so short bursts are
+    absorbed; beyond that they are refused. A queued connection that waited longer than
+    queue_timeout seconds (0 for no limit) is closed instead of served, as its client
+    has likely given up.
 
-    https://docs.python.org/3/library/socketserver.html#socketserver.ThreadingMixIn
+    https://docs.python.org/3/library/socketserver.html#socketserver.TCPServer
     """
 
-    daemon_threads = True
-    _connection_semaphore = threading.BoundedSemaphore(MAX_CONNECTIONS)
+    allow_reuse_port = False
+
+    def __init__(
+        self,
+        server_address: tuple[str, int],
+        RequestHandlerClass,
+        bind_and_activate: bool = True,
+        max_connections: int = None,
+        queue_size: int = ACCEPT_QUEUE_SIZE,
+        queue_timeout: float = ACCEPT_QUEUE_TIMEOUT,
+    ):
+        self.max_connections = max_connections or MAX_CONNECTIONS
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        # Accepted connections with when they were accepted, until a worker takes them
+        self._queue: deque[tuple[socket.socket, tuple, float]] = deque()
+        self._queue_changed = threading.Condition()
+        self._workers = 0
+        self._busy_workers = 0
+        self._closing = False
+        # When each request was accepted, until its handler starts
+        self._accepted_at: dict[socket.socket, float] = {}
+        super().__init__(server_address, RequestHandlerClass, bind_and_activate)
+
+    def server_bind(self):
+        # socketserver only honours allow_reuse_port itself from Python 3.11
+        if self.allow_reuse_port:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        super().server_bind()
 
     def process_request(self, request, client_address):
-        if self._connection_semaphore.acquire(blocking=False):
-            try:
-                super().process_request(request, client_address)
-            except Exception:
-                self._connection_semaphore.release()
-                raise
-        else:
+        accepted_at = time.monotonic()
+        with self._queue_changed:
+            admitted = len(self._queue) < self.max_connections - self._busy_workers + self.queue_size
+            if admitted:
+                self._accepted_at[request] = accepted_at
+                self._queue.append((request, client_address, accepted_at))
+                ACCEPT_QUEUE_DEPTH.inc()
+                # Workers not serving a connection are waiting for one, or about to
+                waiting_workers = self._workers - self._busy_workers
+                if waiting_workers < len(self._queue) and self._workers < self.max_connections:
+                    self._start_worker()
+                self._queue_changed.notify()
+        if not admitted:
             logger.warning("Connection limit reached, rejecting connection")
+            CONNECTIONS_REJECTED.labels("queue_full").inc()
             self.shutdown_request(request)
+            return
+        CONNECTIONS_ACCEPTED.inc()
 
-    def process_request_thread(self, request, client_address):
+    def _start_worker(self) -> None:
+        # Called with _queue_changed held
+        self._workers += 1
         try:
-            super().process_request_thread(request, client_address)
+            threading.Thread(target=self._work, daemon=True).start()
+        except RuntimeError:
+            # Out of threads: the connection waits for a running worker
+            self._workers -= 1
+            logger.error("Could not start a worker thread")
+
+    def _work(self) -> None:
+        """
+        Serves queued connections until the server closes.
+        """
+        while True:
+            with self._queue_changed:
+                while not self._queue and not self._closing:
+                    self._queue_changed.wait()
+                if not self._queue:
+                    self._workers -= 1
+                    return
+                request, client_address, accepted_at = self._queue.popleft()
+                ACCEPT_QUEUE_DEPTH.dec()
+                self._busy_workers += 1
+
+            try:
+                waited = time.monotonic() - accepted_at
+                ACCEPT_QUEUE_WAIT_SECONDS.observe(waited)
+                if self.queue_timeout and waited > self.queue_timeout:
+                    logger.warning(f"Connection waited {waited:.1f}s for a worker, closing it")
+                    CONNECTIONS_REJECTED.labels("queue_timeout").inc()
+                    self._accepted_at.pop(request, None)
+                    self.shutdown_request(request)
+                else:
+                    self._serve(request, client_address)
+            finally:
+                with self._queue_changed:
+                    self._busy_workers -= 1
+
+    def _serve(self, request, client_address) -> None:
+        ACTIVE_CONNECTIONS.inc()
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
         finally:
-            self._connection_semaphore.release()
+            self._accepted_at.pop(request, None)
+            self.shutdown_request(request)
+            ACTIVE_CONNECTIONS.dec()
+
+    def server_close(self):
+        """
+        Stops the listener and idle workers, and closes connections still queued.
+        Workers serving a connection finish it first.
+        """
+        super().server_close()
+        with self._queue_changed:
+            self._closing = True
+            queued, self._queue = self._queue, deque()
+            ACCEPT_QUEUE_DEPTH.dec(len(queued))
+            self._queue_changed.notify_all()
+        for request, _, _ in queued:
+            self._accepted_at.pop(request, None)
+            self.shutdown_request(request)
+
+    def pop_accept_time(self, request: socket.socket) -> float:
+        """
+        Returns when request was accepted, on time.monotonic(), or None if unknown.
+        """
+        return self._accepted_at.pop(request, None)
 
 
 class TCPProxyServer(StreamRequestHandler):
@@ -60,6 +182,8 @@ class TCPProxyServer(StreamRequestHandler):
     client_address: DetailedAddress
     connection: socket.socket
     server: ThreadingTCPServer
+    timer: SessionTimer
+    user_session: UserSession
 
     def handle(self):
         """
@@ -70,7 +194,19 @@ class TCPProxyServer(StreamRequestHandler):
             client_address: Client address returned by BaseServer.get_request().
             server: BaseServer object used for handling the request.
         """
-        request_handler = TCPHandler(self.connection)
+        self.timer = SessionTimer(started=self.server.pop_accept_time(self.request))
+        self.timer.mark("accept")
+        self.user_session = None
+        try:
+            self._handle()
+        finally:
+            self.timer.finish()
+            if self.user_session is not None:
+                self.user_session.release()
+
+    def _handle(self) -> None:
+        apply_socket_profile(self.connection, listener_profile())
+        request_handler = TCPHandler(self.connection, self.timer)
 
         if not request_handler.handle_request():
             logger.error("Handshake failed")
@@ -81,10 +217,14 @@ class TCPProxyServer(StreamRequestHandler):
             dst_request: Request = request_handler.parse_request()
         except Exception:
             logger.error("Failed to parse SOCKS5 request")
+            HANDSHAKE_FAILURES.labels("request").inc()
             self._send_error_reply(generate_general_socks_server_failure_reply())
             return
+        self.timer.mark("request")
 
         peer = self.connection.getpeername()
+        self.timer.peer = peer
+        self.timer.destination = dst_request.address
         self.client_address: DetailedAddress = DetailedAddress(
             ip=peer[0],
             port=peer[1],
@@ -94,9 +234,17 @@ class TCPProxyServer(StreamRequestHandler):
         self._log_connection(dst_request.address)
 
         atyp = dst_request.address.address_type
+        try:
+            self.user_session = get_user_limiter().acquire(request_handler.username)
+        except UserLimitExceededError as e:
+            logger.warning(str(e))
+            HANDSHAKE_FAILURES.labels(e.reason).inc()
+            self._send_error_reply(generate_connection_not_allowed_by_ruleset_reply(atyp))
+            return
+
         try:
             if dst_request.command == CommandCodes.CONNECT.value:
-                self.handle_connect(dst_request.address)
+                self.handle_connect(dst_request.address, request_handler.protocol.trailing_data())
 
             elif dst_request.command == CommandCodes.BIND.value:
                 self.handle_bind(dst_request.address)
@@ -105,32 +253,41 @@ class TCPProxyServer(StreamRequestHandler):
                 self.handle_udp_associate(dst_request.address)
 
             else:
+                HANDSHAKE_FAILURES.labels("command_not_supported").inc()
                 self._send_error_reply(generate_command_not_supported_reply(atyp))
 
         except ConnectionRefusedError:
             logger.error(f"Connection refused: {dst_request.address}")
+            HANDSHAKE_FAILURES.labels("connection_refused").inc()
             self._send_error_reply(generate_connection_refused_reply(atyp))
-        except socket.gaierror:
+        except (socket.gaierror, TimeoutError):
             logger.error(f"Host unreachable: {dst_request.address}")
+            HANDSHAKE_FAILURES.labels("host_unreachable").inc()
             self._send_error_reply(generate_host_unreachable_reply(atyp))
         except Exception as e:
             logger.error(f"Exception: {e}")
+            HANDSHAKE_FAILURES.labels("server_failure").inc()
             self._send_error_reply(generate_general_socks_server_failure_reply(atyp))
 
-    def handle_connect(self, dst_address: DetailedAddress) -> None:
+    def handle_connect(self, dst_address: DetailedAddress, early_data: bytes = b"") -> None:
         """
-        Handles CONNECT command.
+        Handles CONNECT command. early_data is what the client sent after its request
+        without waiting for the reply, and goes to the destination first.
         """
         # Allocate port for TCP relay
-        tcp_relay = TCPRelay(self.connection, dst_address)
+        tcp_relay = TCPRelay(self.connection, dst_address, user_session=self.user_session)
+        self.timer.mark("connect")
 
         # Send reply with bind address and port
         success_reply = generate_succeeded_reply(
             dst_address.address_type, *tcp_relay.get_proxy_address()
         )
         self.connection.sendall(success_reply)
+        self.timer.mark("reply")
 
-        # Start TCP relay
+        # Start TCP relay, setup ends with its first byte
+        tcp_relay.on_first_byte = self.timer.first_byte
+        tcp_relay.forward_early_data(early_data)
         tcp_relay.listen_and_relay()
 
     def handle_udp_associate(self, dst_address: DetailedAddress) -> None:
@@ -138,13 +295,17 @@ class TCPProxyServer(StreamRequestHandler):
         Handles UDP ASSOCIATE command.
         """
         # Allocate port for UDP relay
-        udp_relay = UDPRelay(self.connection, dst_address)
+        udp_relay = UDPRelay(self.connection, dst_address, self.user_session)
+        self.timer.mark("connect")
 
         # Send reply with allocated port and server IP
         success_reply = generate_succeeded_reply(
             dst_address.address_type, *udp_relay.get_proxy_address()
         )
         self.connection.sendall(success_reply)
+        self.timer.mark("reply")
+        # The association has no first byte to wait for, setup ends with the reply
+        self.timer.finish()
 
         # Start UDP relay
         udp_relay.listen_and_relay()
@@ -154,6 +315,7 @@ class TCPProxyServer(StreamRequestHandler):
         Handles BIND command.
         """
         logger.error("BIND command not supported")
+        HANDSHAKE_FAILURES.labels("command_not_supported").inc()
         self._send_error_reply(generate_command_not_supported_reply(address.address_type))
 
     def _send_error_reply(self, reply: bytes) -> None:
@@ -0,0 +1,115 @@
+"""
+Per-phase latency of SOCKS session setup.
+
+A SessionTimer starts when a client connection is accepted and is marked as each setup
+phase ends, so every phase lasts from the previous mark to its own. finish() records the
+phases in SESSION_PHASE_SECONDS and logs sessions slower than the configured threshold
+with their full breakdown, telling slow DNS apart from slow upstreams or slow clients.
+"""
+import time
+from typing import Callable
+
+from .config import ProxyConfiguration
+from .logger import get_logger
+from .metrics import DEFAULT_BUCKETS, Histogram
+from .models import DetailedAddress
+from .utils import slow_session_template
+
+logger = get_logger(__name__)
+
+# Setup phases in the order they happen. A session records only the phases it reaches:
+# auth only after USERNAME/PASSWORD was negotiated, dns only for domain name requests.
+PHASES = (
+    "accept",  # accepted by the kernel until the handler starts
+    "negotiation",  # method selection request read and answered
+    "auth",  # USERNAME/PASSWORD subnegotiation
+    "request",  # request read and parsed, excluding dns
+    "dns",  # destination domain name resolution
+    "connect",  # upstream connected, or UDP relay socket bound
+    "reply",  # success reply sent
+    "first_byte",  # first payload byte relayed in either direction
+)
+
+SESSION_PHASE_SECONDS = Histogram(
+    "socks5_session_phase_seconds",
+    "Duration of each SOCKS5 session setup phase.",
+    ("phase",),
+    buckets=(0.0001, 0.00025, 0.0005, *DEFAULT_BUCKETS),
+)
+
+
+class SessionTimer:
+    """
+    Phase durations of one SOCKS session. Not thread-safe: a session is marked by the
+    thread or task serving it.
+    """
+
+    def __init__(self, started: float = None, clock: Callable[[], float] = time.monotonic):
+        """
+        Args:
+            started (float): When the connection was accepted, on clock. Defaults to now.
+            clock (Callable[[], float]): Monotonic time source.
+        """
+        self._clock = clock
+        self.started = clock() if started is None else started
+        self._last = self.started
+        self.durations: dict[str, float] = {}
+        self.peer: tuple = None
+        self.destination: DetailedAddress = None
+        self.finished = False
+
+    def mark(self, phase: str) -> None:
+        """
+        Ends phase now. Marking a phase again adds to it, so a phase interrupted by
+        another (request by dns) is still measured as one.
+        """
+        now = self._clock()
+        self.durations[phase] = self.durations.get(phase, 0.0) + now - self._last
+        self._last = now
+
+    @property
+    def total(self) -> float:
+        """Seconds from accept to the last mark."""
+        return self._last - self.started
+
+    def first_byte(self) -> None:
+        """
+        Relay callback for the first payload byte: ends setup and records the session.
+        """
+        self.mark("first_byte")
+        self.finish()
+
+    def finish(self) -> None:
+        """
+        Records the phases reached so far, once. Later calls do nothing.
+        """
+        if self.finished:
+            return
+        self.finished = True
+        for phase, duration in self.durations.items():
+            SESSION_PHASE_SECONDS.labels(phase).observe(duration)
+
+        threshold = ProxyConfiguration.get_slow_session_threshold()
+        if threshold and self.total >= threshold:
+            logger.warning(self._describe())
+
+    def _describe(self) -> str:
+        src_ip, src_port = self.peer[:2] if self.peer else ("?", "?")
+        if self.destination is None:
+            destination = "?"
+        else:
+            destination = (
+                f"({self.destination.name}) {self.destination.ip}:{self.destination.port}"
+            )
+        phases = " ".join(
+            f"{phase}={self.durations[phase] * 1000:.1f}ms"
+            for phase in PHASES
+            if phase in self.durations
+        )
+        return slow_session_template.substitute(
+            src_ip=src_ip,
+            src_port=src_port,
+            destination=destination,
+            total_ms=f"{self.total * 1000:.1f}",
+            phases=phases,
+        )
@@ -0,0 +1,112 @@
+"""
+Socket option profiles for the TCP sockets on both sides of a relay.
+
+The listener's profile is applied to every accepted client socket. Once a CONNECT
+names its destination, the profile configured for the destination port (or the
+listener's) is applied to the upstream socket and, when it differs, to the client
+socket as well, so both legs of a tunnel are tuned alike.
+
+Options a profile leaves as None keep the kernel's (or the event loop's) setting.
+Options the platform does not provide are skipped.
+"""
+import socket
+from dataclasses import dataclass
+
+from .config import ProxyConfiguration
+from .logger import get_logger
+
+logger = get_logger(__name__)
+
+
+@dataclass(frozen=True)
+class SocketProfile:
+    nodelay: bool = None  # TCP_NODELAY, send small writes without waiting to coalesce
+    quickack: bool = None  # TCP_QUICKACK, acknowledge at once instead of delaying ACKs
+    keepalive: bool = None  # SO_KEEPALIVE
+    keepidle: int = None  # TCP_KEEPIDLE, idle seconds before the first probe
+    keepintvl: int = None  # TCP_KEEPINTVL, seconds between probes
+    keepcnt: int = None  # TCP_KEEPCNT, unanswered probes before the connection drops
+    sndbuf: int = None  # SO_SNDBUF, bytes; a fixed size disables kernel autotuning
+    rcvbuf: int = None  # SO_RCVBUF, bytes; a fixed size disables kernel autotuning
+    user_timeout: int = None  # TCP_USER_TIMEOUT, ms sent data may stay unacknowledged
+
+
+PROFILES: dict[str, SocketProfile] = {
+    "default": SocketProfile(),
+    # Shells, games, request/response protocols: latency over throughput,
+    # and dead peers noticed within a couple of minutes
+    "interactive": SocketProfile(
+        nodelay=True,
+        quickack=True,
+        keepalive=True,
+        keepidle=60,
+        keepintvl=10,
+        keepcnt=6,
+        user_timeout=30000,
+    ),
+    # Downloads and backups: large buffers for long fat pipes, patient timeouts
+    "bulk": SocketProfile(
+        keepalive=True,
+        keepidle=300,
+        keepintvl=30,
+        keepcnt=4,
+        sndbuf=4194304,
+        rcvbuf=4194304,
+        user_timeout=120000,
+    ),
+}
+
+# (field, level, option name); option names missing from the socket module are skipped
+_OPTIONS = (
+    ("nodelay", socket.IPPROTO_TCP, "TCP_NODELAY"),
+    ("quickack", socket.IPPROTO_TCP, "TCP_QUICKACK"),
+    ("keepalive", socket.SOL_SOCKET, "SO_KEEPALIVE"),
+    ("keepidle", socket.IPPROTO_TCP, "TCP_KEEPIDLE"),
+    ("keepintvl", socket.IPPROTO_TCP, "TCP_KEEPINTVL"),
+    ("keepcnt", socket.IPPROTO_TCP, "TCP_KEEPCNT"),
+    ("sndbuf", socket.SOL_SOCKET, "SO_SNDBUF"),
+    ("rcvbuf", socket.SOL_SOCKET, "SO_RCVBUF"),
+    ("user_timeout", socket.IPPROTO_TCP, "TCP_USER_TIMEOUT"),
+)
+
+
+def apply_socket_profile(sock: socket.socket, profile: SocketProfile) -> None:
+    """
+    Sets every option profile specifies on sock. An option the socket rejects is
+    logged and skipped; a tuning failure never fails the connection.
+    """
+    for field, level, name in _OPTIONS:
+        value = getattr(profile, field)
+        option = getattr(socket, name, None)
+        if value is None or option is None:
+            continue
+        try:
+            sock.setsockopt(level, option, int(value))
+        except OSError as e:
+            logger.debug(f"Could not set {name}={value}: {e}")
+
+
+def listener_profile() -> SocketProfile:
+    """
+    Returns the profile applied to accepted client sockets.
+    """
+    return PROFILES[ProxyConfiguration.get_socket_profile()]
+
+
+def destination_profile(port: int) -> SocketProfile:
+    """
+    Returns the profile for tunnels to port, falling back to the listener's.
+    """
+    name = ProxyConfiguration.get_port_profiles().get(port)
+    return PROFILES[name] if name is not None else listener_profile()
+
+
+def tune_relay_sockets(client: socket.socket, upstream: socket.socket, port: int) -> None:
+    """
+    Applies the profile for destination port to a tunnel's upstream socket, and to
+    its client socket if the listener applied a different one on accept.
+    """
+    profile = destination_profile(port)
+    apply_socket_profile(upstream, profile)
+    if profile is not listener_profile():
+        apply_socket_profile(client, profile)
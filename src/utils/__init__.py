@@ -24,12 +24,18 @@ from .sockets import (
     generate_tcp_socket,
     generate_udp_socket,
     generate_address_from_socket,
+    happy_eyeballs_connect,
+    order_connect_candidates,
+    remember_connect_family,
+    address_family_of,
 )
 from .logs import (
     connection_established_template,
     connection_closed_template,
     base_relay_template,
     detailed_relay_template,
+    relay_summary_template,
+    slow_session_template,
 )
 
 __all__ = [
@@ -54,8 +60,14 @@ __all__ = [
     "generate_tcp_socket",
     "generate_udp_socket",
     "generate_address_from_socket",
+    "happy_eyeballs_connect",
+    "order_connect_candidates",
+    "remember_connect_family",
+    "address_family_of",
     "connection_established_template",
     "connection_closed_template",
     "base_relay_template",
     "detailed_relay_template",
+    "relay_summary_template",
+    "slow_session_template",
 ]
@@ -0,0 +1,66 @@
+"""
+Receive buffers that size themselves to the flow they carry.
+"""
+
+# Consecutive reads that fill the buffer before it doubles
+GROW_AFTER: int = 1
+# Consecutive reads using under a quarter of the buffer before it halves
+SHRINK_AFTER: int = 16
+
+
+class AdaptiveBuffer:
+    """
+    A read buffer for one relay direction that doubles while reads keep filling it,
+    halves while reads stay small, and drops back to min_size when the flow goes idle.
+    Bulk transfers move more bytes per syscall; interactive flows hold little memory.
+
+    The buffer is allocated on first use of view and reallocated only on a resize.
+    Views taken before a resize stay valid but are no longer the current buffer.
+    """
+
+    __slots__ = ("min_size", "max_size", "size", "_view", "_full_reads", "_small_reads")
+
+    def __init__(self, min_size: int, max_size: int):
+        if not 0 < min_size <= max_size:
+            raise ValueError(f"invalid buffer bounds {min_size}..{max_size}")
+        self.min_size = min_size
+        self.max_size = max_size
+        self.size = min_size
+        self._view: memoryview = None
+        self._full_reads = 0
+        self._small_reads = 0
+
+    @property
+    def view(self) -> memoryview:
+        """The buffer to read into, size bytes long."""
+        if self._view is None or len(self._view) != self.size:
+            self._view = memoryview(bytearray(self.size))
+        return self._view
+
+    def record(self, received: int) -> None:
+        """
+        Adjusts the size after a read of received bytes into a buffer of the current size.
+        """
+        if received >= self.size:
+            self._small_reads = 0
+            self._full_reads += 1
+            if self._full_reads >= GROW_AFTER and self.size < self.max_size:
+                self.size = min(self.size * 2, self.max_size)
+                self._full_reads = 0
+        elif received < self.size // 4:
+            self._full_reads = 0
+            self._small_reads += 1
+            if self._small_reads >= SHRINK_AFTER and self.size > self.min_size:
+                self.size = max(self.size // 2, self.min_size)
+                self._small_reads = 0
+        else:
+            self._full_reads = self._small_reads = 0
+
+    def idle(self) -> None:
+        """
+        Returns to min_size and releases a larger buffer.
+        """
+        self._full_reads = self._small_reads = 0
+        if self.size != self.min_size:
+            self.size = self.min_size
+            self._view = None
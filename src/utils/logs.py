@@ -16,3 +16,10 @@ detailed_relay_template = string.Template(
     "RELAY | $protocol | ($src_domain_name) $src_ip:$src_port -> "
     "($dst_domain_name) $dst_ip:$dst_port | $data_size bytes"
 )
+relay_summary_template = string.Template(
+    "RELAY SUMMARY | $protocol | $src_ip:$src_port -> $dst_ip:$dst_port | "
+    "$chunks chunks | $data_size bytes | $seconds s"
+)
+slow_session_template = string.Template(
+    "SLOW SESSION | $src_ip:$src_port -> $destination | $total_ms ms | $phases"
+)
@@ -0,0 +1,310 @@
+"""
+Batched UDP I/O.
+
+On Linux, recvmmsg(2) and sendmmsg(2) are called through ctypes so one syscall moves a
+whole batch of datagrams. Elsewhere, or if libc does not export them, the same
+interface falls back to draining the socket with recvfrom/sendto until it would block.
+
+Message headers, iovecs, payload slots and socket addresses are allocated once per
+receiver or sender and updated in place through memoryviews, so a batch costs a
+couple of buffer copies per datagram instead of a ctypes object per field.
+
+Addresses passed to DatagramSender.send must be IP literals.
+"""
+import ctypes
+import errno
+import mmap
+import socket
+import struct
+import sys
+
+MSG_DONTWAIT: int = getattr(socket, "MSG_DONTWAIT", 0)
+SOCKADDR_STORAGE_SIZE = 128
+SOCKADDR_IN6_SIZE = 28
+SOCKADDR_CACHE_SIZE = 1024  # addresses kept per DatagramReceiver or DatagramSender
+
+
+class _IOVec(ctypes.Structure):
+    _fields_ = [("iov_base", ctypes.c_void_p), ("iov_len", ctypes.c_size_t)]
+
+
+class _MsgHdr(ctypes.Structure):
+    _fields_ = [
+        ("msg_name", ctypes.c_void_p),
+        ("msg_namelen", ctypes.c_uint32),
+        ("msg_iov", ctypes.POINTER(_IOVec)),
+        ("msg_iovlen", ctypes.c_size_t),
+        ("msg_control", ctypes.c_void_p),
+        ("msg_controllen", ctypes.c_size_t),
+        ("msg_flags", ctypes.c_int),
+    ]
+
+
+class _MMsgHdr(ctypes.Structure):
+    _fields_ = [("msg_hdr", _MsgHdr), ("msg_len", ctypes.c_uint)]
+
+
+_MMSG_SIZE = ctypes.sizeof(_MMsgHdr)
+_IOVEC_SIZE = ctypes.sizeof(_IOVec)
+_NAMELEN_OFFSET = _MsgHdr.msg_namelen.offset
+_MSG_LEN_OFFSET = _MMsgHdr.msg_len.offset
+_IOV_LEN_OFFSET = _IOVec.iov_len.offset
+_uint32 = struct.Struct("I")
+_size_t = struct.Struct("N")
+
+
+def _load_mmsg():
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        recvmmsg, sendmmsg = libc.recvmmsg, libc.sendmmsg
+    except (OSError, AttributeError):
+        return None
+    # Message vectors are passed by address so a send can resume partway through one
+    recvmmsg.argtypes = [
+        ctypes.c_int, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int, ctypes.c_void_p
+    ]
+    recvmmsg.restype = ctypes.c_int
+    sendmmsg.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int]
+    sendmmsg.restype = ctypes.c_int
+    return recvmmsg, sendmmsg
+
+
+_mmsg = _load_mmsg()
+MMSG_AVAILABLE: bool = _mmsg is not None
+
+
+def _decode_sockaddr(raw) -> tuple:
+    family = struct.unpack_from("=H", raw)[0]
+    port = struct.unpack_from("!H", raw, 2)[0]
+    if family == socket.AF_INET6:
+        return socket.inet_ntop(socket.AF_INET6, raw[8:24]), port
+    return socket.inet_ntop(socket.AF_INET, raw[4:8]), port
+
+
+def _encode_sockaddr(address: tuple) -> bytes:
+    ip, port = address[0], address[1]
+    if ":" in ip:
+        return (
+            struct.pack("=H", socket.AF_INET6)
+            + struct.pack("!HI", port, 0)
+            + socket.inet_pton(socket.AF_INET6, ip)
+            + struct.pack("=I", 0)
+        )
+    return (
+        struct.pack("=H", socket.AF_INET)
+        + struct.pack("!H", port)
+        + socket.inet_pton(socket.AF_INET, ip)
+        + bytes(8)
+    )
+
+
+def _use_mmsg(use_mmsg: bool) -> bool:
+    return MMSG_AVAILABLE if use_mmsg is None else use_mmsg and MMSG_AVAILABLE
+
+
+class _MessageVector:
+    """
+    batch_size mmsghdr entries, each pointing at one iovec, one payload slot of
+    slot_size bytes and one sockaddr slot.
+    """
+
+    def __init__(self, batch_size: int, slot_size: int):
+        # Anonymous pages are zeroed on first touch, so slots sized for the largest
+        # datagram only take resident memory for the bytes datagrams actually use
+        self._payload_pages = mmap.mmap(-1, slot_size * batch_size)
+        self.payloads = (ctypes.c_char * (slot_size * batch_size)).from_buffer(self._payload_pages)
+        self.names = (ctypes.c_char * (SOCKADDR_STORAGE_SIZE * batch_size))()
+        self.iovecs = (_IOVec * batch_size)()
+        self.messages = (_MMsgHdr * batch_size)()
+        self.address = ctypes.addressof(self.messages)
+
+        payloads_base = ctypes.addressof(self.payloads)
+        names_base = ctypes.addressof(self.names)
+        for i in range(batch_size):
+            self.iovecs[i].iov_base = payloads_base + i * slot_size
+            self.iovecs[i].iov_len = slot_size
+            header = self.messages[i].msg_hdr
+            header.msg_name = names_base + i * SOCKADDR_STORAGE_SIZE
+            header.msg_namelen = SOCKADDR_STORAGE_SIZE
+            header.msg_iov = ctypes.pointer(self.iovecs[i])
+            header.msg_iovlen = 1
+
+        self.payloads_view = memoryview(self.payloads).cast("B")
+        self.names_view = memoryview(self.names).cast("B")
+        self.iovecs_view = memoryview(self.iovecs).cast("B")
+        self.messages_view = memoryview(self.messages).cast("B")
+        self.pristine = bytes(self.messages_view)
+
+
+class DatagramReceiver:
+    """
+    Receives up to batch_size datagrams per call into preallocated buffers.
+
+    One receiver can serve any number of sockets as long as it is used from one
+    thread at a time; received payloads are copied out before recv() returns.
+    """
+
+    def __init__(self, batch_size: int, buffer_size: int, use_mmsg: bool = None):
+        """
+        Initializes a new instance of the DatagramReceiver class.
+
+        Args:
+            batch_size (int): Maximum datagrams returned per call.
+            buffer_size (int): Bytes kept per datagram; longer datagrams are truncated.
+            use_mmsg (bool): Force recvmmsg on or off. Defaults to MMSG_AVAILABLE.
+        """
+        self.batch_size = batch_size
+        self.buffer_size = buffer_size
+        self.use_mmsg = _use_mmsg(use_mmsg)
+        self._vector = _MessageVector(batch_size, buffer_size) if self.use_mmsg else None
+        self._received = 0
+        self._addresses: dict[bytes, tuple] = {}
+
+    def recv(self, sock: socket.socket) -> list[tuple[bytes, tuple]]:
+        """
+        Returns the (data, address) pairs waiting on sock, at most batch_size of them.
+        Returns an empty list if nothing is waiting.
+        """
+        if not self.use_mmsg:
+            return self._recv_drain(sock)
+
+        vector = self._vector
+        if self._received:
+            # The kernel rewrote msg_namelen and msg_len of the entries it filled last time
+            used = self._received * _MMSG_SIZE
+            vector.messages_view[:used] = vector.pristine[:used]
+        received = _mmsg[0](sock.fileno(), vector.address, self.batch_size, MSG_DONTWAIT, None)
+        if received < 0:
+            self._received = 0
+            err = ctypes.get_errno()
+            if err in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                return []
+            raise OSError(err, f"recvmmsg: {errno.errorcode.get(err, err)}")
+        self._received = received
+
+        messages, payloads, names = vector.messages_view, vector.payloads_view, vector.names_view
+        addresses = self._addresses
+        datagrams = []
+        for i in range(received):
+            start = i * self.buffer_size
+            length = _uint32.unpack_from(messages, i * _MMSG_SIZE + _MSG_LEN_OFFSET)[0]
+            name = names[i * SOCKADDR_STORAGE_SIZE : i * SOCKADDR_STORAGE_SIZE + SOCKADDR_IN6_SIZE].tobytes()
+            address = addresses.get(name)
+            if address is None:
+                if len(addresses) >= SOCKADDR_CACHE_SIZE:
+                    addresses.clear()
+                address = addresses[name] = _decode_sockaddr(name)
+            datagrams.append((payloads[start : start + min(length, self.buffer_size)].tobytes(), address))
+        return datagrams
+
+    def _recv_drain(self, sock: socket.socket) -> list[tuple[bytes, tuple]]:
+        datagrams = []
+        while len(datagrams) < self.batch_size:
+            try:
+                datagrams.append(sock.recvfrom(self.buffer_size))
+            except (BlockingIOError, InterruptedError):
+                break
+        return datagrams
+
+
+class DatagramSender:
+    """
+    Sends lists of datagrams with one sendmmsg call per batch_size of them.
+
+    Payloads are copied into preallocated slots of buffer_size bytes; a datagram
+    that does not fit is sent on its own with sendto. Encoded socket addresses are
+    cached, since an association talks to a handful of peers.
+    """
+
+    def __init__(self, batch_size: int, buffer_size: int, use_mmsg: bool = None):
+        """
+        Initializes a new instance of the DatagramSender class.
+
+        Args:
+            batch_size (int): Maximum datagrams per sendmmsg call.
+            buffer_size (int): Largest datagram sent through sendmmsg.
+            use_mmsg (bool): Force sendmmsg on or off. Defaults to MMSG_AVAILABLE.
+        """
+        self.batch_size = batch_size
+        self.buffer_size = buffer_size
+        self.use_mmsg = _use_mmsg(use_mmsg)
+        self._vector = _MessageVector(batch_size, buffer_size) if self.use_mmsg else None
+        self._names: dict[tuple, bytes] = {}
+        # The encoded address each slot currently holds; most batches go to one peer
+        self._slot_names: list[bytes] = [b""] * batch_size
+
+    def send(self, sock: socket.socket, datagrams: list[tuple[bytes, tuple]]) -> int:
+        """
+        Sends (data, address) pairs from sock. Datagrams the socket cannot take without
+        blocking are dropped, as UDP would.
+
+        Returns:
+            int: The number of datagrams sent.
+        """
+        if not self.use_mmsg:
+            return _send_each(sock, datagrams)
+
+        sent = 0
+        for start in range(0, len(datagrams), self.batch_size):
+            sent += self._send_batch(sock, datagrams[start : start + self.batch_size])
+        return sent
+
+    def _send_batch(self, sock: socket.socket, datagrams: list[tuple[bytes, tuple]]) -> int:
+        vector = self._vector
+        payloads, names = vector.payloads_view, vector.names_view
+        messages, iovecs = vector.messages_view, vector.iovecs_view
+        slot_names = self._slot_names
+        count = sent = 0
+        for data, address in datagrams:
+            length = len(data)
+            if length > self.buffer_size:
+                sent += _send_each(sock, [(data, address)])
+                continue
+            name = self._names.get(address)
+            if name is None:
+                if len(self._names) >= SOCKADDR_CACHE_SIZE:
+                    self._names.clear()
+                name = self._names[address] = _encode_sockaddr(address)
+
+            slot = count * self.buffer_size
+            payloads[slot : slot + length] = data
+            _size_t.pack_into(iovecs, count * _IOVEC_SIZE + _IOV_LEN_OFFSET, length)
+            if slot_names[count] is not name:
+                name_slot = count * SOCKADDR_STORAGE_SIZE
+                names[name_slot : name_slot + len(name)] = name
+                _uint32.pack_into(messages, count * _MMSG_SIZE + _NAMELEN_OFFSET, len(name))
+                slot_names[count] = name
+            count += 1
+
+        position = 0
+        while position < count:
+            result = _mmsg[1](
+                sock.fileno(), vector.address + position * _MMSG_SIZE, count - position, MSG_DONTWAIT
+            )
+            if result < 0:
+                err = ctypes.get_errno()
+                if err == errno.EINTR:
+                    continue
+                if err in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    break
+                # The datagram at the head of the batch failed; skip it like sendto would
+                position += 1
+                continue
+            position += result
+            sent += result
+        return sent
+
+
+def _send_each(sock: socket.socket, datagrams: list[tuple[bytes, tuple]]) -> int:
+    sent = 0
+    for data, address in datagrams:
+        try:
+            sock.sendto(data, address)
+        except (BlockingIOError, InterruptedError):
+            break
+        except OSError:
+            continue
+        sent += 1
+    return sent
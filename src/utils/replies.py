@@ -1,7 +1,47 @@
+"""
+SOCKS5 reply encoding.
+
+Every failure reply and method selection response is built once at import time and
+looked up afterwards. Success replies depend on the bind address, whose port is
+ephemeral, so only their header and BND.ADDR are kept in an LRU cache, keyed by the
+bind IP, and the port is packed onto them for each reply.
+"""
 import struct
+from functools import lru_cache
 
 from .addresses import map_address_to_bytes
-from ..constants import SOCKS_VERSION, ReplyCodes, AddressTypeCodes, MethodCodes
+from ..constants import (
+    SOCKS_VERSION,
+    SUCCEEDED_REPLY_CACHE_SIZE,
+    ReplyCodes,
+    AddressTypeCodes,
+    MethodCodes,
+)
+
+_reply_header = struct.Struct("!BBBB")
+_port = struct.Struct("!H")
+_method_response = struct.Struct("!BB")
+
+
+def _build_failed_reply(address_type: AddressTypeCodes, error_number: ReplyCodes) -> bytes:
+    if address_type == AddressTypeCodes.DOMAIN_NAME:
+        address_type = AddressTypeCodes.IPv4
+    header = _reply_header.pack(SOCKS_VERSION, error_number.value, 0, address_type.value)
+    if address_type == AddressTypeCodes.IPv6:
+        addr_bytes = b"\x00" * 16
+    else:
+        addr_bytes = b"\x00" * 4
+    return header + addr_bytes + _port.pack(0)
+
+
+_FAILED_REPLIES: dict[tuple[AddressTypeCodes, ReplyCodes], bytes] = {
+    (address_type, error_number): _build_failed_reply(address_type, error_number)
+    for address_type in AddressTypeCodes
+    for error_number in ReplyCodes
+}
+_METHOD_RESPONSES: dict[MethodCodes, bytes] = {
+    method: _method_response.pack(SOCKS_VERSION, method.value) for method in MethodCodes
+}
 
 
 def generate_general_socks_server_failure_reply(
@@ -61,29 +101,23 @@ def generate_unassigned_reply() -> bytes:
 def generate_failed_reply(
     address_type: AddressTypeCodes, error_number: ReplyCodes
 ) -> bytes:
-    if address_type == AddressTypeCodes.DOMAIN_NAME:
-        address_type = AddressTypeCodes.IPv4
-    header = struct.pack(
-        "!BBBB", SOCKS_VERSION, error_number.value, 0, address_type.value
+    return _FAILED_REPLIES[address_type, error_number]
+
+
+@lru_cache(maxsize=SUCCEEDED_REPLY_CACHE_SIZE)
+def _succeeded_reply_prefix(address_type: AddressTypeCodes, ip: str) -> bytes:
+    addr_bytes: bytes = map_address_to_bytes(address_type, ip)
+    header = _reply_header.pack(
+        SOCKS_VERSION, ReplyCodes.SUCCEEDED.value, 0, address_type.value
     )
-    if address_type == AddressTypeCodes.IPv6:
-        addr_bytes = b"\x00" * 16
-    else:
-        addr_bytes = b"\x00" * 4
-    port = struct.pack("!H", 0)
-    return header + addr_bytes + port
+    return header + addr_bytes
 
 
 def generate_succeeded_reply(
     address_type: AddressTypeCodes, ip: str, port: int
 ) -> bytes:
-    addr_bytes: bytes = map_address_to_bytes(address_type, ip)
-    header = struct.pack(
-        "!BBBB", SOCKS_VERSION, ReplyCodes.SUCCEEDED.value, 0, address_type.value
-    )
-    port_bytes = struct.pack("!H", port)
-    return header + addr_bytes + port_bytes
+    return _succeeded_reply_prefix(address_type, ip) + _port.pack(port)
 
 
 def generate_connection_method_response(method: MethodCodes) -> bytes:
-    return struct.pack("!BB", SOCKS_VERSION, method.value)
+    return _METHOD_RESPONSES[method]
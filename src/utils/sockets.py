@@ -1,12 +1,26 @@
+import errno
+import os
+import selectors
 import socket
+import threading
+import time
+from collections import deque
+from itertools import zip_longest
 
 from .addresses import (
     map_address_enum_to_socket_family,
     map_address_family_to_enum,
     resolve_address_info,
 )
-from ..constants import AddressTypeCodes
+from ..constants import (
+    AddressTypeCodes,
+    UPSTREAM_CONNECT_TIMEOUT,
+    HAPPY_EYEBALLS_DELAY,
+    FAMILY_PREFERENCE_TTL,
+    FAMILY_PREFERENCE_MAX_ENTRIES,
+)
 from ..models import DetailedAddress
+from ..resolver import TTLCache
 
 
 def generate_tcp_socket(address_type: AddressTypeCodes) -> socket.socket:
@@ -27,3 +41,112 @@ def generate_address_from_socket(socket: socket.socket) -> DetailedAddress:
         **resolve_address_info(address[0], address[1]),
         address_type=map_address_family_to_enum(socket.family),
     )
+
+
+_family_preferences = TTLCache(FAMILY_PREFERENCE_MAX_ENTRIES)
+_family_preferences_lock = threading.Lock()
+
+
+def address_family_of(ip: str) -> int:
+    return socket.AF_INET6 if ":" in ip else socket.AF_INET
+
+
+def remember_connect_family(host: str, family: int) -> None:
+    """
+    Records the address family that won the last connection race to host.
+    """
+    with _family_preferences_lock:
+        _family_preferences.set(host, family, FAMILY_PREFERENCE_TTL)
+
+
+def order_connect_candidates(host: str, addresses: list[str]) -> list[str]:
+    """
+    Orders addresses for a Happy Eyeballs race per RFC 8305 section 4: families are
+    interleaved, starting with the family that last won for host, or otherwise with
+    the family of the first address getaddrinfo returned.
+    """
+    if not addresses:
+        return []
+    with _family_preferences_lock:
+        preferred = _family_preferences.get(host)
+    if preferred is None:
+        preferred = address_family_of(addresses[0])
+
+    first = [ip for ip in addresses if address_family_of(ip) == preferred]
+    second = [ip for ip in addresses if address_family_of(ip) != preferred]
+    ordered = []
+    for pair in zip_longest(first, second):
+        ordered.extend(ip for ip in pair if ip is not None)
+    return ordered
+
+
+def happy_eyeballs_connect(
+    host: str,
+    addresses: list[str],
+    port: int,
+    timeout: float = UPSTREAM_CONNECT_TIMEOUT,
+    delay: float = HAPPY_EYEBALLS_DELAY,
+) -> socket.socket:
+    """
+    Connects to whichever of addresses answers first (RFC 8305).
+
+    Attempts start delay seconds apart, or immediately after the previous attempt
+    fails, and race each other until one connects or timeout expires.
+
+    Returns:
+        socket.socket: The connected socket, in blocking mode.
+    Raises:
+        OSError: The last connection error, or TimeoutError if nothing connected in time.
+    """
+    candidates = deque(order_connect_candidates(host, addresses))
+    deadline = time.monotonic() + timeout
+    next_attempt_at = time.monotonic()
+    selector = selectors.DefaultSelector()
+    attempts: dict[socket.socket, str] = {}
+    last_error: OSError = None
+
+    try:
+        while candidates or attempts:
+            now = time.monotonic()
+            if now >= deadline:
+                raise TimeoutError(f"Connection to {host} port {port} timed out")
+
+            if candidates and (not attempts or now >= next_attempt_at):
+                ip = candidates.popleft()
+                sock = socket.socket(address_family_of(ip), socket.SOCK_STREAM)
+                sock.setblocking(False)
+                err = sock.connect_ex((ip, port))
+                if err == 0:
+                    return _connected(host, sock)
+                if err not in (errno.EINPROGRESS, errno.EWOULDBLOCK):
+                    last_error = OSError(err, os.strerror(err))
+                    sock.close()
+                    continue
+                attempts[sock] = ip
+                selector.register(sock, selectors.EVENT_WRITE)
+                next_attempt_at = now + delay
+
+            wait_until = min(deadline, next_attempt_at) if candidates else deadline
+            for key, _ in selector.select(max(0.0, wait_until - time.monotonic())):
+                sock = key.fileobj
+                selector.unregister(sock)
+                attempts.pop(sock)
+                err = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                if err == 0:
+                    return _connected(host, sock)
+                last_error = OSError(err, os.strerror(err))
+                sock.close()
+                # A failed attempt starts the next one without waiting out the delay
+                next_attempt_at = time.monotonic()
+    finally:
+        for sock in attempts:
+            sock.close()
+        selector.close()
+
+    raise last_error
+
+
+def _connected(host: str, sock: socket.socket) -> socket.socket:
+    remember_connect_family(host, sock.family)
+    sock.setblocking(True)
+    return sock
@@ -0,0 +1,159 @@
+"""
+Multi-process worker mode.
+
+The supervisor forks one process per worker. Each worker binds the listen address
+itself with SO_REUSEPORT, so the kernel spreads incoming connections across
+processes and every worker has its own GIL.
+"""
+import os
+import signal
+import time
+from typing import Callable
+
+from .logger import get_logger, stop_logging
+
+logger = get_logger(__name__)
+
+
+WORKER_RESTART_DELAY: float = 1.0  # seconds, applied when a worker dies right after starting
+WORKER_MAX_FAST_FAILURES: int = 5  # workers in a row dying right after starting before the supervisor gives up
+
+_worker_index = 0
+
+
+def worker_index() -> int:
+    """
+    Returns the index, from 0 to num_workers - 1, of the worker this process runs as.
+    A restarted worker takes over the index of the one it replaces. 0 outside worker mode.
+    """
+    return _worker_index
+
+
+class WorkerSupervisor:
+    """
+    Forks and supervises worker processes.
+
+    Crashed workers are restarted. SIGINT and SIGTERM received by the supervisor are
+    forwarded to every worker, and the supervisor returns once all of them have exited.
+
+    A worker that dies within WORKER_RESTART_DELAY of starting most likely cannot start
+    at all, e.g. because the listen address cannot be bound. After
+    WORKER_MAX_FAST_FAILURES of those in a row the supervisor stops the other workers
+    instead of restarting, and sets exit_code to 1.
+    """
+
+    def __init__(self, num_workers: int, target: Callable[[], None]):
+        """
+        Initializes a new instance of the WorkerSupervisor class.
+
+        Args:
+            num_workers (int): Number of worker processes to keep running.
+            target (Callable[[], None]): Function run by each worker; it should serve until interrupted.
+        """
+        if num_workers < 1:
+            raise ValueError("num_workers must be at least 1")
+        self.num_workers = num_workers
+        self.target = target
+        self.workers: dict[int, float] = {}  # pid -> start time
+        self._indexes: dict[int, int] = {}  # pid -> worker index
+        self.stopping = False
+        self.fast_failures = 0  # consecutive workers that died right after starting
+        self.exit_code = 0
+
+    def run(self) -> None:
+        """
+        Starts the workers and blocks until they have all exited after a shutdown signal,
+        or after the supervisor gave up on workers that fail to start.
+        """
+        previous_handlers = {
+            signum: signal.signal(signum, self._handle_signal)
+            for signum in (signal.SIGINT, signal.SIGTERM)
+        }
+        try:
+            for index in range(self.num_workers):
+                self._spawn(index)
+            logger.info(f"Supervisor started {self.num_workers} workers")
+            self._supervise()
+        finally:
+            for signum, handler in previous_handlers.items():
+                signal.signal(signum, handler)
+
+    def stop(self, signum: int = signal.SIGTERM) -> None:
+        """
+        Stops restarting workers and forwards signum to every running worker.
+        """
+        self.stopping = True
+        for pid in list(self.workers):
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass
+
+    def _handle_signal(self, signum, frame) -> None:
+        logger.info(f"Supervisor received signal {signum}, stopping workers...")
+        self.stop(signum)
+
+    def _supervise(self) -> None:
+        while self.workers:
+            try:
+                pid, status = os.waitpid(-1, 0)
+            except ChildProcessError:
+                break
+            started = self.workers.pop(pid, None)
+            index = self._indexes.pop(pid, 0)
+            if started is None:
+                continue
+
+            exit_code = os.waitstatus_to_exitcode(status)
+            if self.stopping:
+                logger.info(f"Worker {pid} exited ({exit_code})")
+                continue
+
+            failed_fast = time.monotonic() - started < WORKER_RESTART_DELAY
+            self.fast_failures = self.fast_failures + 1 if failed_fast else 0
+            if self.fast_failures >= WORKER_MAX_FAST_FAILURES:
+                logger.error(
+                    f"Worker {pid} exited unexpectedly ({exit_code}), the last {self.fast_failures} "
+                    f"workers exited right after starting, stopping"
+                )
+                self.exit_code = 1
+                self.stop()
+                continue
+
+            logger.error(f"Worker {pid} exited unexpectedly ({exit_code}), restarting")
+            if failed_fast:
+                time.sleep(WORKER_RESTART_DELAY)
+            if not self.stopping:
+                self._spawn(index)
+
+    def _spawn(self, index: int) -> int:
+        pid = os.fork()
+        if pid == 0:
+            self._run_worker(index)
+        self.workers[pid] = time.monotonic()
+        self._indexes[pid] = index
+        return pid
+
+    def _run_worker(self, index: int = 0) -> None:
+        """
+        Runs target in the forked child and never returns. SIGTERM is turned into
+        KeyboardInterrupt so workers shut down through the same path as SIGINT.
+        """
+        global _worker_index
+        _worker_index = index
+        exit_code = 0
+        try:
+            signal.signal(signal.SIGINT, signal.default_int_handler)
+            signal.signal(signal.SIGTERM, signal.default_int_handler)
+            self.target()
+        except KeyboardInterrupt:
+            pass
+        except SystemExit as e:
+            exit_code = e.code if isinstance(e.code, int) else 1
+        except BaseException:
+            logger.exception("Worker crashed")
+            exit_code = 1
+        finally:
+            # os._exit skips atexit, so write out queued log records first
+            stop_logging()
+            os._exit(exit_code)
@@ -0,0 +1,187 @@
+import asyncio
+import socket
+import struct
+import unittest
+from unittest.mock import patch
+
+from src.async_server import AsyncTCPServer
+from src.resolver import get_resolver
+
+
+async def start_echo_server():
+    async def echo(reader, writer):
+        while data := await reader.read(4096):
+            writer.write(data)
+            await writer.drain()
+        writer.close()
+
+    server = await asyncio.start_server(echo, "127.0.0.1", 0)
+    return server, server.sockets[0].getsockname()[1]
+
+
+class TestAsyncTCPServer(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.server = AsyncTCPServer(("127.0.0.1", 0))
+        await self.server.start()
+        self.serve_task = asyncio.ensure_future(self.server.serve_forever())
+
+    async def asyncTearDown(self):
+        self.serve_task.cancel()
+        await asyncio.gather(self.serve_task, return_exceptions=True)
+        await self.server.close()
+
+    async def _open_client(self):
+        return await asyncio.open_connection(*self.server.server_address)
+
+    async def _negotiate_no_auth(self, reader, writer):
+        writer.write(b"\x05\x01\x00")
+        await writer.drain()
+        self.assertEqual(await reader.readexactly(2), b"\x05\x00")
+
+    async def test_connect_relays_data(self):
+        echo_server, echo_port = await start_echo_server()
+        self.addAsyncCleanup(echo_server.wait_closed)
+        self.addCleanup(echo_server.close)
+
+        reader, writer = await self._open_client()
+        await self._negotiate_no_auth(reader, writer)
+        writer.write(
+            b"\x05\x01\x00\x01" + socket.inet_aton("127.0.0.1") + struct.pack("!H", echo_port)
+        )
+        await writer.drain()
+
+        reply = await reader.readexactly(10)
+        self.assertEqual(reply[:4], b"\x05\x00\x00\x01")
+
+        writer.write(b"hello through asyncio")
+        await writer.drain()
+        self.assertEqual(await reader.readexactly(21), b"hello through asyncio")
+
+        writer.close()
+        await writer.wait_closed()
+
+    @patch("src.resolver.socket.getaddrinfo")
+    async def test_connect_fails_over_between_resolved_addresses(self, mock_getaddrinfo):
+        echo_server, echo_port = await start_echo_server()
+        self.addAsyncCleanup(echo_server.wait_closed)
+        self.addCleanup(echo_server.close)
+        get_resolver().clear()
+        self.addCleanup(get_resolver().clear)
+        # Nothing listens on 127.0.0.2, so the race falls through to 127.0.0.1
+        mock_getaddrinfo.return_value = [
+            (socket.AF_INET, socket.SOCK_STREAM, 0, "", ("127.0.0.2", 0)),
+            (socket.AF_INET, socket.SOCK_STREAM, 0, "", ("127.0.0.1", 0)),
+        ]
+
+        reader, writer = await self._open_client()
+        await self._negotiate_no_auth(reader, writer)
+        name = b"failover.example.com"
+        writer.write(b"\x05\x01\x00\x03" + bytes([len(name)]) + name + struct.pack("!H", echo_port))
+        await writer.drain()
+
+        reply = await reader.readexactly(10)
+        self.assertEqual(reply[:4], b"\x05\x00\x00\x01")
+        writer.write(b"ping")
+        await writer.drain()
+        self.assertEqual(await reader.readexactly(4), b"ping")
+
+        writer.close()
+        await writer.wait_closed()
+
+    async def test_connect_refused_sends_refused_reply(self):
+        with socket.socket() as probe:
+            probe.bind(("127.0.0.1", 0))
+            closed_port = probe.getsockname()[1]
+
+        reader, writer = await self._open_client()
+        await self._negotiate_no_auth(reader, writer)
+        writer.write(
+            b"\x05\x01\x00\x01" + socket.inet_aton("127.0.0.1") + struct.pack("!H", closed_port)
+        )
+        await writer.drain()
+
+        reply = await reader.readexactly(10)
+        self.assertEqual(reply, b"\x05\x05\x00\x01\x00\x00\x00\x00\x00\x00")
+        writer.close()
+
+    async def test_bind_command_not_supported(self):
+        reader, writer = await self._open_client()
+        await self._negotiate_no_auth(reader, writer)
+        writer.write(b"\x05\x02\x00\x01" + socket.inet_aton("127.0.0.1") + struct.pack("!H", 80))
+        await writer.drain()
+
+        reply = await reader.readexactly(10)
+        self.assertEqual(reply[1], 0x07)
+        writer.close()
+
+    async def test_username_password_auth(self):
+        reader, writer = await self._open_client()
+        writer.write(b"\x05\x01\x02")
+        await writer.drain()
+        self.assertEqual(await reader.readexactly(2), b"\x05\x02")
+
+        writer.write(b"\x01\x0amyusername\x0amypassword")
+        await writer.drain()
+        self.assertEqual(await reader.readexactly(2), b"\x01\x00")
+        writer.close()
+
+    @patch("src.handlers.tcp.auth_required", return_value=True)
+    async def test_no_acceptable_methods_closes_connection(self, _mock):
+        reader, writer = await self._open_client()
+        writer.write(b"\x05\x01\x00")
+        await writer.drain()
+        self.assertEqual(await reader.readexactly(2), b"\x05\xff")
+        self.assertEqual(await reader.read(), b"")
+        writer.close()
+
+    async def test_invalid_version_closes_connection(self):
+        reader, writer = await self._open_client()
+        writer.write(b"\x04\x01\x00")
+        await writer.drain()
+        self.assertEqual(await reader.read(), b"")
+        writer.close()
+
+    async def test_udp_associate_relays_datagrams(self):
+        loop = asyncio.get_running_loop()
+        echo = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        echo.bind(("127.0.0.1", 0))
+        echo.setblocking(False)
+        self.addCleanup(echo.close)
+
+        def on_echo():
+            data, addr = echo.recvfrom(4096)
+            echo.sendto(data, addr)
+
+        loop.add_reader(echo.fileno(), on_echo)
+        self.addCleanup(loop.remove_reader, echo.fileno())
+        echo_port = echo.getsockname()[1]
+
+        reader, writer = await self._open_client()
+        await self._negotiate_no_auth(reader, writer)
+        writer.write(b"\x05\x03\x00\x01" + socket.inet_aton("0.0.0.0") + struct.pack("!H", 0))
+        await writer.drain()
+        reply = await reader.readexactly(10)
+        self.assertEqual(reply[:4], b"\x05\x00\x00\x01")
+        relay_port = struct.unpack("!H", reply[8:10])[0]
+
+        client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        client.setblocking(False)
+        self.addCleanup(client.close)
+        header = b"\x00\x00\x00\x01" + socket.inet_aton("127.0.0.1") + struct.pack("!H", echo_port)
+        client.sendto(header + b"ping", ("127.0.0.1", relay_port))
+
+        response = await asyncio.wait_for(loop.sock_recv(client, 4096), 5)
+        self.assertEqual(response, header + b"ping")
+
+        writer.close()
+        await writer.wait_closed()
+
+    async def test_connection_limit_rejects_excess_clients(self):
+        self.server.max_connections = 0
+        reader, writer = await self._open_client()
+        self.assertEqual(await reader.read(), b"")
+        writer.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,210 @@
+import os
+import socket
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from src.credentials import (
+    Authenticator,
+    CredentialFile,
+    StaticCredentials,
+    VerificationCache,
+    hash_password,
+    verify_password,
+)
+from src.metrics import AUTH_SECONDS
+
+from . import test_relay_timeouts
+from .test_pool import FakeClock
+
+
+def auth_count(result: str) -> int:
+    counts, _ = AUTH_SECONDS.labels(result).snapshot()
+    return sum(counts)
+
+
+class TestPasswordHashes(unittest.TestCase):
+    def test_each_scheme_verifies_its_password_only(self):
+        for scheme in ("scrypt", "pbkdf2_sha256"):
+            with self.subTest(scheme=scheme):
+                encoded = hash_password("secret", scheme)
+                self.assertTrue(encoded.startswith(scheme + "$"))
+                self.assertTrue(verify_password("secret", encoded))
+                self.assertFalse(verify_password("Secret", encoded))
+
+    def test_hashes_are_salted(self):
+        self.assertNotEqual(hash_password("secret"), hash_password("secret"))
+
+    def test_malformed_hashes_are_rejected(self):
+        for encoded in ("md5$abc", "scrypt$1$2", "pbkdf2_sha256$many$c2FsdA==$aGFzaA=="):
+            with self.subTest(encoded=encoded), self.assertRaises(ValueError):
+                verify_password("secret", encoded)
+        with self.assertRaises(ValueError):
+            hash_password("secret", "md5")
+
+
+class TestStaticCredentials(unittest.TestCase):
+    def test_only_the_configured_pair_is_accepted(self):
+        credentials = StaticCredentials("alice", "secret")
+        self.assertTrue(credentials.verify("alice", "secret"))
+        self.assertFalse(credentials.verify("alice", "wrong"))
+        self.assertFalse(credentials.verify("bob", "secret"))
+        self.assertFalse(credentials.verify("", ""))
+
+
+class TestCredentialFile(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "users.txt")
+        self.alice = f"alice:{hash_password('secret')}\n"
+        self.bob = f"bob:{hash_password('hunter2', 'pbkdf2_sha256')}\n"
+
+    def write(self, *lines: str) -> None:
+        with open(self.path, "w") as file:
+            file.writelines(lines)
+
+    def test_users_are_verified_against_their_hashes(self):
+        self.write("# users\n", "\n", self.alice, self.bob)
+        credentials = CredentialFile(self.path)
+        self.assertTrue(credentials.verify("alice", "secret"))
+        self.assertTrue(credentials.verify("bob", "hunter2"))
+        self.assertFalse(credentials.verify("alice", "hunter2"))
+        self.assertFalse(credentials.verify("carol", "secret"))
+
+    def test_malformed_lines_are_skipped(self):
+        self.write("not a user line\n", "mallory:plaintext\n", self.alice)
+        with self.assertLogs("src.credentials", level="ERROR") as logs:
+            credentials = CredentialFile(self.path)
+        self.assertEqual(len(logs.output), 2)
+        self.assertTrue(credentials.verify("alice", "secret"))
+        self.assertFalse(credentials.verify("mallory", "plaintext"))
+
+    def test_changes_are_picked_up_once_the_check_interval_passed(self):
+        self.write(self.alice)
+        clock = FakeClock()
+        with patch("src.credentials.time.monotonic", clock):
+            credentials = CredentialFile(self.path, check_interval=1.0)
+            self.write(self.alice, self.bob)
+            self.assertFalse(credentials.verify("bob", "hunter2"))
+            clock.now = 1.0
+            self.assertTrue(credentials.verify("bob", "hunter2"))
+        self.assertEqual(credentials.generation, 2)
+
+    def test_a_missing_file_keeps_the_users_loaded_before(self):
+        self.write(self.alice)
+        credentials = CredentialFile(self.path, check_interval=0.0)
+        os.remove(self.path)
+        with self.assertLogs("src.credentials", level="ERROR"):
+            self.assertTrue(credentials.verify("alice", "secret"))
+
+
+class TestVerificationCache(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = patch("src.credentials.time.monotonic", self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_entries_match_the_verified_password_until_they_expire(self):
+        cache = VerificationCache(ttl=10.0)
+        cache.put("alice", "secret", 0)
+        self.assertTrue(cache.get("alice", "secret", 0))
+        self.assertFalse(cache.get("alice", "wrong", 0))
+        self.clock.now = 10.0
+        self.assertFalse(cache.get("alice", "secret", 0))
+
+    def test_entries_from_other_credentials_generations_are_dropped(self):
+        cache = VerificationCache(ttl=10.0)
+        cache.put("alice", "secret", 1)
+        self.assertFalse(cache.get("alice", "secret", 2))
+        self.assertFalse(cache.get("alice", "secret", 1))
+
+    def test_least_recently_used_entries_are_evicted(self):
+        cache = VerificationCache(max_entries=2, ttl=10.0)
+        cache.put("alice", "a", 0)
+        cache.put("bob", "b", 0)
+        cache.get("alice", "a", 0)
+        cache.put("carol", "c", 0)
+        self.assertTrue(cache.get("alice", "a", 0))
+        self.assertFalse(cache.get("bob", "b", 0))
+        self.assertTrue(cache.get("carol", "c", 0))
+
+    def test_a_zero_ttl_disables_caching(self):
+        cache = VerificationCache(ttl=0.0)
+        cache.put("alice", "secret", 0)
+        self.assertFalse(cache.get("alice", "secret", 0))
+
+
+class TestAuthenticator(unittest.TestCase):
+    def test_each_check_is_timed_by_result(self):
+        authenticator = Authenticator(StaticCredentials("alice", "secret"), VerificationCache(ttl=60.0))
+        before = {result: auth_count(result) for result in ("cached", "verified", "rejected")}
+        self.assertTrue(authenticator.verify("alice", "secret"))
+        self.assertTrue(authenticator.cached("alice", "secret"))
+        self.assertTrue(authenticator.verify("alice", "secret"))
+        self.assertFalse(authenticator.verify("alice", "wrong"))
+        self.assertFalse(authenticator.cached("bob", "secret"))
+        self.assertEqual(auth_count("verified"), before["verified"] + 1)
+        self.assertEqual(auth_count("cached"), before["cached"] + 2)
+        self.assertEqual(auth_count("rejected"), before["rejected"] + 1)
+
+    def test_a_changed_credential_file_invalidates_cached_checks(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, "users.txt")
+        with open(path, "w") as file:
+            file.write(f"alice:{hash_password('secret')}\n")
+        authenticator = Authenticator(CredentialFile(path, check_interval=0.0), VerificationCache(ttl=60.0))
+        self.assertTrue(authenticator.verify("alice", "secret"))
+
+        with open(path, "w") as file:
+            file.write(f"alice:{hash_password('changed')}\n# password rotated\n")
+        self.assertFalse(authenticator.verify("alice", "secret"))
+        self.assertTrue(authenticator.verify("alice", "changed"))
+
+
+class CredentialFileAuthMixin:
+    """Authenticates against a credential file through one serving engine."""
+
+    def start_proxy(self) -> tuple[str, int]:
+        raise NotImplementedError
+
+    def setUp(self):
+        self.proxy_address = self.start_proxy()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, "users.txt")
+        with open(path, "w") as file:
+            file.write(f"alice:{hash_password('secret')}\n")
+        authenticator = Authenticator(CredentialFile(path), VerificationCache(ttl=60.0))
+        patcher = patch("src.credentials._authenticator", authenticator)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def authenticate(self, username: str, password: str) -> bytes:
+        client = socket.create_connection(self.proxy_address)
+        self.addCleanup(client.close)
+        client.settimeout(5)
+        client.sendall(b"\x05\x01\x02")
+        self.assertEqual(client.recv(2), b"\x05\x02")
+        client.sendall(bytes([1, len(username)]) + username.encode() + bytes([len(password)]) + password.encode())
+        return client.recv(2)
+
+    def test_users_in_the_credential_file_are_authenticated(self):
+        self.assertEqual(self.authenticate("alice", "secret"), b"\x01\x00")
+        self.assertEqual(self.authenticate("alice", "secret"), b"\x01\x00")
+        self.assertEqual(self.authenticate("alice", "wrong"), b"\x01\x01")
+        self.assertEqual(self.authenticate("myusername", "mypassword"), b"\x01\x01")
+
+
+class TestThreadedCredentialFileAuth(CredentialFileAuthMixin, unittest.TestCase):
+    start_proxy = test_relay_timeouts.TestThreadedRelayTimeouts.start_proxy
+
+
+class TestAsyncCredentialFileAuth(CredentialFileAuthMixin, unittest.TestCase):
+    start_proxy = test_relay_timeouts.TestAsyncRelayTimeouts.start_proxy
+
+
+if __name__ == "__main__":
+    unittest.main()
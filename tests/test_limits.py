@@ -0,0 +1,172 @@
+import socket
+import struct
+import time
+import unittest
+from unittest.mock import patch
+
+from src.constants import USERNAME, PASSWORD, UDP_BUFFER_SIZE
+from src.exceptions import UserLimitExceededError
+from src.limits import TokenBucket, UserLimiter, paced_read_size
+from src.metrics import HANDSHAKE_FAILURES, UDP_DROPPED
+from src.relays.udp_relay import UDPRelay
+
+from . import test_relay_timeouts
+from .test_pool import FakeClock
+from .test_relay_timeouts import HalfCloseServer
+
+
+class TestTokenBucket(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.bucket = TokenBucket(rate=100, burst=200, clock=self.clock)
+
+    def test_burst_is_available_at_once(self):
+        self.assertEqual(self.bucket.consume(200), 0.0)
+
+    def test_debt_is_repaid_at_the_rate(self):
+        self.assertEqual(self.bucket.consume(250), 0.5)
+        self.clock.now = 0.5
+        self.assertEqual(self.bucket.consume(0), 0.0)
+
+    def test_refill_is_capped_at_the_burst(self):
+        self.bucket.consume(200)
+        self.clock.now = 10.0
+        self.assertFalse(self.bucket.try_consume(201))
+        self.assertTrue(self.bucket.try_consume(200))
+
+    def test_try_consume_takes_nothing_when_short(self):
+        self.bucket.consume(150)
+        self.assertFalse(self.bucket.try_consume(60))
+        self.assertTrue(self.bucket.try_consume(50))
+
+
+class TestUserLimiter(unittest.TestCase):
+    def test_anonymous_and_unlimited_sessions_are_not_tracked(self):
+        self.assertIsNone(UserLimiter(max_sessions=1).acquire(None))
+        self.assertIsNone(UserLimiter().acquire("alice"))
+
+    def test_sessions_are_capped_per_user(self):
+        limiter = UserLimiter(max_sessions=2)
+        first = limiter.acquire("alice")
+        limiter.acquire("alice")
+        limiter.acquire("bob")
+        with self.assertRaises(UserLimitExceededError) as raised:
+            limiter.acquire("alice")
+        self.assertEqual(raised.exception.reason, "session_limit")
+        first.release()
+        first.release()
+        limiter.acquire("alice")
+        with self.assertRaises(UserLimitExceededError):
+            limiter.acquire("alice")
+
+    def test_new_sessions_are_rate_limited_per_user(self):
+        clock = FakeClock()
+        limiter = UserLimiter(connection_rate=2, clock=clock)
+        limiter.acquire("alice")
+        limiter.acquire("alice")
+        with self.assertRaises(UserLimitExceededError) as raised:
+            limiter.acquire("alice")
+        self.assertEqual(raised.exception.reason, "connection_rate")
+        limiter.acquire("bob")
+        clock.now = 0.5
+        limiter.acquire("alice")
+
+    def test_sessions_of_a_user_share_their_buckets(self):
+        limiter = UserLimiter(bandwidth=1000)
+        first, second = limiter.acquire("alice"), limiter.acquire("alice")
+        other = limiter.acquire("bob")
+        self.assertIs(first.upstream, second.upstream)
+        self.assertIsNot(first.upstream, first.downstream)
+        self.assertIsNot(first.upstream, other.upstream)
+        # Bursts always fit the largest UDP datagram
+        self.assertEqual(first.upstream.burst, UDP_BUFFER_SIZE)
+
+    def test_limited_sessions_read_an_eighth_of_a_second_at_a_time(self):
+        session = UserLimiter(bandwidth=65536).acquire("alice")
+        self.assertEqual(paced_read_size(session, 4096, 262144), 8192)
+        self.assertEqual(paced_read_size(session, 16384, 262144), 16384)
+        self.assertEqual(paced_read_size(None, 4096, 262144), 262144)
+
+    def test_udp_datagrams_beyond_the_bucket_are_dropped(self):
+        bucket = TokenBucket(rate=1, burst=100)
+        before = UDP_DROPPED.labels("rate_limited").get()
+        self.assertTrue(UDPRelay._within_limit(bucket, 100))
+        self.assertFalse(UDPRelay._within_limit(bucket, 100))
+        self.assertTrue(UDPRelay._within_limit(None, 100))
+        self.assertEqual(UDP_DROPPED.labels("rate_limited").get(), before + 1)
+
+
+class UserLimitsMixin:
+    """Drives one serving engine through authenticated CONNECTs with per-user limits."""
+
+    def start_proxy(self) -> tuple[str, int]:
+        raise NotImplementedError
+
+    def setUp(self):
+        self.proxy_address = self.start_proxy()
+        self.upstream = HalfCloseServer()
+        self.addCleanup(self.upstream.close)
+
+    def limit(self, **limits) -> None:
+        patcher = patch("src.limits._limiter", UserLimiter(**limits))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def request_tunnel(self) -> tuple[socket.socket, int]:
+        client = socket.create_connection(self.proxy_address)
+        self.addCleanup(client.close)
+        client.settimeout(5)
+        client.sendall(b"\x05\x01\x02")
+        self.assertEqual(client.recv(2), b"\x05\x02")
+        client.sendall(
+            bytes([1, len(USERNAME)]) + USERNAME.encode() + bytes([len(PASSWORD)]) + PASSWORD.encode()
+        )
+        self.assertEqual(client.recv(2), b"\x01\x00")
+        client.sendall(b"\x05\x01\x00\x01" + socket.inet_aton("127.0.0.1") + struct.pack("!H", self.upstream.port))
+        return client, client.recv(10)[1]
+
+    def test_sessions_beyond_the_cap_are_not_allowed(self):
+        self.limit(max_sessions=1)
+        before = HANDSHAKE_FAILURES.labels("session_limit").get()
+        first, reply = self.request_tunnel()
+        self.assertEqual(reply, 0x00)
+        _, reply = self.request_tunnel()
+        self.assertEqual(reply, 0x02)
+        self.assertEqual(HANDSHAKE_FAILURES.labels("session_limit").get(), before + 1)
+
+        first.close()
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline:
+            _, reply = self.request_tunnel()
+            if reply == 0x00:
+                break
+            time.sleep(0.05)
+        self.assertEqual(reply, 0x00)
+
+    def test_relayed_bytes_are_held_to_the_user_bandwidth(self):
+        self.limit(bandwidth=UDP_BUFFER_SIZE)
+        client, reply = self.request_tunnel()
+        self.assertEqual(reply, 0x00)
+        payload = b"\x42" * (UDP_BUFFER_SIZE + UDP_BUFFER_SIZE // 2)
+
+        started = time.monotonic()
+        client.sendall(payload)
+        received = 0
+        while received < len(payload):
+            chunk = client.recv(len(payload) - received)
+            self.assertTrue(chunk)
+            received += len(chunk)
+        # One burst is free, the remaining half a second of bytes waits for the bucket
+        self.assertGreaterEqual(time.monotonic() - started, 0.35)
+
+
+class TestThreadedUserLimits(UserLimitsMixin, unittest.TestCase):
+    start_proxy = test_relay_timeouts.TestThreadedRelayTimeouts.start_proxy
+
+
+class TestAsyncUserLimits(UserLimitsMixin, unittest.TestCase):
+    start_proxy = test_relay_timeouts.TestAsyncRelayTimeouts.start_proxy
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,10 +1,16 @@
+import io
 import logging
+import queue
+import sys
 import threading
 import unittest
+from logging.handlers import QueueListener
 from unittest.mock import patch
 
+from src import logger as logger_module
 from src.config import ProxyConfiguration
-from src.logger import get_logger, configure_logger, _logger_lock
+from src.logger import DroppingQueueHandler, get_logger, configure_logger, _logger_lock
+from src.metrics import LOG_RECORDS_DROPPED
 
 
 class TestLoggerThreadSafety(unittest.TestCase):
@@ -58,5 +64,74 @@ class TestLoggerThreadSafety(unittest.TestCase):
             self.assertEqual(count_after_first, count_after_second)
 
 
+def make_record(message: str, level: int = logging.INFO) -> logging.LogRecord:
+    return logging.LogRecord("test_pipeline", level, __file__, 1, message, None, None)
+
+
+class TestLoggingPipeline(unittest.TestCase):
+    def test_loggers_share_one_queue_handler(self):
+        class FreshConfig(ProxyConfiguration):
+            pass
+
+        FreshConfig.initialize("localhost", 1080, "debug")
+
+        with patch("src.logger.ProxyConfiguration", FreshConfig):
+            first = logging.getLogger("test_shared_first")
+            second = logging.getLogger("test_shared_second")
+            configure_logger(first)
+            configure_logger(second)
+        self.assertEqual(first.handlers, [logger_module._queue_handler])
+        self.assertEqual(second.handlers, first.handlers)
+
+    def test_queued_records_hold_their_message_but_no_args_or_traceback(self):
+        handler = DroppingQueueHandler(queue.SimpleQueue())
+        pending = ["first"]
+        try:
+            raise ValueError("boom")
+        except ValueError:
+            record = logging.LogRecord(
+                "test_pipeline", logging.ERROR, __file__, 1, "pending %s", (pending,), sys.exc_info()
+            )
+        handler.handle(record)
+        pending.append("logged later")
+
+        queued = handler.queue.get_nowait()
+        self.assertIsNone(queued.args)
+        self.assertIsNone(queued.exc_info)
+        self.assertTrue(queued.msg.startswith("pending ['first']\nTraceback"))
+        self.assertIn("ValueError: boom", queued.msg)
+
+    def test_records_beyond_capacity_are_dropped_and_counted(self):
+        handler = DroppingQueueHandler(queue.SimpleQueue(), capacity=2)
+        before = LOG_RECORDS_DROPPED.get()
+        for i in range(5):
+            handler.handle(make_record(f"record {i}"))
+        self.assertEqual(handler.queue.qsize(), 2)
+        self.assertEqual(handler.dropped, 3)
+        self.assertEqual(LOG_RECORDS_DROPPED.get(), before + 3)
+
+    def test_writer_thread_formats_and_writes_records(self):
+        stream = io.StringIO()
+        console = logging.StreamHandler(stream)
+        console.setFormatter(logging.Formatter("%(levelname)s %(message)s"))
+        handler = DroppingQueueHandler(queue.SimpleQueue())
+        listener = QueueListener(handler.queue, console, respect_handler_level=True)
+        listener.start()
+        handler.handle(make_record("relayed"))
+        handler.handle(make_record("failed", logging.ERROR))
+        listener.stop()
+        self.assertEqual(stream.getvalue(), "INFO relayed\nERROR failed\n")
+
+    def test_stop_logging_writes_out_queued_records(self):
+        stream = io.StringIO()
+        console = logger_module._console_handler
+        with patch.multiple(console, stream=stream, level=logging.DEBUG):
+            logger_module.start_logging()
+            logger_module._queue_handler.handle(make_record("queued before stop"))
+            logger_module.stop_logging()
+            self.assertIn("queued before stop", stream.getvalue())
+        logger_module.start_logging()
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,157 @@
+import socket
+import threading
+import unittest
+import urllib.error
+import urllib.request
+
+from src import metrics
+from src.constants import AddressTypeCodes
+from src.metrics import Counter, Gauge, Histogram, Registry
+from src.models import DetailedAddress
+from src.server import ThreadingTCPServer, TCPProxyServer
+from src.relays import TCPRelay
+
+from .test_pool import wait_for
+from .test_tcp_relay import tcp_socket_pair
+
+
+class TestMetricTypes(unittest.TestCase):
+    def setUp(self):
+        self.registry = Registry()
+
+    def test_counter_exposition(self):
+        counter = Counter("requests_total", "Requests served.", registry=self.registry)
+        counter.inc()
+        counter.inc(2.5)
+        self.assertEqual(
+            self.registry.render(),
+            "# HELP requests_total Requests served.\n"
+            "# TYPE requests_total counter\n"
+            "requests_total 3.5\n",
+        )
+
+    def test_labelled_children_are_rendered_sorted(self):
+        counter = Counter("drops_total", "Drops.", ("reason",), registry=self.registry)
+        counter.labels("b").inc()
+        counter.labels("a").inc(2)
+        self.assertIs(counter.labels("a"), counter.labels("a"))
+        self.assertIn('drops_total{reason="a"} 2\ndrops_total{reason="b"} 1\n', self.registry.render())
+
+    def test_label_values_are_escaped(self):
+        counter = Counter("drops_total", "Drops.", ("reason",), registry=self.registry)
+        counter.labels('say "hi"\\\n').inc()
+        self.assertIn('drops_total{reason="say \\"hi\\"\\\\\\n"} 1', self.registry.render())
+
+    def test_wrong_label_count_raises(self):
+        counter = Counter("drops_total", "Drops.", ("reason",), registry=self.registry)
+        with self.assertRaises(ValueError):
+            counter.labels("a", "b")
+
+    def test_gauge_goes_up_and_down(self):
+        gauge = Gauge("active", "Active.", registry=self.registry)
+        gauge.inc()
+        gauge.inc()
+        gauge.dec()
+        self.assertEqual(gauge.get(), 1)
+        gauge.set(7)
+        self.assertIn("active 7\n", self.registry.render())
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = Histogram("latency_seconds", "Latency.", buckets=(0.1, 1.0), registry=self.registry)
+        for value in (0.05, 0.1, 0.5, 3.0):
+            histogram.observe(value)
+        rendered = self.registry.render()
+        self.assertIn('latency_seconds_bucket{le="0.1"} 2\n', rendered)
+        self.assertIn('latency_seconds_bucket{le="1"} 3\n', rendered)
+        self.assertIn('latency_seconds_bucket{le="+Inf"} 4\n', rendered)
+        self.assertIn("latency_seconds_sum 3.65\n", rendered)
+        self.assertIn("latency_seconds_count 4\n", rendered)
+
+    def test_concurrent_increments_are_not_lost(self):
+        counter = Counter("hits_total", "Hits.", registry=self.registry)
+
+        def work():
+            for _ in range(10000):
+                counter.inc()
+
+        threads = [threading.Thread(target=work) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(counter.get(), 40000)
+
+
+class TestMetricsEndpoint(unittest.TestCase):
+    def setUp(self):
+        self.server = metrics.serve_metrics("127.0.0.1", 0)
+        self.addCleanup(metrics.stop_metrics)
+        self.base_url = f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def test_serves_registry(self):
+        with urllib.request.urlopen(f"{self.base_url}/metrics", timeout=2) as response:
+            self.assertEqual(response.headers["Content-Type"], metrics.CONTENT_TYPE)
+            body = response.read().decode()
+        self.assertIn("# TYPE socks5_active_connections gauge", body)
+        self.assertIn("# TYPE socks5_upstream_connect_seconds histogram", body)
+
+    def test_other_paths_are_not_found(self):
+        with self.assertRaises(urllib.error.HTTPError) as cm:
+            urllib.request.urlopen(f"{self.base_url}/", timeout=2)
+        self.assertEqual(cm.exception.code, 404)
+
+
+class TestProxyMetrics(unittest.TestCase):
+    def test_threaded_server_counts_connections_and_handshake_failures(self):
+        server = ThreadingTCPServer(("127.0.0.1", 0), TCPProxyServer)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+        accepted = metrics.CONNECTIONS_ACCEPTED.get()
+        failures = metrics.HANDSHAKE_FAILURES.labels("no_acceptable_methods")
+        failed = failures.get()
+        with socket.create_connection(server.server_address) as client:
+            client.sendall(b"\x05\x01\x03")  # only an unassigned method
+            self.assertEqual(client.recv(2), b"\x05\xff")
+            wait_for(lambda: failures.get() == failed + 1)
+        self.assertEqual(metrics.CONNECTIONS_ACCEPTED.get(), accepted + 1)
+        wait_for(lambda: metrics.ACTIVE_CONNECTIONS.get() == 0)
+
+    def test_tcp_relay_counts_bytes_and_connect_latency(self):
+        upstream = metrics.RELAYED_BYTES.labels("tcp", "upstream")
+        downstream = metrics.RELAYED_BYTES.labels("tcp", "downstream")
+        sent, received = upstream.get(), downstream.get()
+        connects = sum(metrics.UPSTREAM_CONNECT_SECONDS._default.snapshot()[0])
+
+        listener = socket.socket()
+        listener.bind(("127.0.0.1", 0))
+        listener.listen(1)
+        self.addCleanup(listener.close)
+        client_app, client_conn = tcp_socket_pair()
+        self.addCleanup(client_app.close)
+        self.addCleanup(client_conn.close)
+
+        dst = DetailedAddress(
+            name="sink", ip="127.0.0.1", port=listener.getsockname()[1],
+            address_type=AddressTypeCodes.IPv4,
+        )
+        relay = TCPRelay(client_conn, dst, relay_mode="copy")
+        remote, _ = listener.accept()
+        self.addCleanup(remote.close)
+        worker = threading.Thread(target=relay.listen_and_relay)
+        worker.start()
+
+        client_app.sendall(b"x" * 1000)
+        wait_for(lambda: upstream.get() - sent == 1000)
+        remote.sendall(b"y" * 10)
+        self.assertEqual(client_app.recv(1024), b"y" * 10)
+        client_app.shutdown(socket.SHUT_WR)
+        worker.join(timeout=5)
+
+        self.assertEqual(downstream.get() - received, 10)
+        self.assertEqual(sum(metrics.UPSTREAM_CONNECT_SECONDS._default.snapshot()[0]), connects + 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,149 @@
+import socket
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+from src.constants import AddressTypeCodes
+from src.models import DetailedAddress
+from src.pool import UpstreamPool
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class Backend:
+    """Loopback listener that accepts connections and keeps them until told to close them."""
+
+    def __init__(self):
+        self.listener = socket.socket()
+        self.listener.bind(("127.0.0.1", 0))
+        self.listener.listen(16)
+        self.port = self.listener.getsockname()[1]
+        self.connections: list[socket.socket] = []
+        self._thread = threading.Thread(target=self._accept, daemon=True)
+        self._thread.start()
+
+    def _accept(self) -> None:
+        while True:
+            try:
+                conn, _ = self.listener.accept()
+            except OSError:
+                return
+            self.connections.append(conn)
+
+    def close_connections(self) -> None:
+        for conn in self.connections:
+            conn.close()
+
+    def close(self) -> None:
+        self.listener.close()
+        self.close_connections()
+
+
+def wait_for(predicate, timeout: float = 5.0) -> None:
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise AssertionError("condition not met in time")
+        time.sleep(0.01)
+
+
+def make_address(port: int, name: str = "127.0.0.1") -> DetailedAddress:
+    return DetailedAddress(name=name, ip="127.0.0.1", port=port, address_type=AddressTypeCodes.IPv4)
+
+
+class TestUpstreamPool(unittest.TestCase):
+    def setUp(self):
+        self.backend = Backend()
+        self.addCleanup(self.backend.close)
+
+    def _start_pool(self, **kwargs) -> UpstreamPool:
+        pool = UpstreamPool([("127.0.0.1", self.backend.port)], size=2, **kwargs)
+        pool.start()
+        self.addCleanup(pool.close)
+        wait_for(lambda: pool.stats()["idle"] == 2)
+        return pool
+
+    def test_acquire_hands_out_connected_socket_and_refills(self):
+        pool = self._start_pool()
+        sock = pool.acquire(make_address(self.backend.port))
+        self.addCleanup(sock.close)
+
+        self.assertEqual(sock.getpeername(), ("127.0.0.1", self.backend.port))
+        self.assertTrue(sock.getblocking())
+        self.assertEqual(pool.stats()["hits"], 1)
+        wait_for(lambda: pool.stats()["idle"] == 2)
+
+    def test_acquire_ignores_destinations_not_pooled(self):
+        pool = self._start_pool()
+        self.assertIsNone(pool.acquire(make_address(self.backend.port + 1)))
+        self.assertEqual(pool.stats()["misses"], 0)
+
+    def test_acquire_matches_requested_domain_name(self):
+        pool = UpstreamPool([("backend.internal", 8080)])
+        self.assertEqual(
+            pool._key_for(make_address(8080, name="backend.internal")), ("backend.internal", 8080)
+        )
+
+    def test_sockets_closed_by_peer_are_evicted(self):
+        pool = self._start_pool(check_interval=60)
+        wait_for(lambda: len(self.backend.connections) == 2)
+        self.backend.close_connections()
+        # Let the FINs arrive before the health check peeks at the sockets
+        time.sleep(0.05)
+
+        self.assertIsNone(pool.acquire(make_address(self.backend.port)))
+        stats = pool.stats()
+        self.assertEqual(stats["evictions"], 2)
+        self.assertEqual(stats["misses"], 1)
+
+    def test_idle_sockets_expire(self):
+        clock = FakeClock()
+        pool = self._start_pool(max_idle=30, check_interval=60, clock=clock)
+        clock.now = 30
+        self.assertIsNone(pool.acquire(make_address(self.backend.port)))
+        self.assertEqual(pool.stats()["evictions"], 2)
+
+    def test_unreachable_destination_does_not_stop_pool(self):
+        with socket.socket() as probe:
+            probe.bind(("127.0.0.1", 0))
+            closed_port = probe.getsockname()[1]
+
+        pool = UpstreamPool([("127.0.0.1", closed_port), ("127.0.0.1", self.backend.port)], size=1)
+        pool.start()
+        self.addCleanup(pool.close)
+        wait_for(lambda: pool.stats()["idle"] == 1)
+        self.assertIsNone(pool.acquire(make_address(closed_port)))
+
+    def test_a_slow_destination_does_not_hold_up_the_others(self):
+        slow = ("192.0.2.1", 80)
+        release = threading.Event()
+        create_connection = socket.create_connection
+
+        def connect(address, timeout):
+            if address == slow:
+                release.wait(timeout=5)
+                raise OSError("timed out")
+            return create_connection(address, timeout=timeout)
+
+        patcher = patch("src.pool.socket.create_connection", connect)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        pool = UpstreamPool([slow, ("127.0.0.1", self.backend.port)], size=2)
+        pool.start()
+        self.addCleanup(pool.close)
+        self.addCleanup(release.set)
+        wait_for(lambda: pool.stats()["idle"] == 2, timeout=2)
+        sock = pool.acquire(make_address(self.backend.port))
+        self.addCleanup(sock.close)
+        self.assertEqual(sock.getpeername(), ("127.0.0.1", self.backend.port))
+
+
+if __name__ == "__main__":
+    unittest.main()
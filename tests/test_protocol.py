@@ -0,0 +1,206 @@
+import socket
+import struct
+import unittest
+from unittest.mock import patch
+
+from src.constants import USERNAME, PASSWORD, AddressTypeCodes, MethodCodes
+from src.exceptions import InvalidRequestError, InvalidVersionError
+from src.handlers.tcp import TCPHandler
+from src.metrics import HANDSHAKE_FAILURES
+from src.protocol import (
+    Credentials,
+    Greeting,
+    ProtocolState,
+    RequestReceived,
+    ServerProtocol,
+    parse_udp_header,
+)
+
+from . import test_relay_timeouts
+from .test_relay_timeouts import HalfCloseServer
+from .test_tcp_relay import tcp_socket_pair
+
+GREETING = b"\x05\x02\x00\x02"
+CREDENTIALS = bytes([1, len(USERNAME)]) + USERNAME.encode() + bytes([len(PASSWORD)]) + PASSWORD.encode()
+IPV4_REQUEST = b"\x05\x01\x00\x01" + socket.inet_aton("93.184.216.34") + struct.pack("!H", 80)
+
+
+class TestServerProtocol(unittest.TestCase):
+    def setUp(self):
+        self.protocol = ServerProtocol()
+
+    def test_messages_split_across_reads_are_parsed_once_complete(self):
+        for byte in GREETING[:-1]:
+            self.protocol.receive_data(bytes([byte]))
+            self.assertIsNone(self.protocol.next_event())
+        self.protocol.receive_data(GREETING[-1:])
+        self.assertEqual(self.protocol.next_event(), Greeting(b"\x00\x02"))
+        self.assertEqual(self.protocol.state, ProtocolState.SELECTING_METHOD)
+
+    def test_a_pipelined_handshake_is_parsed_from_one_read(self):
+        self.protocol.receive_data(GREETING + CREDENTIALS + IPV4_REQUEST + b"early")
+        self.assertEqual(self.protocol.next_event(), Greeting(b"\x00\x02"))
+        self.assertEqual(self.protocol.select_method(MethodCodes.USERNAME_PASSWORD), b"\x05\x02")
+        self.assertEqual(self.protocol.next_event(), Credentials(USERNAME, PASSWORD))
+        self.assertEqual(self.protocol.auth_reply(True), b"\x01\x00")
+        self.assertEqual(
+            self.protocol.next_event(),
+            RequestReceived(0x01, AddressTypeCodes.IPv4.value, "93.184.216.34", 80),
+        )
+        self.assertEqual(self.protocol.state, ProtocolState.ESTABLISHED)
+        self.assertEqual(self.protocol.trailing_data(), b"early")
+        self.assertEqual(self.protocol.trailing_data(), b"")
+
+    def test_requests_carry_domain_names_and_ipv6_addresses(self):
+        self.protocol.select_method(MethodCodes.NO_AUTHENTICATION_REQUIRED)
+        self.protocol.receive_data(b"\x05\x03\x00\x03\x0bexample.com" + struct.pack("!H", 443))
+        self.assertEqual(
+            self.protocol.next_event(),
+            RequestReceived(0x03, AddressTypeCodes.DOMAIN_NAME.value, "example.com", 443),
+        )
+
+        protocol = ServerProtocol()
+        protocol.select_method(MethodCodes.NO_AUTHENTICATION_REQUIRED)
+        protocol.receive_data(b"\x05\x01\x00\x04" + socket.inet_pton(socket.AF_INET6, "2001:db8::1"))
+        self.assertIsNone(protocol.next_event())
+        protocol.receive_data(struct.pack("!H", 8080))
+        self.assertEqual(protocol.next_event().host, "2001:db8::1")
+
+    def test_a_wrong_version_is_rejected_from_its_first_byte(self):
+        self.protocol.receive_data(b"\x04")
+        with self.assertRaises(InvalidVersionError):
+            self.protocol.next_event()
+        self.assertEqual(self.protocol.state, ProtocolState.CLOSED)
+
+    def test_a_wrong_subnegotiation_version_is_rejected(self):
+        self.protocol.select_method(MethodCodes.USERNAME_PASSWORD)
+        self.protocol.receive_data(b"\x05")
+        with self.assertRaises(InvalidVersionError):
+            self.protocol.next_event()
+        self.assertEqual(self.protocol.auth_reply(False), b"\x01\x01")
+
+    def test_malformed_requests_are_rejected(self):
+        for request in (b"\x05\x01\x01", b"\x05\x01\x00\x02"):
+            with self.subTest(request=request):
+                protocol = ServerProtocol()
+                protocol.select_method(MethodCodes.NO_AUTHENTICATION_REQUIRED)
+                protocol.receive_data(request)
+                with self.assertRaises(InvalidRequestError):
+                    protocol.next_event()
+
+    def test_names_and_credentials_that_are_not_utf8_are_rejected(self):
+        self.protocol.select_method(MethodCodes.USERNAME_PASSWORD)
+        self.protocol.receive_data(b"\x01\x02\xff\xfe\x01a")
+        with self.assertRaises(InvalidRequestError):
+            self.protocol.next_event()
+        self.assertEqual(self.protocol.state, ProtocolState.CLOSED)
+
+        protocol = ServerProtocol()
+        protocol.select_method(MethodCodes.NO_AUTHENTICATION_REQUIRED)
+        protocol.receive_data(b"\x05\x01\x00\x03\x02\xff\xfe\x00\x50")
+        with self.assertRaises(InvalidRequestError):
+            protocol.next_event()
+
+    def test_no_message_is_parsed_before_the_last_one_was_answered(self):
+        self.protocol.receive_data(GREETING + CREDENTIALS)
+        self.protocol.next_event()
+        with self.assertRaises(RuntimeError):
+            self.protocol.next_event()
+        self.protocol.select_method(MethodCodes.NO_ACCEPTABLE_METHODS)
+        self.assertEqual(self.protocol.state, ProtocolState.CLOSED)
+
+
+class TestParseUDPHeader(unittest.TestCase):
+    def test_each_address_type_is_parsed(self):
+        port = struct.pack("!H", 53)
+        for header, host, address_type in (
+            (b"\x01" + socket.inet_aton("192.0.2.1"), "192.0.2.1", AddressTypeCodes.IPv4),
+            (b"\x03\x0bexample.com", "example.com", AddressTypeCodes.DOMAIN_NAME),
+            (b"\x04" + socket.inet_pton(socket.AF_INET6, "2001:db8::1"), "2001:db8::1", AddressTypeCodes.IPv6),
+        ):
+            with self.subTest(host=host):
+                datagram = parse_udp_header(b"\x00\x00\x02" + header + port + b"query")
+                self.assertEqual(datagram.frag, 2)
+                self.assertEqual(datagram.address_type, address_type)
+                self.assertEqual((datagram.dst_addr, datagram.dst_port), (host, 53))
+                self.assertEqual(datagram.data, b"query")
+
+    def test_truncated_and_unknown_headers_are_rejected(self):
+        for data in (b"\x00\x00", b"\x00\x00\x00\x01\x7f\x00", b"\x00\x00\x00\x03\x0bexample", b"\x00\x00\x00\x05"):
+            with self.subTest(data=data), self.assertRaises(InvalidRequestError):
+                parse_udp_header(data)
+
+
+class TestPipelinedHandshake(unittest.TestCase):
+    def test_the_threaded_handler_parses_a_pipelined_handshake_from_one_read(self):
+        client, server_side = tcp_socket_pair()
+        self.addCleanup(client.close)
+        self.addCleanup(server_side.close)
+        client.sendall(GREETING + CREDENTIALS + IPV4_REQUEST)
+        handler = TCPHandler(server_side)
+        reads = []
+        original_recv = socket.socket.recv
+
+        def recv(sock: socket.socket, size: int) -> bytes:
+            reads.append(size)
+            return original_recv(sock, size)
+
+        with patch.object(socket.socket, "recv", recv), patch("src.handlers.base.get_reverse_lookup_enricher"):
+            self.assertTrue(handler.handle_request())
+            request = handler.parse_request()
+        self.assertEqual(len(reads), 1)
+        self.assertEqual(handler.username, USERNAME)
+        self.assertEqual((request.address.ip, request.address.port), ("93.184.216.34", 80))
+        self.assertEqual(client.recv(4), b"\x05\x02\x01\x00")
+
+
+class PipelinedClientMixin:
+    """Sends whole handshakes, and the first payload, at once through one serving engine."""
+
+    def start_proxy(self) -> tuple[str, int]:
+        raise NotImplementedError
+
+    def setUp(self):
+        self.proxy_address = self.start_proxy()
+        self.upstream = HalfCloseServer()
+        self.addCleanup(self.upstream.close)
+
+    def test_bytes_sent_after_the_request_reach_the_destination(self):
+        client = socket.create_connection(self.proxy_address)
+        self.addCleanup(client.close)
+        client.settimeout(5)
+        request = b"\x05\x01\x00\x01" + socket.inet_aton("127.0.0.1") + struct.pack("!H", self.upstream.port)
+        client.sendall(GREETING + CREDENTIALS + request + b"ping")
+
+        expected = b"\x05\x02\x01\x00"
+        received = b""
+        while len(received) < len(expected) + 10 + 4:
+            chunk = client.recv(64)
+            self.assertTrue(chunk)
+            received += chunk
+        self.assertEqual(received[:len(expected) + 2], expected + b"\x05\x00")
+        self.assertEqual(received[-4:], b"ping")
+
+    def test_credentials_that_are_not_utf8_are_refused(self):
+        client = socket.create_connection(self.proxy_address)
+        self.addCleanup(client.close)
+        client.settimeout(5)
+        before = HANDSHAKE_FAILURES.labels("auth").get()
+        client.sendall(GREETING + b"\x01\x02\xff\xfe\x01a")
+        received = b""
+        while chunk := client.recv(64):
+            received += chunk
+        self.assertEqual(received, b"\x05\x02\x01\x01")
+        self.assertEqual(HANDSHAKE_FAILURES.labels("auth").get(), before + 1)
+
+
+class TestThreadedPipelinedClient(PipelinedClientMixin, unittest.TestCase):
+    start_proxy = test_relay_timeouts.TestThreadedRelayTimeouts.start_proxy
+
+
+class TestAsyncPipelinedClient(PipelinedClientMixin, unittest.TestCase):
+    start_proxy = test_relay_timeouts.TestAsyncRelayTimeouts.start_proxy
+
+
+if __name__ == "__main__":
+    unittest.main()
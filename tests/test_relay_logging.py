@@ -0,0 +1,132 @@
+import logging
+import threading
+import unittest
+from unittest.mock import patch
+
+from src.config import ProxyConfiguration
+from src.constants import AddressTypeCodes
+from src.models import BaseAddress, DetailedAddress
+from src.relays.base import RelayLogSampler
+from src.relays.tcp_relay import TCPRelay
+
+from .test_pool import FakeClock
+from .test_relay_timeouts import HalfCloseServer
+from .test_tcp_relay import tcp_socket_pair
+
+CLIENT = BaseAddress("127.0.0.1", 5000)
+REMOTE = BaseAddress("192.0.2.1", 53)
+
+
+def relay_logging(sample_rate: int = 1, interval: float = 0.0):
+    return patch.multiple(
+        ProxyConfiguration, _relay_log_sample_rate=sample_rate, _relay_log_interval=interval
+    )
+
+
+def debug_logger(name: str) -> logging.Logger:
+    logger = logging.getLogger(name)
+    logger.setLevel(logging.DEBUG)
+    return logger
+
+
+class TestRelayLogSampler(unittest.TestCase):
+    def test_nothing_is_created_while_debug_is_off(self):
+        logger = logging.getLogger("test_relay_log_off")
+        logger.setLevel(logging.INFO)
+        with relay_logging():
+            self.assertIsNone(RelayLogSampler.create(logger, "TCP"))
+
+    def test_nothing_is_created_when_sampling_and_summaries_are_off(self):
+        with relay_logging(sample_rate=0, interval=0.0):
+            self.assertIsNone(RelayLogSampler.create(debug_logger("test_relay_log_disabled"), "TCP"))
+
+    def test_one_in_every_sample_rate_chunks_is_logged(self):
+        logger = debug_logger("test_relay_log_sampled")
+        with relay_logging(sample_rate=3):
+            sampler = RelayLogSampler.create(logger, "UDP")
+        with self.assertLogs(logger, level="DEBUG") as logs:
+            for size in range(1, 8):
+                sampler.record(CLIENT, REMOTE, size)
+        self.assertEqual(
+            logs.output,
+            [
+                "DEBUG:test_relay_log_sampled:RELAY | UDP | 127.0.0.1:5000 -> 192.0.2.1:53 | 3 bytes",
+                "DEBUG:test_relay_log_sampled:RELAY | UDP | 127.0.0.1:5000 -> 192.0.2.1:53 | 6 bytes",
+            ],
+        )
+
+    def test_detailed_addresses_are_logged_with_their_names(self):
+        logger = debug_logger("test_relay_log_detailed")
+        client = DetailedAddress("127.0.0.1", 5000, "Client", AddressTypeCodes.IPv4)
+        remote = DetailedAddress("93.184.216.34", 80, "example.com", AddressTypeCodes.IPv4)
+        with relay_logging():
+            sampler = RelayLogSampler.create(logger, "TCP")
+        with self.assertLogs(logger, level="DEBUG") as logs:
+            sampler.record(client, remote, 10)
+        self.assertIn("(Client) 127.0.0.1:5000 -> (example.com) 93.184.216.34:80 | 10 bytes", logs.output[0])
+
+    def test_summaries_total_each_direction_per_interval(self):
+        logger = debug_logger("test_relay_log_summary")
+        clock = FakeClock()
+        with relay_logging(sample_rate=0, interval=5.0), patch("src.relays.base.time.monotonic", clock):
+            sampler = RelayLogSampler.create(logger, "UDP")
+            with self.assertLogs(logger, level="DEBUG") as logs:
+                sampler.record(CLIENT, REMOTE, 100)
+                sampler.record(REMOTE, CLIENT, 40)
+                clock.now = 5.0
+                sampler.record(CLIENT, REMOTE, 50)
+                clock.now = 6.5
+                sampler.record(REMOTE, CLIENT, 60)
+                sampler.summarize()
+        self.assertEqual(
+            [line.split(":", 2)[2] for line in logs.output],
+            [
+                "RELAY SUMMARY | UDP | 127.0.0.1:5000 -> 192.0.2.1:53 | 2 chunks | 150 bytes | 5.0 s",
+                "RELAY SUMMARY | UDP | 192.0.2.1:53 -> 127.0.0.1:5000 | 1 chunks | 40 bytes | 5.0 s",
+                "RELAY SUMMARY | UDP | 192.0.2.1:53 -> 127.0.0.1:5000 | 1 chunks | 60 bytes | 1.5 s",
+            ],
+        )
+
+
+class TestTCPRelayLogging(unittest.TestCase):
+    def setUp(self):
+        self.upstream = HalfCloseServer()
+        self.addCleanup(self.upstream.close)
+        self.client_app, client_conn = tcp_socket_pair()
+        self.addCleanup(self.client_app.close)
+        self.addCleanup(client_conn.close)
+        self.client_conn = client_conn
+        self.destination = DetailedAddress(
+            name="localhost", ip="127.0.0.1", port=self.upstream.port,
+            address_type=AddressTypeCodes.IPv4,
+        )
+
+    def relay_one_message(self) -> TCPRelay:
+        relay = TCPRelay(self.client_conn, self.destination, relay_mode="copy")
+        worker = threading.Thread(target=relay.listen_and_relay, daemon=True)
+        worker.start()
+        self.client_app.sendall(b"ping")
+        self.assertEqual(self.client_app.recv(4), b"ping")
+        self.client_app.close()
+        worker.join(5)
+        return relay
+
+    def test_relay_without_debug_has_no_relay_log(self):
+        logger = logging.getLogger("src.relays.tcp_relay")
+        self.addCleanup(logger.setLevel, logger.level)
+        logger.setLevel(logging.INFO)
+        relay = self.relay_one_message()
+        self.assertIsNone(relay.relay_log)
+
+    def test_relay_with_debug_logs_each_chunk_and_a_final_summary(self):
+        with relay_logging(sample_rate=1, interval=60.0):
+            with self.assertLogs("src.relays.tcp_relay", level="DEBUG") as logs:
+                self.relay_one_message()
+        relayed = [line for line in logs.output if ":RELAY | TCP" in line]
+        summaries = [line for line in logs.output if "RELAY SUMMARY" in line]
+        self.assertEqual(len(relayed), 2)
+        self.assertEqual(len(summaries), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
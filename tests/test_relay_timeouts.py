@@ -0,0 +1,210 @@
+import asyncio
+import socket
+import struct
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+from src.async_server import AsyncTCPServer
+from src.config import ProxyConfiguration
+from src.metrics import RELAY_CLOSES
+from src.relays.base import RelayDeadlines
+from src.server import ThreadingTCPServer, TCPProxyServer
+
+from .test_pool import wait_for
+
+
+def closes(reason: str) -> float:
+    return RELAY_CLOSES.labels(reason).get()
+
+
+def relay_timeouts(idle: float = 0.0, lifetime: float = 0.0, linger: float = 0.0):
+    return patch.multiple(
+        ProxyConfiguration, _idle_timeout=idle, _max_lifetime=lifetime, _half_close_linger=linger
+    )
+
+
+class HalfCloseServer:
+    """
+    Echoes each loopback connection. At EOF it sends reply and closes, or with
+    reply None keeps the connection open until close().
+    """
+
+    def __init__(self, reply: bytes = None):
+        self.reply = reply
+        self.listener = socket.socket()
+        self.listener.bind(("127.0.0.1", 0))
+        self.listener.listen(8)
+        self.port: int = self.listener.getsockname()[1]
+        self._connections: list[socket.socket] = []
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self) -> None:
+        while True:
+            try:
+                conn, _ = self.listener.accept()
+            except OSError:
+                return
+            self._connections.append(conn)
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    def _serve(self, conn: socket.socket) -> None:
+        try:
+            while data := conn.recv(4096):
+                conn.sendall(data)
+            if self.reply is not None:
+                conn.sendall(self.reply)
+                conn.close()
+        except OSError:
+            pass
+
+    def close(self) -> None:
+        self.listener.close()
+        for conn in self._connections:
+            conn.close()
+
+
+class TestRelayDeadlines(unittest.TestCase):
+    def test_nothing_expires_when_disabled(self):
+        with relay_timeouts():
+            deadlines = RelayDeadlines(now=0.0)
+        self.assertIsNone(deadlines.expired(1e9))
+        self.assertEqual(deadlines.timeout(5.0, 3), 3)
+        self.assertIsNone(deadlines.timeout(5.0))
+
+    def test_idle_deadline_moves_with_activity(self):
+        with relay_timeouts(idle=10):
+            deadlines = RelayDeadlines(now=0.0)
+        deadlines.last_activity = 8.0
+        self.assertIsNone(deadlines.expired(17.0))
+        self.assertEqual(deadlines.timeout(17.0, 3), 1.0)
+        self.assertEqual(deadlines.expired(18.0), "idle_timeout")
+
+    def test_lifetime_expires_regardless_of_activity(self):
+        with relay_timeouts(idle=10, lifetime=30):
+            deadlines = RelayDeadlines(now=100.0)
+        deadlines.last_activity = 129.0
+        self.assertEqual(deadlines.timeout(129.0), 1.0)
+        self.assertEqual(deadlines.expired(130.0), "max_lifetime")
+
+    def test_linger_starts_at_the_first_half_close(self):
+        with relay_timeouts(linger=5):
+            deadlines = RelayDeadlines(now=0.0)
+        deadlines.half_closed(10.0)
+        deadlines.half_closed(12.0)
+        self.assertEqual(deadlines.timeout(11.0), 4.0)
+        self.assertEqual(deadlines.expired(15.0), "linger_expired")
+
+
+class RelayTimeoutsMixin:
+    """Drives one serving engine through a CONNECT with the relay timeouts configured."""
+
+    def start_proxy(self) -> tuple[str, int]:
+        raise NotImplementedError
+
+    def open_tunnel(self, upstream_port: int) -> socket.socket:
+        client = socket.create_connection(self.proxy_address)
+        self.addCleanup(client.close)
+        client.settimeout(5)
+        client.sendall(b"\x05\x01\x00")
+        self.assertEqual(client.recv(2), b"\x05\x00")
+        client.sendall(b"\x05\x01\x00\x01" + socket.inet_aton("127.0.0.1") + struct.pack("!H", upstream_port))
+        self.assertEqual(client.recv(10)[:2], b"\x05\x00")
+        client.sendall(b"ping")
+        self.assertEqual(client.recv(4), b"ping")
+        return client
+
+    def configure(self, **timeouts) -> None:
+        patcher = relay_timeouts(**timeouts)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def upstream(self, reply: bytes = None) -> HalfCloseServer:
+        server = HalfCloseServer(reply)
+        self.addCleanup(server.close)
+        return server
+
+    def setUp(self):
+        self.proxy_address = self.start_proxy()
+
+    def test_idle_tunnel_is_closed(self):
+        self.configure(idle=0.3)
+        before = closes("idle_timeout")
+        client = self.open_tunnel(self.upstream().port)
+        started = time.monotonic()
+        self.assertEqual(client.recv(1), b"")
+        self.assertGreaterEqual(time.monotonic() - started, 0.2)
+        wait_for(lambda: closes("idle_timeout") == before + 1)
+
+    def test_busy_tunnel_is_closed_at_its_lifetime(self):
+        self.configure(idle=0.2, lifetime=0.6)
+        before = closes("max_lifetime")
+        client = self.open_tunnel(self.upstream().port)
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline:
+            try:
+                client.sendall(b"ping")
+                if client.recv(4) == b"":
+                    break
+            except OSError:
+                break
+            time.sleep(0.05)
+        wait_for(lambda: closes("max_lifetime") == before + 1)
+
+    def test_half_close_ends_the_tunnel_without_linger(self):
+        before = closes("client_closed")
+        client = self.open_tunnel(self.upstream(reply=b"done").port)
+        client.shutdown(socket.SHUT_WR)
+        self.assertEqual(client.recv(4), b"")
+        wait_for(lambda: closes("client_closed") == before + 1)
+
+    def test_half_close_is_passed_on_with_linger(self):
+        self.configure(linger=5)
+        before = closes("client_closed")
+        client = self.open_tunnel(self.upstream(reply=b"done").port)
+        client.shutdown(socket.SHUT_WR)
+        self.assertEqual(client.recv(4), b"done")
+        self.assertEqual(client.recv(1), b"")
+        wait_for(lambda: closes("client_closed") == before + 1)
+
+    def test_linger_expires_when_the_other_side_keeps_open(self):
+        self.configure(linger=0.3)
+        before = closes("linger_expired")
+        client = self.open_tunnel(self.upstream().port)
+        client.shutdown(socket.SHUT_WR)
+        self.assertEqual(client.recv(1), b"")
+        wait_for(lambda: closes("linger_expired") == before + 1)
+
+
+class TestThreadedRelayTimeouts(RelayTimeoutsMixin, unittest.TestCase):
+    def start_proxy(self) -> tuple[str, int]:
+        server = ThreadingTCPServer(("127.0.0.1", 0), TCPProxyServer)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return server.server_address
+
+
+class TestAsyncRelayTimeouts(RelayTimeoutsMixin, unittest.TestCase):
+    def start_proxy(self) -> tuple[str, int]:
+        loop = asyncio.new_event_loop()
+        thread = threading.Thread(target=loop.run_forever, daemon=True)
+        thread.start()
+        server = AsyncTCPServer(("127.0.0.1", 0))
+        asyncio.run_coroutine_threadsafe(server.start(), loop).result(5)
+
+        def stop():
+            # Let relays finish on their own so no callback is cancelled mid-stream
+            wait_for(lambda: server.active_connections == 0)
+            asyncio.run_coroutine_threadsafe(server.close(), loop).result(5)
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join(5)
+            loop.close()
+
+        self.addCleanup(stop)
+        return server.server_address
+
+
+if __name__ == "__main__":
+    unittest.main()
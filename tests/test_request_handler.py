@@ -4,9 +4,11 @@ from unittest.mock import patch
 import struct
 import socket
 from src.handlers.tcp import TCPHandler
-from src.exceptions import InvalidVersionError, InvalidRequestError
+from src.exceptions import InvalidRequestError
 from src.constants import AddressTypeCodes, MethodCodes
+from src.metrics import HANDSHAKE_FAILURES
 from src.models import Request
+from src.resolver import get_resolver
 
 # Testing Data
 # Initial Requests
@@ -29,15 +31,31 @@ class TestTCPRequestHandlerIPv4(unittest.TestCase):
     def setUp(self):
         self.connection = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.handler = TCPHandler(self.connection)
+        get_resolver().clear()
+        enricher_patcher = patch("src.handlers.base.get_reverse_lookup_enricher")
+        self.mock_enricher = enricher_patcher.start().return_value
+        self.addCleanup(enricher_patcher.stop)
 
     def tearDown(self):
         self.connection.close()
 
+    def negotiate(self, method: MethodCodes = MethodCodes.NO_AUTHENTICATION_REQUIRED) -> None:
+        """Moves the handler's protocol past method negotiation, as handle_request does."""
+        self.handler.protocol.select_method(method)
+
+    def parse_address(self, address_type: int):
+        """Parses the address of a CONNECT request whose header was already received."""
+        self.negotiate()
+        self.handler.protocol.receive_data(struct.pack("!BBBB", 0x05, 0x01, 0x00, address_type))
+        return self.handler.parse_request().address
+
     @patch("socket.socket.recv")
     def test_handle_handshake__incorrect_version(self, mock_recv):
         mock_recv.side_effect = [REQ_INCORRECT_VERSION]
-        with self.assertRaises(InvalidVersionError):
-            self.handler.handle_request()
+        failures = HANDSHAKE_FAILURES.labels("version").get()
+        with self.assertLogs("src.handlers.tcp", level="WARNING"):
+            self.assertFalse(self.handler.handle_request())
+        self.assertEqual(HANDSHAKE_FAILURES.labels("version").get(), failures + 1)
 
     @patch("socket.socket.recv")
     @patch("socket.socket.sendall")
@@ -127,6 +145,7 @@ class TestTCPRequestHandlerIPv4(unittest.TestCase):
             bytes([len("mypassword")]),
             b"mypassword",
         ]
+        self.negotiate(MethodCodes.USERNAME_PASSWORD)
         result = self.handler._handle_username_password_auth()
         mock_sendall.assert_called_with(RESP_LOGIN_SUCCESS)
         self.assertTrue(result)
@@ -141,19 +160,19 @@ class TestTCPRequestHandlerIPv4(unittest.TestCase):
             bytes([len("eh")]),
             b"eh",
         ]
+        self.negotiate(MethodCodes.USERNAME_PASSWORD)
         result = self.handler._handle_username_password_auth()
         mock_sendall.assert_called_with(RESP_LOGIN_FAILURE)
         self.assertFalse(result)
 
     @patch("socket.socket.recv")
-    @patch("src.handlers.base.socket.gethostbyaddr")
-    def test_parse_request(self, mock_gethostbyaddr, mock_recv):
-        mock_gethostbyaddr.return_value = ("example.com", [], ["93.184.216.34"])
+    def test_parse_request(self, mock_recv):
         mock_recv.side_effect = [
             struct.pack("!BBBB", 0x05, 0x01, 0x00, 0x01),
             socket.inet_aton("93.184.216.34"),
             struct.pack("!H", 80),
         ]
+        self.negotiate()
         result = self.handler.parse_request()
         self.assertIsInstance(result, Request)
         self.assertEqual(result.version, 5)
@@ -163,18 +182,18 @@ class TestTCPRequestHandlerIPv4(unittest.TestCase):
         self.assertEqual(result.address.address_type, AddressTypeCodes.IPv4)
 
     @patch("socket.socket.recv")
-    @patch("src.handlers.base.socket.gethostbyaddr")
-    def test_parse_address_ipv4(self, mock_gethostbyaddr, mock_recv):
-        mock_gethostbyaddr.return_value = ("example.com", [], ["1.2.3.4"])
+    def test_parse_address_ipv4(self, mock_recv):
         mock_recv.side_effect = [
             socket.inet_aton("1.2.3.4"),
             struct.pack("!H", 443),
         ]
-        result = self.handler._parse_address(AddressTypeCodes.IPv4.value)
+        result = self.parse_address(AddressTypeCodes.IPv4.value)
         self.assertEqual(result.ip, "1.2.3.4")
         self.assertEqual(result.port, 443)
-        self.assertEqual(result.name, "example.com")
+        # The PTR name is filled in later; the request proceeds with the IP as its name
+        self.assertEqual(result.name, "1.2.3.4")
         self.assertEqual(result.address_type, AddressTypeCodes.IPv4)
+        self.mock_enricher.enrich.assert_called_once_with(result)
 
     @patch("socket.socket.recv")
     @patch("src.handlers.base.socket.getaddrinfo")
@@ -188,11 +207,12 @@ class TestTCPRequestHandlerIPv4(unittest.TestCase):
             domain.encode(),
             struct.pack("!H", 80),
         ]
-        result = self.handler._parse_address(AddressTypeCodes.DOMAIN_NAME.value)
+        result = self.parse_address(AddressTypeCodes.DOMAIN_NAME.value)
         self.assertEqual(result.ip, "93.184.216.34")
         self.assertEqual(result.port, 80)
         self.assertEqual(result.name, domain)
         self.assertEqual(result.address_type, AddressTypeCodes.IPv4)
+        self.mock_enricher.enrich.assert_not_called()
 
     @patch("socket.socket.recv")
     @patch("src.handlers.base.socket.getaddrinfo")
@@ -206,26 +226,36 @@ class TestTCPRequestHandlerIPv4(unittest.TestCase):
             domain.encode(),
             struct.pack("!H", 443),
         ]
-        result = self.handler._parse_address(AddressTypeCodes.DOMAIN_NAME.value)
+        result = self.parse_address(AddressTypeCodes.DOMAIN_NAME.value)
         self.assertEqual(result.ip, "2606:4700::6812:1a78")
         self.assertEqual(result.port, 443)
         self.assertEqual(result.name, domain)
         self.assertEqual(result.address_type, AddressTypeCodes.IPv6)
 
     @patch("socket.socket.recv")
-    @patch("src.handlers.base.socket.gethostbyaddr")
-    def test_parse_address_ipv6(self, mock_gethostbyaddr, mock_recv):
+    def test_parse_address_ipv6(self, mock_recv):
         ipv6 = "2001:db8::1"
-        mock_gethostbyaddr.return_value = ("ipv6host.example.com", [], [ipv6])
         mock_recv.side_effect = [
             socket.inet_pton(socket.AF_INET6, ipv6),
             struct.pack("!H", 8080),
         ]
-        result = self.handler._parse_address(AddressTypeCodes.IPv6.value)
+        result = self.parse_address(AddressTypeCodes.IPv6.value)
         self.assertEqual(result.ip, ipv6)
         self.assertEqual(result.port, 8080)
-        self.assertEqual(result.name, "ipv6host.example.com")
+        self.assertEqual(result.name, ipv6)
         self.assertEqual(result.address_type, AddressTypeCodes.IPv6)
+        self.mock_enricher.enrich.assert_called_once_with(result)
+
+    @patch("socket.socket.recv")
+    def test_parse_address_skips_ptr_when_reverse_dns_off(self, mock_recv):
+        mock_recv.side_effect = [
+            socket.inet_aton("1.2.3.4"),
+            struct.pack("!H", 443),
+        ]
+        with patch("src.handlers.base.ProxyConfiguration.get_reverse_dns", return_value="off"):
+            result = self.parse_address(AddressTypeCodes.IPv4.value)
+        self.assertEqual(result.name, "1.2.3.4")
+        self.mock_enricher.enrich.assert_not_called()
 
     @patch("socket.socket.recv")
     def test_parse_request_rejects_nonzero_rsv(self, mock_recv):
@@ -233,39 +263,13 @@ class TestTCPRequestHandlerIPv4(unittest.TestCase):
         mock_recv.side_effect = [
             struct.pack("!BBBB", 0x05, 0x01, 0x01, 0x01),
         ]
+        self.negotiate()
         with self.assertRaises(InvalidRequestError):
             self.handler.parse_request()
 
     def test_parse_address_invalid(self):
         with self.assertRaises(InvalidRequestError):
-            self.handler._parse_address(0xFF)
-
-    @patch("src.handlers.base.socket.gethostbyaddr")
-    def test_gethostbyaddr_success(self, mock_gethostbyaddr):
-        mock_gethostbyaddr.return_value = ("example.com", [], ["1.2.3.4"])
-        result = self.handler._gethostbyaddr("1.2.3.4")
-        self.assertEqual(result, "example.com")
-
-    @patch("src.handlers.base.socket.gethostbyaddr")
-    def test_gethostbyaddr_failure_returns_ip(self, mock_gethostbyaddr):
-        mock_gethostbyaddr.side_effect = OSError("no reverse DNS")
-        result = self.handler._gethostbyaddr("1.2.3.4")
-        self.assertEqual(result, "1.2.3.4")
-
-    @patch("src.handlers.base.DNS_LOOKUP_TIMEOUT", 0.1)
-    @patch("src.handlers.base.socket.gethostbyaddr")
-    def test_gethostbyaddr_timeout_returns_ip(self, mock_gethostbyaddr):
-        """Reverse DNS should return the IP if the lookup takes too long."""
-        done = threading.Event()
-
-        def slow_lookup(ip):
-            done.wait(timeout=5)
-            return ("example.com", [], [ip])
-
-        mock_gethostbyaddr.side_effect = slow_lookup
-        result = self.handler._gethostbyaddr("1.2.3.4")
-        self.assertEqual(result, "1.2.3.4")
-        done.set()
+            self.parse_address(0xFF)
 
     @patch("src.handlers.base.DNS_LOOKUP_TIMEOUT", 0.1)
     @patch("src.handlers.base.socket.getaddrinfo")
@@ -278,7 +282,7 @@ class TestTCPRequestHandlerIPv4(unittest.TestCase):
             return [(socket.AF_INET, socket.SOCK_STREAM, 0, "", ("93.184.216.34", 0))]
 
         mock_getaddrinfo.side_effect = slow_lookup
-        ip, atyp = self.handler._resolve_hostname("example.com")
+        ip, atyp, _ = self.handler._resolve_hostname("example.com")
         self.assertEqual(ip, "example.com")
         self.assertEqual(atyp, AddressTypeCodes.IPv4.value)
         done.set()
@@ -288,7 +292,7 @@ class TestTCPRequestHandlerIPv4(unittest.TestCase):
         mock_getaddrinfo.return_value = [
             (socket.AF_INET, socket.SOCK_STREAM, 0, "", ("93.184.216.34", 0)),
         ]
-        ip, atyp = self.handler._resolve_hostname("example.com")
+        ip, atyp, _ = self.handler._resolve_hostname("example.com")
         self.assertEqual(ip, "93.184.216.34")
         self.assertEqual(atyp, AddressTypeCodes.IPv4.value)
 
@@ -297,22 +301,32 @@ class TestTCPRequestHandlerIPv4(unittest.TestCase):
         mock_getaddrinfo.return_value = [
             (socket.AF_INET6, socket.SOCK_STREAM, 0, "", ("2606:4700::6812:1a78", 0, 0, 0)),
         ]
-        ip, atyp = self.handler._resolve_hostname("example.com")
+        ip, atyp, _ = self.handler._resolve_hostname("example.com")
         self.assertEqual(ip, "2606:4700::6812:1a78")
         self.assertEqual(atyp, AddressTypeCodes.IPv6.value)
 
     @patch("src.handlers.base.socket.getaddrinfo")
     def test_resolve_hostname_failure_returns_name(self, mock_getaddrinfo):
         mock_getaddrinfo.side_effect = OSError("no DNS")
-        ip, atyp = self.handler._resolve_hostname("example.com")
+        ip, atyp, _ = self.handler._resolve_hostname("example.com")
         self.assertEqual(ip, "example.com")
         self.assertEqual(atyp, AddressTypeCodes.IPv4.value)
 
+    @patch("src.handlers.base.socket.getaddrinfo")
+    def test_resolve_hostname_uses_shared_cache(self, mock_getaddrinfo):
+        mock_getaddrinfo.return_value = [
+            (socket.AF_INET, socket.SOCK_STREAM, 0, "", ("93.184.216.34", 0)),
+        ]
+        first = self.handler._resolve_hostname("cached.example.com")
+        second = TCPHandler(self.connection)._resolve_hostname("cached.example.com")
+        self.assertEqual(first, second)
+        mock_getaddrinfo.assert_called_once()
+
     @patch("src.handlers.base.socket.getaddrinfo")
     def test_resolve_hostname_empty_result_returns_name(self, mock_getaddrinfo):
         """getaddrinfo returning empty list should fall back to name with IPv4."""
         mock_getaddrinfo.return_value = []
-        ip, atyp = self.handler._resolve_hostname("example.com")
+        ip, atyp, _ = self.handler._resolve_hostname("example.com")
         self.assertEqual(ip, "example.com")
         self.assertEqual(atyp, AddressTypeCodes.IPv4.value)
 
@@ -0,0 +1,240 @@
+import threading
+import unittest
+from unittest.mock import patch
+
+from src.constants import AddressTypeCodes
+from src.models import DetailedAddress
+from src.resolver import Resolver, ReverseLookupEnricher, TTLCache, get_resolver
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class TestTTLCache(unittest.TestCase):
+    def test_entries_expire_after_ttl(self):
+        clock = FakeClock()
+        cache = TTLCache(max_entries=10, clock=clock)
+        cache.set("a", 1, ttl=5)
+        self.assertEqual(cache.get("a"), 1)
+        clock.now = 5
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(len(cache), 0)
+
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = TTLCache(max_entries=2)
+        cache.set("a", 1, ttl=60)
+        cache.set("b", 2, ttl=60)
+        cache.get("a")
+        cache.set("c", 3, ttl=60)
+        self.assertEqual(cache.get("a"), 1)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("c"), 3)
+
+
+class TestResolver(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.resolver = Resolver(max_workers=2, ttl=30, negative_ttl=5, clock=self.clock)
+
+    def test_positive_results_are_cached_until_ttl(self):
+        calls = []
+
+        def lookup():
+            calls.append(1)
+            return "result"
+
+        self.assertEqual(self.resolver.lookup("key", lookup).result(timeout=1), "result")
+        self.assertEqual(self.resolver.lookup("key", lookup).result(timeout=1), "result")
+        self.assertEqual(len(calls), 1)
+
+        self.clock.now = 30
+        self.resolver.lookup("key", lookup).result(timeout=1)
+        self.assertEqual(len(calls), 2)
+
+        stats = self.resolver.stats()
+        self.assertEqual(stats["hits"], 1)
+        self.assertEqual(stats["misses"], 2)
+
+    def test_failures_are_cached_as_negative_entries(self):
+        calls = []
+
+        def lookup():
+            calls.append(1)
+            raise OSError("NXDOMAIN")
+
+        for _ in range(3):
+            with self.assertRaises(OSError):
+                self.resolver.lookup("missing", lookup).result(timeout=1)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(self.resolver.stats()["negative_hits"], 2)
+
+        self.clock.now = 5
+        with self.assertRaises(OSError):
+            self.resolver.lookup("missing", lookup).result(timeout=1)
+        self.assertEqual(len(calls), 2)
+
+    def test_non_os_errors_are_not_cached(self):
+        calls = []
+
+        def lookup():
+            calls.append(1)
+            raise ValueError("bad input")
+
+        for _ in range(2):
+            with self.assertRaises(ValueError):
+                self.resolver.lookup("bad", lookup).result(timeout=1)
+        self.assertEqual(len(calls), 2)
+
+    def test_concurrent_lookups_share_one_query(self):
+        release = threading.Event()
+        calls = []
+
+        def slow_lookup():
+            calls.append(1)
+            release.wait(timeout=5)
+            return "shared"
+
+        futures = [self.resolver.lookup("hot", slow_lookup) for _ in range(5)]
+        release.set()
+        self.assertEqual([f.result(timeout=1) for f in futures], ["shared"] * 5)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(self.resolver.stats()["coalesced"], 4)
+
+    def test_clear_ignores_lookups_still_in_flight(self):
+        release = threading.Event()
+        future = self.resolver.lookup("late", lambda: release.wait(timeout=5) and "late")
+        self.resolver.clear()
+        release.set()
+        self.assertEqual(future.result(timeout=1), "late")
+        self.assertEqual(self.resolver.stats()["entries"], 0)
+
+    def test_get_resolver_is_process_wide(self):
+        self.assertIs(get_resolver(), get_resolver())
+
+
+def make_address(ip: str) -> DetailedAddress:
+    return DetailedAddress(name=ip, ip=ip, port=80, address_type=AddressTypeCodes.IPv4)
+
+
+class TestReverseLookupEnricher(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.enricher = ReverseLookupEnricher(max_workers=1, ttl=300, negative_ttl=10, clock=self.clock)
+
+    @patch("src.resolver.socket.gethostbyaddr")
+    def test_enrich_names_address_in_background(self, mock_gethostbyaddr):
+        release = threading.Event()
+
+        def slow_ptr(ip):
+            release.wait(timeout=5)
+            return ("host.example.com", [], [ip])
+
+        mock_gethostbyaddr.side_effect = slow_ptr
+        address = make_address("1.2.3.4")
+
+        future = self.enricher.enrich(address)
+        # enrich() returns immediately; the address keeps its IP until the lookup ends
+        self.assertEqual(address.name, "1.2.3.4")
+        release.set()
+        future.result(timeout=1)
+        self.assertEqual(address.name, "host.example.com")
+
+    @patch("src.resolver.socket.gethostbyaddr")
+    def test_cached_names_are_applied_synchronously(self, mock_gethostbyaddr):
+        mock_gethostbyaddr.return_value = ("host.example.com", [], ["1.2.3.4"])
+        self.enricher.enrich(make_address("1.2.3.4")).result(timeout=1)
+
+        address = make_address("1.2.3.4")
+        self.assertIsNone(self.enricher.enrich(address))
+        self.assertEqual(address.name, "host.example.com")
+        mock_gethostbyaddr.assert_called_once()
+
+    @patch("src.resolver.socket.gethostbyaddr")
+    def test_failed_lookup_keeps_ip_and_is_cached(self, mock_gethostbyaddr):
+        mock_gethostbyaddr.side_effect = OSError("no PTR record")
+        address = make_address("5.6.7.8")
+        self.assertEqual(self.enricher.enrich(address).result(timeout=1), "5.6.7.8")
+        self.assertEqual(address.name, "5.6.7.8")
+
+        self.assertIsNone(self.enricher.enrich(make_address("5.6.7.8")))
+        self.clock.now = 10
+        self.assertIsNotNone(self.enricher.enrich(make_address("5.6.7.8")))
+
+    @patch("src.resolver.socket.gethostbyaddr")
+    def test_concurrent_addresses_share_one_lookup(self, mock_gethostbyaddr):
+        release = threading.Event()
+
+        def slow_ptr(ip):
+            release.wait(timeout=5)
+            return ("shared.example.com", [], [ip])
+
+        mock_gethostbyaddr.side_effect = slow_ptr
+        addresses = [make_address("9.9.9.9") for _ in range(3)]
+        futures = [self.enricher.enrich(address) for address in addresses]
+        release.set()
+        futures[0].result(timeout=1)
+
+        self.assertTrue(all(future is futures[0] for future in futures))
+        for address in addresses:
+            self.assertEqual(address.name, "shared.example.com")
+        mock_gethostbyaddr.assert_called_once()
+
+    @patch("src.resolver.socket.gethostbyaddr")
+    def test_a_flood_of_ips_leaves_the_backlog_bounded(self, mock_gethostbyaddr):
+        release = threading.Event()
+
+        def slow_ptr(ip):
+            release.wait(timeout=5)
+            return (f"host-{ip}.example.com", [], [ip])
+
+        mock_gethostbyaddr.side_effect = slow_ptr
+        enricher = ReverseLookupEnricher(max_workers=1, max_pending=4, clock=self.clock)
+        addresses = [make_address(f"10.0.{i // 256}.{i % 256}") for i in range(1000)]
+        futures = [enricher.enrich(address) for address in addresses]
+
+        self.assertEqual(sum(future is not None for future in futures), 4)
+        self.assertEqual(len(enricher._inflight), 4)
+        self.assertEqual(len(enricher._pending), 4)
+        self.assertLessEqual(enricher._executor._work_queue.qsize(), 4)
+        self.assertEqual(enricher.dropped, 996)
+
+        release.set()
+        for future in futures[:4]:
+            future.result(timeout=1)
+        self.assertEqual(addresses[0].name, "host-10.0.0.0.example.com")
+        self.assertEqual(addresses[4].name, "10.0.0.4")
+        # The backlog drained, so new IPs are looked up again
+        self.assertIsNotNone(enricher.enrich(make_address("10.9.9.9")))
+
+    @patch("src.resolver.socket.gethostbyaddr")
+    def test_lookups_that_waited_past_the_timeout_are_skipped(self, mock_gethostbyaddr):
+        release = threading.Event()
+
+        def slow_ptr(ip):
+            release.wait(timeout=5)
+            return ("host.example.com", [], [ip])
+
+        mock_gethostbyaddr.side_effect = slow_ptr
+        enricher = ReverseLookupEnricher(max_workers=1, timeout=2.0, clock=self.clock)
+        first = enricher.enrich(make_address("1.1.1.1"))
+        address = make_address("2.2.2.2")
+        queued = enricher.enrich(address)
+        self.clock.now = 2.0
+        release.set()
+
+        first.result(timeout=1)
+        self.assertEqual(queued.result(timeout=1), "2.2.2.2")
+        self.assertEqual(address.name, "2.2.2.2")
+        mock_gethostbyaddr.assert_called_once_with("1.1.1.1")
+        self.assertEqual(enricher.skipped, 1)
+        # Skipped lookups are not cached
+        self.assertIsNotNone(enricher.enrich(make_address("2.2.2.2")))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,9 +1,15 @@
 import socket
+import threading
+import time
 import unittest
+from socketserver import StreamRequestHandler
 from unittest.mock import MagicMock, patch
 
 from src.exceptions import InvalidVersionError, InvalidRequestError
-from src.server import TCPProxyServer
+from src.metrics import ACCEPT_QUEUE_DEPTH, CONNECTIONS_REJECTED, Gauge, Registry
+from src.server import ThreadingTCPServer, TCPProxyServer
+
+from .test_pool import wait_for
 
 
 class TestHandleParseRequestErrors(unittest.TestCase):
@@ -16,6 +22,7 @@ class TestHandleParseRequestErrors(unittest.TestCase):
         handler.connection.getpeername.return_value = ("127.0.0.1", 9999)
         handler.request = handler.connection
         handler.server = MagicMock()
+        handler.server.pop_accept_time.return_value = None
         return handler
 
     @patch("src.server.TCPHandler")
@@ -96,5 +103,120 @@ class TestSendErrorReply(unittest.TestCase):
         handler._send_error_reply(b"\x05\x01\x00\x01\x00\x00\x00\x00\x00\x00")
 
 
+class HoldingHandler(StreamRequestHandler):
+    """Writes b"served", then holds the connection until release is set."""
+
+    release: threading.Event
+
+    def handle(self):
+        self.wfile.write(b"served")
+        self.wfile.flush()
+        self.release.wait(5)
+
+
+class TestWorkerPoolAdmission(unittest.TestCase):
+    def _start(self, **limits) -> ThreadingTCPServer:
+        release = threading.Event()
+        handler = type("Handler", (HoldingHandler,), {"release": release})
+        server = ThreadingTCPServer(("127.0.0.1", 0), handler, **limits)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.addCleanup(release.set)
+        self.release = release
+        return server
+
+    def _connect(self, server: ThreadingTCPServer) -> socket.socket:
+        client = socket.create_connection(server.server_address)
+        client.settimeout(5)
+        self.addCleanup(client.close)
+        return client
+
+    def test_burst_beyond_the_workers_is_queued_then_served(self):
+        server = self._start(max_connections=1, queue_size=2)
+        depth = ACCEPT_QUEUE_DEPTH.get()
+        clients = [self._connect(server) for _ in range(3)]
+        self.assertEqual(clients[0].recv(6), b"served")
+        wait_for(lambda: ACCEPT_QUEUE_DEPTH.get() == depth + 2)
+
+        self.release.set()
+        for client in clients[1:]:
+            self.assertEqual(client.recv(6), b"served")
+        self.assertEqual(server._workers, 1)
+
+    def test_connections_beyond_the_queue_are_refused(self):
+        server = self._start(max_connections=1, queue_size=1)
+        refused = CONNECTIONS_REJECTED.labels("queue_full").get()
+        served, queued, extra = (self._connect(server) for _ in range(3))
+        self.assertEqual(served.recv(6), b"served")
+        self.assertEqual(extra.recv(6), b"")
+        self.assertEqual(CONNECTIONS_REJECTED.labels("queue_full").get(), refused + 1)
+
+        self.release.set()
+        self.assertEqual(queued.recv(6), b"served")
+
+    def test_connections_that_waited_too_long_are_closed(self):
+        server = self._start(max_connections=1, queue_size=4, queue_timeout=0.1)
+        timed_out = CONNECTIONS_REJECTED.labels("queue_timeout").get()
+        served, waiting = self._connect(server), self._connect(server)
+        self.assertEqual(served.recv(6), b"served")
+        threading.Timer(0.3, self.release.set).start()
+        self.assertEqual(waiting.recv(6), b"")
+        self.assertEqual(CONNECTIONS_REJECTED.labels("queue_timeout").get(), timed_out + 1)
+
+    def test_limits_belong_to_each_server(self):
+        small = self._start(max_connections=1, queue_size=0)
+        large = self._start(max_connections=3, queue_size=0)
+        self.assertEqual(self._connect(small).recv(6), b"served")
+        self.assertEqual(self._connect(small).recv(6), b"")
+        for _ in range(3):
+            self.assertEqual(self._connect(large).recv(6), b"served")
+
+    def test_close_drops_queued_connections(self):
+        server = self._start(max_connections=1, queue_size=2)
+        served, queued = self._connect(server), self._connect(server)
+        self.assertEqual(served.recv(6), b"served")
+        wait_for(lambda: len(server._queue) == 1)
+        server.shutdown()
+        server.server_close()
+        self.assertEqual(queued.recv(6), b"")
+
+    def test_queue_depth_never_goes_negative_and_returns_to_zero(self):
+        readings = []
+
+        class RecordingGauge(Gauge):
+            def inc(self, amount: float = 1) -> None:
+                # Widens the window in which a worker could take a connection not yet counted
+                time.sleep(0.005)
+                super().inc(amount)
+
+            def dec(self, amount: float = 1) -> None:
+                super().dec(amount)
+                readings.append(self.get())
+
+        depth = RecordingGauge("accept_queue_depth", "Queue depth.", registry=Registry())
+        patcher = patch("src.server.ACCEPT_QUEUE_DEPTH", depth)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        server = self._start(max_connections=4, queue_size=64)
+        self.release.set()
+
+        clients = []
+        connectors = [
+            threading.Thread(target=lambda: clients.extend(self._connect(server) for _ in range(5)))
+            for _ in range(2)
+        ]
+        for connector in connectors:
+            connector.start()
+        for connector in connectors:
+            connector.join()
+        for client in clients:
+            self.assertEqual(client.recv(6), b"served")
+
+        wait_for(lambda: len(readings) == 10)
+        self.assertGreaterEqual(min(readings), 0)
+        self.assertEqual(depth.get(), 0)
+
+
 if __name__ == "__main__":
     unittest.main()
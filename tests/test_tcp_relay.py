@@ -1,13 +1,26 @@
 import socket
 import selectors
+import threading
+import time
 import unittest
 from unittest.mock import MagicMock, patch
 
-from src.constants import AddressTypeCodes
+from src.constants import AddressTypeCodes, RELAY_BUFFER_MAX_SIZE, TCP_RELAY_MAX_PENDING
 from src.models import DetailedAddress
+from src.relays import tcp_relay
 from src.relays.tcp_relay import TCPRelay
 
 
+def tcp_socket_pair() -> tuple[socket.socket, socket.socket]:
+    """Returns two ends of a loopback TCP connection."""
+    with socket.socket() as listener:
+        listener.bind(("127.0.0.1", 0))
+        listener.listen(1)
+        client = socket.create_connection(listener.getsockname())
+        server, _ = listener.accept()
+    return client, server
+
+
 class TestTCPRelay(unittest.TestCase):
     @patch("src.relays.tcp_relay.selectors.DefaultSelector")
     @patch("src.relays.tcp_relay.generate_tcp_socket")
@@ -58,6 +71,47 @@ class TestTCPRelay(unittest.TestCase):
             TCPRelay(client_conn, dst)
 
         mock_selector.close.assert_called_once()
+        mock_gen_socket.return_value.close.assert_called_once()
+
+    @patch("src.relays.tcp_relay.selectors.DefaultSelector")
+    @patch("src.relays.tcp_relay.generate_tcp_socket")
+    @patch("src.relays.tcp_relay.acquire_pooled_connection")
+    def test_pooled_connection_skips_connect(self, mock_acquire, mock_gen_socket, _):
+        pooled = MagicMock()
+        pooled.family = socket.AF_INET
+        pooled.getpeername.return_value = ("10.0.0.5", 8080)
+        pooled.getsockname.return_value = ("10.0.0.1", 5000)
+        mock_acquire.return_value = pooled
+
+        dst = DetailedAddress(
+            name="backend.internal", ip="10.0.0.5", port=8080,
+            address_type=AddressTypeCodes.IPv4,
+        )
+        relay = TCPRelay(MagicMock(), dst)
+
+        self.assertIs(relay.proxy_connection, pooled)
+        mock_gen_socket.assert_not_called()
+        pooled.connect.assert_not_called()
+
+    @patch("src.relays.tcp_relay.selectors.DefaultSelector")
+    @patch("src.relays.tcp_relay.happy_eyeballs_connect")
+    def test_multiple_candidates_race_and_update_destination(self, mock_connect, _):
+        proxy_sock = MagicMock()
+        proxy_sock.family = socket.AF_INET6
+        proxy_sock.getpeername.return_value = ("2001:db8::1", 443, 0, 0)
+        proxy_sock.getsockname.return_value = ("::", 5000, 0, 0)
+        mock_connect.return_value = proxy_sock
+
+        dst = DetailedAddress(
+            name="dual.example.com", ip="192.0.2.1", port=443,
+            address_type=AddressTypeCodes.IPv4,
+            candidates=["192.0.2.1", "2001:db8::1"],
+        )
+        TCPRelay(MagicMock(), dst)
+
+        mock_connect.assert_called_once_with("dual.example.com", ["192.0.2.1", "2001:db8::1"], 443)
+        self.assertEqual(dst.ip, "2001:db8::1")
+        self.assertEqual(dst.address_type, AddressTypeCodes.IPv6)
 
     def test_relay_data_eof_triggers_cleanup(self):
         relay, client, proxy, selector = self._create_relay()
@@ -66,7 +120,7 @@ class TestTCPRelay(unittest.TestCase):
         mock_key.fileobj = client
 
         selector.select.return_value = [(mock_key, selectors.EVENT_READ)]
-        client.recv.return_value = b""  # EOF
+        client.recv_into.return_value = 0  # EOF
 
         relay.listen_and_relay()
         # Cleanup should close selector
@@ -78,7 +132,7 @@ class TestTCPRelay(unittest.TestCase):
         mock_key = MagicMock()
         mock_key.fileobj = client
         selector.select.return_value = [(mock_key, selectors.EVENT_READ)]
-        client.recv.side_effect = BrokenPipeError("broken pipe")
+        client.recv_into.side_effect = BrokenPipeError("broken pipe")
 
         relay.listen_and_relay()
         selector.close.assert_called()
@@ -89,7 +143,7 @@ class TestTCPRelay(unittest.TestCase):
         mock_key = MagicMock()
         mock_key.fileobj = client
         selector.select.return_value = [(mock_key, selectors.EVENT_READ)]
-        client.recv.side_effect = ConnectionResetError("reset")
+        client.recv_into.side_effect = ConnectionResetError("reset")
 
         relay.listen_and_relay()
         selector.close.assert_called()
@@ -120,15 +174,42 @@ class TestTCPRelay(unittest.TestCase):
 
     def test_recv_data(self):
         relay, client, proxy, _ = self._create_relay()
-        client.recv.return_value = b"data"
-        result = relay._recv_data(client)
-        self.assertEqual(result, b"data")
+        buffer = memoryview(bytearray(16))
+        client.recv_into.return_value = 4
+        result = relay._recv_data(client, buffer)
+        self.assertEqual(result, 4)
+        client.recv_into.assert_called_once_with(buffer)
 
     def test_recv_data_raises_on_error(self):
         relay, client, proxy, _ = self._create_relay()
-        client.recv.side_effect = socket.error("recv failed")
+        client.recv_into.side_effect = socket.error("recv failed")
         with self.assertRaises(socket.error):
-            relay._recv_data(client)
+            relay._recv_data(client, memoryview(bytearray(16)))
+
+    def test_buffers_are_reused_per_direction(self):
+        relay, client, proxy, _ = self._create_relay()
+        self.assertIs(relay._get_buffer(client), relay._get_buffer(client))
+        self.assertIsNot(relay._get_buffer(client), relay._get_buffer(proxy))
+
+    def test_read_size_grows_while_reads_fill_it_and_resets_when_idle(self):
+        relay, client, proxy, selector = self._create_relay()
+
+        mock_key = MagicMock()
+        mock_key.fileobj = client
+        readable = [(mock_key, selectors.EVENT_READ)]
+        selector.select.side_effect = [readable] * 3 + [[]] + [readable] * 2
+        read_sizes = []
+
+        def recv_into(buffer):
+            read_sizes.append(len(buffer))
+            return len(buffer) if len(read_sizes) < 5 else 0
+
+        client.recv_into.side_effect = recv_into
+        proxy.send.side_effect = len
+
+        relay.listen_and_relay()
+
+        self.assertEqual(read_sizes, [4096, 8192, 16384, 4096, 8192])
 
     def test_relay_forwards_data_between_sockets(self):
         relay, client, proxy, selector = self._create_relay()
@@ -143,12 +224,255 @@ class TestTCPRelay(unittest.TestCase):
             [(mock_key_client, selectors.EVENT_READ)],
             [(mock_key_eof, selectors.EVENT_READ)],
         ]
-        client.recv.side_effect = [b"request data", b""]
-        proxy.send.return_value = 12
+        chunks = [b"request data", b""]
+
+        def recv_into(buffer):
+            chunk = chunks.pop(0)
+            buffer[:len(chunk)] = chunk
+            return len(chunk)
+
+        client.recv_into.side_effect = recv_into
+        sent = []
+        proxy.send.side_effect = lambda view: sent.append(bytes(view)) or len(view)
+
+        relay.listen_and_relay()
+
+        self.assertEqual(sent, [b"request data"])
+
+    def test_relay_partial_send_resumes_from_offset(self):
+        relay, client, proxy, selector = self._create_relay()
+
+        mock_key = MagicMock()
+        mock_key.fileobj = client
+        selector.select.return_value = [(mock_key, selectors.EVENT_READ)]
+
+        chunks = [b"0123456789", b""]
+
+        def recv_into(buffer):
+            chunk = chunks.pop(0)
+            buffer[:len(chunk)] = chunk
+            return len(chunk)
+
+        client.recv_into.side_effect = recv_into
+        sent = []
+
+        def partial_send(view):
+            sent.append(bytes(view))
+            return min(4, len(view))
+
+        proxy.send.side_effect = partial_send
+
+        relay.listen_and_relay()
+
+        self.assertEqual(sent, [b"0123456789", b"456789", b"89"])
+
+    def test_blocked_send_keeps_data_pending_until_writable(self):
+        relay, client, proxy, selector = self._create_relay()
+
+        client_key, proxy_key = MagicMock(fileobj=client), MagicMock(fileobj=proxy)
+        selector.select.side_effect = [
+            [(client_key, selectors.EVENT_READ)],
+            [(proxy_key, selectors.EVENT_WRITE)],
+            [(client_key, selectors.EVENT_READ)],
+        ]
+        chunks = [b"request data", b""]
+
+        def recv_into(buffer):
+            chunk = chunks.pop(0)
+            buffer[:len(chunk)] = chunk
+            return len(chunk)
+
+        client.recv_into.side_effect = recv_into
+        sent = []
+
+        def send(data):
+            result = next(responses)
+            if isinstance(result, Exception):
+                raise result
+            sent.append(bytes(data))
+            return result
+
+        responses = iter([BlockingIOError(), 12])
+        proxy.send.side_effect = send
+
+        relay.listen_and_relay()
+
+        self.assertEqual(sent, [b"request data"])
+        selector.modify.assert_any_call(proxy, selectors.EVENT_READ | selectors.EVENT_WRITE)
+        selector.modify.assert_any_call(proxy, selectors.EVENT_READ)
+
+    @patch("src.relays.tcp_relay.TCP_RELAY_MAX_PENDING", 8)
+    def test_reading_pauses_while_pending_is_at_the_cap(self):
+        relay, client, proxy, selector = self._create_relay()
+
+        client_key, proxy_key = MagicMock(fileobj=client), MagicMock(fileobj=proxy)
+        selector.select.side_effect = [
+            [(client_key, selectors.EVENT_READ)],
+            [(proxy_key, selectors.EVENT_WRITE)],
+            [(client_key, selectors.EVENT_READ)],
+        ]
+        chunks = [b"0123456789", b""]
+
+        def recv_into(buffer):
+            chunk = chunks.pop(0)
+            buffer[:len(chunk)] = chunk
+            return len(chunk)
+
+        client.recv_into.side_effect = recv_into
+        responses = iter([BlockingIOError(), 10])
+
+        def send(data):
+            result = next(responses)
+            if isinstance(result, Exception):
+                raise result
+            return result
+
+        proxy.send.side_effect = send
 
         relay.listen_and_relay()
 
-        proxy.send.assert_called_once_with(b"request data")
+        # The client is unwatched while 10 bytes wait for the proxy, then watched again
+        selector.unregister.assert_any_call(client)
+        selector.register.assert_any_call(client, selectors.EVENT_READ)
+        self.assertEqual(relay._pending, {})
+
+
+class SlowConsumerMixin:
+    """A destination that stops reading while the client keeps sending."""
+
+    relay_mode: str
+
+    def setUp(self):
+        self.listener = socket.socket()
+        self.listener.bind(("127.0.0.1", 0))
+        self.listener.listen(1)
+        self.addCleanup(self.listener.close)
+
+        self.client_app, self.client_conn = tcp_socket_pair()
+        self.addCleanup(self.client_app.close)
+        self.addCleanup(self.client_conn.close)
+
+    def test_slow_destination_gets_backpressure_not_teardown(self):
+        dst = DetailedAddress(
+            name="slow", ip="127.0.0.1", port=self.listener.getsockname()[1],
+            address_type=AddressTypeCodes.IPv4,
+        )
+        relay = TCPRelay(self.client_conn, dst, relay_mode=self.relay_mode)
+        upstream, _ = self.listener.accept()
+        self.addCleanup(upstream.close)
+        worker = threading.Thread(target=relay.listen_and_relay)
+        worker.start()
+
+        payload = bytes(range(256)) * 262144  # 64 MiB, more than the socket buffers hold
+        sender = threading.Thread(target=self.client_app.sendall, args=(payload,))
+        sender.start()
+        time.sleep(0.5)
+
+        # The client is held back instead of the relay buffering or dropping the payload
+        self.assertTrue(worker.is_alive())
+        self.assertTrue(sender.is_alive())
+        self.assertLessEqual(
+            relay._pending_bytes(relay.proxy_connection), TCP_RELAY_MAX_PENDING + RELAY_BUFFER_MAX_SIZE
+        )
+
+        received = bytearray()
+        while len(received) < len(payload):
+            received += upstream.recv(1 << 20)
+        sender.join(timeout=5)
+        self.assertEqual(bytes(received), payload)
+
+        self.client_app.shutdown(socket.SHUT_WR)
+        worker.join(timeout=5)
+        self.assertFalse(worker.is_alive())
+
+    def test_early_data_waits_for_the_destination_without_blocking(self):
+        dst = DetailedAddress(
+            name="slow", ip="127.0.0.1", port=self.listener.getsockname()[1],
+            address_type=AddressTypeCodes.IPv4,
+        )
+        relay = TCPRelay(self.client_conn, dst, relay_mode=self.relay_mode)
+        upstream, _ = self.listener.accept()
+        self.addCleanup(upstream.close)
+
+        early_data = bytes(range(256)) * 16
+        relay.forward_early_data(early_data)
+        self.assertEqual(relay._pending_bytes(relay.proxy_connection), len(early_data))
+
+        worker = threading.Thread(target=relay.listen_and_relay)
+        worker.start()
+        self.client_app.sendall(b"after")
+        received = bytearray()
+        while len(received) < len(early_data) + 5:
+            received += upstream.recv(65536)
+        self.assertEqual(bytes(received), early_data + b"after")
+
+        self.client_app.shutdown(socket.SHUT_WR)
+        worker.join(timeout=5)
+        self.assertFalse(worker.is_alive())
+
+
+class TestTCPRelayCopyBackpressure(SlowConsumerMixin, unittest.TestCase):
+    relay_mode = "copy"
+
+
+@unittest.skipUnless(tcp_relay.SPLICE_AVAILABLE, "os.splice not available")
+class TestTCPRelaySpliceBackpressure(SlowConsumerMixin, unittest.TestCase):
+    relay_mode = "splice"
+
+
+class TestTCPRelayModeSelection(unittest.TestCase):
+    def test_copy_mode_is_always_copy(self):
+        self.assertEqual(TCPRelay._select_relay_mode("copy"), "copy")
+
+    @patch("src.relays.tcp_relay.SPLICE_AVAILABLE", True)
+    def test_auto_prefers_splice_when_available(self):
+        self.assertEqual(TCPRelay._select_relay_mode("auto"), "splice")
+
+    @patch("src.relays.tcp_relay.SPLICE_AVAILABLE", False)
+    def test_splice_falls_back_to_copy_when_unavailable(self):
+        self.assertEqual(TCPRelay._select_relay_mode("splice"), "copy")
+        self.assertEqual(TCPRelay._select_relay_mode("auto"), "copy")
+
+
+@unittest.skipUnless(tcp_relay.SPLICE_AVAILABLE, "os.splice not available")
+class TestTCPRelaySplice(unittest.TestCase):
+    def setUp(self):
+        self.listener = socket.socket()
+        self.listener.bind(("127.0.0.1", 0))
+        self.listener.listen(1)
+        self.addCleanup(self.listener.close)
+
+        self.client_app, self.client_conn = tcp_socket_pair()
+        self.addCleanup(self.client_app.close)
+        self.addCleanup(self.client_conn.close)
+
+    def test_splice_relays_both_directions(self):
+        dst = DetailedAddress(
+            name="sink", ip="127.0.0.1", port=self.listener.getsockname()[1],
+            address_type=AddressTypeCodes.IPv4,
+        )
+        relay = TCPRelay(self.client_conn, dst, relay_mode="splice")
+        self.assertEqual(relay.relay_mode, "splice")
+        upstream, _ = self.listener.accept()
+        self.addCleanup(upstream.close)
+
+        worker = threading.Thread(target=relay.listen_and_relay)
+        worker.start()
+
+        payload = bytes(range(256)) * 1024
+        self.client_app.sendall(payload)
+        received = bytearray()
+        while len(received) < len(payload):
+            received += upstream.recv(65536)
+        self.assertEqual(bytes(received), payload)
+
+        upstream.sendall(b"response")
+        self.assertEqual(self.client_app.recv(1024), b"response")
+
+        self.client_app.shutdown(socket.SHUT_WR)
+        worker.join(timeout=5)
+        self.assertFalse(worker.is_alive())
+        self.assertEqual(relay._pipes, {})
 
 
 if __name__ == "__main__":
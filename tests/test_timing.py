@@ -0,0 +1,152 @@
+import asyncio
+import socket
+import struct
+import threading
+import unittest
+from unittest.mock import patch
+
+from src.async_server import AsyncTCPServer
+from src.resolver import get_resolver
+from src.server import ThreadingTCPServer, TCPProxyServer
+from src.timing import SESSION_PHASE_SECONDS, SessionTimer
+
+from .test_async_server import start_echo_server
+from .test_pool import FakeClock, wait_for
+
+_getaddrinfo = socket.getaddrinfo
+
+SETUP_PHASES = ("accept", "negotiation", "request", "dns", "connect", "reply", "first_byte")
+
+
+def phase_count(phase: str) -> int:
+    return sum(SESSION_PHASE_SECONDS.labels(phase).snapshot()[0])
+
+
+def fake_getaddrinfo(host, *args, **kwargs):
+    if host == "timed.example.com":
+        return [(socket.AF_INET, socket.SOCK_STREAM, 0, "", ("127.0.0.1", 0))]
+    return _getaddrinfo(host, *args, **kwargs)
+
+
+def connect_request(name: bytes, port: int) -> bytes:
+    return b"\x05\x01\x00\x03" + bytes([len(name)]) + name + struct.pack("!H", port)
+
+
+class TestSessionTimer(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.timer = SessionTimer(started=-0.5, clock=self.clock)
+
+    def test_phases_last_from_the_previous_mark(self):
+        self.timer.mark("accept")
+        self.clock.now = 2.0
+        self.timer.mark("negotiation")
+        self.assertEqual(self.timer.durations, {"accept": 0.5, "negotiation": 2.0})
+        self.assertEqual(self.timer.total, 2.5)
+
+    def test_marking_a_phase_again_adds_to_it(self):
+        self.clock.now = 1.0
+        self.timer.mark("request")
+        self.clock.now = 3.0
+        self.timer.mark("dns")
+        self.clock.now = 3.5
+        self.timer.mark("request")
+        self.assertEqual(self.timer.durations, {"request": 2.0, "dns": 2.0})
+
+    def test_finish_records_phases_once(self):
+        before = phase_count("connect")
+        self.timer.mark("connect")
+        self.timer.finish()
+        self.timer.finish()
+        self.assertEqual(phase_count("connect"), before + 1)
+
+    def test_slow_session_is_logged_with_its_breakdown(self):
+        self.timer.peer = ("127.0.0.1", 5000)
+        self.timer.mark("accept")
+        self.clock.now = 1.5
+        self.timer.mark("dns")
+        with patch("src.timing.ProxyConfiguration.get_slow_session_threshold", return_value=1.0):
+            with self.assertLogs("src.timing", level="WARNING") as logs:
+                self.timer.first_byte()
+        self.assertEqual(
+            logs.records[0].getMessage(),
+            "SLOW SESSION | 127.0.0.1:5000 -> ? | 2000.0 ms | "
+            "accept=500.0ms dns=1500.0ms first_byte=0.0ms",
+        )
+
+    def test_fast_session_and_disabled_threshold_are_not_logged(self):
+        for threshold in (5.0, 0):
+            timer = SessionTimer(clock=self.clock)
+            self.clock.now += 2.0
+            timer.mark("dns")
+            with patch("src.timing.ProxyConfiguration.get_slow_session_threshold", return_value=threshold):
+                with self.assertNoLogs("src.timing", level="WARNING"):
+                    timer.finish()
+
+
+class TestThreadedSessionPhases(unittest.TestCase):
+    @patch("src.resolver.socket.getaddrinfo", fake_getaddrinfo)
+    def test_connect_records_every_setup_phase(self):
+        get_resolver().clear()
+        self.addCleanup(get_resolver().clear)
+        listener = socket.socket()
+        listener.bind(("127.0.0.1", 0))
+        listener.listen(1)
+        self.addCleanup(listener.close)
+
+        server = ThreadingTCPServer(("127.0.0.1", 0), TCPProxyServer)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+        before = {phase: phase_count(phase) for phase in SETUP_PHASES}
+        with socket.create_connection(server.server_address) as client:
+            client.sendall(b"\x05\x01\x00")
+            self.assertEqual(client.recv(2), b"\x05\x00")
+            client.sendall(connect_request(b"timed.example.com", listener.getsockname()[1]))
+            self.assertEqual(client.recv(10)[:2], b"\x05\x00")
+            remote, _ = listener.accept()
+            self.addCleanup(remote.close)
+            client.sendall(b"ping")
+            self.assertEqual(remote.recv(4), b"ping")
+            wait_for(lambda: phase_count("first_byte") == before["first_byte"] + 1)
+
+        for phase in SETUP_PHASES:
+            self.assertEqual(phase_count(phase), before[phase] + 1, phase)
+        self.assertEqual(server._accepted_at, {})
+
+
+class TestAsyncSessionPhases(unittest.IsolatedAsyncioTestCase):
+    @patch("src.resolver.socket.getaddrinfo", fake_getaddrinfo)
+    async def test_connect_records_every_setup_phase(self):
+        get_resolver().clear()
+        self.addCleanup(get_resolver().clear)
+        echo_server, echo_port = await start_echo_server()
+        self.addAsyncCleanup(echo_server.wait_closed)
+        self.addCleanup(echo_server.close)
+
+        server = AsyncTCPServer(("127.0.0.1", 0))
+        await server.start()
+        serve_task = asyncio.ensure_future(server.serve_forever())
+        self.addAsyncCleanup(server.close)
+        self.addCleanup(serve_task.cancel)
+
+        before = {phase: phase_count(phase) for phase in SETUP_PHASES}
+        reader, writer = await asyncio.open_connection(*server.server_address)
+        writer.write(b"\x05\x01\x00")
+        writer.write(connect_request(b"timed.example.com", echo_port))
+        await writer.drain()
+        self.assertEqual(await reader.readexactly(2), b"\x05\x00")
+        self.assertEqual((await reader.readexactly(10))[:2], b"\x05\x00")
+        writer.write(b"ping")
+        await writer.drain()
+        self.assertEqual(await reader.readexactly(4), b"ping")
+        writer.close()
+        await writer.wait_closed()
+
+        for phase in SETUP_PHASES:
+            self.assertEqual(phase_count(phase), before[phase] + 1, phase)
+
+
+if __name__ == "__main__":
+    unittest.main()
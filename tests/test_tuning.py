@@ -0,0 +1,104 @@
+import socket
+import unittest
+from unittest.mock import MagicMock, patch
+
+from src.config import ProxyConfiguration
+from src.constants import AddressTypeCodes
+from src.models import DetailedAddress
+from src.relays.tcp_relay import TCPRelay
+from src.tuning import (
+    PROFILES,
+    SocketProfile,
+    apply_socket_profile,
+    destination_profile,
+    tune_relay_sockets,
+)
+
+from .test_tcp_relay import tcp_socket_pair
+
+
+def configured_profiles(listener: str, ports: dict[int, str]):
+    return patch.multiple(ProxyConfiguration, _socket_profile=listener, _port_profiles=ports)
+
+
+class TestApplySocketProfile(unittest.TestCase):
+    def setUp(self):
+        self.client, self.server = tcp_socket_pair()
+        self.addCleanup(self.client.close)
+        self.addCleanup(self.server.close)
+
+    def test_interactive_profile_sets_its_options(self):
+        apply_socket_profile(self.client, PROFILES["interactive"])
+        self.assertEqual(self.client.getsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY), 1)
+        self.assertEqual(self.client.getsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE), 1)
+        if hasattr(socket, "TCP_KEEPIDLE"):
+            self.assertEqual(self.client.getsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE), 60)
+        if hasattr(socket, "TCP_USER_TIMEOUT"):
+            self.assertEqual(
+                self.client.getsockopt(socket.IPPROTO_TCP, socket.TCP_USER_TIMEOUT), 30000
+            )
+
+    def test_bulk_profile_sets_buffer_sizes(self):
+        before = self.client.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+        apply_socket_profile(self.client, SocketProfile(rcvbuf=before * 4))
+        self.assertGreater(self.client.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF), before)
+
+    def test_default_profile_sets_nothing(self):
+        sock = MagicMock()
+        apply_socket_profile(sock, PROFILES["default"])
+        sock.setsockopt.assert_not_called()
+
+    def test_rejected_and_missing_options_are_skipped(self):
+        sock = MagicMock()
+        sock.setsockopt.side_effect = [OSError("not supported"), None]
+        with patch("src.tuning.socket.TCP_QUICKACK", None, create=True):
+            apply_socket_profile(sock, SocketProfile(nodelay=True, quickack=True, keepalive=True))
+        self.assertEqual(sock.setsockopt.call_count, 2)
+        sock.setsockopt.assert_called_with(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+
+
+class TestProfileSelection(unittest.TestCase):
+    def test_destination_port_overrides_the_listener_profile(self):
+        with configured_profiles("bulk", {22: "interactive"}):
+            self.assertIs(destination_profile(22), PROFILES["interactive"])
+            self.assertIs(destination_profile(443), PROFILES["bulk"])
+
+    def test_client_socket_is_retuned_only_for_a_different_profile(self):
+        client, upstream = MagicMock(), MagicMock()
+        with configured_profiles("interactive", {5001: "bulk"}):
+            tune_relay_sockets(client, upstream, 5000)
+            client.setsockopt.assert_not_called()
+            upstream.setsockopt.assert_called()
+
+            tune_relay_sockets(client, upstream, 5001)
+            client.setsockopt.assert_any_call(socket.SOL_SOCKET, socket.SO_SNDBUF, 4194304)
+
+
+class TestRelaySocketTuning(unittest.TestCase):
+    def test_tcp_relay_tunes_both_sides_for_the_destination_port(self):
+        listener = socket.socket()
+        listener.bind(("127.0.0.1", 0))
+        listener.listen(1)
+        self.addCleanup(listener.close)
+        client_app, client_conn = tcp_socket_pair()
+        self.addCleanup(client_app.close)
+        self.addCleanup(client_conn.close)
+        port = listener.getsockname()[1]
+
+        with configured_profiles("default", {port: "interactive"}):
+            relay = TCPRelay(
+                client_conn,
+                DetailedAddress(
+                    name="localhost", ip="127.0.0.1", port=port,
+                    address_type=AddressTypeCodes.IPv4,
+                ),
+            )
+        self.addCleanup(relay._cleanup)
+
+        for sock in (relay.proxy_connection, client_conn):
+            self.assertEqual(sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY), 1)
+            self.assertEqual(sock.getsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
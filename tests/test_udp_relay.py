@@ -1,12 +1,17 @@
 import socket
 import struct
+import threading
 import unittest
+from collections import OrderedDict
 from unittest.mock import MagicMock, patch
 
 from src.constants import AddressTypeCodes
 from src.handlers.udp import UDPHandler
-from src.models import DetailedAddress
-from src.relays.udp_relay import UDPRelay
+from src.models import DetailedAddress, UDPDatagram
+from src.relays.udp_relay import ReassemblyQueue, UDPRelay, permit_destination
+from src.utils.mmsg import DatagramReceiver, DatagramSender
+
+from .test_tcp_relay import tcp_socket_pair
 
 
 def build_udp_datagram(dst_addr: str, dst_port: int, data: bytes, frag: int = 0, atyp: int = 1) -> bytes:
@@ -46,9 +51,99 @@ class TestBuildUDPResponseHeader(unittest.TestCase):
             UDPHandler.build_udp_response_header("not-an-ip", 80)
 
 
+def fragment(frag: int, data: bytes, port: int = 53) -> UDPDatagram:
+    return UDPDatagram(
+        frag=frag, address_type=AddressTypeCodes.IPv4, dst_addr="10.0.0.1", dst_port=port, data=data
+    )
+
+
+class TestReassemblyQueue(unittest.TestCase):
+    def setUp(self):
+        self.now = 0.0
+        self.queue = ReassemblyQueue(timeout=5.0, max_bytes=100, clock=lambda: self.now)
+
+    def test_standalone_datagram_passes_through(self):
+        datagram = fragment(0, b"whole")
+        self.assertIs(self.queue.add(datagram), datagram)
+
+    def test_fragments_are_joined_at_end_of_sequence(self):
+        self.assertIsNone(self.queue.add(fragment(1, b"ab")))
+        self.assertIsNone(self.queue.add(fragment(2, b"cd")))
+        datagram = self.queue.add(fragment(0x83, b"ef"))
+        self.assertEqual((datagram.frag, datagram.data), (0, b"abcdef"))
+        self.assertEqual((datagram.dst_addr, datagram.dst_port), ("10.0.0.1", 53))
+        self.assertIsNone(self.queue.deadline)
+
+    def test_single_fragment_sequence(self):
+        self.assertEqual(self.queue.add(fragment(0x81, b"only")).data, b"only")
+
+    def test_lower_frag_abandons_queue(self):
+        self.queue.add(fragment(1, b"stale"))
+        self.queue.add(fragment(2, b"stale"))
+        self.assertIsNone(self.queue.add(fragment(1, b"ab")))
+        self.assertEqual(self.queue.add(fragment(0x82, b"cd")).data, b"abcd")
+
+    def test_standalone_datagram_abandons_queue(self):
+        self.queue.add(fragment(1, b"stale"))
+        self.assertEqual(self.queue.add(fragment(0, b"whole")).data, b"whole")
+        self.assertIsNone(self.queue.add(fragment(0x82, b"orphan")))
+
+    def test_gap_in_sequence_abandons_queue(self):
+        self.queue.add(fragment(1, b"ab"))
+        self.assertIsNone(self.queue.add(fragment(0x83, b"ef")))
+        self.assertIsNone(self.queue.deadline)
+
+    def test_fragment_without_its_first_is_dropped(self):
+        self.assertIsNone(self.queue.add(fragment(2, b"cd")))
+        self.assertIsNone(self.queue.deadline)
+
+    def test_destination_change_abandons_queue(self):
+        self.queue.add(fragment(1, b"ab"))
+        self.assertIsNone(self.queue.add(fragment(0x82, b"cd", port=54)))
+        self.assertIsNone(self.queue.deadline)
+
+    def test_timer_expiry_abandons_queue(self):
+        self.queue.add(fragment(1, b"ab"))
+        self.assertEqual(self.queue.deadline, 5.0)
+        self.now = 5.0
+        self.queue.expire()
+        self.assertIsNone(self.queue.deadline)
+        self.assertIsNone(self.queue.add(fragment(0x82, b"cd")))
+
+    def test_sequence_larger_than_max_bytes_is_abandoned(self):
+        self.queue.add(fragment(1, b"x" * 60))
+        self.assertIsNone(self.queue.add(fragment(0x82, b"x" * 60)))
+        self.assertIsNone(self.queue.deadline)
+
+
+class UDPEcho:
+    """Loopback UDP server that echoes every datagram back to its sender."""
+
+    def __init__(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(("127.0.0.1", 0))
+        self.port = self.sock.getsockname()[1]
+        self.received = 0
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                data, addr = self.sock.recvfrom(65535)
+            except OSError:
+                return
+            self.received += 1
+            self.sock.sendto(data, addr)
+
+    def close(self):
+        self.sock.close()
+
+
 class TestUDPRelay(unittest.TestCase):
+    @patch("src.relays.udp_relay.selectors.DefaultSelector")
     @patch("src.relays.udp_relay.generate_udp_socket")
-    def test_init_creates_and_binds_socket(self, mock_gen_socket):
+    def test_init_creates_and_binds_socket(self, mock_gen_socket, _):
         mock_sock = MagicMock()
         mock_sock.getsockname.return_value = ("0.0.0.0", 5000)
         mock_gen_socket.return_value = mock_sock
@@ -65,128 +160,151 @@ class TestUDPRelay(unittest.TestCase):
         self.assertEqual(relay.get_proxy_address().ip, "0.0.0.0")
         self.assertEqual(relay.get_proxy_address().port, 5000)
 
-    @patch("src.relays.udp_relay.generate_udp_socket")
-    def test_listen_and_relay_forwards_packet(self, mock_gen_socket):
-        mock_proxy_sock = MagicMock()
-        mock_proxy_sock.getsockname.return_value = ("0.0.0.0", 5000)
-        mock_gen_socket.return_value = mock_proxy_sock
+    def test_destination_table_is_bounded(self):
+        destinations = OrderedDict()
+        with patch("src.relays.udp_relay.UDP_MAX_DESTINATIONS", 2):
+            for port in (1, 2, 1, 3):
+                permit_destination(destinations, ("127.0.0.1", port))
+        self.assertEqual(list(destinations), [("127.0.0.1", 1), ("127.0.0.1", 3)])
 
-        client_conn = MagicMock()
-        client_conn.getpeername.return_value = ("127.0.0.1", 1234)
-        dst = DetailedAddress(
-            name="test", ip="1.2.3.4", port=80,
-            address_type=AddressTypeCodes.IPv4,
-        )
-        relay = UDPRelay(client_conn, dst)
 
-        # Build a valid UDP datagram
-        datagram = build_udp_datagram("10.0.0.1", 53, b"hello")
-        client_addr = ("127.0.0.1", 1234)
-
-        # First recvfrom returns the datagram, second raises timeout to exit loop
-        mock_proxy_sock.recvfrom.side_effect = [
-            (datagram, client_addr),
-            socket.timeout("done"),
-        ]
-
-        # Mock the forward socket created inside listen_and_relay
-        mock_fwd_sock = MagicMock()
-        mock_fwd_sock.recvfrom.return_value = (b"response", ("10.0.0.1", 53))
-        mock_fwd_sock.__enter__ = MagicMock(return_value=mock_fwd_sock)
-        mock_fwd_sock.__exit__ = MagicMock(return_value=False)
-
-        with patch("src.relays.udp_relay.socket.socket", return_value=mock_fwd_sock):
-            relay.listen_and_relay()
-
-        # Verify data was sent to correct destination
-        mock_fwd_sock.sendto.assert_called_once_with(b"hello", ("10.0.0.1", 53))
-        # Verify response was SOCKS5-encapsulated before sending back to client
-        sent_data = mock_proxy_sock.sendto.call_args[0][0]
-        # RSV(2) + FRAG(1) + ATYP(1)=IPv4 + ADDR(4) + PORT(2) + DATA
-        expected_header = (
-            b"\x00\x00\x00\x01"
-            + socket.inet_aton("10.0.0.1")
-            + struct.pack("!H", 53)
-        )
-        self.assertTrue(sent_data.startswith(expected_header))
-        self.assertTrue(sent_data.endswith(b"response"))
+class TestUDPRelayAssociation(unittest.TestCase):
+    """Runs a UDPRelay over real loopback sockets, with its control connection."""
 
-    @patch("src.relays.udp_relay.generate_udp_socket")
-    def test_listen_and_relay_drops_fragmented_datagrams(self, mock_gen_socket):
-        mock_proxy_sock = MagicMock()
-        mock_proxy_sock.getsockname.return_value = ("0.0.0.0", 5000)
-        mock_gen_socket.return_value = mock_proxy_sock
+    def setUp(self):
+        self.control_client, control_server = tcp_socket_pair()
+        self.addCleanup(self.control_client.close)
+        self.addCleanup(control_server.close)
 
-        client_conn = MagicMock()
-        client_conn.getpeername.return_value = ("127.0.0.1", 1234)
         dst = DetailedAddress(
-            name="test", ip="1.2.3.4", port=80,
+            name="0.0.0.0", ip="0.0.0.0", port=0,
             address_type=AddressTypeCodes.IPv4,
         )
-        relay = UDPRelay(client_conn, dst)
-
-        # Build a fragmented datagram (frag != 0)
-        frag_datagram = build_udp_datagram("10.0.0.1", 53, b"data", frag=1)
-        client_addr = ("127.0.0.1", 1234)
-
-        mock_proxy_sock.recvfrom.side_effect = [
-            (frag_datagram, client_addr),
-            socket.timeout("done"),
-        ]
-
-        with patch("src.relays.udp_relay.socket.socket") as mock_socket_cls:
-            relay.listen_and_relay()
-            # Should NOT have created any forward socket for fragmented datagram
-            mock_socket_cls.assert_not_called()
-
-    @patch("src.relays.udp_relay.generate_udp_socket")
-    def test_listen_and_relay_handles_socket_error(self, mock_gen_socket):
-        mock_proxy_sock = MagicMock()
-        mock_proxy_sock.getsockname.return_value = ("0.0.0.0", 5000)
-        mock_gen_socket.return_value = mock_proxy_sock
-
-        client_conn = MagicMock()
-        client_conn.getpeername.return_value = ("127.0.0.1", 1234)
-        dst = DetailedAddress(
-            name="test", ip="1.2.3.4", port=80,
-            address_type=AddressTypeCodes.IPv4,
-        )
-        relay = UDPRelay(client_conn, dst)
-
-        # recvfrom raises a socket error
-        mock_proxy_sock.recvfrom.side_effect = OSError("network down")
-
-        # Should not raise — error should be handled gracefully
-        relay.listen_and_relay()
-
-    @patch("src.relays.udp_relay.generate_udp_socket")
-    def test_listen_and_relay_drops_wrong_source_ip(self, mock_gen_socket):
+        self.relay = UDPRelay(control_server, dst)
+        self.relay_address = ("127.0.0.1", self.relay.get_proxy_address().port)
+        self.thread = threading.Thread(target=self.relay.listen_and_relay, daemon=True)
+
+        self.client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.client.settimeout(2)
+        self.addCleanup(self.client.close)
+
+    def _start(self):
+        self.thread.start()
+        self.addCleanup(self.thread.join, 2)
+        self.addCleanup(self.control_client.close)
+
+    def _send(self, port: int, data: bytes, frag: int = 0):
+        self.client.sendto(build_udp_datagram("127.0.0.1", port, data, frag=frag), self.relay_address)
+
+    def test_many_datagrams_and_destinations_share_one_outbound_socket(self):
+        echoes = [UDPEcho(), UDPEcho()]
+        for echo in echoes:
+            self.addCleanup(echo.close)
+        self._start()
+
+        # Nothing waits for a reply before the next datagram goes out
+        for i in range(10):
+            self._send(echoes[i % 2].port, b"ping %d" % i)
+        replies = set()
+        for _ in range(10):
+            replies.add(UDPHandler.parse_udp_datagram(self.client.recv(65535)).data)
+
+        self.assertEqual(replies, {b"ping %d" % i for i in range(10)})
+        self.assertEqual(len(self.relay._outbound), 1)
+
+    def test_relays_batches_without_mmsg(self):
+        self.relay._receiver = DatagramReceiver(batch_size=4, buffer_size=4096, use_mmsg=False)
+        self.relay._sender = DatagramSender(batch_size=4, buffer_size=4096, use_mmsg=False)
+        echo = UDPEcho()
+        self.addCleanup(echo.close)
+        self._start()
+
+        for i in range(10):
+            self._send(echo.port, b"ping %d" % i)
+        replies = {UDPHandler.parse_udp_datagram(self.client.recv(65535)).data for _ in range(10)}
+        self.assertEqual(replies, {b"ping %d" % i for i in range(10)})
+
+    def test_large_datagrams_are_relayed_whole(self):
+        echo = UDPEcho()
+        self.addCleanup(echo.close)
+        self._start()
+
+        payload = bytes(range(256)) * 240  # 61440 bytes, well over a 4 KiB buffer
+        self._send(echo.port, payload)
+        self.assertEqual(UDPHandler.parse_udp_datagram(self.client.recv(65535)).data, payload)
+
+    def test_reply_is_encapsulated_with_remote_address(self):
+        echo = UDPEcho()
+        self.addCleanup(echo.close)
+        self._start()
+
+        self._send(echo.port, b"hello")
+        reply = self.client.recv(65535)
+        expected_header = b"\x00\x00\x00\x01" + socket.inet_aton("127.0.0.1") + struct.pack("!H", echo.port)
+        self.assertEqual(reply, expected_header + b"hello")
+
+    def test_fragmented_datagrams_are_reassembled(self):
+        echo = UDPEcho()
+        self.addCleanup(echo.close)
+        self._start()
+
+        self._send(echo.port, b"frag", frag=1)
+        self._send(echo.port, b"ment", frag=2)
+        self._send(echo.port, b"ed", frag=0x83)
+        self._send(echo.port, b"whole")
+        self.assertTrue(self.client.recv(65535).endswith(b"fragmented"))
+        self.assertTrue(self.client.recv(65535).endswith(b"whole"))
+        self.assertEqual(echo.received, 2)
+
+    def test_incomplete_fragment_sequence_is_not_forwarded(self):
+        echo = UDPEcho()
+        self.addCleanup(echo.close)
+        self._start()
+
+        self._send(echo.port, b"lost", frag=1)
+        self._send(echo.port, b"whole")
+        self.assertTrue(self.client.recv(65535).endswith(b"whole"))
+        self.assertEqual(echo.received, 1)
+
+    def test_datagrams_from_other_sources_are_dropped(self):
         """RFC 1928 Section 7: drop datagrams from IPs other than the client."""
-        mock_proxy_sock = MagicMock()
-        mock_proxy_sock.getsockname.return_value = ("0.0.0.0", 5000)
-        mock_gen_socket.return_value = mock_proxy_sock
-
-        client_conn = MagicMock()
-        client_conn.getpeername.return_value = ("127.0.0.1", 1234)
-        dst = DetailedAddress(
-            name="test", ip="1.2.3.4", port=80,
-            address_type=AddressTypeCodes.IPv4,
-        )
-        relay = UDPRelay(client_conn, dst)
-
-        # Build a valid datagram but from wrong source IP
-        datagram = build_udp_datagram("10.0.0.1", 53, b"injected")
-        wrong_addr = ("192.168.1.99", 5555)
-
-        mock_proxy_sock.recvfrom.side_effect = [
-            (datagram, wrong_addr),
-            socket.timeout("done"),
-        ]
-
-        with patch("src.relays.udp_relay.socket.socket") as mock_socket_cls:
-            relay.listen_and_relay()
-            # Should NOT have forwarded the packet from wrong source
-            mock_socket_cls.assert_not_called()
+        echo = UDPEcho()
+        self.addCleanup(echo.close)
+        self.relay.expected_client_ip = "192.0.2.1"
+        self._start()
+
+        self._send(echo.port, b"injected")
+        self.client.settimeout(0.2)
+        with self.assertRaises(socket.timeout):
+            self.client.recv(65535)
+        self.assertEqual(echo.received, 0)
+
+    def test_replies_from_unknown_remotes_are_dropped(self):
+        echo = UDPEcho()
+        self.addCleanup(echo.close)
+        self._start()
+        self._send(echo.port, b"hello")
+        self.client.recv(65535)
+
+        outbound_port = self.relay._outbound[socket.AF_INET].getsockname()[1]
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as stranger:
+            stranger.sendto(b"unsolicited", ("127.0.0.1", outbound_port))
+        self.client.settimeout(0.2)
+        with self.assertRaises(socket.timeout):
+            self.client.recv(65535)
+
+    def test_association_ends_when_control_connection_closes(self):
+        self._start()
+        self.control_client.close()
+        self.thread.join(timeout=2)
+        self.assertFalse(self.thread.is_alive())
+        self.assertEqual(self.relay.proxy_connection.fileno(), -1)
+
+    @patch("src.relays.udp_relay.UDP_RECV_TIMEOUT", 0.05)
+    def test_association_ends_after_idle_timeout(self):
+        self._start()
+        self.thread.join(timeout=2)
+        self.assertFalse(self.thread.is_alive())
 
 
 if __name__ == "__main__":
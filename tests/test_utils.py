@@ -16,8 +16,14 @@ from src.utils import (
     map_address_enum_to_socket_family,
     generate_succeeded_reply,
     generate_tcp_socket,
+    happy_eyeballs_connect,
+    order_connect_candidates,
+    remember_connect_family,
 )
-from src.constants import AddressTypeCodes, MethodCodes
+from src.utils import replies
+from src.utils.buffers import SHRINK_AFTER, AdaptiveBuffer
+from src.utils.mmsg import MMSG_AVAILABLE, DatagramReceiver, DatagramSender
+from src.constants import AddressTypeCodes, MethodCodes, ReplyCodes
 
 
 class TestErrorUtils(unittest.TestCase):
@@ -291,6 +297,28 @@ class TestSuccessUtils(unittest.TestCase):
         self.assertEqual(expected_reply, expected)
 
 
+class TestReplyCache(unittest.TestCase):
+    def test_every_failure_reply_is_precomputed(self):
+        for address_type in AddressTypeCodes:
+            for error_number in ReplyCodes:
+                reply = replies.generate_failed_reply(address_type, error_number)
+                self.assertEqual(reply, replies._build_failed_reply(address_type, error_number))
+                self.assertEqual(reply[1], error_number.value)
+
+    def test_succeeded_replies_are_cached_by_bind_ip_across_ports(self):
+        replies._succeeded_reply_prefix.cache_clear()
+        first = generate_succeeded_reply(AddressTypeCodes.IPv4, "10.0.0.1", 8080)
+        second = generate_succeeded_reply(AddressTypeCodes.IPv4, "10.0.0.1", 40001)
+        self.assertEqual(first, b"\x05\x00\x00\x01\x0a\x00\x00\x01\x1f\x90")
+        self.assertEqual(second, b"\x05\x00\x00\x01\x0a\x00\x00\x01\x9c\x41")
+        cache_info = replies._succeeded_reply_prefix.cache_info()
+        self.assertEqual((cache_info.hits, cache_info.misses), (1, 1))
+
+    def test_invalid_bind_address_still_raises(self):
+        with self.assertRaises(OSError):
+            generate_succeeded_reply(AddressTypeCodes.IPv4, "not-an-ip", 80)
+
+
 class TestGenerateSocketUtils(unittest.TestCase):
     def test_generate_tcp_socket__ipv4(self):
         sock = generate_tcp_socket(AddressTypeCodes.IPv4)
@@ -317,5 +345,159 @@ class TestGenerateSocketUtils(unittest.TestCase):
             generate_tcp_socket(address.address_type)
 
 
+def ipv6_loopback_available() -> bool:
+    try:
+        with socket.socket(socket.AF_INET6, socket.SOCK_STREAM) as sock:
+            sock.bind(("::1", 0))
+        return True
+    except OSError:
+        return False
+
+
+class TestHappyEyeballs(unittest.TestCase):
+    def setUp(self):
+        self.listener = socket.socket()
+        self.addCleanup(self.listener.close)
+        self.listener.bind(("127.0.0.1", 0))
+        self.listener.listen(8)
+        self.port = self.listener.getsockname()[1]
+
+    def test_order_interleaves_families_starting_with_first_result(self):
+        addresses = ["2001:db8::1", "2001:db8::2", "192.0.2.1", "192.0.2.2"]
+        self.assertEqual(
+            order_connect_candidates("order.example.com", addresses),
+            ["2001:db8::1", "192.0.2.1", "2001:db8::2", "192.0.2.2"],
+        )
+
+    def test_order_prefers_family_that_last_won(self):
+        remember_connect_family("winner.example.com", socket.AF_INET)
+        self.assertEqual(
+            order_connect_candidates("winner.example.com", ["2001:db8::1", "192.0.2.1"]),
+            ["192.0.2.1", "2001:db8::1"],
+        )
+
+    def test_fails_over_to_next_address(self):
+        # 127.0.0.2 is loopback too, but nothing listens there so it refuses at once
+        sock = happy_eyeballs_connect("failover.example.com", ["127.0.0.2", "127.0.0.1"], self.port)
+        self.addCleanup(sock.close)
+        self.assertEqual(sock.getpeername(), ("127.0.0.1", self.port))
+        self.assertTrue(sock.getblocking())
+
+    def test_raises_last_error_when_every_address_fails(self):
+        with self.assertRaises(ConnectionRefusedError):
+            happy_eyeballs_connect("refused.example.com", ["127.0.0.2", "127.0.0.3"], self.port)
+
+    def test_raises_timeout_when_nothing_connects_in_time(self):
+        with self.assertRaises(TimeoutError):
+            happy_eyeballs_connect("slow.example.com", ["127.0.0.1"], self.port, timeout=0)
+
+    @unittest.skipUnless(ipv6_loopback_available(), "IPv6 loopback not available")
+    def test_remembers_winning_family(self):
+        sock = happy_eyeballs_connect("dual.example.com", ["::1", "127.0.0.1"], self.port)
+        self.addCleanup(sock.close)
+        self.assertEqual(sock.family, socket.AF_INET)
+        self.assertEqual(
+            order_connect_candidates("dual.example.com", ["::1", "127.0.0.1"]),
+            ["127.0.0.1", "::1"],
+        )
+
+
+class TestBatchedDatagramIO(unittest.TestCase):
+    def _udp_pair(self, family: int, host: str) -> tuple[socket.socket, socket.socket]:
+        receiver = socket.socket(family, socket.SOCK_DGRAM)
+        receiver.bind((host, 0))
+        receiver.setblocking(False)
+        sender = socket.socket(family, socket.SOCK_DGRAM)
+        sender.bind((host, 0))
+        self.addCleanup(receiver.close)
+        self.addCleanup(sender.close)
+        return receiver, sender
+
+    def _round_trip(self, use_mmsg: bool, family: int = socket.AF_INET, host: str = "127.0.0.1"):
+        receiver, sender = self._udp_pair(family, host)
+        datagrams = [(b"datagram %d" % i, receiver.getsockname()[:2]) for i in range(40)]
+        # Spans several sendmmsg batches
+        batch_sender = DatagramSender(batch_size=16, buffer_size=64, use_mmsg=use_mmsg)
+        self.assertEqual(batch_sender.send(sender, datagrams), 40)
+
+        batch_receiver = DatagramReceiver(batch_size=32, buffer_size=2048, use_mmsg=use_mmsg)
+        first, second = batch_receiver.recv(receiver), batch_receiver.recv(receiver)
+        self.assertEqual((len(first), len(second)), (32, 8))
+        self.assertEqual([data for data, _ in first + second], [data for data, _ in datagrams])
+        self.assertEqual(first[0][1][:2], sender.getsockname()[:2])
+        self.assertEqual(batch_receiver.recv(receiver), [])
+
+    @unittest.skipUnless(MMSG_AVAILABLE, "recvmmsg/sendmmsg not available")
+    def test_mmsg_round_trip(self):
+        self._round_trip(use_mmsg=True)
+
+    @unittest.skipUnless(MMSG_AVAILABLE and ipv6_loopback_available(), "needs mmsg and IPv6")
+    def test_mmsg_round_trip_ipv6(self):
+        self._round_trip(use_mmsg=True, family=socket.AF_INET6, host="::1")
+
+    def test_drain_fallback_round_trip(self):
+        self._round_trip(use_mmsg=False)
+
+    def test_datagrams_longer_than_buffer_are_truncated(self):
+        receiver, sender = self._udp_pair(socket.AF_INET, "127.0.0.1")
+        DatagramSender(batch_size=4, buffer_size=2048).send(sender, [(b"x" * 100, receiver.getsockname())])
+        [(data, _)] = DatagramReceiver(batch_size=4, buffer_size=10).recv(receiver)
+        self.assertEqual(data, b"x" * 10)
+
+    def test_datagrams_larger_than_send_slot_are_sent_alone(self):
+        receiver, sender = self._udp_pair(socket.AF_INET, "127.0.0.1")
+        address = receiver.getsockname()
+        datagrams = [(b"small", address), (b"y" * 100, address), (b"small again", address)]
+        self.assertEqual(DatagramSender(batch_size=4, buffer_size=16).send(sender, datagrams), 3)
+        received = DatagramReceiver(batch_size=4, buffer_size=2048).recv(receiver)
+        self.assertEqual(sorted(data for data, _ in received), sorted(data for data, _ in datagrams))
+
+
+class TestAdaptiveBuffer(unittest.TestCase):
+    def test_full_reads_double_the_size_up_to_max(self):
+        buffer = AdaptiveBuffer(1024, 6144)
+        sizes = []
+        for _ in range(4):
+            buffer.record(buffer.size)
+            sizes.append(buffer.size)
+        self.assertEqual(sizes, [2048, 4096, 6144, 6144])
+        self.assertEqual(len(buffer.view), 6144)
+
+    def test_partial_reads_keep_the_size(self):
+        buffer = AdaptiveBuffer(1024, 4096)
+        for _ in range(SHRINK_AFTER * 2):
+            buffer.record(600)
+        self.assertEqual(buffer.size, 1024)
+
+    def test_shrinks_after_a_run_of_small_reads(self):
+        buffer = AdaptiveBuffer(1024, 4096)
+        buffer.size = 4096
+        for _ in range(SHRINK_AFTER - 1):
+            buffer.record(10)
+        self.assertEqual(buffer.size, 4096)
+        buffer.record(10)
+        self.assertEqual(buffer.size, 2048)
+
+    def test_idle_returns_to_min_and_releases_the_large_buffer(self):
+        buffer = AdaptiveBuffer(1024, 4096)
+        buffer.size = 4096
+        large = buffer.view
+        buffer.idle()
+        self.assertEqual(buffer.size, 1024)
+        self.assertIsNot(buffer.view, large)
+        self.assertEqual(len(buffer.view), 1024)
+
+    def test_view_is_reused_while_the_size_holds(self):
+        buffer = AdaptiveBuffer(1024, 1024)
+        view = buffer.view
+        buffer.record(1024)
+        self.assertIs(buffer.view, view)
+
+    def test_rejects_invalid_bounds(self):
+        for bounds in ((0, 10), (10, 5)):
+            with self.assertRaises(ValueError):
+                AdaptiveBuffer(*bounds)
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,163 @@
+import signal
+import socket
+import unittest
+from unittest.mock import patch
+
+from src.server import ThreadingTCPServer, TCPProxyServer
+from src import workers
+from src.workers import WorkerSupervisor
+
+EXITED_OK = 0
+EXITED_WITH_ERROR = 1 << 8  # wait status for exit code 1
+
+
+class TestWorkerSupervisor(unittest.TestCase):
+    def test_rejects_zero_workers(self):
+        with self.assertRaises(ValueError):
+            WorkerSupervisor(0, lambda: None)
+
+    @patch("src.workers.signal.signal")
+    @patch("src.workers.os.kill")
+    @patch("src.workers.os.waitpid")
+    @patch("src.workers.os.fork")
+    def test_spawns_workers_and_restarts_crashed_ones(self, mock_fork, mock_waitpid, mock_kill, _):
+        supervisor = WorkerSupervisor(2, lambda: None)
+        mock_fork.side_effect = [101, 102, 103]
+
+        def waitpid(pid, options):
+            if mock_waitpid.call_count == 1:
+                return 101, EXITED_WITH_ERROR
+            if mock_waitpid.call_count == 2:
+                supervisor.stop(signal.SIGTERM)
+                return 102, EXITED_OK
+            return 103, EXITED_OK
+
+        mock_waitpid.side_effect = waitpid
+
+        with patch("src.workers.WORKER_RESTART_DELAY", 0):
+            supervisor.run()
+
+        self.assertEqual(mock_fork.call_count, 3)
+        # The stop signal reached the restarted worker and the surviving original
+        mock_kill.assert_any_call(102, signal.SIGTERM)
+        mock_kill.assert_any_call(103, signal.SIGTERM)
+        self.assertEqual(supervisor.workers, {})
+
+    @patch("src.workers.os._exit")
+    @patch("src.workers.os.fork")
+    def test_restarted_worker_takes_over_index(self, mock_fork, _):
+        supervisor = WorkerSupervisor(2, lambda: None)
+        mock_fork.side_effect = [101, 102, 103]
+        supervisor._spawn(0)
+        supervisor._spawn(1)
+        with patch("src.workers.os.waitpid", side_effect=[(102, EXITED_WITH_ERROR), ChildProcessError]):
+            with patch("src.workers.WORKER_RESTART_DELAY", 0):
+                supervisor._supervise()
+        self.assertEqual(supervisor._indexes, {101: 0, 103: 1})
+
+        self.addCleanup(setattr, workers, "_worker_index", 0)
+        supervisor._run_worker(1)
+        self.assertEqual(workers.worker_index(), 1)
+
+    @patch("src.workers.signal.signal")
+    @patch("src.workers.os.waitpid")
+    @patch("src.workers.os.fork")
+    def test_does_not_restart_workers_after_stop(self, mock_fork, mock_waitpid, _):
+        supervisor = WorkerSupervisor(1, lambda: None)
+        mock_fork.return_value = 201
+
+        def waitpid(pid, options):
+            supervisor.stopping = True
+            return 201, EXITED_WITH_ERROR
+
+        mock_waitpid.side_effect = waitpid
+        supervisor.run()
+        mock_fork.assert_called_once()
+
+    @patch("src.workers.time.sleep")
+    @patch("src.workers.signal.signal")
+    @patch("src.workers.os.kill")
+    @patch("src.workers.os.waitpid")
+    @patch("src.workers.os.fork")
+    def test_gives_up_on_workers_that_keep_failing_to_start(self, mock_fork, mock_waitpid, mock_kill, _, mock_sleep):
+        supervisor = WorkerSupervisor(2, lambda: None)
+        mock_fork.side_effect = range(101, 200)
+
+        def waitpid(pid, options):
+            pid = next(iter(supervisor.workers))
+            return pid, EXITED_OK if supervisor.stopping else EXITED_WITH_ERROR
+
+        mock_waitpid.side_effect = waitpid
+        supervisor.run()
+
+        self.assertEqual(supervisor.exit_code, 1)
+        self.assertEqual(mock_fork.call_count, 2 + workers.WORKER_MAX_FAST_FAILURES - 1)
+        self.assertEqual(mock_sleep.call_count, workers.WORKER_MAX_FAST_FAILURES - 1)
+        # The worker still running when the supervisor gave up was stopped
+        mock_kill.assert_called_once_with(106, signal.SIGTERM)
+        self.assertEqual(supervisor.workers, {})
+
+    @patch("src.workers.os.fork")
+    def test_a_worker_that_ran_for_a_while_resets_the_failure_count(self, mock_fork):
+        supervisor = WorkerSupervisor(1, lambda: None)
+        mock_fork.side_effect = [101, 102]
+        supervisor._spawn(0)
+        supervisor.workers[101] -= workers.WORKER_RESTART_DELAY
+        supervisor.fast_failures = workers.WORKER_MAX_FAST_FAILURES - 1
+        with patch("src.workers.os.waitpid", side_effect=[(101, EXITED_WITH_ERROR), ChildProcessError]):
+            supervisor._supervise()
+        self.assertEqual(supervisor.fast_failures, 0)
+        self.assertEqual(supervisor.exit_code, 0)
+        self.assertEqual(list(supervisor.workers), [102])
+
+    @patch("src.workers.signal.signal")
+    @patch("src.workers.os.kill")
+    def test_signal_handler_forwards_signal(self, mock_kill, _):
+        supervisor = WorkerSupervisor(1, lambda: None)
+        supervisor.workers = {301: 0.0, 302: 0.0}
+        supervisor._handle_signal(signal.SIGINT, None)
+        self.assertTrue(supervisor.stopping)
+        mock_kill.assert_any_call(301, signal.SIGINT)
+        mock_kill.assert_any_call(302, signal.SIGINT)
+
+    @patch("src.workers.os._exit")
+    def test_worker_exit_codes(self, mock_exit):
+        WorkerSupervisor(1, lambda: None)._run_worker()
+        mock_exit.assert_called_with(0)
+
+        def crash():
+            raise RuntimeError("boom")
+
+        WorkerSupervisor(1, crash)._run_worker()
+        mock_exit.assert_called_with(1)
+
+        def interrupted():
+            raise KeyboardInterrupt
+
+        WorkerSupervisor(1, interrupted)._run_worker()
+        mock_exit.assert_called_with(0)
+
+
+@unittest.skipUnless(hasattr(socket, "SO_REUSEPORT"), "SO_REUSEPORT not available")
+class TestReusePortListeners(unittest.TestCase):
+    def _make_server(self, address, reuse_port):
+        server = ThreadingTCPServer(address, TCPProxyServer, bind_and_activate=False)
+        self.addCleanup(server.server_close)
+        server.allow_reuse_port = reuse_port
+        server.server_bind()
+        server.server_activate()
+        return server
+
+    def test_reuse_port_listeners_share_address(self):
+        first = self._make_server(("127.0.0.1", 0), reuse_port=True)
+        second = self._make_server(first.server_address, reuse_port=True)
+        self.assertEqual(first.server_address, second.server_address)
+
+    def test_without_reuse_port_second_bind_fails(self):
+        first = self._make_server(("127.0.0.1", 0), reuse_port=False)
+        with self.assertRaises(OSError):
+            self._make_server(first.server_address, reuse_port=False)
+
+
+if __name__ == "__main__":
+    unittest.main()